@@ -6,14 +6,11 @@
 from dotenv import load_dotenv
 import os
 import time
-import threading
 from datetime import datetime, timedelta, timezone
 import csv
 import pandas as pd
 from pathlib import Path
 import numpy as np
-import talib
-import requests
 import math
 from pybit.unified_trading import HTTP
 import logging
@@ -22,155 +19,110 @@ import json
 import getpass
 from cryptography.fernet import Fernet
 import gc
-
-
-
-
-symbol = 'BTCUSDT'
-MAX_ACTIVE_TRADES = 1
-previous_rsi = None
-previous_sma_rsi = None
-current_trade_type = None
+import asyncio
+from j3_clock import ExchangeClock
+from j3_market_feed import MarketDataFeed
+from j3_account_state import AccountStateStore, private_ws_factory
+from j3_indicators import IndicatorEngine, INDICATOR_COLUMNS
+from j3_candle_store import CandleStore, indicator_field
+from j3_kline_sync import KlineSync, RateLimiter
+from j3_history import HistoryDownloader
+from j3_regimes import RegimeTable, build_regime_table, candles_hash, history_range
+from j3_runtime import Runtime
+from j3_orders import Order, OrderExecutor, ORDER_SUBMITTED, ORDER_ACKED, ORDER_FILLED, call_with_retries
+from j3_snapshot import SnapshotProvider
+from j3_rules import compile_rules
+from j3_context import SymbolContext
+from j3_journal import TradeJournal
+from j3_logging import setup_queue_logging
+from j3_fear_greed import FearGreedStore, fetch_fear_greed_entries
+from j3_metrics import Metrics
+from j3_margin import LiquidationGuard, position_delta, solve_liquidation_close, target_leverage
+from functools import partial
+
+
+
+
+MAX_ACTIVE_TRADES = 1 # Лимит открытых сделок на один символ
 next_analysis_time = None # Время следующего обновления данных о сделках
-active_trades = {} # Словарь для хранения всех активных сделок по их ID
-next_trade_id = 1 # Счетчик для генерации уникальных ID сделок
-trades_lock = threading.RLock() # Блокировка для безопасного обновления списка сделок
-last_price_indicator = ""
-fear_greed_data = None
+ORDER_STEP_TIMEOUT = 60 # Срок подготовительного шага ордера (информация о символе, плечо, позиция), сек
+SNAPSHOT_TTL = 2 # Сколько секунд срез считается актуальным
+signal_rules = None # Таблица правил входа и выхода, скомпилированная при запуске (CompiledRules)
+fear_greed_store = None # Индекс страха и жадности по суткам (FearGreedStore)
 next_rsi_update_time = None
-current_rsi = None
-current_sma_rsi = None
-previous_mid_price = 0
-bull_long_trades_count = 0
-previous_stoch_k = None
-previous_stoch_d = None
-current_stoch_k = None
-current_stoch_d = None
-previous_williams_r_overbought = None
-current_williams_r_overbought = None
-previous_williams_r_oversold = None
-current_williams_r_oversold = None
 next_global_update_time = None
-df_trades = None # Глобальная переменная для хранения DataFrame с историей сделок
 market_periods = []
-current_market_type = None
+regime_table = None # Периоды рынка для двоичного поиска (RegimeTable)
+current_market_type = None # Тип рынка по таблице периодов (контексты переключаются вслед за ним)
 next_market_change = None
+exchange_clock = None # Локальные часы биржи (ExchangeClock)
+market_feed = None # Кеш тикеров всех символов из WebSocket (MarketDataFeed)
+account_state = None # Состояние аккаунта из приватных потоков (AccountStateStore)
+contexts = {} # Символ -> SymbolContext: состояние стратегии каждого торгуемого контракта
+history_downloaders = {} # Загрузчики истории с кешем на диске по (символ, таймфрейм)
+kline_rate_limiter = RateLimiter(10) # Общий лимит запросов get_kline всех символов, запросов/сек
+log_writer = None # Фоновая запись логов (LogWriter)
+LOG_RETENTION_DAYS = 14 # Сколько суток хранятся сегменты логов
+metrics = Metrics('j3') # Задержки этапов и счётчики в формате Prometheus
+event_runtime = None # Событийное ядро (Runtime): счётчики обязанностей для метрик
+METRICS_PORT = None # Порт HTTP /metrics на 127.0.0.1 (None — только файл)
 
 # Определение имени скрипта для динамических путей
 script_name = os.path.basename(__file__).split('.')[0]
 
-# Путь к CSV-файлу
-CSV_FILE = Path(f"trades_bybit_{script_name}.csv")
-
 # Путь к файлу ошибок WebSocket
 ERROR_LOG_FILE = Path(f"errors_{script_name}.log")
+# Максимальное время выполнения обязанностей торгового цикла, сек
+DUTY_TIMEOUTS = {
+    'market_change': 300,
+    'fear_greed': 180,
+    'refresh': 300,
+    'signals': 300,
+    'report': 60,
+    'guard': 120,
+    'warmup': 25,
+}
+# Повторы неудачного обновления данных и проверки сигналов по той же свече: количество и пауза, сек
+DUTY_RETRIES = 3
+DUTY_RETRY_DELAY = 60
+# За сколько секунд до закрытия свечи GLOBAL_TIMEFRAME начинается подготовка (лимиты инструмента, плечо, индекс, свечи)
+WARMUP_LEAD = 30
+# Запас до закрытия свечи, сек: при меньшем остатке подготовка прекращается, работу доделает обновление после закрытия
+WARMUP_RESERVE = 5
+# Таблица периодов рынка с хешем исходных недельных свечей
+REGIME_TABLE_FILE = Path(f"market_regimes_{script_name}.json")
+# История индекса страха и жадности по суткам
+FEAR_GREED_FILE = Path(f"fear_greed_{script_name}.j3c")
+# Метрики в текстовом формате Prometheus (обновляются после каждого отчёта)
+METRICS_FILE = Path(f"metrics_{script_name}.prom")
 
 
 def get_server_time():
-    try:
-        response = client.get_server_time()
-        if response['retCode'] == 0:
-            server_time_ms = int(response['result']['timeSecond']) * 1000
-            return datetime.fromtimestamp(server_time_ms / 1000, tz=timezone.utc)
-        else:
-            log_event(f"⚠️ Ошибка получения времени сервера: {response['retMsg']}")
-            return datetime.now(timezone.utc)
-    except Exception as e:
-        # log_event(f"⚠️ Ошибка при получении времени сервера: {e}")  # Комментируем, чтобы избежать рекурсии если log_event вызывает это
-        return datetime.now(timezone.utc)
+    """Время биржи из локальных часов ExchangeClock (без запроса к API)."""
+    if exchange_clock is not None:
+        return exchange_clock.now()
+    return datetime.now(timezone.utc)
 
 
 
 def setup_logging():
     """
     Настраивает логирование с выводом временных меток в UTC.
-    Логи записываются в файл logs.txt и выводятся в консоль.
+    Вызовы logging только ставят запись в очередь; фоновый поток пишет их пакетами
+    в суточные сегменты logs_{script_name}_YYYY-MM-DD.txt и в консоль.
+    Сегменты старше LOG_RETENTION_DAYS суток удаляются целиком при смене суток.
     """
-    class UTCFormatter(logging.Formatter):
-        def formatTime(self, record, datefmt=None):
-            utc_time = datetime.fromtimestamp(record.created, tz=timezone.utc)
-            if datefmt:
-                return utc_time.strftime(datefmt)
-            return utc_time.strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    # Удаляем все существующие обработчики, чтобы избежать дублирования
-    if logger.handlers:
-        logger.handlers.clear()
-    # Создаем файловый обработчик с динамическим именем
-    file_handler = logging.FileHandler(f'logs_{script_name}.txt', encoding='utf-8')
-    file_handler.setFormatter(UTCFormatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(file_handler)
-    # Создаем консольный обработчик
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(UTCFormatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(console_handler)
-    # Вызываем функцию очистки логов при запуске
-    cleanup_logs()
-
-
-
-
-def cleanup_logs():
-    try:
-        with open(f'logs_{script_name}.txt', 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        if not lines:
-            return
-        now = get_server_time()
-        if now.tzinfo is None:
-            now = now.replace(tzinfo=timezone.utc)
-        cutoff_date = now - timedelta(days=14)
-        cutoff_date = cutoff_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        if cutoff_date.tzinfo is None:
-            cutoff_date = cutoff_date.replace(tzinfo=timezone.utc)
-        filtered_lines = []
-        current_date = None
-        for line in lines:
-            try:
-                timestamp_str = line.split(' - ')[0]
-                log_date = pd.to_datetime(timestamp_str, format='%Y-%m-%d %H:%M:%S,%f', utc=True)
-                if log_date.tzinfo is None:
-                    log_date = log_date.replace(tzinfo=timezone.utc)
-                log_day_start = log_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                # Проверяем, сменились ли сутки с последней проверкой
-                if current_date != log_day_start:
-                    current_date = log_day_start
-                if log_day_start >= cutoff_date:
-                    filtered_lines.append(line)
-            except (ValueError, IndexError):
-                # Пропускаем строки с некорректным форматом
-                continue
-        # Если была очистка, переписываем файл
-        if len(filtered_lines) < len(lines):
-            with open(f'logs_{script_name}.txt', 'w', encoding='utf-8') as f:
-                f.writelines(filtered_lines)
-            log_event("🧹 Очищены старые записи из logs.txt")
-    except FileNotFoundError:
-        # Если файла нет, он будет создан автоматически обработчиком
-        pass
-    except Exception as e:
-        # Логируем ошибку в консоль, так как файл может быть недоступен
-        print(f"Ошибка при очистке логов: {e}")
+    global log_writer
+    log_writer = setup_queue_logging(f'logs_{script_name}', retention_days=LOG_RETENTION_DAYS)
 
 
 
 def log_event(event):
-    global last_log_day
-    # Инициализируем last_log_day, если он ещё не определён
-    if 'last_log_day' not in globals():
-        globals()['last_log_day'] = get_server_time().date()
-    timestamp = get_server_time()
-    current_day = timestamp.date()
-    # Проверяем смену суток
-    if current_day != last_log_day:
-        cleanup_logs()
-        globals()['last_log_day'] = current_day
     logging.info(f"{event}")
 
 
-# Переключатель авторизации: True - Bitwarden, False - .env файл
-USE_BITWARDEN = True  # Измените на False для использования .env
+# Переключатель авторизации: True - Bitwarden, False - .env файл (или переменная окружения USE_BITWARDEN=false)
+USE_BITWARDEN = os.getenv('USE_BITWARDEN', 'true').lower() != 'false'  # Измените на False для использования .env
 
 if USE_BITWARDEN:
     # Оригинальный код для Bitwarden с улучшениями
@@ -245,12 +197,6 @@ if USE_BITWARDEN:
         testnet=False                 # Установите True для тестовой сети
     )
 
-    # Проверка расхождения времени (после создания client)
-    server_time = get_server_time()
-    local_time = datetime.now(timezone.utc)
-    time_diff = abs((server_time - local_time).total_seconds())
-    if time_diff > 60:
-        log_event(f"⚠️ Расхождение времени: локальное {local_time}, сервер Bybit {server_time} (разница {time_diff:.0f} сек). Это может вызвать ошибки с токенами Bitwarden. Синхронизируйте время сервера (NTP).")
 else:
     load_dotenv()
     BYBIT_API_KEY = os.getenv('BYBIT_API_KEY')
@@ -264,6 +210,26 @@ else:
         testnet=False
     )
 
+# Локальный симулятор биржи (python j3_exchange_sim.py): REST и WebSocket без сети
+BYBIT_ENDPOINT = os.getenv('BYBIT_ENDPOINT')
+if BYBIT_ENDPOINT:
+    client.endpoint = BYBIT_ENDPOINT.rstrip('/')
+    log_event(f"🧪 Биржа: локальный симулятор {client.endpoint}")
+
+# Синхронизация часов с биржей один раз, далее время берётся локально с фоновой пересинхронизацией
+exchange_clock = ExchangeClock(client, log=log_event)
+exchange_clock.sync()
+exchange_clock.start()
+log_event(f"🕒 Часы биржи синхронизированы: смещение {exchange_clock.offset_ms:+.0f} мс, RTT {exchange_clock.rtt_ms or 0:.0f} мс")
+
+# Проверка расхождения времени (после синхронизации часов)
+if USE_BITWARDEN:
+    server_time = get_server_time()
+    local_time = datetime.now(timezone.utc)
+    time_diff = abs((server_time - local_time).total_seconds())
+    if time_diff > 60:
+        log_event(f"⚠️ Расхождение времени: локальное {local_time}, сервер Bybit {server_time} (разница {time_diff:.0f} сек). Это может вызвать ошибки с токенами Bitwarden. Синхронизируйте время сервера (NTP).")
+
 
 
 # Определение типов данных для столбцов CSV
@@ -320,11 +286,22 @@ TRADING_CONFIG = { # True / False
 }
 
 
+# Торгуемые линейные контракты: символ -> доля баланса (%), от которой считается объём входа.
+# Сумма долей не должна превышать 100: баланс USDT общий для всех символов.
+# Файлы первого символа называются как в односимвольной версии, остальных — с суффиксом символа.
+SYMBOL_ALLOCATION = {
+'BTCUSDT': 100.0,
+}
+REGIME_SYMBOL = 'BTCUSDT' # Периоды рынка (циклы халвинга) строятся по недельным свечам этого символа
+
+
 ANALYSIS_TIMEFRAME = '1h'
 GLOBAL_TIMEFRAME = '1w'
 
 MIN_DELTA_LIQUIDATION_LONG = 10.0 # Минимальная дельта для лонг-позиций
 MIN_DELTA_LIQUIDATION_SHORT = 10.0 # Минимальная дельта для шорт-позиций
+MIN_DELTA_LIQUIDATION_BUFFER = 0.5 # Запас сверх минимальной дельты, к которому возвращает частичное закрытие, %
+LIQUIDATION_GUARD_COOLDOWN = 60 # Пауза между действиями контроля ликвидации по тикерам, сек
 
 
 # Параметры для bull
@@ -363,90 +340,76 @@ BEAR_FEAR_GREED_HIGH = 52
 
 
 
+def get_history_downloader(symbol, timeframe):
+    """Загрузчик истории с кешем на диске для символа и таймфрейма (создаётся один раз)."""
+    key = (symbol, timeframe)
+    if key not in history_downloaders:
+        # Для месяца — верхняя оценка длительности, чтобы незакрытая свеча не попала в кеш
+        step = timedelta(days=31) if timeframe.endswith('M') else parse_timeframe(timeframe)
+        history_downloaders[key] = HistoryDownloader(
+            client,
+            symbol,
+            get_bybit_interval(timeframe),
+            int(step.total_seconds() * 1000),
+            cache_dir=f"history_cache_{script_name}",
+            rate_limiter=kline_rate_limiter,
+            log=log_event
+        )
+    return history_downloaders[key]
+
+
 def load_historical_data(symbol, timeframe='1w', start_time=None, end_time=None):
-    interval = get_bybit_interval(timeframe)
     if start_time is None:
         start_time = datetime(2009, 1, 1, tzinfo=timezone.utc)
     start_ms = int(start_time.timestamp() * 1000)
+    now = get_server_time()
     if end_time is None:
-        end_time = get_server_time()
+        end_time = now
     end_ms = int(end_time.timestamp() * 1000)
-    all_candles = []
-    while start_ms < end_ms:
-        response = client.get_kline(
-            category="linear",
-            symbol=symbol,
-            interval=interval,
-            start=start_ms,
-            limit=1000
-        )
-        if response['retCode'] != 0:
-            log_event(f"⚠️ Ошибка загрузки исторических данных: {response['retMsg']}")
-            break
-        candles = response['result']['list']
-        if not candles:
-            break
-        all_candles.extend(candles)
-        last_time = int(candles[0][0])
-        start_ms = last_time + 1
-    if not all_candles:
+    try:
+        records = get_history_downloader(symbol, timeframe).load(start_ms, end_ms, int(now.timestamp() * 1000))
+    except Exception as e:
+        log_event(f"⚠️ Ошибка загрузки исторических данных: {e}")
+        return pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close'])
+    if len(records) == 0:
         log_event("⚠️ Нет исторических данных для загрузки")
         return pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close'])
-    df = pd.DataFrame([{
-        'time': pd.to_datetime(int(c[0]), unit='ms', utc=True),
-        'open': float(c[1]),
-        'high': float(c[2]),
-        'low': float(c[3]),
-        'close': float(c[4])
-    } for c in all_candles])
-    df = df.sort_values('time')
+    df = pd.DataFrame({
+        'time': pd.to_datetime(records['time'], unit='ms', utc=True),
+        'open': records['open'],
+        'high': records['high'],
+        'low': records['low'],
+        'close': records['close']
+    })
     df.set_index('time', inplace=True)
     return df
 
 
 
 def calculate_market_periods(df):
-    global market_periods
-    halvings = [
-        datetime(2024, 4, 20, 0, 9, 27, tzinfo=timezone.utc),
-    ]
-    market_periods = []
-    cycle = 4 # Текущий цикл для последнего халвинга
-    halving = halvings[0]
-    log_event(f"🔄 Обработка цикла {cycle}, дата халвинга: {halving.strftime('%Y-%m-%d')}")
-  
-    # Ограниченный диапазон для загрузки данных: 100 недель до и 10 после халвинга
-    start_time = halving - timedelta(weeks=100)
-    end_time = halving + timedelta(weeks=10)
-    df_cycle = load_historical_data(symbol, '1w', start_time=start_time, end_time=end_time)
-  
-    weekday = halving.weekday()
-    if weekday == 0:
-        monday_after = halving.replace(hour=0, minute=0, second=0, microsecond=0)
+    """
+    Периоды рынка всех циклов халвинга. Таблица сохраняется в REGIME_TABLE_FILE вместе
+    с хешем исходных недельных свечей и пересчитывается только при их изменении
+    (свечи читаются из кеша истории на диске).
+    """
+    global market_periods, regime_table
+    start_time, end_time = history_range()
+    df_cycles = load_historical_data(REGIME_SYMBOL, '1w', start_time=start_time, end_time=end_time)
+    if df_cycles.empty:
+        times_ms = np.empty(0, dtype=np.int64)
     else:
-        days_to_monday = 7 - weekday
-        monday_after = (halving + timedelta(days=days_to_monday)).replace(hour=0, minute=0, second=0, microsecond=0)
-    try:
-        i_halving = df_cycle.index.get_loc(monday_after)
-    except KeyError:
-        return
-    i_74 = i_halving - 74
-    i_78 = i_halving - 78
-    if i_74 < 0 or i_78 < 0:
-        log_event(f"⚠️ Индексы за пределами данных для цикла {cycle}, пропуск")
-        return
-    low_74 = df_cycle.iloc[i_74]['low']
-    low_78 = df_cycle.iloc[i_78]['low']
-    if low_74 < low_78:
-        bottom_i = i_74
+        times_ms = ((df_cycles.index - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64)
+    lows = df_cycles['low'].to_numpy(dtype=np.float64)
+    source_hash = candles_hash(times_ms, lows)
+    table = RegimeTable.load(REGIME_TABLE_FILE)
+    if table is not None and table.source_hash == source_hash:
+        log_event(f"📂 Периоды рынка загружены из {REGIME_TABLE_FILE}")
     else:
-        bottom_i = i_78
-    bottom_date = df_cycle.index[bottom_i]
-    peak_date = bottom_date + timedelta(weeks=152)
-    change_to_bear = peak_date + timedelta(weeks=1)
-    bear_change = change_to_bear + timedelta(weeks=52)
-    market_periods.append({'cycle': cycle, 'type': 'bull', 'start': bottom_date, 'change': change_to_bear})
-    market_periods.append({'cycle': cycle, 'type': 'bear', 'start': change_to_bear, 'change': bear_change})
+        table = build_regime_table(times_ms, lows, log=log_event)
+        table.save(REGIME_TABLE_FILE)
+        log_event(f"💾 Периоды рынка пересчитаны и сохранены в {REGIME_TABLE_FILE}")
+    regime_table = table
+    market_periods = table.periods
     for period in market_periods:
         end = period['change'] - timedelta(days=7)
         type_en = period['type']
@@ -454,7 +417,7 @@ def calculate_market_periods(df):
         end_str = end.strftime('%Y-%m-%d %H:%M:%S')
         change_str = period['change'].strftime('%Y-%m-%d %H:%M:%S')
         log_event(f"📊 {type_en.upper()} цикл {period['cycle']}: {start_str} - {end_str}, смена {change_str}")
-    del df_cycle  # Очистка датафрейма после использования
+    del df_cycles  # Очистка датафрейма после использования
     gc.collect()  # Принудительный сбор мусора для освобождения памяти
 
 
@@ -467,21 +430,17 @@ def get_market_type(date):
             return TEST_MARKET_TYPE
     if date.tzinfo is None:
         date = date.replace(tzinfo=timezone.utc)
-    date_day = date.date()
-    if not market_periods:
+    if regime_table is None or not len(regime_table):
         log_event("⚠️ Нет периодов рынка для определения типа")
         return None
-    for period in market_periods:
-        start_day = period['start'].date()
-        change_day = period['change'].date()
-        if start_day <= date_day < change_day:
-            market = period['type']
-            if (market == 'bull' and TRADING_CONFIG.get('ENABLE_BULL_MARKET', True)) or \
-               (market == 'bear' and TRADING_CONFIG.get('ENABLE_BEAR_MARKET', True)):
-                return market
-            else:
-                return None
-    log_event("⚠️ Тип рынка не найден для указанной даты")
+    period = regime_table.lookup(date)
+    if period is None:
+        log_event("⚠️ Тип рынка не найден для указанной даты")
+        return None
+    market = period['type']
+    if (market == 'bull' and TRADING_CONFIG.get('ENABLE_BULL_MARKET', True)) or \
+       (market == 'bear' and TRADING_CONFIG.get('ENABLE_BEAR_MARKET', True)):
+        return market
     return None
 
 
@@ -493,33 +452,33 @@ def get_next_market_change_date(current_date):
         return current_type, next_change
     if current_date.tzinfo is None:
         current_date = current_date.replace(tzinfo=timezone.utc)
-    date_day = current_date.date()
-    if not market_periods:
+    if regime_table is None or not len(regime_table):
         log_event("⚠️ Нет периодов рынка для определения смены")
         return None, None
-    for period in market_periods:
-        start_day = period['start'].date()
-        change_day = period['change'].date()
-        if start_day <= date_day < change_day:
-            return period['type'], period['change']
-    log_event("⚠️ Не найдена дата смены рынка")
-    return None, None
+    period = regime_table.lookup(current_date)
+    if period is None:
+        log_event("⚠️ Не найдена дата смены рынка")
+        return None, None
+    return period['type'], period['change']
 
 
 
 
 # Обновление пути к файлу с данными свечей для включения новых параметров и типа рынка
-def get_market_data_file(market_type):
-    if market_type == 'bull':
-        return Path(f"market_data_bull_{script_name}.csv")
-    elif market_type == 'bear':
-        return Path(f"market_data_bear_{script_name}.csv")
+def get_market_data_file(ctx, market_type):
+    if market_type in ('bull', 'bear'):
+        return ctx.path(f"market_data_{market_type}", "csv")
     else:
         raise ValueError(f"Неподдерживаемый тип рынка: {market_type}")
 
 
 
 def get_current_price_with_retries(client, symbol, max_retries=5, delay=5):
+    # Сначала цена из кеша WebSocket, REST только если поток недоступен или цена устарела
+    if market_feed is not None:
+        cached_price = market_feed.get_price(symbol)
+        if cached_price is not None:
+            return cached_price
     for attempt in range(max_retries):
         try:
             ticker = client.get_tickers(category="linear", symbol=symbol)
@@ -537,7 +496,128 @@ def get_current_price_with_retries(client, symbol, max_retries=5, delay=5):
             
 
 
+def get_positions_response(symbol):
+    """Позиции в формате ответа REST get_positions: из account_state, иначе запросом к бирже."""
+    if account_state is not None and account_state.is_live():
+        position = account_state.get_position(symbol)
+        if position is not None:
+            return {'retCode': 0, 'retMsg': 'OK', 'result': {'list': [position]}}
+    return client.get_positions(category="linear", symbol=symbol)
+
+
+def get_position_version(symbol):
+    """Номер последнего обновления позиции символа из потока (0, если поток недоступен)."""
+    if account_state is not None and account_state.is_live():
+        return account_state.position_version(symbol)
+    return 0
+
+
+def wait_for_position_refresh(symbol, since_version, predicate=None, timeout=5.0, fallback_delay=2):
+    """Ждёт обновления позиции из потока position; без потока — фиксированная пауза как раньше."""
+    if account_state is not None and account_state.is_live():
+        position = account_state.wait_for_position_update(symbol, since_version, predicate=predicate, timeout=timeout)
+        if position is None:
+            log_event(f"⚠️ Обновление позиции не получено за {timeout:.0f} сек")
+        return position
+    time.sleep(fallback_delay)
+    return None
+
+
+def get_order_executor(ctx):
+    """Автомат исполнения ордеров символа; исполнения читаются из account_state, если поток подключён."""
+    if ctx.order_executor is None:
+        ctx.order_executor = OrderExecutor(client, ctx.symbol, account_state=account_state, log=log_event)
+    return ctx.order_executor
+
+
+def record_order_metrics(ctx, order):
+    """Задержки ордера по истории его состояний: отправка → подтверждение → исполнение, и от закрытия свечи до подтверждения."""
+    times = {}
+    for state, at in order.history:
+        times.setdefault(state, at)
+    metrics.inc('orders_total', symbol=ctx.symbol, side=order.side, state=order.state)
+    if ORDER_SUBMITTED in times and ORDER_ACKED in times:
+        metrics.observe('stage_seconds', times[ORDER_ACKED] - times[ORDER_SUBMITTED], stage='order_ack', symbol=ctx.symbol)
+        if ctx.candle_close is not None:
+            ack_time = get_server_time() - timedelta(seconds=time.monotonic() - times[ORDER_ACKED])
+            metrics.observe('candle_to_ack_seconds', (ack_time - ctx.candle_close).total_seconds(), symbol=ctx.symbol)
+    if ORDER_ACKED in times and ORDER_FILLED in times:
+        metrics.observe('stage_seconds', times[ORDER_FILLED] - times[ORDER_ACKED], stage='order_fill', symbol=ctx.symbol)
+
+
+def collect_metrics():
+    """Счётчики, которые объекты ведут сами: запросы свечей, сообщения WebSocket, обязанности, срезы аккаунта."""
+    samples = []
+    for symbol, ctx in contexts.items():
+        labels = {'symbol': symbol}
+        if ctx.kline_sync is not None:
+            samples.append(('kline_requests_total', 'counter', labels, ctx.kline_sync.requests))
+            samples.append(('kline_candles_total', 'counter', labels, ctx.kline_sync.fetched_candles))
+        if ctx.snapshot_provider is not None:
+            samples.append(('snapshot_fetches_total', 'counter', labels, ctx.snapshot_provider.fetches))
+            samples.append(('snapshot_hits_total', 'counter', labels, ctx.snapshot_provider.hits))
+        samples.append(('active_trades', 'gauge', labels, len(ctx.active_trades)))
+        if ctx.liquidation_guard is not None:
+            samples.append(('liquidation_guard_checks_total', 'counter', labels, ctx.liquidation_guard.checks))
+            samples.append(('liquidation_guard_triggers_total', 'counter', labels, ctx.liquidation_guard.triggers))
+            samples.append(('liquidation_guard_suppressed_total', 'counter', labels, ctx.liquidation_guard.suppressed))
+    if market_feed is not None:
+        samples.append(('market_feed_messages_total', 'counter', {}, market_feed.messages))
+    if event_runtime is not None:
+        for name, duty in event_runtime.duties.items():
+            samples.append(('duty_runs_total', 'counter', {'duty': name}, duty.runs))
+            samples.append(('duty_timeouts_total', 'counter', {'duty': name}, duty.timeouts))
+            samples.append(('duty_errors_total', 'counter', {'duty': name}, duty.errors))
+    return samples
+
+
+def setup_metrics():
+    """Описания метрик, сборщик счётчиков и (если задан METRICS_PORT) HTTP /metrics."""
+    metrics.log = log_event
+    metrics.describe('stage_seconds', 'summary', "Длительность этапа цикла: kline_sync, indicators, check_signals, sizing, order_ack, order_fill, warmup")
+    metrics.describe('candle_to_signals_seconds', 'summary', "От закрытия свечи до начала проверки сигналов")
+    metrics.describe('candle_to_ack_seconds', 'summary', "От закрытия свечи до подтверждения ордера биржей")
+    metrics.describe('orders_total', 'counter', "Ордера по итоговому состоянию")
+    metrics.add_collector(collect_metrics)
+    if METRICS_PORT:
+        try:
+            metrics.serve(METRICS_PORT)
+        except OSError as e:
+            log_event(f"⚠️ Не удалось открыть порт метрик {METRICS_PORT}: {e}")
+
+
+def export_metrics():
+    try:
+        metrics.write(METRICS_FILE)
+    except OSError as e:
+        log_event(f"⚠️ Не удалось записать метрики в {METRICS_FILE}: {e}")
+
+
+def get_account_snapshot(ctx, refresh=False):
+    """Срез баланса, позиции символа и его цены на текущий цикл: один набор запросов вместо повторных."""
+    if ctx.snapshot_provider is None:
+        ctx.snapshot_provider = SnapshotProvider(
+            get_available_balance,
+            lambda: get_positions_response(ctx.symbol),
+            lambda: get_current_price_with_retries(client, ctx.symbol),
+            ttl=SNAPSHOT_TTL,
+            log=log_event
+        )
+    return ctx.snapshot_provider.get(refresh=refresh)
+
+
+def invalidate_account_snapshot(ctx):
+    """Сброс среза после исполнения ордера: следующий цикл увидит новый баланс и позицию."""
+    if ctx.snapshot_provider is not None:
+        ctx.snapshot_provider.invalidate()
+
+
 def get_available_balance(max_retries=5, delay=5):
+    # Баланс из приватного потока wallet, REST только если поток недоступен
+    if account_state is not None and account_state.is_live():
+        wallet_balance = account_state.get_wallet_balance('USDT')
+        if wallet_balance is not None:
+            return wallet_balance
     for attempt in range(max_retries):
         try:
             balance = client.get_wallet_balance(accountType="UNIFIED")
@@ -565,8 +645,7 @@ def get_active_trades_from_exchange(client, symbol='BTCUSDT', max_retries=5, del
     for attempt in range(max_retries):
         try:
             # Получаем данные о позициях (замена Binance get_isolated_margin_account)
-            account = client.get_positions(category="linear", symbol=symbol)
-            get_available_balance()
+            account = get_positions_response(symbol)
             position = account['result']['list'][0]
             net_asset = float(position['size'])
             borrowed_btc = float(position['size']) if position['side'] == 'Sell' else 0.0
@@ -595,9 +674,6 @@ def get_active_trades_from_exchange(client, symbol='BTCUSDT', max_retries=5, del
                     liquidation_price = None
                     log_event(f"⚠️ Ошибка преобразования 'liqPrice' в float: {e}")
 
-            # Получаем текущую рыночную цену
-            current_price = get_current_price_with_retries(client, symbol)
-            
             # Формируем данные о сделке без цены входа и времени (логика осталась прежней)
             trade_data = {
                 'direction': direction,
@@ -616,16 +692,14 @@ def get_active_trades_from_exchange(client, symbol='BTCUSDT', max_retries=5, del
 
 
 
-def sync_active_trades():
-    global active_trades, next_trade_id, df_trades, CSV_FILE, current_trade_type, previous_rsi, previous_sma_rsi, current_rsi, current_sma_rsi, next_rsi_update_time
-    global current_market_type  # Используем глобальную переменную
+def sync_active_trades(ctx):
     log_event("🔄 Начало синхронизации активных сделок с биржи")
-    exchange_trades = get_active_trades_from_exchange(client)
-    active_trades.clear()
+    exchange_trades = get_active_trades_from_exchange(client, ctx.symbol)
+    ctx.active_trades.clear()
     current_time = get_server_time()
     if current_time.tzinfo is None:
         current_time = current_time.replace(tzinfo=timezone.utc)
-    if current_market_type is None:
+    if ctx.market_type is None:
         log_event("⚠️ Тип рынка не определён при синхронизации")
         return
     if exchange_trades:
@@ -635,26 +709,26 @@ def sync_active_trades():
         liquidation_price = trade['liquidation_price']
         # Формируем полный тип сделки на основе текущего рынка
         full_direction = None
-        if current_market_type == 'bull':
+        if ctx.market_type == 'bull':
             if direction == 'LONG':
                 full_direction = 'BULL_LONG'
             elif direction == 'SHORT':
                 full_direction = 'BULL_SHORT'
-        elif current_market_type == 'bear':
+        elif ctx.market_type == 'bear':
             if direction == 'SHORT':
                 full_direction = 'BEAR_SHORT'
             elif direction == 'LONG':
                 full_direction = 'BEAR_LONG'
         if full_direction is None:
-            log_event(f"⚠️ Неожиданное направление {direction} для рынка {current_market_type}. Сделка не синхронизирована.")
+            log_event(f"⚠️ Неожиданное направление {direction} для рынка {ctx.market_type}. Сделка не синхронизирована.")
             return
         if not TRADING_CONFIG[f'ENABLE_{full_direction}']:
             log_event(f"⚠️ Синхронизация {full_direction} отключена в конфигурации")
             return
         log_event(f"📈 Полный тип сделки: {full_direction}")
         # Генерируем новый trade_id
-        trade_id = next_trade_id
-        next_trade_id += 1
+        trade_id = ctx.next_trade_id
+        ctx.next_trade_id += 1
         log_event(f"📝 Новая сделка ID {trade_id}")
         # Создаём запись о сделке без entry_price и entry_time
         trade_record = {
@@ -678,22 +752,10 @@ def sync_active_trades():
         }
         # Используем текущий timestamp как ключ
         entry_time_str = current_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        active_trades[entry_time_str] = trade_record
+        ctx.active_trades[entry_time_str] = trade_record
         log_event(f"📝 Сделка добавлена в active_trades")
-        current_trade_type = full_direction
-        log_event(f"📈 Установлен текущий тип сделки: {current_trade_type}")
-        # Обновление df_trades
-        if df_trades is None:
-            df_trades = pd.DataFrame(columns=[
-                'Trade_ID', 'Status', 'Direction', 'Entry_Time', 'Exit_Time', 'Trade_Duration', 'Hours',
-                'Entry_Price', 'Exit_Price', 'Position_Size', 'Position_Value',
-                'Leverage', 'Net_PnL_USDT', 'Net_PnL_Percent', 'Balance', 'Withdraw'
-            ])
-            df_trades['Entry_Time'] = pd.Series(dtype='datetime64[ns, UTC]')
-            df_trades['Exit_Time'] = pd.Series(dtype='datetime64[ns, UTC]')
-            df_trades['Trade_Duration'] = pd.Series(dtype=str)
-            df_trades['Hours'] = pd.Series(dtype=float)
-            log_event("📝 Создан новый DataFrame для df_trades")
+        ctx.current_trade_type = full_direction
+        log_event(f"📈 Установлен текущий тип сделки: {ctx.current_trade_type}")
         new_row = {
             'Trade_ID': str(trade_id),
             'Status': 'open',
@@ -709,14 +771,12 @@ def sync_active_trades():
             'Leverage': float(TRADING_CONFIG.get(full_direction, {}).get('LEVERAGE', 1)),
             'Net_PnL_USDT': np.nan,
             'Net_PnL_Percent': np.nan,
-            'Balance': float(get_available_balance()),
+            'Balance': float(get_account_snapshot(ctx).balance),
             'Withdraw': np.nan
         }
-        df_trades = pd.concat([df_trades, pd.DataFrame([new_row])], ignore_index=True)
-        log_event(f"📝 Добавлена новая запись в df_trades")
-        if CSV_FILE.exists():
-            df_trades.to_csv(CSV_FILE, index=False, float_format='%.2f')
-            log_event(f"💾 История сделок сохранена в {CSV_FILE}")
+        if ctx.journal is not None:
+            ctx.journal.append(new_row)
+            log_event(f"💾 Сделка записана в журнал {ctx.journal.path}")
         log_event(f"📈 Синхронизирована сделка: {full_direction}")
     else:
         log_event("⚪ Нет активных сделок для синхронизации")
@@ -724,151 +784,149 @@ def sync_active_trades():
 
 
 
-def manage_liquidation_price():
-    global client, symbol, MIN_DELTA_LIQUIDATION_LONG, MIN_DELTA_LIQUIDATION_SHORT
-    global current_market_type  # Используем глобальную переменную
-    for attempt in range(3): # Попытки получения данных
-        try:
-            # Получаем данные о позиции через Bybit API
-            position_response = client.get_positions(category="linear", symbol=symbol)
-            if position_response['retCode'] != 0:
-                raise ValueError(f"Ошибка API: {position_response['retMsg']}")
-            positions = position_response['result']['list']
-            if not positions:
-                log_event("⚪ Нет позиций для управления рисками")
-                return
-            position = positions[0] # Предполагаем одну позицию на символ
-            size = float(position['size'])
-            side = position['side']
-            direction = 'LONG' if side == 'Buy' else 'SHORT'
-            # Получаем цену ликвидации с проверкой на пустое значение
-            liq_price_str = position.get('liqPrice', '')
-            if liq_price_str == '':
-                log_event("⚪ Нет цены ликвидации")
-                return
-            liquidation_price = float(liq_price_str)
-            # Получаем текущую рыночную цену
-            current_price = get_current_price_with_retries(client, symbol)
-            # Рассчитываем дельту до ликвидации
-            if direction == 'LONG':
-                delta_percent = (current_price - liquidation_price) / current_price * 100
-                min_delta = MIN_DELTA_LIQUIDATION_LONG
-            else:
-                delta_percent = (liquidation_price - current_price) / current_price * 100
-                min_delta = MIN_DELTA_LIQUIDATION_SHORT
-            if delta_percent < min_delta:
-                log_event(f"⚠️ Дельта {delta_percent:.2f}% < {min_delta}%, требуется частичное закрытие {direction}-позиции")
-          
-                # Процент от позиции для закрытия
-                CLOSE_PERCENT = 5.0 # По умолчанию 5%
-          
-                # Рассчитываем объем для закрытия как процент от текущего размера позиции
-                close_amount = size * (CLOSE_PERCENT / 100)
-          
-                # Проверяем минимальный объем для закрытия
-                MIN_CLOSE_AMOUNT = 0.001 # Минимальный объем для закрытия
-                if close_amount < MIN_CLOSE_AMOUNT:
-                    close_amount = MIN_CLOSE_AMOUNT
-          
-                # Округляем объем с учетом точности символа
-                close_amount = round(close_amount, 3)
-          
-                log_event(f"Рассчитан объем для закрытия: {close_amount:.8f} BTC")
-          
-                # Частичное закрытие позиции
-                close_all_trades(reason=f"delta_control_{direction.lower()}", position_value=close_amount)
-                time.sleep(2) # Пауза для обновления после закрытия
-                # Проверяем новую дельту после закрытия
-                position_response = client.get_positions(category="linear", symbol=symbol)
+def manage_liquidation_price(ctx, refresh=False):
+    """
+    Контроль дельты до цены ликвидации. Вызывается из LiquidationGuard, обязанности guard_{symbol}
+    и проверки сигналов, поэтому чтение позиции, расчёт и частичное закрытие выполняются целиком
+    под ctx.order_lock: второй вызов ждёт первого и читает позицию заново, а не сокращает её повторно.
+    """
+    if not ctx.order_lock.acquire(blocking=False):
+        ctx.order_lock.acquire()
+        refresh = True  # Пока ждали, позицию мог изменить другой вызов
+    try:
+        for attempt in range(3): # Попытки получения данных
+            try:
+                # Позиция и цена из среза цикла; повторная попытка берёт новый срез
+                snapshot = get_account_snapshot(ctx, refresh=refresh or attempt > 0)
+                position_response = snapshot.positions_response
+                if position_response is None:
+                    raise ValueError(snapshot.errors.get('positions_response', "позиция не получена"))
                 if position_response['retCode'] != 0:
-                    log_event(f"⚠️ Ошибка API после закрытия: {position_response['retMsg']}")
-                    return
+                    raise ValueError(f"Ошибка API: {position_response['retMsg']}")
                 positions = position_response['result']['list']
-                if positions:
-                    position = positions[0]
-                    liq_price_str = position.get('liqPrice', '')
-                    if liq_price_str:
-                        liquidation_price = float(liq_price_str)
+                if not positions:
+                    log_event("⚪ Нет позиций для управления рисками")
+                    return
+                position = positions[0] # Предполагаем одну позицию на символ
+                size = float(position['size'])
+                side = position['side']
+                direction = 'LONG' if side == 'Buy' else 'SHORT'
+                # Получаем цену ликвидации с проверкой на пустое значение
+                liq_price_str = position.get('liqPrice', '')
+                if liq_price_str == '':
+                    log_event("⚪ Нет цены ликвидации")
+                    return
+                liquidation_price = float(liq_price_str)
+                # Биржа ликвидирует по mark-цене; без потока тикеров — последняя цена среза
+                current_price = market_feed.get_price(ctx.symbol, 'mark') if market_feed is not None else None
+                if current_price is None:
+                    current_price = snapshot.price
+                if current_price is None:
+                    raise ValueError("текущая цена не получена")
+                # Рассчитываем дельту до ликвидации
+                if direction == 'LONG':
+                    delta_percent = (current_price - liquidation_price) / current_price * 100
+                    min_delta = MIN_DELTA_LIQUIDATION_LONG
+                else:
+                    delta_percent = (liquidation_price - current_price) / current_price * 100
+                    min_delta = MIN_DELTA_LIQUIDATION_SHORT
+                if delta_percent < min_delta:
+                    log_event(f"⚠️ Дельта {delta_percent:.2f}% < {min_delta}%, требуется частичное закрытие {direction}-позиции")
+          
+                    # Объём, после которого снижение плеча возвращает дельту к порогу (с запасом) одним ордером
+                    symbol_info = get_instrument_info(ctx)
+                    close_amount, new_leverage = solve_liquidation_close(
+                        direction, current_price, float(position['avgPrice']), size, float(position['leverage']),
+                        liquidation_price, ctx.capital(snapshot.balance), min_delta + MIN_DELTA_LIQUIDATION_BUFFER,
+                        fee_rate=TRADING_CONFIG['COMMISSION_RATE'] / 100,
+                        qty_step=symbol_info['qty_step'], min_qty=symbol_info['min_order_qty']
+                    )
+                    log_event(f"Рассчитан объем для закрытия: {close_amount:.8f} BTC, целевое плечо {new_leverage:.2f}x")
+                    if close_amount <= 0:
+                        # Капитала хватает на всю позицию — достаточно снизить плечо
+                        adjust_leverage_after_partial_close(ctx, direction, min_delta)
+                        return
+                    # Частичное закрытие позиции
+                    position_version = get_position_version(ctx.symbol)
+                    close_all_trades(ctx, reason=f"delta_control_{direction.lower()}", position_value=close_amount)
+                    wait_for_position_refresh(ctx.symbol, position_version) # Ожидание обновления позиции после закрытия
+                    # Проверяем новую дельту после закрытия
+                    position_response = get_positions_response(ctx.symbol)
+                    if position_response['retCode'] != 0:
+                        log_event(f"⚠️ Ошибка API после закрытия: {position_response['retMsg']}")
+                        return
+                    positions = position_response['result']['list']
+                    if positions:
+                        position = positions[0]
+                        liq_price_str = position.get('liqPrice', '')
+                        if liq_price_str:
+                            liquidation_price = float(liq_price_str)
+                            if direction == 'LONG':
+                                delta_percent = (current_price - liquidation_price) / current_price * 100
+                            else:
+                                delta_percent = (liquidation_price - current_price) / current_price * 100
+                            log_event(f"Дельта после частичного закрытия: {delta_percent:.2f}%")
+                else:
+                    # Расчёт критической цены для коррекции
+                    critical_price = None
+                    if liquidation_price > 0:
                         if direction == 'LONG':
-                            delta_percent = (current_price - liquidation_price) / current_price * 100
+                            critical_price = liquidation_price / (1 - min_delta / 100)
                         else:
-                            delta_percent = (liquidation_price - current_price) / current_price * 100
-                        log_event(f"Дельта после частичного закрытия: {delta_percent:.2f}%")
-            else:
-                # Расчёт критической цены для коррекции
-                critical_price = None
-                if liquidation_price > 0:
-                    if direction == 'LONG':
-                        critical_price = liquidation_price / (1 - min_delta / 100)
-                    else:
-                        critical_price = liquidation_price / (1 + min_delta / 100)
-                if critical_price is not None:
-                    log_event(f"Уровень мин. дельты: {critical_price:,.2f} USDT")
-                log_event(f"Дельта {delta_percent:.2f}% >= {min_delta}%, коррекция не требуется")
-            # Определяем тип сделки
-            if current_market_type == 'bull':
-                trade_type = 'BULL_LONG' if direction == 'LONG' else None
-            elif current_market_type == 'bear':
-                trade_type = 'BEAR_SHORT' if direction == 'SHORT' else None
-            if not trade_type:
-                log_event(f"⚠️ Неожиданное направление {direction} для рынка {current_market_type}")
-                return
-            leverage = TRADING_CONFIG.get(trade_type, {}).get('LEVERAGE', 1)
-            break # Успешное выполнение, выходим из цикла попыток
-        except Exception as e:
-            log_event(f"⚠️ Ошибка при управлении рисками (попытка {attempt + 1}/3): {e}")
-            if attempt < 2:
-                time.sleep(5) # Пауза перед повторной попыткой
-            else:
-                log_event("⚠️ Не удалось получить данные после 3 попыток")
+                            critical_price = liquidation_price / (1 + min_delta / 100)
+                    if critical_price is not None:
+                        log_event(f"Уровень мин. дельты: {critical_price:,.2f} USDT")
+                    log_event(f"Дельта {delta_percent:.2f}% >= {min_delta}%, коррекция не требуется")
+                # Определяем тип сделки
+                if ctx.market_type == 'bull':
+                    trade_type = 'BULL_LONG' if direction == 'LONG' else None
+                elif ctx.market_type == 'bear':
+                    trade_type = 'BEAR_SHORT' if direction == 'SHORT' else None
+                if not trade_type:
+                    log_event(f"⚠️ Неожиданное направление {direction} для рынка {ctx.market_type}")
+                    return
+                leverage = TRADING_CONFIG.get(trade_type, {}).get('LEVERAGE', 1)
+                break # Успешное выполнение, выходим из цикла попыток
+            except Exception as e:
+                log_event(f"⚠️ Ошибка при управлении рисками (попытка {attempt + 1}/3): {e}")
+                if attempt < 2:
+                    time.sleep(5) # Пауза перед повторной попыткой
+                else:
+                    log_event("⚠️ Не удалось получить данные после 3 попыток")
+    finally:
+        ctx.order_lock.release()
 
 
 
-def fetch_fear_greed_data(filename=f"fear_greed_index_{script_name}.csv", max_retries=5, delay=5):
-    url = "https://api.alternative.me/fng/?limit=21"
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            response.json()['data']
-            data = response.json()['data']
-            with open(filename, mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(['Date', 'Value', 'Classification'])
-                for entry in data:
-                    timestamp = int(entry['timestamp'])
-                    date = datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None).strftime('%d/%m/%Y')
-                    value = entry['value']
-                    classification = entry.get('value_classification', 'Unknown')
-                    writer.writerow([date, value, classification])
-            return data
-        except requests.RequestException as e:
-            log_event(f"⚠️ Ошибка при запросе данных (попытка {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(delay * (2 ** attempt))
-            else:
-                log_event("⚠️ Не удалось получить данные индекса после всех попыток")
-                return []
-
-
 def load_fear_greed_data():
-    global fear_greed_data
-    fear_greed_file = Path(f"fear_greed_index_{script_name}.csv")
-    if fear_greed_file.exists():
-        fear_greed_data = pd.read_csv(fear_greed_file, parse_dates=['Date'], dayfirst=True)
-        fear_greed_data['Date'] = pd.to_datetime(fear_greed_data['Date'], format='%d/%m/%Y', utc=True)
-        if fear_greed_data['Date'].dt.tz is None:
-            fear_greed_data['Date'] = fear_greed_data['Date'].dt.tz_localize('UTC')
-        fear_greed_data = fear_greed_data.sort_values(by='Date')
-    else:
-        fear_greed_data = pd.DataFrame(columns=['Date', 'Value'])
-        log_event("⚠️ Файл fear_greed_index.csv не найден, создан пустой DataFrame")
-    return fear_greed_data
+    """Хранилище индекса страха и жадности; прежний CSV переносится при первом запуске."""
+    global fear_greed_store
+    if fear_greed_store is None:
+        fear_greed_store = FearGreedStore(FEAR_GREED_FILE, fetch=partial(fetch_fear_greed_entries, log=log_event), log=log_event)
+        legacy_file = Path(f"fear_greed_index_{script_name}.csv")
+        if not len(fear_greed_store) and legacy_file.exists():
+            count = fear_greed_store.import_csv(legacy_file)
+            log_event(f"📥 Индекс страха и жадности: перенесено {count} дней из {legacy_file}")
+    return fear_greed_store
+
+
+def fetch_fear_greed_data(**fetch_options):
+    """
+    Дозагрузка индекса страха и жадности: дни новее последнего сохранённого; неполная история
+    (пустое хранилище или перенесённый CSV) один раз загружается целиком и сливается с сохранённой.
+    fetch_options (max_retries, timeout) ограничивают запрос, например при подготовке к закрытию свечи.
+    """
+    store = load_fear_greed_data()
+    added = store.update(get_server_time(), **fetch_options)
+    if added is None:
+        log_event("Не удалось получить данные индекса страха и жадности")
+    elif added:
+        log_event(f"📊 Индекс страха и жадности: добавлено {added} дн., всего {len(store)}")
+    return added
 
 
 def get_fear_greed_value(date, timeframe=GLOBAL_TIMEFRAME):
-    global fear_greed_data
-    if fear_greed_data is None or fear_greed_data.empty:
+    if fear_greed_store is None or not len(fear_greed_store):
         return None
     if date.tzinfo is None:
         date = date.replace(tzinfo=timezone.utc)
@@ -888,15 +946,11 @@ def get_fear_greed_value(date, timeframe=GLOBAL_TIMEFRAME):
     target_date = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
     if target_date.tzinfo is None:
         target_date = target_date.replace(tzinfo=timezone.utc)
-    # Ищем данные за target_date в fear_greed_data
-    filtered = fear_greed_data[fear_greed_data['Date'] == target_date]
-    if not filtered.empty:
-        return filtered.iloc[0]['Value']
-    return None
+    return fear_greed_store.value(target_date)
 
 
-def initialize_market_data_file(market_type):
-    MARKET_DATA_FILE = get_market_data_file(market_type)
+def initialize_market_data_file(ctx, market_type):
+    MARKET_DATA_FILE = get_market_data_file(ctx, market_type)
     headers = ['time', 'open', 'high', 'low', 'close', 'RSI', 'RSI-based MA', 'StochRSI_K', 'StochRSI_D', 'Williams_R_Overbought', 'Williams_R_Oversold']
     if not MARKET_DATA_FILE.exists():
         with open(MARKET_DATA_FILE, 'w', newline='', encoding='utf-8') as f:
@@ -915,96 +969,73 @@ def initialize_market_data_file(market_type):
         log_event(f"📁 Файл {MARKET_DATA_FILE} обновлён с новыми столбцами")
     
 
-def load_market_data(market_type):
-    global current_rsi, current_sma_rsi, previous_rsi, previous_sma_rsi
-    global current_stoch_k, current_stoch_d, previous_stoch_k, previous_stoch_d
-    global current_williams_r_overbought, previous_williams_r_overbought
-    global current_williams_r_oversold, previous_williams_r_oversold
-    MARKET_DATA_FILE = get_market_data_file(market_type)
+def get_candle_store(ctx):
+    """
+    Хранилище свечей символа и глобального таймфрейма (открывается один раз).
+    Файлы всех символов лежат рядом и различаются именем символа.
+    """
+    if ctx.candle_store is None:
+        ctx.candle_store = CandleStore(Path(f"candles_{ctx.symbol}_{GLOBAL_TIMEFRAME}_{script_name}.j3c"))
+    return ctx.candle_store
+
+
+def get_kline_sync(ctx, timeframe, history=242):
+    """Синхронизатор свечей биржи с хранилищем символа (создаётся один раз, лимит запросов общий)."""
+    if ctx.kline_sync is None:
+        ctx.kline_sync = KlineSync(
+            client,
+            get_candle_store(ctx),
+            ctx.symbol,
+            get_bybit_interval(timeframe),
+            int(parse_timeframe(timeframe).total_seconds() * 1000),
+            history=history,
+            regular=not timeframe.endswith('M'),
+            log=log_event,
+            rate_limiter=kline_rate_limiter
+        )
+    return ctx.kline_sync
+
+
+def candles_to_dataframe(records, market_type):
+    """Свечи из хранилища в DataFrame с колонками файла market_data для типа рынка."""
+    df = pd.DataFrame({
+        'time': pd.to_datetime(records['time'], unit='ms', utc=True),
+        'open': records['open'],
+        'high': records['high'],
+        'low': records['low'],
+        'close': records['close'],
+    })
+    for col in INDICATOR_COLUMNS:
+        df[col] = records[indicator_field(market_type, col)]
+    return df
+
+
+def load_market_data(ctx, market_type):
     try:
-        if MARKET_DATA_FILE.exists():
-            df = pd.read_csv(
-                MARKET_DATA_FILE,
-                parse_dates=['time'],
-                date_format='%Y-%m-%d %H:%M:%S'
-            )
-            # Приведение типов данных к float64 для всех числовых столбцов (для совместимости с TALib)
-            numeric_cols = ['open', 'high', 'low', 'close', 'RSI', 'RSI-based MA', 'StochRSI_K', 'StochRSI_D', 'Williams_R_Overbought', 'Williams_R_Oversold']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float64)
-            # Проверка и приведение столбца time к datetime64[ns, UTC] aware
-            df['time'] = pd.to_datetime(df['time'], errors='coerce', utc=True)
-            df = df.dropna(subset=['time']) # Удаляем строки с некорректными датами
-            df = df.sort_values(by='time')
-            df = df.tail(242)
-     
-            # Установка глобальных значений всегда
-            if len(df) >= 2:
-                previous_rsi = df['RSI'].iloc[-2]
-                current_rsi = df['RSI'].iloc[-1]
-                previous_sma_rsi = df['RSI-based MA'].iloc[-2]
-                current_sma_rsi = df['RSI-based MA'].iloc[-1]
-         
-                previous_stoch_k = df['StochRSI_K'].iloc[-2]
-                current_stoch_k = df['StochRSI_K'].iloc[-1]
-                previous_stoch_d = df['StochRSI_D'].iloc[-2]
-                current_stoch_d = df['StochRSI_D'].iloc[-1]
-         
-                previous_williams_r_overbought = df['Williams_R_Overbought'].iloc[-2]
-                current_williams_r_overbought = df['Williams_R_Overbought'].iloc[-1]
-         
-                previous_williams_r_oversold = df['Williams_R_Oversold'].iloc[-2]
-                current_williams_r_oversold = df['Williams_R_Oversold'].iloc[-1]
-         
-            else:
-                # Инициализация NaN для всех, если данных мало
-                current_rsi = current_sma_rsi = previous_rsi = previous_sma_rsi = np.nan
-                current_stoch_k = current_stoch_d = previous_stoch_k = previous_stoch_d = np.nan
-                current_williams_r_overbought = previous_williams_r_overbought = np.nan
-                current_williams_r_oversold = previous_williams_r_oversold = np.nan
-                log_event("🗑️ Файл MARKET_DATA пустой, загружаю данные для расчета индикаторов. ")
-            return df
-        else:
-            log_event(f"⚠️ Файл {MARKET_DATA_FILE} не найден, создан пустой DataFrame")
-            # Инициализация NaN для всех индикаторов
-            current_rsi = current_sma_rsi = previous_rsi = previous_sma_rsi = np.nan
-            current_stoch_k = current_stoch_d = previous_stoch_k = previous_stoch_d = np.nan
-            current_williams_r_overbought = previous_williams_r_overbought = np.nan
-            current_williams_r_oversold = previous_williams_r_oversold = np.nan
-            return pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close', 'RSI', 'RSI-based MA', 'StochRSI_K', 'StochRSI_D', 'Williams_R_Overbought', 'Williams_R_Oversold'])
+        records = get_candle_store(ctx).last(242)  # Представление без копирования
+        # Значения индикаторов контекста устанавливаются всегда (NaN, если данных мало)
+        ctx.set_indicators(records, market_type)
+        if len(records) < 2:
+            log_event(f"🗑️ Хранилище свечей {ctx.symbol} пустое, загружаю данные для расчета индикаторов. ")
+        return candles_to_dataframe(records, market_type)
     except Exception as e:
-        log_event(f"⚠️ Ошибка при загрузке данных из {MARKET_DATA_FILE}: {e}")
+        log_event(f"⚠️ Ошибка при загрузке свечей {ctx.symbol} из хранилища: {e}")
         # Инициализация NaN в случае ошибки
-        current_rsi = current_sma_rsi = previous_rsi = previous_sma_rsi = np.nan
-        current_stoch_k = current_stoch_d = previous_stoch_k = previous_stoch_d = np.nan
-        current_williams_r_overbought = previous_williams_r_overbought = np.nan
-        current_williams_r_oversold = previous_williams_r_oversold = np.nan
+        ctx.set_indicators((), market_type)
         return pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close', 'RSI', 'RSI-based MA', 'StochRSI_K', 'StochRSI_D', 'Williams_R_Overbought', 'Williams_R_Oversold'])
 
 
 
-def save_market_data(df, market_type):
-    MARKET_DATA_FILE = get_market_data_file(market_type)
+def save_market_data(ctx, market_type, rows=9):
+    """Экспорт последних свечей из хранилища в файл market_data (для просмотра и внешних скриптов)."""
+    MARKET_DATA_FILE = get_market_data_file(ctx, market_type)
     try:
-        df = df.tail(9).copy()
-        # Преобразование числовых столбцов в float64 для точности расчётов
-        numeric_cols = ['open', 'high', 'low', 'close', 'RSI', 'RSI-based MA', 'StochRSI_K', 'StochRSI_D', 'Williams_R_Overbought', 'Williams_R_Oversold']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = df[col].astype(np.float64)
-        # Приводим time к UTC aware, если оно timezone-aware
-        if 'time' in df.columns and df['time'].dt.tz is not None:
-            df['time'] = df['time'].dt.tz_convert('UTC')
+        df = candles_to_dataframe(get_candle_store(ctx).last(rows), market_type)
         # Форматируем время в строковый формат без временной зоны
         df['time'] = df['time'].dt.strftime('%Y-%m-%d %H:%M:%S')
-        # Убеждаемся, что все столбцы присутствуют
-        required_cols = ['time', 'open', 'high', 'low', 'close', 'RSI', 'RSI-based MA', 'StochRSI_K', 'StochRSI_D', 'Williams_R_Overbought', 'Williams_R_Oversold']
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = np.nan
-        df = df[required_cols]
-        df.to_csv(MARKET_DATA_FILE, index=False)
+        tmp_file = MARKET_DATA_FILE.with_suffix('.tmp')
+        df.to_csv(tmp_file, index=False)
+        os.replace(tmp_file, MARKET_DATA_FILE)
     except Exception as e:
         log_event(f"⚠️ Ошибка при сохранении данных в {MARKET_DATA_FILE}: {e}")
 
@@ -1041,102 +1072,36 @@ def format_duration(seconds):
         return f"{days:.2f} дн"
 
 
-def check_rsi_crossing(current_rsi, current_sma_rsi):
-    """Определяет, произошло ли пересечение RSI и SMA RSI."""
-    global previous_rsi, previous_sma_rsi
-    if previous_rsi is None or previous_sma_rsi is None:
-        return None
-    if previous_rsi > previous_sma_rsi and current_rsi < current_sma_rsi:
-        return "down" # Пересечение сверху вниз
-    elif previous_rsi < previous_sma_rsi and current_rsi > current_sma_rsi:
-        return "up" # Пересечение снизу вверх
-    return None
-    
-
-def check_stoch_crossing(current_k, current_d):
-    """Определяет, произошло ли пересечение %K и %D Stochastic RSI (down для сигнала закрытия лонг, up для шорт)."""
-    global previous_stoch_k, previous_stoch_d
-    if previous_stoch_k is None or previous_stoch_d is None:
-        return None
-    if previous_stoch_k > previous_stoch_d and current_k < current_d:
-        return "down" # Пересечение сверху вниз
-    elif previous_stoch_k < previous_stoch_d and current_k > current_d:
-        return "up" # Пересечение снизу вверх
-    return None
-
-
-
-def check_williams_overbought(market_type):
-    """Проверяет overbought для Williams %R (для закрытия лонг-позиций или открытия шорт)."""
-    global current_williams_r_overbought
-    level = BULL_WILLIAMS_OVERBOUGHT_LEVEL if market_type == 'bull' else BEAR_WILLIAMS_OVERBOUGHT_LEVEL
-    if current_williams_r_overbought is not None and current_williams_r_overbought >= level:
-        return True # Overbought, сигнал
-    return False
-
-
-def check_williams_oversold(market_type):
-    """Проверяет oversold для Williams %R (для открытия лонг-позиций или закрытия шорт)."""
-    global current_williams_r_oversold
-    level = BULL_WILLIAMS_OVERSOLD_LEVEL if market_type == 'bull' else BEAR_WILLIAMS_OVERSOLD_LEVEL
-    if current_williams_r_oversold is not None and current_williams_r_oversold <= level:
-        return True # Oversold, сигнал
-    return False
-
-
-def initialize_csv():
-    global df_trades, CSV_FILE
-    headers = [
-        'Trade_ID', 'Status', 'Direction', 'Entry_Time', 'Exit_Time', 'Trade_Duration', 'Hours',
-        'Entry_Price', 'Exit_Price', 'Position_Size', 'Position_Value',
-        'Leverage', 'Net_PnL_USDT', 'Net_PnL_Percent', 'Balance', 'Withdraw'
-    ]
-    dtypes = {
-        'Trade_ID': str,
-        'Status': str,
-        'Direction': str,
-        'Entry_Time': 'datetime64[ns, UTC]',
-        'Exit_Time': 'datetime64[ns, UTC]',
-        'Trade_Duration': str,
-        'Hours': float,
-        'Entry_Price': float,
-        'Exit_Price': float,
-        'Position_Size': float,
-        'Position_Value': float,
-        'Leverage': float,
-        'Net_PnL_USDT': float,
-        'Net_PnL_Percent': float,
-        'Balance': float,
-        'Withdraw': float
-    }
+def initialize_journal(ctx):
+    """
+    Журнал сделок контекста (SQLite, trades_bybit_*.sqlite). При первом открытии в него
+    переносится прежний trades_bybit_*.csv; дальше CSV выгружается по запросу (export_trades_csv).
+    """
     if TRADING_CONFIG['ENABLE_LOGGING']:
-        if CSV_FILE.exists():
-            df_trades = pd.read_csv(
-                CSV_FILE,
-                parse_dates=['Entry_Time', 'Exit_Time'],
-                dtype={col: dtypes[col] for col in headers if col not in ['Entry_Time', 'Exit_Time']}
-            )
-            # Принудительно парсим даты с utc=True и обработкой ошибок
-            df_trades['Entry_Time'] = pd.to_datetime(df_trades['Entry_Time'], utc=True, errors='coerce')
-            df_trades['Exit_Time'] = pd.to_datetime(df_trades['Exit_Time'], utc=True, errors='coerce')
-            missing_cols = [col for col in headers if col not in df_trades.columns]
-            for col in missing_cols:
-                df_trades[col] = pd.Series(dtype=dtypes[col])
-            df_trades = df_trades[headers]
-            # Безопасное приведение Position_Size к числу, если это строка
-            df_trades['Position_Size'] = pd.to_numeric(df_trades['Position_Size'], errors='coerce')
-            df_trades = df_trades.tail(30)  # Ограничение до 30 строк
-            log_event("📝 CSV файл загружен в DataFrame")
-        else:
-            df_trades = pd.DataFrame({col: pd.Series(dtype=dtypes[col]) for col in headers})
-            df_trades.to_csv(CSV_FILE, index=False, float_format='%.2f')
-            log_event("📝 Создан новый файл CSV с заголовками")
+        ctx.journal = TradeJournal(ctx.path("trades_bybit", "sqlite"), log=log_event)
+        if len(ctx.journal) == 0 and ctx.csv_file.exists():
+            try:
+                imported = ctx.journal.import_csv(ctx.csv_file)
+                log_event(f"📥 История сделок перенесена из {ctx.csv_file} в журнал: {imported} строк")
+            except Exception as e:
+                log_event(f"⚠️ Ошибка переноса истории сделок из {ctx.csv_file}: {e}")
+        log_event(f"📝 Журнал сделок {ctx.journal.path}: {len(ctx.journal)} строк")
     else:
-        df_trades = None
-        CSV_FILE = None
+        ctx.journal = None
         log_event("📝 Запись сделок отключена")
 
 
+def export_trades_csv(ctx, path=None, start=None, end=None):
+    """Выгрузка журнала сделок (или диапазона [start, end]) в CSV; по умолчанию — в trades_bybit_*.csv."""
+    if ctx.journal is None:
+        log_event("⚠️ Журнал сделок отключён, выгружать нечего")
+        return 0
+    path = path or ctx.csv_file
+    count = ctx.journal.export_csv(path, start, end)
+    log_event(f"💾 Журнал сделок {ctx.symbol} выгружен в {path}: {count} строк")
+    return count
+
+
 
 
 # Функция для преобразования таймфрейма в строковый формат Bybit
@@ -1179,141 +1144,136 @@ def parse_timeframe(timeframe):
         raise ValueError(f"Неподдерживаемый таймфрейм: {timeframe}")
 
 
-def update_market_data_on_candle_close(symbol, timeframe, current_time, limit=242, end_time=None):
-    global client, BULL_RSI_PERIOD, BULL_SMA_RSI_PERIOD, BULL_STOCHRSI_K_PERIOD, BULL_STOCHRSI_D_PERIOD, BULL_STOCHRSI_RSI_PERIOD, BULL_STOCHRSI_STOCH_PERIOD, BULL_WILLIAMS_OVERBOUGHT_PERIOD, BULL_WILLIAMS_OVERSOLD_PERIOD
-    global BEAR_RSI_PERIOD, BEAR_SMA_RSI_PERIOD, BEAR_STOCHRSI_K_PERIOD, BEAR_STOCHRSI_D_PERIOD, BEAR_STOCHRSI_RSI_PERIOD, BEAR_STOCHRSI_STOCH_PERIOD, BEAR_WILLIAMS_OVERBOUGHT_PERIOD, BEAR_WILLIAMS_OVERSOLD_PERIOD
-    global current_market_type # Используем глобальную переменную
-    if current_market_type is None:
+def get_signal_rules():
+    """Таблица правил j3_rules, скомпилированная под TRADING_CONFIG и пороги BULL_* / BEAR_*."""
+    global signal_rules
+    if signal_rules is None:
+        signal_rules = compile_rules({
+            'TRADING_CONFIG': TRADING_CONFIG,
+            'BULL_WILLIAMS_OVERBOUGHT_LEVEL': BULL_WILLIAMS_OVERBOUGHT_LEVEL,
+            'BULL_WILLIAMS_OVERSOLD_LEVEL': BULL_WILLIAMS_OVERSOLD_LEVEL,
+            'BULL_FEAR_GREED_LOW': BULL_FEAR_GREED_LOW,
+            'BEAR_WILLIAMS_OVERBOUGHT_LEVEL': BEAR_WILLIAMS_OVERBOUGHT_LEVEL,
+            'BEAR_WILLIAMS_OVERSOLD_LEVEL': BEAR_WILLIAMS_OVERSOLD_LEVEL,
+            'BEAR_FEAR_GREED_HIGH': BEAR_FEAR_GREED_HIGH,
+        })
+    return signal_rules
+
+
+def get_indicator_params(market_type):
+    """Периоды и источники индикаторов для типа рынка (параметры BULL_* / BEAR_*)."""
+    if market_type == 'bull':
+        return {
+            'rsi_period': BULL_RSI_PERIOD,
+            'sma_rsi_period': BULL_SMA_RSI_PERIOD,
+            'stochrsi_rsi_period': BULL_STOCHRSI_RSI_PERIOD,
+            'stochrsi_stoch_period': BULL_STOCHRSI_STOCH_PERIOD,
+            'stochrsi_k_period': BULL_STOCHRSI_K_PERIOD,
+            'stochrsi_d_period': BULL_STOCHRSI_D_PERIOD,
+            'williams_overbought_period': BULL_WILLIAMS_OVERBOUGHT_PERIOD,
+            'williams_overbought_source': BULL_WILLIAMS_OVERBOUGHT_SOURCE,
+            'williams_oversold_period': BULL_WILLIAMS_OVERSOLD_PERIOD,
+            'williams_oversold_source': BULL_WILLIAMS_OVERSOLD_SOURCE,
+        }
+    return {
+        'rsi_period': BEAR_RSI_PERIOD,
+        'sma_rsi_period': BEAR_SMA_RSI_PERIOD,
+        'stochrsi_rsi_period': BEAR_STOCHRSI_RSI_PERIOD,
+        'stochrsi_stoch_period': BEAR_STOCHRSI_STOCH_PERIOD,
+        'stochrsi_k_period': BEAR_STOCHRSI_K_PERIOD,
+        'stochrsi_d_period': BEAR_STOCHRSI_D_PERIOD,
+        'williams_overbought_period': BEAR_WILLIAMS_OVERBOUGHT_PERIOD,
+        'williams_overbought_source': BEAR_WILLIAMS_OVERBOUGHT_SOURCE,
+        'williams_oversold_period': BEAR_WILLIAMS_OVERSOLD_PERIOD,
+        'williams_oversold_source': BEAR_WILLIAMS_OVERSOLD_SOURCE,
+    }
+
+
+def get_indicator_state_file(ctx, market_type):
+    return ctx.path(f"indicator_state_{market_type}", "json")
+
+
+def load_indicator_engine(ctx, market_type, params):
+    """Восстанавливает IndicatorEngine из контрольной точки, если параметры не менялись."""
+    state_file = get_indicator_state_file(ctx, market_type)
+    if not state_file.exists():
+        return None
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('params') != params:
+            log_event(f"🔄 Параметры индикаторов изменились, контрольная точка {state_file} пересчитывается")
+            return None
+        return IndicatorEngine.from_state(state)
+    except Exception as e:
+        log_event(f"⚠️ Ошибка чтения контрольной точки индикаторов {state_file}: {e}")
+        return None
+
+
+def save_indicator_engine(ctx, engine, market_type):
+    """Атомарно сохраняет контрольную точку IndicatorEngine."""
+    state_file = get_indicator_state_file(ctx, market_type)
+    tmp_file = state_file.with_suffix('.tmp')
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(engine.get_state(), f)
+        os.replace(tmp_file, state_file)
+    except Exception as e:
+        log_event(f"⚠️ Ошибка сохранения контрольной точки индикаторов {state_file}: {e}")
+
+
+def update_market_data_on_candle_close(ctx, timeframe, current_time, limit=242, end_time=None):
+    if ctx.market_type is None:
         log_event("⚠️ Тип рынка не определён")
         return
-    df_market = load_market_data(current_market_type) # Используем глобальную вместо вызова
-    interval = get_bybit_interval(timeframe)
-    tf_delta = parse_timeframe(timeframe)
-    tf_delta_ms = int(tf_delta.total_seconds() * 1000)
     # Определяем начало текущей свечи
     current_candle_start = get_current_candle_start_time(current_time, timeframe)
-    # Точный end_time как конец последней закрытой свечи (или кастомный)
-    if end_time is None:
-        end_time = current_candle_start - timedelta(microseconds=1)
-    end_time_ms = int(end_time.timestamp() * 1000)
-    # Точный start_time как начало limit-й предыдущей свечи
-    start_time = current_candle_start - limit * tf_delta
-    start_time_ms = int(start_time.timestamp() * 1000)
-    # Проверка корректности диапазона времени
-    if start_time_ms >= end_time_ms:
-        log_event("⚠️ Некорректный диапазон времени: start_time_ms >= end_time_ms, корректируем start_time_ms")
-        start_time_ms = int((current_candle_start - limit * tf_delta).timestamp() * 1000)
-    max_retries = 5
-    delay = 5
-    candles = None
-    for attempt in range(max_retries):
-        try:
-            response = client.get_kline(
-                category="linear",
-                symbol=symbol,
-                interval=interval,
-                start=start_time_ms,
-                end=end_time_ms,
-                limit=limit
-            )
-            if response['retCode'] != 0:
-                raise ValueError(f"Ошибка API: {response['retMsg']}")
-            candles = response['result']['list']
-            break
-        except Exception as e:
-            log_event(f"⚠️ Ошибка при получении свечей (попытка {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(delay * (2 ** attempt))
-            else:
-                log_event("⚠️ Не удалось получить свечи после всех попыток")
-                return
-    if not candles:
+    # Граница закрытых свечей: начало текущей свечи (или кастомный end_time)
+    if end_time is not None:
+        current_candle_start = end_time + timedelta(microseconds=1)
+    current_candle_start_ms = int(current_candle_start.timestamp() * 1000)
+    # Догружаем только недостающие свечи: последняя сохранённая перепроверяется, пропуски заполняются
+    store = get_candle_store(ctx)
+    sync = get_kline_sync(ctx, timeframe, limit)
+    requests_before, fetched_before = sync.requests, sync.fetched_candles
+    try:
+        with metrics.time('stage_seconds', stage='kline_sync', symbol=ctx.symbol):
+            updated, added, first_changed = sync.sync(current_candle_start_ms)
+    except Exception as e:
+        log_event(f"⚠️ Не удалось синхронизировать свечи: {e}")
+        return
+    log_event(f"📥 Синхронизация свечей {ctx.symbol}: запросов {sync.requests - requests_before}, получено {sync.fetched_candles - fetched_before} (всего {sync.fetched_candles})")
+    if len(store) == 0:
         log_event("⚠️ Нет закрытых свечей для актуализации")
         return
-    new_rows = []
-    for candle in candles:
-        candle_time = pd.to_datetime(int(candle[0]), unit='ms', utc=True)
-        new_data = {
-            'time': candle_time,
-            'open': float(candle[1]),
-            'high': float(candle[2]),
-            'low': float(candle[3]),
-            'close': float(candle[4])
-        }
-        new_rows.append(new_data)
-    if not new_rows:
-        log_event("📝 Нет новых данных для добавления")
+    if added or updated:
+        log_event(f"🗄️ Хранилище свечей: добавлено {added}, обновлено {updated}, всего {len(store)}")
+    if first_changed is None:
+        first_changed = len(store)
+    # Потоковый расчет индикаторов: продолжаем с контрольной точки или пересчитываем всю историю
+    params = get_indicator_params(ctx.market_type)
+    engine = load_indicator_engine(ctx, ctx.market_type, params)
+    start = None
+    if engine is not None and engine.last_time is not None:
+        position = store.index_of(engine.last_time)
+        # Контрольная точка годится, только если свечи до неё не были пересмотрены
+        if position is not None and position < first_changed:
+            start = position + 1
+    if start is None:
+        engine = IndicatorEngine(params)
+        start = 0
+        log_event(f"📐 Полный расчет индикаторов по {len(store)} свечам")
+    fresh = store.view()[start:]
+    if len(fresh) == 0:
+        log_event("📝 Нет новых закрытых свечей для расчета индикаторов")
         return
-    new_df = pd.DataFrame(new_rows)
-    # Удаляем старые записи в диапазоне запрошенных свечей
-    if not df_market.empty:
-        min_time = new_df['time'].min()
-        max_time = new_df['time'].max()
-        df_market = df_market[(df_market['time'] < min_time) | (df_market['time'] > max_time)]
-    # Добавляем свежие данные с проверкой на пустой df_market для избежания FutureWarning
-    if df_market.empty:
-        df_market = new_df
-    else:
-        df_market = pd.concat([df_market, new_df], ignore_index=True)
-    df_market = df_market.sort_values(by='time').drop_duplicates(subset=['time'])
-    # Универсальный расчет индикаторов с выбором параметров по типу рынка
-    closes_np = df_market['close'].values.astype(np.float64)
-    highs_np = df_market['high'].values.astype(np.float64)
-    lows_np = df_market['low'].values.astype(np.float64)
-    opens_np = df_market['open'].values.astype(np.float64) # Добавлен массив для opens
-    rsi_period = BULL_RSI_PERIOD if current_market_type == 'bull' else BEAR_RSI_PERIOD
-    sma_rsi_period = BULL_SMA_RSI_PERIOD if current_market_type == 'bull' else BEAR_SMA_RSI_PERIOD
-    stochrsi_k_period = BULL_STOCHRSI_K_PERIOD if current_market_type == 'bull' else BEAR_STOCHRSI_K_PERIOD
-    stochrsi_d_period = BULL_STOCHRSI_D_PERIOD if current_market_type == 'bull' else BEAR_STOCHRSI_D_PERIOD
-    stochrsi_rsi_period = BULL_STOCHRSI_RSI_PERIOD if current_market_type == 'bull' else BEAR_STOCHRSI_RSI_PERIOD
-    stochrsi_stoch_period = BULL_STOCHRSI_STOCH_PERIOD if current_market_type == 'bull' else BEAR_STOCHRSI_STOCH_PERIOD
-    williams_overbought_period = BULL_WILLIAMS_OVERBOUGHT_PERIOD if current_market_type == 'bull' else BEAR_WILLIAMS_OVERBOUGHT_PERIOD
-    williams_oversold_period = BULL_WILLIAMS_OVERSOLD_PERIOD if current_market_type == 'bull' else BEAR_WILLIAMS_OVERSOLD_PERIOD
-    williams_overbought_source = BULL_WILLIAMS_OVERBOUGHT_SOURCE if current_market_type == 'bull' else BEAR_WILLIAMS_OVERBOUGHT_SOURCE
-    williams_oversold_source = BULL_WILLIAMS_OVERSOLD_SOURCE if current_market_type == 'bull' else BEAR_WILLIAMS_OVERSOLD_SOURCE
-    # RSI (всегда рассчитывается)
-    if len(closes_np) >= rsi_period:
-        rsi = talib.RSI(closes_np, timeperiod=rsi_period)
-        df_market['RSI'] = rsi.astype(np.float64)
-        if len(rsi) >= sma_rsi_period:
-            sma_rsi = talib.SMA(rsi, timeperiod=sma_rsi_period)
-            df_market['RSI-based MA'] = sma_rsi.astype(np.float64)
-        else:
-            df_market['RSI-based MA'] = np.full(len(rsi), np.nan, dtype=np.float64)
-    else:
-        df_market['RSI'] = np.full(len(closes_np), np.nan, dtype=np.float64)
-        df_market['RSI-based MA'] = np.full(len(closes_np), np.nan, dtype=np.float64)
-    # Stochastic RSI (всегда рассчитывается)
-    if len(closes_np) >= stochrsi_rsi_period:
-        fastk, fastd = talib.STOCHRSI(
-            closes_np,
-            timeperiod=stochrsi_rsi_period,
-            fastk_period=stochrsi_stoch_period,
-            fastd_period=stochrsi_k_period,
-            fastd_matype=0
-        )
-        df_market['StochRSI_K'] = fastd.astype(np.float64)
-        if len(fastd) >= stochrsi_d_period:
-            df_market['StochRSI_D'] = talib.SMA(fastd, timeperiod=stochrsi_d_period).astype(np.float64)
-        else:
-            df_market['StochRSI_D'] = np.full(len(fastd), np.nan, dtype=np.float64)
-    else:
-        df_market['StochRSI_K'] = np.full(len(closes_np), np.nan, dtype=np.float64)
-        df_market['StochRSI_D'] = np.full(len(closes_np), np.nan, dtype=np.float64)
-    # Williams %R overbought (всегда рассчитывается)
-    if len(df_market) >= williams_overbought_period:
-        source_overbought_np = opens_np if williams_overbought_source == 'Open' else closes_np
-        df_market['Williams_R_Overbought'] = talib.WILLR(highs_np, lows_np, source_overbought_np, timeperiod=williams_overbought_period).astype(np.float64)
-    else:
-        df_market['Williams_R_Overbought'] = np.full(len(df_market), np.nan, dtype=np.float64)
-    # Williams %R oversold (всегда рассчитывается)
-    if len(df_market) >= williams_oversold_period:
-        source_oversold_np = opens_np if williams_oversold_source == 'Open' else closes_np
-        df_market['Williams_R_Oversold'] = talib.WILLR(highs_np, lows_np, source_oversold_np, timeperiod=williams_oversold_period).astype(np.float64)
-    else:
-        df_market['Williams_R_Oversold'] = np.full(len(df_market), np.nan, dtype=np.float64)
-    del closes_np, highs_np, lows_np, opens_np
-    save_market_data(df_market, current_market_type)
+    if start > 0:
+        log_event(f"📐 Инкрементальный расчет индикаторов: {len(fresh)} нов. свечей")
+    with metrics.time('stage_seconds', stage='indicators', symbol=ctx.symbol):
+        values = engine.run(fresh['time'], fresh['open'], fresh['high'], fresh['low'], fresh['close'])
+        store.set_values(start, {indicator_field(ctx.market_type, col): values[col] for col in INDICATOR_COLUMNS})
+        save_indicator_engine(ctx, engine, ctx.market_type)
+    save_market_data(ctx, ctx.market_type)
 
 
 
@@ -1392,9 +1352,13 @@ def get_next_candle_end_time(current_time, timeframe):
 
 
 
-def log_market_data(mid_price, previous_mid_price, last_price_indicator, current_time, current_rsi, current_sma_rsi, symbol, GLOBAL_TIMEFRAME, get_fear_greed_value, get_available_balance):
-    global current_stoch_k, current_stoch_d, current_williams_r_overbought, current_williams_r_oversold
-    global current_market_type  # Используем глобальную переменную
+def log_market_data(ctx, mid_price, current_time, snapshot=None):
+    previous_mid_price = ctx.previous_mid_price
+    last_price_indicator = ctx.last_price_indicator
+    current_rsi, current_sma_rsi = ctx.current['RSI'], ctx.current['RSI-based MA']
+    current_stoch_k, current_stoch_d = ctx.current['StochRSI_K'], ctx.current['StochRSI_D']
+    current_williams_r_overbought = ctx.current['Williams_R_Overbought']
+    current_williams_r_oversold = ctx.current['Williams_R_Oversold']
     price_change = mid_price - previous_mid_price
     price_indicator = last_price_indicator
     if previous_mid_price != 0:
@@ -1406,7 +1370,7 @@ def log_market_data(mid_price, previous_mid_price, last_price_indicator, current
             last_price_indicator = price_indicator
     log_event("----------------------------------------------|")
     log_event("---------------| Юнона 3 BYBIT |--------------|")
-    log_event("------- Изолированная маржа [BTC/USDT] -------|")
+    log_event(f"------- Изолированная маржа [{ctx.pair}] -------|")
     log_event("----------------------------------------------|")
     log_event(f"Таймфрейм: {GLOBAL_TIMEFRAME}, Данные: {ANALYSIS_TIMEFRAME}")
     log_event("----------------------------------------------|")
@@ -1414,7 +1378,7 @@ def log_market_data(mid_price, previous_mid_price, last_price_indicator, current
     current_time = get_server_time()
     if current_time.tzinfo is None:
         current_time = current_time.replace(tzinfo=timezone.utc)
-    df_market = load_market_data(current_market_type)  # Используем глобальную вместо повторного вызова
+    df_market = load_market_data(ctx, ctx.market_type)
     current_candle_start = get_current_candle_start_time(current_time, GLOBAL_TIMEFRAME)
     end_datetime = current_candle_start - timedelta(microseconds=1)
     if not df_market.empty:
@@ -1454,260 +1418,126 @@ def log_market_data(mid_price, previous_mid_price, last_price_indicator, current
         log_event(f"Индекс страха и жадности: {fear_greed_value}")
     else:
         log_event("Индекс страха и жадности: данные недоступны")
-    available_balance = get_available_balance()
+    available_balance = snapshot.balance if snapshot is not None else get_available_balance()
     log_event(f"Доступный баланс: {available_balance:,.2f} USDT")
     log_event("----------------------------------------------|")
 
 
 
-def check_signals(current_price):
-    global current_trade_type, previous_rsi, previous_sma_rsi, last_market_type, current_rsi, current_sma_rsi
-    global previous_stoch_k, previous_stoch_d, current_stoch_k, current_stoch_d
-    global previous_williams_r_overbought, current_williams_r_overbought
-    global previous_williams_r_oversold, current_williams_r_oversold
-    global BULL_WILLIAMS_OVERBOUGHT_LEVEL, BULL_WILLIAMS_OVERSOLD_LEVEL, BEAR_WILLIAMS_OVERBOUGHT_LEVEL, BEAR_WILLIAMS_OVERSOLD_LEVEL
-    global current_market_type # Используем глобальную переменную
-    with trades_lock:
-        current_time = get_server_time()
-        if current_time.tzinfo is None:
-            current_time = current_time.replace(tzinfo=timezone.utc)
-        if current_market_type is None:
-            log_event("⚠️ Тип рынка не определён для текущей даты")
-            return
-        # Получаем значение индекса страха и жадности
-        fear_greed_value = get_fear_greed_value(current_time)
-        if fear_greed_value is None:
-            log_event("⚠️ Нет данных индекса страха для текущей даты. Работаем только по RSI.")
-        # Проверяем пересечение RSI и SMA RSI напрямую на globals (как в бэктесте после импорта после импорта)
-        crossing = check_rsi_crossing(current_rsi, current_sma_rsi)
-        # Проверяем пересечение StochRSI K/D напрямую на globals
-        stoch_crossing = check_stoch_crossing(current_stoch_k, current_stoch_d)
-        # Логика для бычьего рынка
-        if current_market_type == 'bull' and TRADING_CONFIG['ENABLE_BULL_MARKET']:
-            if not active_trades:
-                # Открытие bull long: RSI вверх
-                if TRADING_CONFIG['ENABLE_BULL_LONG'] and TRADING_CONFIG['ENABLE_BULL_RSI'] and crossing == "up":
-                    log_event(f"📈 Сигнал на открытие BULL_LONG: Пересечение RSI вверх")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_LONG', current_price, position_value)
-                # Открытие bull long: перепроданность Williams
-                if TRADING_CONFIG['ENABLE_BULL_LONG'] and TRADING_CONFIG['ENABLE_BULL_WILLIAMS_OVERSOLD'] and current_williams_r_oversold <= BULL_WILLIAMS_OVERSOLD_LEVEL:
-                    log_event(f"📈 Сигнал на открытие BULL_LONG: Перепроданность Williams %R")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_LONG', current_price, position_value)
-                # Открытие bull long: индекс страха
-                if TRADING_CONFIG['ENABLE_BULL_LONG'] and TRADING_CONFIG['ENABLE_BULL_FEAR_GREED'] and fear_greed_value is not None and fear_greed_value <= BULL_FEAR_GREED_LOW:
-                    log_event(f"📈 Сигнал на открытие BULL_LONG: Низкий индекс страха ({fear_greed_value})")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_LONG', current_price, position_value)
-                # Открытие bull long: StochRSI вверх (новое условие)
-                if TRADING_CONFIG['ENABLE_BULL_LONG'] and TRADING_CONFIG['ENABLE_BULL_STOCHRSI'] and stoch_crossing == "up":
-                    log_event(f"📈 Сигнал на открытие BULL_LONG: Пересечение StochRSI вверх")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_LONG', current_price, position_value)
-                # Открытие bull short: RSI вниз
-                if TRADING_CONFIG['ENABLE_BULL_SHORT'] and TRADING_CONFIG['ENABLE_BULL_RSI'] and crossing == "down":
-                    log_event(f"📉 Сигнал на открытие BULL_SHORT: Пересечение RSI вниз")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_SHORT', current_price, position_value)
-                # Открытие bull short: перекупленность Williams
-                if TRADING_CONFIG['ENABLE_BULL_SHORT'] and TRADING_CONFIG['ENABLE_BULL_WILLIAMS_OVERBOUGHT'] and current_williams_r_overbought >= BULL_WILLIAMS_OVERBOUGHT_LEVEL:
-                    log_event(f"📉 Сигнал на открытие BULL_SHORT: Перекупленность Williams %R")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_SHORT', current_price, position_value)
-                # Открытие bull short: высокий индекс жадности
-                if TRADING_CONFIG['ENABLE_BULL_SHORT'] and TRADING_CONFIG['ENABLE_BULL_FEAR_GREED']:
-                    log_event(f"📉 Сигнал на открытие BULL_SHORT: Высокий индекс жадности ({fear_greed_value})")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_SHORT', current_price, position_value)
-                # Открытие bull short: StochRSI вниз (новое условие)
-                if TRADING_CONFIG['ENABLE_BULL_SHORT'] and TRADING_CONFIG['ENABLE_BULL_STOCHRSI'] and stoch_crossing == "down":
-                    log_event(f"📉 Сигнал на открытие BULL_SHORT: Пересечение StochRSI вниз")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BULL_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BULL_SHORT', current_price, position_value)
-            else:
-                if current_trade_type == 'BULL_LONG':
-                    # Закрытие bull long: RSI вниз
-                    if TRADING_CONFIG['ENABLE_BULL_RSI'] and crossing == "down":
-                        log_event(f"🔄 Закрытие BULL_LONG: Пересечение RSI вниз")
-                        close_all_trades("rsi_down", force_close=True)
-                    # Закрытие bull long: стохастик вниз
-                    if TRADING_CONFIG['ENABLE_BULL_STOCHRSI'] and stoch_crossing == "down":
-                        log_event(f"🔄 Закрытие BULL_LONG: Пересечение StochRSI вниз")
-                        close_all_trades("stoch_down", force_close=True)
-                    # Закрытие bull long: перекупленность по Williams
-                    if TRADING_CONFIG['ENABLE_BULL_WILLIAMS_OVERBOUGHT'] and current_williams_r_overbought >= BULL_WILLIAMS_OVERBOUGHT_LEVEL:
-                        log_event(f"🔄 Закрытие BULL_LONG: Перекупленность Williams %R")
-                        close_all_trades("williams_overbought", force_close=True)
-                elif current_trade_type == 'BULL_SHORT':
-                    # Закрытие bull short: RSI вверх
-                    if TRADING_CONFIG['ENABLE_BULL_RSI'] and crossing == "up":
-                        log_event(f"🔄 Закрытие BULL_SHORT: Пересечение RSI вверх")
-                        close_all_trades("rsi_up", force_close=True)
-                    # Закрытие bull short: стохастик вверх
-                    if TRADING_CONFIG['ENABLE_BULL_STOCHRSI'] and stoch_crossing == "up":
-                        log_event(f"🔄 Закрытие BULL_SHORT: Пересечение StochRSI вверх")
-                        close_all_trades("stoch_up", force_close=True)
-                    # Закрытие bull short: перепроданность по Williams
-                    if TRADING_CONFIG['ENABLE_BULL_WILLIAMS_OVERSOLD'] and current_williams_r_oversold <= BULL_WILLIAMS_OVERSOLD_LEVEL:
-                        log_event(f"🔄 Закрытие BULL_SHORT: Перепроданность Williams %R")
-                        close_all_trades("williams_oversold", force_close=True)
-        # Логика для медвежьего рынка
-        elif current_market_type == 'bear' and TRADING_CONFIG['ENABLE_BEAR_MARKET']:
-            if not active_trades:
-                # Открытие bear short: RSI вниз
-                if TRADING_CONFIG['ENABLE_BEAR_SHORT'] and TRADING_CONFIG['ENABLE_BEAR_RSI'] and crossing == "down":
-                    log_event(f"📉 Сигнал на открытие BEAR_SHORT: Пересечение RSI вниз")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_SHORT', current_price, position_value)
-                # Открытие bear short: перекупленность Williams
-                if TRADING_CONFIG['ENABLE_BEAR_SHORT'] and TRADING_CONFIG['ENABLE_BEAR_WILLIAMS_OVERBOUGHT'] and current_williams_r_overbought >= BEAR_WILLIAMS_OVERBOUGHT_LEVEL:
-                    log_event(f"📉 Сигнал на открытие BEAR_SHORT: Перекупленность Williams %R")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_SHORT', current_price, position_value)
-                # Открытие bear short: индекс страха
-                if TRADING_CONFIG['ENABLE_BEAR_SHORT'] and TRADING_CONFIG['ENABLE_BEAR_FEAR_GREED'] and fear_greed_value is not None and fear_greed_value >= BEAR_FEAR_GREED_HIGH:
-                    log_event(f"📉 Сигнал на открытие BEAR_SHORT: Высокий индекс страха ({fear_greed_value})")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_SHORT', current_price, position_value)
-                # Открытие bear short: StochRSI вниз (новое условие)
-                if TRADING_CONFIG['ENABLE_BEAR_SHORT'] and TRADING_CONFIG['ENABLE_BEAR_STOCHRSI'] and stoch_crossing == "down":
-                    log_event(f"📉 Сигнал на открытие BEAR_SHORT: Пересечение StochRSI вниз")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_SHORT']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_SHORT', current_price, position_value)
-                # Открытие bear long: RSI вверх
-                if TRADING_CONFIG['ENABLE_BEAR_LONG'] and TRADING_CONFIG['ENABLE_BEAR_RSI'] and crossing == "up":
-                    log_event(f"📈 Сигнал на открытие BEAR_LONG: Пересечение RSI вверх")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_LONG', current_price, position_value)
-                # Открытие bear long: перепроданность Williams
-                if TRADING_CONFIG['ENABLE_BEAR_LONG'] and TRADING_CONFIG['ENABLE_BEAR_WILLIAMS_OVERSOLD'] and current_williams_r_oversold <= BEAR_WILLIAMS_OVERSOLD_LEVEL:
-                    log_event(f"📈 Сигнал на открытие BEAR_LONG: Перепроданность Williams %R")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_LONG', current_price, position_value)
-                # Открытие bear long: низкий индекс страха
-                if TRADING_CONFIG['ENABLE_BEAR_LONG'] and TRADING_CONFIG['ENABLE_BEAR_FEAR_GREED']:
-                    log_event(f"📈 Сигнал на открытие BEAR_LONG: Низкий индекс страха ({fear_greed_value})")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_LONG', current_price, position_value)
-                # Открытие bear long: StochRSI вверх (новое условие)
-                if TRADING_CONFIG['ENABLE_BEAR_LONG'] and TRADING_CONFIG['ENABLE_BEAR_STOCHRSI'] and stoch_crossing == "up":
-                    log_event(f"📈 Сигнал на открытие BEAR_LONG: Пересечение StochRSI вверх")
-                    position_value = (get_available_balance() * TRADING_CONFIG['BEAR_LONG']['ENTRY_PERCENT']) / 100
-                    open_trade('BEAR_LONG', current_price, position_value)
-            else:
-                if current_trade_type == 'BEAR_SHORT':
-                    # Закрытие bear short: RSI вверх
-                    if TRADING_CONFIG['ENABLE_BEAR_RSI'] and crossing == "up":
-                        log_event(f"🔄 Закрытие BEAR_SHORT: Пересечение RSI вверх")
-                        close_all_trades("rsi_up", force_close=True)
-                    # Закрытие bear short: стохастик вверх (обратное пересечение)
-                    if TRADING_CONFIG['ENABLE_BEAR_STOCHRSI'] and stoch_crossing == "up":
-                        log_event(f"🔄 Закрытие BEAR_SHORT: Пересечение StochRSI вверх")
-                        close_all_trades("stoch_up", force_close=True)
-                    # Закрытие bear short: перепроданность по Williams
-                    if TRADING_CONFIG['ENABLE_BEAR_WILLIAMS_OVERSOLD'] and current_williams_r_oversold <= BEAR_WILLIAMS_OVERSOLD_LEVEL:
-                        log_event(f"🔄 Закрытие BEAR_SHORT: Перепроданность Williams %R")
-                        close_all_trades("williams_oversold", force_close=True)
-                elif current_trade_type == 'BEAR_LONG':
-                    # Закрытие bear long: RSI вниз
-                    if TRADING_CONFIG['ENABLE_BEAR_RSI'] and crossing == "down":
-                        log_event(f"🔄 Закрытие BEAR_LONG: Пересечение RSI вниз")
-                        close_all_trades("rsi_down", force_close=True)
-                    # Закрытие bear long: стохастик вниз
-                    if TRADING_CONFIG['ENABLE_BEAR_STOCHRSI'] and stoch_crossing == "down":
-                        log_event(f"🔄 Закрытие BEAR_LONG: Пересечение StochRSI вниз")
-                        close_all_trades("stoch_down", force_close=True)
-                    # Закрытие bear long: перекупленность по Williams
-                    if TRADING_CONFIG['ENABLE_BEAR_WILLIAMS_OVERBOUGHT'] and current_williams_r_overbought >= BEAR_WILLIAMS_OVERBOUGHT_LEVEL:
-                        log_event(f"🔄 Закрытие BEAR_LONG: Перекупленность Williams %R")
-                        close_all_trades("williams_overbought", force_close=True)
-        manage_liquidation_price()
-        # Отображение всех активных сделок
-        log_event("----------------------------------------------|")
-        log_event("-------------- Проверка сигнала --------------|")
-        log_event("----------------------------------------------|")
-
-
-def open_trade(trade_type, entry_price, position_value=None, trailing_status=None):
-    global next_trade_id, active_trades, df_trades, trades_lock, MAX_ACTIVE_TRADES, TRADING_CONFIG, CSV_FILE, current_trade_type, client, symbol
-    start_time = time.time()
+def check_signals(ctx, current_price, snapshot=None):
+    started = time.perf_counter()
+    # Состояние сделок читается под trades_lock, ордера исполняются уже без него
+    with ctx.trades_lock:
+        has_active_trades = bool(ctx.active_trades)
+        trade_type = ctx.current_trade_type
+    # Объём входа считается от баланса одного среза, а не от нового запроса на каждый сигнал
+    if snapshot is None:
+        snapshot = get_account_snapshot(ctx)
+    current_time = get_server_time()
+    if current_time.tzinfo is None:
+        current_time = current_time.replace(tzinfo=timezone.utc)
+    if ctx.market_type is None:
+        log_event("⚠️ Тип рынка не определён для текущей даты")
+        return
+    # Получаем значение индекса страха и жадности
+    fear_greed_value = get_fear_greed_value(current_time)
+    if fear_greed_value is None:
+        log_event("⚠️ Нет данных индекса страха для текущей даты. Работаем только по RSI.")
+    # Правила из таблицы j3_rules на двух последних свечах — те же, что и в бэктесте
+    indicators = ctx.rule_indicators()
+    fear_greed = [None, fear_greed_value]
+    rules = get_signal_rules()
+    rule = None
+    if not has_active_trades:
+        rule = rules.entry(ctx.market_type, indicators, fear_greed)
+    elif trade_type is not None:
+        rule = rules.exit(ctx.market_type, indicators, fear_greed, trade_type)
+    # Длительность решения без исполнения ордера
+    metrics.observe('stage_seconds', time.perf_counter() - started, stage='check_signals', symbol=ctx.symbol)
+    if not has_active_trades:
+        if rule is not None:
+            open_type, _, flag, description = rule
+            if flag == 'FEAR_GREED':
+                description = f"{description} ({fear_greed_value})"
+            log_event(f"{'📈' if 'LONG' in open_type else '📉'} {ctx.symbol}: сигнал на открытие {open_type}: {description}")
+            position_value = (ctx.capital(snapshot.balance) * TRADING_CONFIG[open_type]['ENTRY_PERCENT']) / 100
+            open_trade(ctx, open_type, current_price, position_value, snapshot=snapshot)
+    elif trade_type is not None:
+        if rule is not None:
+            reason, _, description = rule
+            log_event(f"🔄 {ctx.symbol}: закрытие {trade_type}: {description}")
+            close_all_trades(ctx, reason, force_close=True)
+    manage_liquidation_price(ctx)  # Срез из кеша, если ордеров не было, иначе новый
+    # Отображение всех активных сделок
+    log_event("----------------------------------------------|")
+    log_event("-------------- Проверка сигнала --------------|")
+    log_event("----------------------------------------------|")
+
+
+def open_trade(ctx, trade_type, entry_price, position_value=None, trailing_status=None, snapshot=None):
+    started = time.perf_counter()
     max_retries = 5
     delay = 5
-    with trades_lock:
-        log_event(f"Пауза 5 секунд перед открытием новой сделки")
-        time.sleep(5)
-        if not TRADING_CONFIG[f'ENABLE_{trade_type}']:
-            log_event(f"⚠️ Открытие {trade_type} отключено в конфигурации")
-            return
-        if len(active_trades) >= MAX_ACTIVE_TRADES:
-            log_event("⚠️ Достигнут лимит активных сделок")
-            return
-        available_balance = get_available_balance()
+    # Ордер в работе держит только order_lock; trades_lock берётся на короткие проверки и запись сделки,
+    # поэтому проверка сигналов и контроль ликвидации не ждут запросов к бирже
+    with ctx.order_lock:
+        with ctx.trades_lock:
+            if not TRADING_CONFIG[f'ENABLE_{trade_type}']:
+                log_event(f"⚠️ Открытие {trade_type} отключено в конфигурации")
+                return
+            if len(ctx.active_trades) >= MAX_ACTIVE_TRADES:
+                log_event("⚠️ Достигнут лимит активных сделок")
+                return
+        # Баланс из среза цикла проверки сигналов, без отдельного запроса
+        available_balance = snapshot.balance if snapshot is not None else get_available_balance()
         log_event(f" Доступный баланс: {available_balance}")
         if position_value is None:
             if trade_type in TRADING_CONFIG:
-                position_value = (available_balance * TRADING_CONFIG[trade_type]['ENTRY_PERCENT']) / 100
+                position_value = (ctx.capital(available_balance) * TRADING_CONFIG[trade_type]['ENTRY_PERCENT']) / 100
             else:
                 log_event(f"⚠️ Неизвестный тип сделки: {trade_type}")
                 return
-        # Retry для получения информации о символе
-        for attempt in range(max_retries):
-            try:
-                symbol_info = client.get_instruments_info(category="linear", symbol=symbol)
-                if symbol_info['retCode'] != 0:
-                    raise ValueError(f"Ошибка API: {symbol_info['retMsg']}")
-                instrument = symbol_info['result']['list'][0]
-                qty_step = float(instrument['lotSizeFilter']['qtyStep'])
-                precision = int(round(-math.log(qty_step, 10), 0))
-                break
-            except Exception as e:
-                log_event(f"⚠️ Ошибка получения информации о символе (попытка {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(delay * (2 ** attempt))
-                else:
-                    log_event("⚠️ Не удалось получить информацию о символе")
-                    return
+        deadline = time.monotonic() + ORDER_STEP_TIMEOUT
+        symbol_info = call_with_retries(lambda: get_instrument_info(ctx), "получение информации о символе",
+                                        max_retries=max_retries, delay=delay, deadline=deadline, log=log_event)
+        if symbol_info is None:
+            return
+        precision = symbol_info['precision']
         leverage = TRADING_CONFIG.get(trade_type, {}).get('LEVERAGE', 1)
         log_event(f"Плечо для {trade_type}: {leverage}x")
-        # Retry для установки плеча
-        for attempt in range(max_retries):
+
+        def apply_leverage():
+            # Плечо, выставленное при подготовке к закрытию этой свечи, не перепроверяется
+            if ctx.candle_close is not None and ctx.warmup.get('candle_close') == ctx.candle_close \
+                    and ctx.warmup.get('leverage') == leverage:
+                log_event(f"✅ Плечо {leverage}x выставлено заранее")
+                return True
+            position_response = get_positions_response(ctx.symbol)
+            if position_response['retCode'] == 0 and position_response['result']['list']:
+                current_leverage = float(position_response['result']['list'][0]['leverage'])
+                if current_leverage == leverage:
+                    log_event(f"✅ Плечо уже установлено на {leverage}x")
+                    return True
             try:
-                position_response = client.get_positions(category="linear", symbol=symbol)
-                if position_response['retCode'] == 0 and position_response['result']['list']:
-                    current_leverage = float(position_response['result']['list'][0]['leverage'])
-                    if current_leverage == leverage:
-                        log_event(f"✅ Плечо уже установлено на {leverage}x")
-                    else:
-                        client.set_leverage(
-                            category="linear",
-                            symbol=symbol,
-                            buyLeverage=str(leverage),
-                            sellLeverage=str(leverage)
-                        )
-                        log_event(f"✅ Плечо установлено на {leverage}x для {trade_type}")
-                else:
-                    client.set_leverage(
-                        category="linear",
-                        symbol=symbol,
-                        buyLeverage=str(leverage),
-                        sellLeverage=str(leverage)
-                    )
-                    log_event(f"✅ Плечо установлено на {leverage}x для {trade_type}")
-                break
+                client.set_leverage(
+                    category="linear",
+                    symbol=ctx.symbol,
+                    buyLeverage=str(leverage),
+                    sellLeverage=str(leverage)
+                )
             except Exception as e:
                 if "leverage not modified" in str(e):
                     log_event(f"⚠️ Плечо не изменено, так как уже установлено на {leverage}x")
-                    break
-                else:
-                    log_event(f"⚠️ Ошибка установки плеча (попытка {attempt + 1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(delay * (2 ** attempt))
-                    else:
-                        log_event("⚠️ Не удалось установить плечо")
-                        return
-        min_order_qty = float(instrument['lotSizeFilter']['minOrderQty'])
-        current_price = get_current_price_with_retries(client, symbol)
+                    return True
+                raise
+            log_event(f"✅ Плечо установлено на {leverage}x для {trade_type}")
+            return True
+
+        if call_with_retries(apply_leverage, "установка плеча", max_retries=max_retries, delay=delay,
+                             deadline=time.monotonic() + ORDER_STEP_TIMEOUT, log=log_event) is None:
+            return
+        min_order_qty = symbol_info['min_order_qty']
+        current_price = get_current_price_with_retries(client, ctx.symbol)
         amount_btc = ((position_value * leverage) / current_price) * 0.9
         amount_btc = math.floor(amount_btc * (10 ** precision)) / (10 ** precision)
         log_event(f"Размер ордера: {amount_btc} BTC")
@@ -1721,53 +1551,41 @@ def open_trade(trade_type, entry_price, position_value=None, trailing_status=Non
         else:
             log_event(f"⚠️ Неизвестный тип сделки: {trade_type}")
             return
-        # Retry для размещения ордера
-        for attempt in range(max_retries):
-            try:
-                order = client.place_order(
-                    category="linear",
-                    symbol=symbol,
-                    side=side,
-                    orderType="Market",
-                    qty=str(amount_btc),
-                    reduceOnly=False,
-                    marginMode="ISOLATED"
-                )
-                if order['retCode'] != 0:
-                    raise ValueError(f"Ошибка API: {order['retMsg']}")
-                log_event(f"✅ Ордер успешно размещен: {order}")
-                break
-            except Exception as e:
-                log_event(f"⚠️ Ошибка размещения ордера (попытка {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(delay * (2 ** attempt))
-                else:
-                    log_event("⚠️ Не удалось разместить ордер")
-                    return
-        current_trade_id = next_trade_id
-        next_trade_id += 1
-        entry_time = get_server_time()
-        entry_time_str = entry_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        commission_open = position_value * (TRADING_CONFIG['COMMISSION_RATE'] / 100)
-        new_trade = {
-            'id': current_trade_id,
-            'direction': trade_type,
-            'entry_price': current_price,
-            'entry_time': entry_time,
-            'entry_time_str': entry_time_str,
-            'current_price': current_price,
-            'size': amount_btc,
-            'value': position_value,
-            'leverage': leverage,
-            'commission_open': commission_open,
-            'status': 'open',
-            'trailing_active': False if trailing_status is None else trailing_status,
-            'max_price': current_price,
-        }
-        active_trades[entry_time_str] = new_trade
-        current_trade_type = trade_type
-        if TRADING_CONFIG['ENABLE_LOGGING'] and CSV_FILE is not None:
-            current_balance = get_available_balance()
+        # Расчёт объёма: информация о символе, плечо, цена и количество
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage='sizing', symbol=ctx.symbol)
+        order = get_order_executor(ctx).execute(Order(side, amount_btc, params={'marginMode': "ISOLATED"}))
+        record_order_metrics(ctx, order)
+        invalidate_account_snapshot(ctx)
+        if order.state != ORDER_FILLED:
+            log_event("⚠️ Не удалось разместить ордер")
+            return
+        # Один новый срез после исполнения: баланс для журнала, отчёт и позиция
+        snapshot = get_account_snapshot(ctx, refresh=True)
+        with ctx.trades_lock:
+            current_trade_id = ctx.next_trade_id
+            ctx.next_trade_id += 1
+            entry_time = get_server_time()
+            entry_time_str = entry_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+            commission_open = position_value * (TRADING_CONFIG['COMMISSION_RATE'] / 100)
+            new_trade = {
+                'id': current_trade_id,
+                'direction': trade_type,
+                'entry_price': current_price,
+                'entry_time': entry_time,
+                'entry_time_str': entry_time_str,
+                'current_price': current_price,
+                'size': amount_btc,
+                'value': position_value,
+                'leverage': leverage,
+                'commission_open': commission_open,
+                'status': 'open',
+                'trailing_active': False if trailing_status is None else trailing_status,
+                'max_price': current_price,
+            }
+            ctx.active_trades[entry_time_str] = new_trade
+            ctx.current_trade_type = trade_type
+        if TRADING_CONFIG['ENABLE_LOGGING'] and ctx.journal is not None:
+            current_balance = snapshot.balance
             new_row = {
                 'Trade_ID': str(current_trade_id),
                 'Status': 'open',
@@ -1786,30 +1604,26 @@ def open_trade(trade_type, entry_price, position_value=None, trailing_status=Non
                 'Balance': float(current_balance),
                 'Withdraw': np.nan
             }
-            if df_trades is None or df_trades.empty or df_trades.isna().all().all():
-                df_trades = pd.DataFrame([new_row])
-            else:
-                df_trades = pd.concat([df_trades, pd.DataFrame([new_row])], ignore_index=True)
-            df_trades = df_trades.tail(30)
             try:
-                df_trades['Position_Size'] = df_trades['Position_Size'].map('{:.3f}'.format, na_action='ignore')
-                if not CSV_FILE.exists():
-                    df_trades.to_csv(CSV_FILE, index=False, float_format='%.2f')
-                else:
-                    with open(CSV_FILE, 'a', newline='') as f:
-                        formatted_row = new_row.copy()
-                        formatted_row['Position_Size'] = '{:.3f}'.format(new_row['Position_Size'])
-                        pd.DataFrame([formatted_row]).to_csv(f, header=False, index=False, float_format='%.2f')
+                ctx.journal.append(new_row)
+                ctx.journal.mark_balance(entry_time, current_balance, f"open_{trade_type}")
             except Exception as e:
-                log_event(f"Ошибка при записи в CSV: {e}")
-        current_time = get_server_time()
-        log_market_data(current_price, previous_mid_price, last_price_indicator, current_time, current_rsi, current_sma_rsi, symbol, GLOBAL_TIMEFRAME, get_fear_greed_value, get_available_balance)
-        display_position()
+                log_event(f"Ошибка при записи в журнал сделок: {e}")
+    current_time = get_server_time()
+    log_market_data(ctx, current_price, current_time, snapshot=snapshot)
+    display_position(ctx, snapshot)
+
+
 
 
+def get_instrument_info(ctx, refresh=False):
+    """Лимиты инструмента (минимальный объём, шаг, точность) из кеша контекста; обновляются при подготовке к закрытию свечи."""
+    if refresh or ctx.instrument is None:
+        ctx.instrument = get_symbol_info(ctx.symbol, raise_errors=True)
+    return ctx.instrument
 
 
-def get_symbol_info(symbol):
+def get_symbol_info(symbol, raise_errors=False):
     try:
         symbol_info = client.get_instruments_info(category="linear", symbol=symbol)
         if symbol_info['retCode'] != 0:
@@ -1824,38 +1638,44 @@ def get_symbol_info(symbol):
             'precision': precision
         }
     except Exception as e:
+        if raise_errors:
+            raise
         log_event(f"Ошибка при получении информации о символе: {e}")
         return None
     
 
-def set_leverage(symbol, leverage, direction):
+def set_leverage(ctx, leverage, direction):
+    """Один запрос установки плеча; False — биржа отклонила (ошибка уже в логе)."""
+    ctx.warmup.pop('leverage', None)
     try:
         response = client.set_leverage(
             category="linear",
-            symbol=symbol,
+            symbol=ctx.symbol,
             buyLeverage=str(leverage),
             sellLeverage=str(leverage)
         )
         if response['retCode'] != 0:
             raise ValueError(f"Ошибка API: {response['retMsg']}")
         log_event(f"✅ Плечо установлено на {leverage:.2f}x для {direction}")
-        time.sleep(6)
+        return True
     except Exception as e:
-        log_event(f"⚠️ Размер плеча минимальный")
-        log_event(f"Пауза 5 секунд для пересчета цены ликвидации")
-        time.sleep(5)
-        manage_liquidation_price()
+        log_event(f"⚠️ Плечо {leverage:.2f}x для {direction} не установлено: {e}")
+        return False
 
 
-def adjust_leverage_after_partial_close(direction, min_delta):
-    global client, symbol, MIN_DELTA_LIQUIDATION_LONG, MIN_DELTA_LIQUIDATION_SHORT
-    # Получаем текущие данные о позиции
-    position_response = client.get_positions(category="linear", symbol=symbol)
+def adjust_leverage_after_partial_close(ctx, direction, min_delta):
+    """
+    Снижение плеча до дельты min_delta + MIN_DELTA_LIQUIDATION_BUFFER одним set_leverage:
+    целевое плечо считается по модели изолированной маржи (j3_margin.target_leverage)
+    из цены входа, размера, поддерживающей маржи и капитала символа; результат
+    проверяется по обновлению позиции из потока position.
+    """
+    position_response = get_positions_response(ctx.symbol)
     if position_response['retCode'] != 0:
         log_event(f"⚠️ Ошибка API: {position_response['retMsg']}")
         return
     positions = position_response['result']['list']
-    if not positions:
+    if not positions or float(positions[0].get('size') or 0) <= 0:
         log_event("⚪ Нет активных позиций для управления рисками")
         return
     position = positions[0]
@@ -1865,89 +1685,78 @@ def adjust_leverage_after_partial_close(direction, min_delta):
         log_event("⚪ Нет цены ликвидации")
         return
     liquidation_price = float(liq_price_str)
-    # Получаем текущую рыночную цену
-    current_price = get_current_price_with_retries(client, symbol)
-    # Рассчитываем дельту маржи
-    if direction == 'LONG':
-        delta_percent = (current_price - liquidation_price) / current_price * 100
-    else:
-        delta_percent = (liquidation_price - current_price) / current_price * 100
+    # Биржа ликвидирует по mark-цене; без потока тикеров — запрос цены
+    current_price = market_feed.get_price(ctx.symbol, 'mark') if market_feed is not None else None
+    if current_price is None:
+        current_price = get_current_price_with_retries(client, ctx.symbol)
+    delta_percent = position_delta(direction, current_price, liquidation_price)
     log_event(f"Текущая дельта: {delta_percent:.2f}% (минимальная: {min_delta}%)")
-    # Устанавливаем минимальное плечо (обычно 1x на Bybit)
-    min_leverage = 1.0
-    leverage_step = 0.6 # Шаг уменьшения плеча
-    # Цикл уменьшения плеча
-    while delta_percent < min_delta and current_leverage > min_leverage:
-        new_leverage = max(current_leverage - leverage_step, min_leverage)
-        set_leverage(symbol, new_leverage, direction)
-        time.sleep(2) # Пауза для обновления данных на бирже
-        # Обновляем данные о позиции
-        position_response = client.get_positions(category="linear", symbol=symbol)
-        if position_response['retCode'] != 0:
-            log_event(f"⚠️ Ошибка API: {position_response['retMsg']}")
-            break
-        positions = position_response['result']['list']
-        if not positions:
-            log_event("⚪ Позиция закрыта")
-            break
-        position = positions[0]
-        current_leverage = float(position['leverage'])
-        liq_price_str = position.get('liqPrice', '')
-        if liq_price_str == '':
-            log_event("⚪ Нет цены ликвидации после обновления")
-            break
-        liquidation_price = float(liq_price_str)
-        # Пересчитываем дельту
-        if direction == 'LONG':
-            delta_percent = (current_price - liquidation_price) / current_price * 100
-        else:
-            delta_percent = (liquidation_price - current_price) / current_price * 100
-        log_event(f"Новое плечо: {current_leverage}x, новая дельта: {delta_percent:.2f}%")
-        if delta_percent >= min_delta:
-            log_event(f"✅ Дельта достигла {delta_percent:.2f}%, что >= {min_delta}%. Остановка уменьшения плеча.")
-            break
-        elif current_leverage <= min_leverage:
-            log_event(f"⚠️ Плечо достигло минимального значения {min_leverage}x, но дельта все еще {delta_percent:.2f}% < {min_delta}%.")
-            break
-
-
-def close_all_trades(reason, exit_time=None, force_close=False, position_value=None):
-    global df_trades, active_trades, trades_lock, TRADING_CONFIG, CSV_FILE, bull_long_trades_count, current_trade_type, client, symbol, current_market_type
-    start_time = time.time()
+    if delta_percent >= min_delta:
+        return
+    new_leverage, expected_delta = target_leverage(
+        direction, current_price, float(position['avgPrice']), current_leverage, liquidation_price,
+        min_delta + MIN_DELTA_LIQUIDATION_BUFFER,
+        size=float(position['size']), budget=ctx.capital(get_available_balance())
+    )
+    if new_leverage >= current_leverage:
+        log_event(f"⚠️ Плечо {current_leverage}x не снижается (минимум 1x или не хватает капитала), дельта {delta_percent:.2f}% < {min_delta}%")
+        return
+    log_event(f"Целевое плечо {new_leverage:.2f}x, ожидаемая дельта {expected_delta:.2f}%")
+    position_version = get_position_version(ctx.symbol)
+    if not set_leverage(ctx, new_leverage, direction):
+        return
+    # Проверка: позиция с новым плечом из потока position (без потока — пауза и REST)
+    position = wait_for_position_refresh(ctx.symbol, position_version, predicate=lambda p: abs(float(p.get('leverage') or 0) - new_leverage) < 1e-6)
+    if position is None:
+        position_response = get_positions_response(ctx.symbol)
+        if position_response['retCode'] != 0 or not position_response['result']['list']:
+            return
+        position = position_response['result']['list'][0]
+    if position.get('liqPrice') in (None, ''):
+        log_event("⚪ Нет цены ликвидации после обновления")
+        return
+    delta_percent = position_delta(direction, current_price, float(position['liqPrice']))
+    log_event(f"Новое плечо: {position['leverage']}x, новая дельта: {delta_percent:.2f}%")
+    if delta_percent < min_delta:
+        log_event(f"⚠️ Дельта {delta_percent:.2f}% после снижения плеча всё ещё < {min_delta}%")
+
+
+def close_all_trades(ctx, reason, exit_time=None, force_close=False, position_value=None):
     trades_to_close = []
     max_retries = 5
     delay = 5
-    with trades_lock:
-        if not active_trades:
-            log_event("⚪ Нет активных сделок для закрытия")
-            return
+    with ctx.order_lock:
+        with ctx.trades_lock:
+            if not ctx.active_trades:
+                log_event("⚪ Нет активных сделок для закрытия")
+                return
         if exit_time is None:
             exit_time = get_server_time()
         exit_time_str = exit_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        current_price = get_current_price_with_retries(client, symbol)
-        # Retry для получения текущих позиций
-        for attempt in range(max_retries):
-            try:
-                position_response = client.get_positions(category="linear", symbol=symbol)
-                if position_response['retCode'] != 0:
-                    raise ValueError(f"Ошибка API: {position_response['retMsg']}")
-                positions = position_response['result']['list']
-                if not positions:
-                    log_event("⚪ Нет активных позиций для закрытия")
-                    return
-                position = positions[0]
-                size = float(position['size'])
-                side = position['side']
-                direction = 'LONG' if side == 'Buy' else 'SHORT'
-                break
-            except Exception as e:
-                log_event(f"⚠️ Ошибка получения позиции (попытка {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(delay * (2 ** attempt))
-                else:
-                    log_event("⚠️ Не удалось получить данные позиции")
-                    return
-        symbol_info = get_symbol_info(symbol)
+        current_price = get_current_price_with_retries(client, ctx.symbol)
+
+        def read_positions():
+            position_response = get_positions_response(ctx.symbol)
+            if position_response['retCode'] != 0:
+                raise ValueError(f"Ошибка API: {position_response['retMsg']}")
+            return position_response['result']['list']
+
+        positions = call_with_retries(read_positions, "получение позиции", max_retries=max_retries, delay=delay,
+                                      deadline=time.monotonic() + ORDER_STEP_TIMEOUT, log=log_event)
+        if positions is None:
+            return
+        if not positions:
+            log_event("⚪ Нет активных позиций для закрытия")
+            return
+        position = positions[0]
+        size = float(position['size'])
+        side = position['side']
+        direction = 'LONG' if side == 'Buy' else 'SHORT'
+        try:
+            symbol_info = get_instrument_info(ctx)
+        except Exception as e:
+            log_event(f"Ошибка при получении информации о символе: {e}")
+            symbol_info = None
         if symbol_info is None:
             log_event("⚠️ Не удалось получить информацию о символе")
             return
@@ -1964,197 +1773,137 @@ def close_all_trades(reason, exit_time=None, force_close=False, position_value=N
             amount_to_close = size
             log_event(f"Полное закрытие {direction}: объем {amount_to_close:.8f} BTC")
         close_side = 'Sell' if direction == 'LONG' else 'Buy'
-        # Retry для размещения ордера на закрытие
-        for attempt in range(max_retries):
-            try:
-                order = client.place_order(
-                    category="linear",
-                    symbol=symbol,
-                    side=close_side,
-                    orderType="Market",
-                    qty=str(amount_to_close),
-                    reduceOnly=True
-                )
-                if order['retCode'] != 0:
-                    raise ValueError(f"Ошибка API: {order['retMsg']}")
-                log_event(f"✅ Ордер на закрытие успешно размещен: {order}")
-                break
-            except Exception as e:
-                log_event(f"⚠️ Ошибка закрытия позиции (попытка {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(delay * (2 ** attempt))
-                else:
-                    log_event("⚠️ Не удалось закрыть позицию")
-                    return
-        # Пауза для исполнения ордера на бирже
-        time.sleep(2)
-        # Получаем актуальный остаток позиции напрямую с биржи
-        for attempt in range(max_retries):
-            try:
-                position_response = client.get_positions(category="linear", symbol=symbol)
-                if position_response['retCode'] != 0:
-                    raise ValueError(f"Ошибка API: {position_response['retMsg']}")
-                positions = position_response['result']['list']
-                if not positions:
-                    new_size = 0.0
-                else:
-                    new_size = float(positions[0]['size'])
-                break
-            except Exception as e:
-                log_event(f"⚠️ Ошибка получения обновленной позиции (попытка {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(delay * (2 ** attempt))
-                else:
-                    log_event("⚠️ Не удалось получить обновленные данные позиции")
-                    return
-        for entry_time_str in list(active_trades.keys()):
-            trade = active_trades[entry_time_str]
-            if trade['direction'].endswith(direction):
-                entry_time = trade.get('entry_time')
-                duration_str = None
-                duration_hours = None
-                if entry_time is not None:
-                    duration_seconds = (exit_time - entry_time).total_seconds()
-                    duration_str = format_duration(duration_seconds)
-                    duration_hours = duration_seconds / 3600
-                else:
-                    log_event("⚠️ Время входа отсутствует, длительность не рассчитывается")
-                entry_price = trade.get('entry_price')
-                leverage = trade.get('leverage', 1)
-                if trade.get('value') is not None:
-                    commission_open = trade.get('commission_open', 0)
-                    commission_close = (amount_to_close / trade['size']) * trade['value'] * (TRADING_CONFIG['COMMISSION_RATE'] / 100) if trade['size'] > 0 else 0
-                    total_commission = commission_open + commission_close
-                    net_pnl = 0
-                    net_pnl_percent = 0
-                    if entry_price is not None and current_price is not None and current_price > 0:
-                        if 'SHORT' in direction:
-                            pnl = (entry_price - current_price) * amount_to_close * leverage
-                        elif 'LONG' in direction:
-                            pnl = (current_price - entry_price) * amount_to_close * leverage
-                        net_pnl = pnl - total_commission
-                        net_pnl_percent = (net_pnl / trade['value']) * 100 if trade['value'] > 0 else 0
-                else:
-                    log_event("⚠️ Значение 'value' отсутствует, комиссия и PNL не рассчитываются")
-                    commission_open = 0
-                    commission_close = 0
-                    total_commission = 0
-                    net_pnl = 0
-                    net_pnl_percent = 0
-                # Обновляем trade['size'] на основе данных с биржи
-                if new_size > 0:
-                    trade['size'] = new_size
-                    log_event(f"Оставшийся размер позиции: {new_size:.8f} BTC")
+        position_version = get_position_version(ctx.symbol)
+        order = get_order_executor(ctx).execute(Order(close_side, amount_to_close, reduce_only=True))
+        record_order_metrics(ctx, order)
+        invalidate_account_snapshot(ctx)
+        if order.state != ORDER_FILLED:
+            log_event("⚠️ Не удалось закрыть позицию")
+            return
+        # Исполнение подтверждено автоматом ордера; позиция — по событию потока position
+        wait_for_position_refresh(ctx.symbol, position_version)
+        positions = call_with_retries(read_positions, "получение обновленной позиции", max_retries=max_retries,
+                                      delay=delay, deadline=time.monotonic() + ORDER_STEP_TIMEOUT, log=log_event)
+        if positions is None:
+            return
+        new_size = float(positions[0]['size']) if positions else 0.0
+        adjust_direction = None
+        with ctx.trades_lock:
+            for entry_time_str in list(ctx.active_trades.keys()):
+                trade = ctx.active_trades[entry_time_str]
+                if trade['direction'].endswith(direction):
+                    entry_time = trade.get('entry_time')
+                    duration_str = None
+                    duration_hours = None
+                    if entry_time is not None:
+                        duration_seconds = (exit_time - entry_time).total_seconds()
+                        duration_str = format_duration(duration_seconds)
+                        duration_hours = duration_seconds / 3600
+                    else:
+                        log_event("⚠️ Время входа отсутствует, длительность не рассчитывается")
+                    entry_price = trade.get('entry_price')
+                    leverage = trade.get('leverage', 1)
                     if trade.get('value') is not None:
-                        trade['value'] *= (new_size / size)
-                        trade['commission_open'] -= commission_open * (amount_to_close / size)
-                    min_delta = MIN_DELTA_LIQUIDATION_LONG if direction == 'LONG' else MIN_DELTA_LIQUIDATION_SHORT
-                    adjust_leverage_after_partial_close(direction, min_delta)
-                    log_event(f"Пауза 5 секунд для пересчета цены ликвидации")
-                    time.sleep(5)
-                    manage_liquidation_price()
-                else:
-                    del active_trades[entry_time_str]
-                    log_event(f"Позиция {direction} полностью закрыта")
-                trades_to_close.append({
-                    'entry_time': entry_time,
-                    'trade_id': trade['id'],
-                    'exit_time': exit_time,
-                    'duration': duration_str,
-                    'duration_hours': duration_hours,
-                    'exit_price': current_price,
-                    'entry_price': entry_price,
-                    'position_size': amount_to_close,
-                    'position_value': trade.get('value', 0),
-                    'leverage': leverage,
-                    'net_pnl': net_pnl,
-                    'net_pnl_percent': net_pnl_percent,
-                    'direction': trade['direction'],
-                    'withdraw_amount': 0
-                })
-        if position_value is None:
-            current_trade_type = None
-            bull_long_trades_count = 0
-            log_event("🔄 Все сделки закрыты. Счетчики активных сделок сброшены.")
-    if TRADING_CONFIG['ENABLE_LOGGING'] and CSV_FILE is not None:
-        if df_trades is None:
-            df_trades = pd.DataFrame(columns=[
-                'Trade_ID', 'Status', 'Direction', 'Entry_Time', 'Exit_Time', 'Trade_Duration', 'Hours',
-                'Entry_Price', 'Exit_Price', 'Position_Size', 'Position_Value',
-                'Leverage', 'Net_PnL_USDT', 'Net_PnL_Percent', 'Balance', 'Withdraw'
-            ])
-            df_trades['Entry_Time'] = pd.Series(dtype='datetime64[ns, UTC]')
-            df_trades['Exit_Time'] = pd.Series(dtype='datetime64[ns, UTC]')
-            df_trades['Trade_Duration'] = pd.Series(dtype=str)
-            df_trades['Hours'] = pd.Series(dtype=float)
-        for trade_data in trades_to_close:
-            mask = (df_trades['Trade_ID'] == str(trade_data['trade_id'])) & (df_trades['Status'] == 'open')
-            if mask.any():
-                df_trades.loc[mask, 'Status'] = reason
-                df_trades.loc[mask, 'Exit_Time'] = trade_data['exit_time']
-                df_trades.loc[mask, 'Trade_Duration'] = trade_data['duration'] if trade_data['duration'] is not None else ''
-                df_trades.loc[mask, 'Hours'] = trade_data['duration_hours'] if trade_data['duration_hours'] is not None else np.nan
-                df_trades.loc[mask, 'Exit_Price'] = trade_data['exit_price']
-                df_trades.loc[mask, 'Net_PnL_USDT'] = trade_data['net_pnl']
-                df_trades.loc[mask, 'Net_PnL_Percent'] = trade_data['net_pnl_percent']
-                df_trades.loc[mask, 'Withdraw'] = trade_data['withdraw_amount'] if trade_data['withdraw_amount'] > 0 else np.nan
-                df_trades.loc[mask, 'Balance'] = get_available_balance()
-                if position_value is not None and new_size > 0:
-                    open_row = df_trades.loc[mask].copy()
-                    open_row['Status'] = 'open'
-                    open_row['Position_Size'] = new_size
-                    open_row['Exit_Time'] = pd.NaT
-                    open_row['Trade_Duration'] = ''
-                    open_row['Hours'] = np.nan
-                    open_row['Exit_Price'] = np.nan
-                    open_row['Net_PnL_USDT'] = np.nan
-                    open_row['Net_PnL_Percent'] = np.nan
-                    open_row['Withdraw'] = np.nan
-                    df_trades = pd.concat([df_trades, open_row], ignore_index=True)
-            else:
-                new_row = {
+                        commission_open = trade.get('commission_open', 0)
+                        commission_close = (amount_to_close / trade['size']) * trade['value'] * (TRADING_CONFIG['COMMISSION_RATE'] / 100) if trade['size'] > 0 else 0
+                        total_commission = commission_open + commission_close
+                        net_pnl = 0
+                        net_pnl_percent = 0
+                        if entry_price is not None and current_price is not None and current_price > 0:
+                            if 'SHORT' in direction:
+                                pnl = (entry_price - current_price) * amount_to_close * leverage
+                            elif 'LONG' in direction:
+                                pnl = (current_price - entry_price) * amount_to_close * leverage
+                            net_pnl = pnl - total_commission
+                            net_pnl_percent = (net_pnl / trade['value']) * 100 if trade['value'] > 0 else 0
+                    else:
+                        log_event("⚠️ Значение 'value' отсутствует, комиссия и PNL не рассчитываются")
+                        commission_open = 0
+                        commission_close = 0
+                        total_commission = 0
+                        net_pnl = 0
+                        net_pnl_percent = 0
+                    # Обновляем trade['size'] на основе данных с биржи
+                    if new_size > 0:
+                        trade['size'] = new_size
+                        log_event(f"Оставшийся размер позиции: {new_size:.8f} BTC")
+                        if trade.get('value') is not None:
+                            trade['value'] *= (new_size / size)
+                            trade['commission_open'] -= commission_open * (amount_to_close / size)
+                        adjust_direction = direction
+                    else:
+                        del ctx.active_trades[entry_time_str]
+                        log_event(f"Позиция {direction} полностью закрыта")
+                    trades_to_close.append({
+                        'entry_time': entry_time,
+                        'trade_id': trade['id'],
+                        'exit_time': exit_time,
+                        'duration': duration_str,
+                        'duration_hours': duration_hours,
+                        'exit_price': current_price,
+                        'entry_price': entry_price,
+                        'position_size': amount_to_close,
+                        'position_value': trade.get('value', 0),
+                        'leverage': leverage,
+                        'net_pnl': net_pnl,
+                        'net_pnl_percent': net_pnl_percent,
+                        'direction': trade['direction'],
+                        'withdraw_amount': 0
+                    })
+            if position_value is None:
+                ctx.current_trade_type = None
+                ctx.bull_long_trades_count = 0
+                log_event("🔄 Все сделки закрыты. Счетчики активных сделок сброшены.")
+        # Снижение плеча после частичного закрытия — вне trades_lock
+        if adjust_direction is not None:
+            min_delta = MIN_DELTA_LIQUIDATION_LONG if adjust_direction == 'LONG' else MIN_DELTA_LIQUIDATION_SHORT
+            adjust_leverage_after_partial_close(ctx, adjust_direction, min_delta)
+            invalidate_account_snapshot(ctx)
+    # Один срез после закрытия: баланс для журнала, отчёт и позиция
+    snapshot = get_account_snapshot(ctx)
+    if TRADING_CONFIG['ENABLE_LOGGING'] and ctx.journal is not None:
+        # Открытые строки сделки закрываются по Trade_ID; при частичном закрытии добавляется строка с остатком
+        remaining_size = new_size if position_value is not None and new_size > 0 else None
+        try:
+            for trade_data in trades_to_close:
+                ctx.journal.close_trade({
                     'Trade_ID': str(trade_data['trade_id']),
                     'Status': reason,
                     'Direction': trade_data['direction'],
-                    'Entry_Time': trade_data['entry_time'] if trade_data['entry_time'] is not None else pd.NaT,
+                    'Entry_Time': trade_data['entry_time'],
                     'Exit_Time': trade_data['exit_time'],
                     'Trade_Duration': trade_data['duration'] if trade_data['duration'] is not None else '',
-                    'Hours': trade_data['duration_hours'] if trade_data['duration_hours'] is not None else np.nan,
-                    'Entry_Price': trade_data['entry_price'] if trade_data['entry_price'] is not None else np.nan,
+                    'Hours': trade_data['duration_hours'],
+                    'Entry_Price': trade_data['entry_price'],
                     'Exit_Price': trade_data['exit_price'],
                     'Position_Size': trade_data['position_size'],
                     'Position_Value': trade_data['position_value'],
                     'Leverage': trade_data['leverage'],
                     'Net_PnL_USDT': trade_data['net_pnl'],
                     'Net_PnL_Percent': trade_data['net_pnl_percent'],
-                    'Withdraw': trade_data['withdraw_amount'] if trade_data['withdraw_amount'] > 0 else np.nan,
-                    'Balance': get_available_balance()
-                }
-                if df_trades.empty or df_trades.isna().all().all():
-                    df_trades = pd.DataFrame([new_row])
-                else:
-                    df_trades = pd.concat([df_trades, pd.DataFrame([new_row])], ignore_index=True)
-            df_trades = df_trades.tail(30)
-        try:
-            df_trades.to_csv(CSV_FILE, index=False, float_format='%.2f')
-            log_event(f"💾 История сделок обновлена в {CSV_FILE}")
+                    'Withdraw': trade_data['withdraw_amount'] if trade_data['withdraw_amount'] > 0 else None,
+                    'Balance': snapshot.balance
+                }, remaining_size=remaining_size)
+            ctx.journal.mark_balance(exit_time, snapshot.balance, reason)
+            log_event(f"💾 История сделок обновлена в {ctx.journal.path}")
         except Exception as e:
-            log_event(f"⚠️ Ошибка при записи в CSV: {e}")
-    # Пауза для обновления данных на бирже
-    time.sleep(2)
+            log_event(f"⚠️ Ошибка при записи в журнал сделок: {e}")
     # Вызов отображения позиции после закрытия сделки
     current_time = get_server_time()
-    log_market_data(current_price, previous_mid_price, last_price_indicator, current_time, current_rsi, current_sma_rsi, symbol, GLOBAL_TIMEFRAME, get_fear_greed_value, get_available_balance)
-    display_position()
+    log_market_data(ctx, current_price, current_time, snapshot=snapshot)
+    display_position(ctx, snapshot)
 
 
-def display_position():
-    with trades_lock:
-        if not active_trades:
+def display_position(ctx, snapshot=None):
+    with ctx.trades_lock:
+        if not ctx.active_trades:
             log_event("⚪ Нет активных позиций")
             return
         try:
-            position_response = client.get_positions(category="linear", symbol=symbol)
+            # Позиция и цена из среза цикла (тот же срез, что у отчёта и сигналов)
+            if snapshot is None or snapshot.positions_response is None or snapshot.price is None:
+                snapshot = get_account_snapshot(ctx)
+            position_response = snapshot.positions_response
             if position_response['retCode'] != 0:
                 log_event(f"⚠️ Ошибка API: {position_response['retMsg']}")
                 return
@@ -2194,12 +1943,11 @@ def display_position():
                 position_value = 0.0
             else:
                 position_value = float(position_value_str)
-            # Получаем текущую цену
-            current_price = get_current_price_with_retries(client, symbol)
+            current_price = snapshot.price
             # Определяем полное направление на основе рынка и side
-            if current_market_type == 'bull':
+            if ctx.market_type == 'bull':
                 full_direction = 'BULL_LONG' if side == 'Buy' else 'BULL_SHORT'
-            elif current_market_type == 'bear':
+            elif ctx.market_type == 'bear':
                 full_direction = 'BEAR_LONG' if side == 'Buy' else 'BEAR_SHORT'
             else:
                 full_direction = 'UNKNOWN'
@@ -2239,13 +1987,40 @@ def display_position():
             log_event(f"⚠️ Ошибка при получении данных о позиции BYBIT: {e}")
 
 
+def create_contexts():
+    """Контексты стратегии по SYMBOL_ALLOCATION; у первого символа файлы с прежними именами."""
+    contexts.clear()
+    for number, (symbol, allocation) in enumerate(SYMBOL_ALLOCATION.items()):
+        file_suffix = script_name if number == 0 else f"{script_name}_{symbol}"
+        contexts[symbol] = SymbolContext(symbol, file_suffix, allocation)
+    log_event(f"📋 Символы: {', '.join(f'{symbol} ({ctx.allocation:g}%)' for symbol, ctx in contexts.items())}")
+    return contexts
+
+
+def start_context(ctx, current_time):
+    """Запуск контекста символа: журнал сделок, синхронизация позиции, свечи и индикаторы."""
+    ctx.market_type = current_market_type
+    if ctx.market_type is not None:
+        initialize_market_data_file(ctx, ctx.market_type)
+    else:
+        log_event(f"⚠️ Тип рынка не определён при запуске, пропуск инициализации файла market_data {ctx.symbol}")
+    initialize_journal(ctx)
+    ctx.next_trade_id = ctx.journal.max_trade_id() + 1 if ctx.journal is not None else 1
+    log_event(f"📝 Инициализация счетчика ID сделок {ctx.symbol}: {ctx.next_trade_id}")
+    sync_active_trades(ctx)
+    snapshot = get_account_snapshot(ctx)
+    log_event(f"📈 Текущая цена {ctx.symbol}: {snapshot.price:.2f}")
+    # Обновление файла market_data.csv и пересчёт индикаторов при запуске, аналогично обновлению свечи
+    update_market_data_on_candle_close(ctx, GLOBAL_TIMEFRAME, current_time)
+    # Первоначальный расчет всех индикаторов из хранилища
+    load_market_data(ctx, ctx.market_type)
+
+
 def run():
-    global next_trade_id, fear_greed_data, next_rsi_update_time, current_rsi, current_sma_rsi, previous_rsi, previous_sma_rsi, next_analysis_time, previous_mid_price, last_price_indicator
-    global current_stoch_k, current_stoch_d, previous_stoch_k, previous_stoch_d
-    global current_williams_r_overbought, current_williams_r_oversold, previous_williams_r_overbought, previous_williams_r_oversold, next_global_update_time
-    global last_fear_greed_update, last_market_type
+    global next_rsi_update_time, next_analysis_time, next_global_update_time
     global current_market_type, next_market_change
     global TEST_MODE, TEST_MARKET_TYPE, TEST_NEXT_CHANGE
+    global market_feed, account_state
     # --- НЕ УДАЛЯТЬ ЭТОТ БЛОК ТЕСТИРОВАНИЯ!!! ---
     TEST_MODE = False  # Установите True / False для активации тестового режима
     # TEST_MARKET_TYPE = 'bull'  # Задайте тип рынка вручную ('bull' или 'bear')
@@ -2254,6 +2029,25 @@ def run():
     if TEST_MODE:
         log_event(f"🧪 Тестовый режим активен: Тип рынка = {TEST_MARKET_TYPE}, Смена = {TEST_NEXT_CHANGE}")
     setup_logging()
+    setup_metrics()
+    get_signal_rules()  # Правила компилируются один раз при запуске
+    create_contexts()
+    # Потоки симулятора только при BYBIT_ENDPOINT: в обычном запуске модуль симулятора не загружается
+    if BYBIT_ENDPOINT:
+        from j3_exchange_sim import sim_ws_factory
+        public_ws = sim_ws_factory(BYBIT_ENDPOINT, 'linear')
+        private_ws = sim_ws_factory(BYBIT_ENDPOINT, 'private', BYBIT_API_KEY, BYBIT_API_SECRET)
+    else:
+        public_ws = None
+        private_ws = private_ws_factory(BYBIT_API_KEY, BYBIT_API_SECRET, rsa_authentication=USE_BITWARDEN)
+    # Один поток тикеров на все символы: цена читается из памяти, REST остаётся запасным путём
+    market_feed = MarketDataFeed(list(contexts), ws_factory=public_ws, log=log_event)
+    market_feed.start()
+    # Приватные потоки: позиции, баланс и исполнения всех символов читаются из памяти
+    account_state = AccountStateStore(private_ws, log=log_event)
+    account_state.start()
+    for symbol in contexts:
+        account_state.seed(client, symbol)
     calculate_market_periods(None)
     current_time = get_server_time()
     if current_time.tzinfo is None:
@@ -2266,135 +2060,265 @@ def run():
             log_event(f"🔄 Дата следующей смены рынка: {next_market_change.strftime('%Y-%m-%d %H:%M:%S %Z')}")
         else:
             log_event("⚠️ Дата смены рынка не определена")
-        initialize_market_data_file(current_market_type)
-    else:
-        log_event("⚠️ Тип рынка не определён при запуске, пропуск инициализации файла market_data")
-    if CSV_FILE is not None and CSV_FILE.exists():
-        try:
-            df = pd.read_csv(CSV_FILE)
-            if not df.empty and 'Trade_ID' in df.columns:
-                df['Trade_ID'] = pd.to_numeric(df['Trade_ID'], errors='coerce')
-                max_id = df['Trade_ID'].max()
-                if pd.isna(max_id):
-                    next_trade_id = 1
-                else:
-                    next_trade_id = int(max_id) + 1
-                log_event(f"📝 Инициализация счетчика ID сделок: {next_trade_id}")
-        except Exception as e:
-            log_event(f"⚠️ Ошибка при инициализации счетчика ID: {e}")
-    else:
-        next_trade_id = 1
-    initialize_csv()
-    sync_active_trades()
-    current_price = get_current_price_with_retries(client, symbol)
-    log_event(f"📈 Текущая цена: {current_price:.2f}")
+    for ctx in contexts.values():
+        start_context(ctx, current_time)
+    start_liquidation_guards()
     ###################################################################################################
     # НЕ УДАЛЯТЬ ЭТОТ БЛОК ТЕСТИРОВАНИЯ!!!
-    # Тестировние входа и выхода из сделок
+    # Тестировние входа и выхода из сделок (первый символ)
+    ctx = next(iter(contexts.values()))
+    snapshot = get_account_snapshot(ctx)
+    current_price = snapshot.price
     # #Задаём размер позиции
-    position_value = (get_available_balance() * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
-    # open_trade('BULL_LONG', current_price, position_value)
+    position_value = (ctx.capital(snapshot.balance) * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
+    # open_trade(ctx, 'BULL_LONG', current_price, position_value)
     # log_event(f"Пауза 10 секунд перед закрытием")
     # time.sleep(10)
-    # close_all_trades("rsi_down", force_close=True)
+    # close_all_trades(ctx, "rsi_down", force_close=True)
     # Открываем сделку 'BEAR_SHORT' для медвежьего рынка
-    # open_trade('BEAR_SHORT', current_price, position_value)
+    # open_trade(ctx, 'BEAR_SHORT', current_price, position_value)
     # log_event("Пауза 10 секунд перед закрытием")
     # time.sleep(10)
-    # close_all_trades("rsi_up", force_close=True)
+    # close_all_trades(ctx, "rsi_up", force_close=True)
     ######### --- Конец блока тестового режима ---    
     # # Инициализация времени следующего обновления данных о сделках
     current_time = get_server_time()
     if current_time.tzinfo is None:
         current_time = current_time.replace(tzinfo=timezone.utc)
-    next_analysis_time = get_next_candle_end_time(current_time, ANALYSIS_TIMEFRAME)
     next_rsi_update_time = get_next_candle_end_time(current_time, GLOBAL_TIMEFRAME)
     next_global_update_time = get_next_candle_end_time(current_time, ANALYSIS_TIMEFRAME)
-    # Обновление файла market_data.csv и пересчёт индикаторов при запуске, аналогично обновлению свечи
-    update_market_data_on_candle_close(symbol, GLOBAL_TIMEFRAME, current_time)
-    # Первоначальный расчет всех индикаторов из файла
-    market_type = get_market_type(current_time)
-    df_market = load_market_data(current_market_type)
-    # Загрузка и сохранение данных индекса страха и жадности
-    fear_greed_data = fetch_fear_greed_data()
-    if not fear_greed_data:
-        log_event("Не удалось получить данные индекса страха и жадности")
-    # Загрузка данных индекса страха и жадности
-    fear_greed_data = load_fear_greed_data()
-    log_market_data(current_price, previous_mid_price, last_price_indicator, current_time, current_rsi, current_sma_rsi, symbol, GLOBAL_TIMEFRAME, get_fear_greed_value, get_available_balance)
-    display_position()
-    manage_liquidation_price()
+    # Индекс страха и жадности (общий для всех символов): хранилище и дозагрузка новых дней
+    load_fear_greed_data()
+    fetch_fear_greed_data()
+    for ctx in contexts.values():
+        snapshot = get_account_snapshot(ctx)
+        log_market_data(ctx, snapshot.price, current_time, snapshot=snapshot)
+        display_position(ctx, snapshot)
+        manage_liquidation_price(ctx)
     next_analysis_time = get_next_candle_end_time(current_time, ANALYSIS_TIMEFRAME)
     log_event("----------------------------------------------|")
     log_event(f"⏳ ({ANALYSIS_TIMEFRAME}) Обновление данных: {next_analysis_time}")
-    last_market_type = current_market_type
-    while True:
+    asyncio.run(run_event_loop())
+
+
+def handle_market_change(when=None):
+    """Смена типа рынка по таймеру: новый тип и дата следующей смены; контексты переключаются следом."""
+    global current_market_type, next_market_change
+    current_time = get_server_time()
+    log_event(f"🔄 Обнаружена смена рынка по времени на {current_time}")
+    current_market_type = get_market_type(current_time)
+    _, next_market_change = get_next_market_change_date(current_time)
+
+
+def switch_market(ctx, when=None):
+    """Переход контекста на текущий тип рынка: закрытие сделок, переключение данных, вход по новому рынку."""
+    previous_market_type = ctx.market_type
+    if previous_market_type == current_market_type:
+        return
+    ctx.market_type = current_market_type
+    log_event(f"🔄 {ctx.symbol}: смена типа рынка с {previous_market_type} на {ctx.market_type}. Закрытие всех сделок.")
+    close_all_trades(ctx, f"market_type_change_to_{ctx.market_type}", force_close=True)
+    initialize_market_data_file(ctx, ctx.market_type)
+    update_market_data_on_candle_close(ctx, GLOBAL_TIMEFRAME, get_server_time())
+    load_market_data(ctx, ctx.market_type)
+    if not ctx.active_trades:
+        snapshot = get_account_snapshot(ctx, refresh=True)
+        current_price = snapshot.price
+        if ctx.market_type == 'bull':
+            position_value = (ctx.capital(snapshot.balance) * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
+            log_event(f"📈 {ctx.symbol}: сигнал на открытие BULL_LONG по смене рынка")
+            open_trade(ctx, 'BULL_LONG', current_price, position_value, snapshot=snapshot)
+        elif ctx.market_type == 'bear':
+            position_value = (ctx.capital(snapshot.balance) * TRADING_CONFIG['BEAR_SHORT']['ENTRY_PERCENT']) / 100
+            log_event(f"📉 {ctx.symbol}: сигнал на открытие BEAR_SHORT по смене рынка")
+            open_trade(ctx, 'BEAR_SHORT', current_price, position_value, snapshot=snapshot)
+
+
+def refresh_fear_greed(when=None):
+    """Закрытие свечи GLOBAL_TIMEFRAME: индекс страха и жадности, общий для всех символов."""
+    if when is not None and get_fear_greed_value(when) is not None:
+        return  # Значение для этой свечи загружено при подготовке
+    fetch_fear_greed_data()
+
+
+def next_warmup_time(now):
+    """Срок подготовки: WARMUP_LEAD сек до ближайшего закрытия свечи GLOBAL_TIMEFRAME, которое ещё не началось готовиться."""
+    boundary = get_next_candle_end_time(now, GLOBAL_TIMEFRAME)
+    if boundary - timedelta(seconds=WARMUP_LEAD) <= now:
+        boundary = get_next_candle_end_time(boundary + timedelta(seconds=1), GLOBAL_TIMEFRAME)
+    return boundary - timedelta(seconds=WARMUP_LEAD)
+
+
+def warm_up(ctx, when=None):
+    """
+    Подготовка к закрытию свечи GLOBAL_TIMEFRAME: лимиты инструмента, пропуски в хранилище свечей,
+    срез аккаунта, плечо для возможного входа и индекс страха и жадности. После закрытия
+    остаются новая свеча, индикаторы по ней, проверка сигналов и отправка ордера.
+    Каждый шаг выполняется, только пока до закрытия остаётся больше WARMUP_RESERVE сек;
+    индекс запрашивается одной попыткой без повторов — при неудаче его загрузит refresh_fear_greed.
+    """
+    started = time.perf_counter()
+    candle_close = when + timedelta(seconds=WARMUP_LEAD) if when is not None else get_next_candle_end_time(get_server_time(), GLOBAL_TIMEFRAME)
+    ctx.warmup = {'candle_close': candle_close}
+
+    def lead_left(step):
+        left = (candle_close - get_server_time()).total_seconds() - WARMUP_RESERVE
+        if left <= 0:
+            log_event(f"⏱️ {ctx.symbol}: подготовка остановлена перед шагом «{step}» — до закрытия свечи не осталось времени")
+        return left
+
+    try:
+        if lead_left('лимиты инструмента') <= 0:
+            return
+        symbol_info = get_instrument_info(ctx, refresh=True)
+        if lead_left('свечи') <= 0:
+            return
+        # Свечи до формирующейся уже в хранилище: после закрытия догружается только она
+        update_market_data_on_candle_close(ctx, GLOBAL_TIMEFRAME, get_server_time())
+        if lead_left('срез аккаунта') <= 0:
+            return
+        snapshot = get_account_snapshot(ctx, refresh=True)
+        with ctx.trades_lock:
+            has_active_trades = bool(ctx.active_trades)
+        if ctx.market_type is not None and not has_active_trades:
+            # Плечо выставляется заранее, если у всех возможных входов оно одинаковое
+            entries = {trade_type for trade_type, _, _, _ in get_signal_rules().open_rules[ctx.market_type]}
+            leverages = {TRADING_CONFIG.get(trade_type, {}).get('LEVERAGE', 1) for trade_type in entries}
+            if len(leverages) == 1 and lead_left('плечо') > 0:
+                leverage = leverages.pop()
+                position = snapshot.position
+                if position is None or float(position['leverage']) != leverage:
+                    try:
+                        client.set_leverage(category="linear", symbol=ctx.symbol, buyLeverage=str(leverage), sellLeverage=str(leverage))
+                    except Exception as e:
+                        if "leverage not modified" not in str(e):
+                            log_event(f"⚠️ {ctx.symbol}: плечо не подготовлено: {e}")
+                            leverage = None
+                if leverage is not None:
+                    ctx.warmup['leverage'] = leverage
+            if snapshot.balance is not None and snapshot.price:
+                for trade_type in sorted(entries):
+                    position_value = ctx.capital(snapshot.balance) * TRADING_CONFIG[trade_type]['ENTRY_PERCENT'] / 100
+                    amount = position_value * TRADING_CONFIG.get(trade_type, {}).get('LEVERAGE', 1) / snapshot.price * 0.9
+                    log_event(f"🔥 {ctx.symbol}: {trade_type} — вход ≈ {amount:.{symbol_info['precision']}f} (мин. {symbol_info['min_order_qty']})")
+        left = lead_left('индекс страха и жадности')
+        if left > 0:
+            fetch_fear_greed_data(max_retries=1, timeout=min(10, left))
+    finally:
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage='warmup', symbol=ctx.symbol)
+        log_event(f"🔥 {ctx.symbol}: подготовка к закрытию свечи {candle_close} за {time.perf_counter() - started:.2f} сек")
+
+
+def refresh_market_data(ctx, when=None):
+    """Закрытие свечи GLOBAL_TIMEFRAME: синхронизация свечей символа и индикаторы."""
+    # Смена рынка, совпавшая с закрытием свечи, применяется до расчёта индикаторов
+    switch_market(ctx, when)
+    current_time = get_server_time()
+    update_market_data_on_candle_close(ctx, GLOBAL_TIMEFRAME, current_time)
+    load_market_data(ctx, ctx.market_type)
+
+
+def evaluate_signals(ctx, when=None):
+    """Проверка сигналов символа по обновлённым индикаторам."""
+    global next_rsi_update_time
+    current_time = get_server_time()
+    if ctx.indicators_ready():
+        if when is not None:
+            metrics.observe('candle_to_signals_seconds', (current_time - when).total_seconds(), symbol=ctx.symbol)
+        # Один срез на цикл решения: сигналы, расчёт объёма и контроль ликвидации
+        ctx.candle_close = when
         try:
-            current_time = get_server_time()
-            if current_time.tzinfo is None:
-                current_time = current_time.replace(tzinfo=timezone.utc)
-            if next_global_update_time is None or current_time >= next_global_update_time:
-                current_price = get_current_price_with_retries(client, symbol)
-                log_market_data(current_price, previous_mid_price, last_price_indicator, current_time, current_rsi, current_sma_rsi, symbol, GLOBAL_TIMEFRAME, get_fear_greed_value, get_available_balance)
-                display_position()
-                manage_liquidation_price()
-                next_global_update_time = get_next_candle_end_time(current_time, ANALYSIS_TIMEFRAME)
-                log_event("----------------------------------------------|")
-                log_event(f"⏳ ({ANALYSIS_TIMEFRAME}) Обновление данных: {next_global_update_time}")
-            # Проверка смены типа рынка только по времени смены
-            if next_market_change and current_time >= next_market_change:
-                log_event(f"🔄 Обнаружена смена рынка по времени на {current_time}")
-                current_market_type = get_market_type(current_time)
-                _, next_market_change = get_next_market_change_date(current_time)
-                if last_market_type != current_market_type:
-                    log_event(f"🔄 Смена типа рынка с {last_market_type} на {current_market_type}. Закрытие всех сделок.")
-                    close_all_trades(f"market_type_change_to_{current_market_type}", force_close=True)
-                    last_market_type = current_market_type
-                    initialize_market_data_file(current_market_type)
-                    update_market_data_on_candle_close(symbol, GLOBAL_TIMEFRAME, current_time)
-                    df_market = load_market_data(current_market_type)
-                    if not active_trades:
-                        if current_market_type == 'bull':
-                            position_value = (get_available_balance() * TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT']) / 100
-                            log_event(f"📈 Сигнал на открытие BULL_LONG по смене рынка")
-                            open_trade('BULL_LONG', current_price, position_value)
-                        elif current_market_type == 'bear':
-                            position_value = (get_available_balance() * TRADING_CONFIG['BEAR_SHORT']['ENTRY_PERCENT']) / 100
-                            log_event(f"📉 Сигнал на открытие BEAR_SHORT по смене рынка")
-                            open_trade('BEAR_SHORT', current_price, position_value)
-            if next_rsi_update_time is None or current_time >= next_rsi_update_time:
-                current_price = get_current_price_with_retries(client, symbol)
-                update_market_data_on_candle_close(symbol, GLOBAL_TIMEFRAME, current_time)
-                df_market = load_market_data(current_market_type)
-                fear_greed_data = fetch_fear_greed_data()
-                if not fear_greed_data:
-                    log_event("Не удалось получить данные индекса страха и жадности")
-                fear_greed_data = load_fear_greed_data()
-                if current_rsi is not None and current_sma_rsi is not None and current_stoch_k is not None and current_stoch_d is not None and current_williams_r_overbought is not None and current_williams_r_oversold is not None:
-                    check_signals(current_price)
-                    log_market_data(current_price, previous_mid_price, last_price_indicator, current_time, current_rsi, current_sma_rsi, symbol, GLOBAL_TIMEFRAME, get_fear_greed_value, get_available_balance)
-                    display_position()
-                    manage_liquidation_price()
-                next_rsi_update_time = get_next_candle_end_time(current_time, GLOBAL_TIMEFRAME)
-                log_event("----------------------------------------------|")
-                log_event(f"⏳ ({GLOBAL_TIMEFRAME}) Обновление свечи: {next_rsi_update_time}")
-                # Лог текущего типа и смены без повторного вызова
-                if current_market_type and next_market_change:
-                    log_event(f"🔄 Тип рынка: {current_market_type}, смена: {next_market_change.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-                else:
-                    log_event("⚠️ Не удалось определить тип рынка или дату смены")
-            time_to_next_analysis = (next_global_update_time - current_time).total_seconds()
-            time_to_next_global = (next_rsi_update_time - current_time).total_seconds()
-            time_to_next = min(time_to_next_analysis, time_to_next_global)
-            time.sleep(max(time_to_next, 1))
-        except Exception as e:
-            log_event(f"⚠️ Ошибка в основном цикле: {e}")
-            time.sleep(2)
+            snapshot = get_account_snapshot(ctx, refresh=True)
+            check_signals(ctx, snapshot.price, snapshot)
+        finally:
+            ctx.candle_close = None
+    next_rsi_update_time = get_next_candle_end_time(current_time, GLOBAL_TIMEFRAME)
+    log_event("----------------------------------------------|")
+    log_event(f"⏳ ({GLOBAL_TIMEFRAME}) Обновление свечи {ctx.symbol}: {next_rsi_update_time}")
+    # Лог текущего типа и смены без повторного вызова
+    if ctx.market_type and next_market_change:
+        log_event(f"🔄 Тип рынка: {ctx.market_type}, смена: {next_market_change.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+    else:
+        log_event("⚠️ Не удалось определить тип рынка или дату смены")
+
+
+def report_status(ctx, when=None):
+    """Отчёт по символу: цена, индикаторы, баланс и позиция."""
+    global next_global_update_time
+    current_time = get_server_time()
+    snapshot = get_account_snapshot(ctx)
+    log_market_data(ctx, snapshot.price, current_time, snapshot=snapshot)
+    display_position(ctx, snapshot)
+    next_global_update_time = get_next_candle_end_time(current_time, ANALYSIS_TIMEFRAME)
+    log_event("----------------------------------------------|")
+    log_event(f"⏳ ({ANALYSIS_TIMEFRAME}) Обновление данных: {next_global_update_time}")
+    export_metrics()
+
+
+def guard_liquidation(ctx, when=None):
+    """Контроль дельты до цены ликвидации позиции символа."""
+    manage_liquidation_price(ctx)
+
+
+def guard_position(ctx):
+    """
+    Позиция символа для проверки по тикеру: только из памяти приватного потока, без REST.
+    Вызывается в потоке тикеров, поэтому устаревшее состояние не перечитывается (is_current):
+    проверка пропускается до перечитывания в обязанностях guard_{symbol} и сигналов.
+    """
+    if account_state is None or not account_state.is_current():
+        return None
+    return account_state.get_position(ctx.symbol)
+
+
+def start_liquidation_guards():
+    """Контроль дельты по каждому обновлению mark-цены: один LiquidationGuard на символ."""
+    for ctx in contexts.values():
+        ctx.liquidation_guard = LiquidationGuard(
+            ctx.symbol,
+            partial(guard_position, ctx),
+            {'LONG': MIN_DELTA_LIQUIDATION_LONG, 'SHORT': MIN_DELTA_LIQUIDATION_SHORT},
+            partial(manage_liquidation_price, ctx, refresh=True),
+            cooldown=LIQUIDATION_GUARD_COOLDOWN,
+            log=log_event
+        )
+        market_feed.add_listener(ctx.liquidation_guard.on_ticker)
+
+
+async def run_event_loop():
+    """
+    Событийное ядро торгового цикла. Колесо таймеров запускает обязанности по закрытию свечей
+    ANALYSIS_TIMEFRAME и GLOBAL_TIMEFRAME и в момент смены рынка; каждая обязанность — своя
+    задача asyncio, а блокирующие запросы pybit выполняются в пуле потоков с тайм-аутом.
+    Общие обязанности (смена рынка, индекс страха и жадности) запускают обязанности каждого символа.
+    За WARMUP_LEAD сек до закрытия свечи GLOBAL_TIMEFRAME подготовка символа делает запросы, не зависящие от новой свечи.
+    Смена рынка, подготовка, обновление данных и сигналы одного символа выполняются по очереди (блокировка символа),
+    символы друг друга не ждут; контроль ликвидации и отчёт от них не зависят.
+    """
+    global event_runtime
+    runtime = Runtime(get_server_time, log=log_event)
+    event_runtime = runtime
+    runtime.add_duty('market_change', handle_market_change, timeout=DUTY_TIMEOUTS['market_change'])
+    runtime.add_duty('fear_greed', refresh_fear_greed, timeout=DUTY_TIMEOUTS['fear_greed'])
+    for symbol, ctx in contexts.items():
+        trading = asyncio.Lock()
+        runtime.add_duty(f'market_switch_{symbol}', partial(switch_market, ctx), timeout=DUTY_TIMEOUTS['market_change'], group=trading, after=('market_change',))
+        runtime.add_duty(f'refresh_{symbol}', partial(refresh_market_data, ctx), timeout=DUTY_TIMEOUTS['refresh'], group=trading, after=('fear_greed',), retries=DUTY_RETRIES, retry_delay=DUTY_RETRY_DELAY)
+        runtime.add_duty(f'signals_{symbol}', partial(evaluate_signals, ctx), timeout=DUTY_TIMEOUTS['signals'], group=trading, after=(f'refresh_{symbol}',), retries=DUTY_RETRIES, retry_delay=DUTY_RETRY_DELAY)
+        runtime.add_duty(f'report_{symbol}', partial(report_status, ctx), timeout=DUTY_TIMEOUTS['report'], after=(f'signals_{symbol}',))
+        runtime.add_duty(f'guard_{symbol}', partial(guard_liquidation, ctx), timeout=DUTY_TIMEOUTS['guard'], after=(f'signals_{symbol}',))
+        runtime.add_duty(f'warmup_{symbol}', partial(warm_up, ctx), timeout=DUTY_TIMEOUTS['warmup'], group=trading)
+    runtime.every('market_change', lambda now: next_market_change, 'market_change')
+    runtime.every('global_candle', lambda now: get_next_candle_end_time(now, GLOBAL_TIMEFRAME), 'fear_greed')
+    for symbol in contexts:
+        runtime.every(f'analysis_report_{symbol}', lambda now: get_next_candle_end_time(now, ANALYSIS_TIMEFRAME), f'report_{symbol}')
+        runtime.every(f'analysis_guard_{symbol}', lambda now: get_next_candle_end_time(now, ANALYSIS_TIMEFRAME), f'guard_{symbol}')
+        runtime.every(f'warmup_{symbol}', next_warmup_time, f'warmup_{symbol}')
+    await runtime.run()
 
 
 if __name__ == "__main__":
     try:
-        initialize_csv()
         run()
     except Exception as e:
         error_msg = f"Ошибка выполнения скрипта: {e}"
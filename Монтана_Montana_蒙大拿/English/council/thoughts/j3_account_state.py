@@ -0,0 +1,269 @@
+# j3_account_state
+
+import time
+import threading
+import logging
+
+
+FILL_TTL = 600.0  # Исполнения, которые никто не ждёт, хранятся не дольше, сек
+MAX_FILLS = 1000
+
+
+def private_ws_factory(api_key, api_secret, rsa_authentication=False):
+    """Фабрика приватного WebSocket Bybit (pybit) с теми же ключами, что и HTTP-клиент."""
+    def factory():
+        from pybit.unified_trading import WebSocket
+        return WebSocket(
+            testnet=False,
+            channel_type="private",
+            api_key=api_key,
+            api_secret=api_secret,
+            rsa_authentication=rsa_authentication
+        )
+    return factory
+
+
+class AccountStateStore:
+    """
+    Локальное состояние аккаунта из приватных потоков Bybit: position, wallet, execution.
+    Позиции хранятся в формате REST get_positions (строковые поля size, side, avgPrice,
+    liqPrice, leverage, ...), поэтому существующий код разбора ответа работает без изменений.
+    Ожидание исполнения ордера и пересчёта позиции — через события, а не фиксированные паузы.
+    Пока поток отключён, состояние из памяти не используется (вызывающий код идёт в REST);
+    после переподключения и если сообщений не было дольше max_age оно перечитывается через REST.
+    Неудачное перечитывание повторяется не раньше чем через reseed_delay * 2**попытка сек (не больше max_age).
+    """
+
+    def __init__(self, ws_factory=None, max_age=300.0, reseed_delay=5, log=logging.info):
+        self.ws_factory = ws_factory
+        self.max_age = max_age  # Потоки присылают только изменения: раз в max_age сек состояние сверяется с REST
+        self.reseed_delay = reseed_delay  # Сек
+        self.log = log
+        self.ws = None
+        self._cond = threading.Condition()
+        self._seed_lock = threading.Lock()
+        self._positions = {}  # symbol -> dict в формате REST
+        self._wallet = {}  # coin -> dict в формате REST (walletBalance, ...)
+        self._fills = {}  # orderId -> {'qty': float, 'leaves': float, 'price': float, 'created': float}
+        self._position_version = {}  # symbol -> счётчик обновлений позиции
+        self._seed_targets = {}  # symbol -> (client, coin) для повторной загрузки через REST
+        self._disconnected = False
+        self._reseed_failures = 0
+        self._reseed_after = 0.0  # time.monotonic(), раньше которого неудачное перечитывание не повторяется
+        self.seeded = False  # Начальное состояние загружено через REST
+        self.last_update = None
+        self.reseeds = 0
+
+    # ------------------------------------------------------------------ запуск
+
+    def start(self):
+        """Подписывается на приватные потоки position/wallet/execution."""
+        if self.ws is not None or self.ws_factory is None:
+            return
+        try:
+            self.ws = self.ws_factory()
+            self.ws.position_stream(callback=self._on_position)
+            self.ws.wallet_stream(callback=self._on_wallet)
+            self.ws.execution_stream(callback=self._on_execution)
+            self.log("📡 Подписка на приватные потоки: position, wallet, execution")
+        except Exception as e:
+            self.ws = None
+            self.log(f"⚠️ Не удалось подключить приватный WebSocket, используется REST: {e}")
+
+    def stop(self):
+        if self.ws is not None:
+            try:
+                self.ws.exit()
+            except Exception as e:
+                self.log(f"⚠️ Ошибка при закрытии приватного WebSocket: {e}")
+            self.ws = None
+
+    def seed(self, client, symbol, coin='USDT'):
+        """Загружает начальное состояние через REST (потоки присылают только изменения)."""
+        self._seed_targets[symbol] = (client, coin)
+        try:
+            position_response = client.get_positions(category="linear", symbol=symbol)
+            if position_response['retCode'] != 0:
+                raise ValueError(f"Ошибка API: {position_response['retMsg']}")
+            balance_response = client.get_wallet_balance(accountType="UNIFIED")
+            if balance_response['retCode'] != 0:
+                raise ValueError(f"Ошибка API: {balance_response['retMsg']}")
+        except Exception as e:
+            self.log(f"⚠️ Не удалось загрузить начальное состояние аккаунта: {e}")
+            return False
+        with self._cond:
+            for position in position_response['result']['list']:
+                self._positions[position['symbol']] = dict(position)
+            for account in balance_response['result']['list']:
+                for coin_entry in account.get('coin', []):
+                    self._wallet[coin_entry['coin']] = dict(coin_entry)
+            self.seeded = True
+            self.last_update = time.monotonic()
+            self._cond.notify_all()
+        return True
+
+    def connected(self):
+        """Поток подключён (is_connected pybit; у клиента без этого метода — пока он открыт)."""
+        if self.ws is None:
+            return False
+        is_connected = getattr(self.ws, 'is_connected', None)
+        try:
+            return True if is_connected is None else bool(is_connected())
+        except Exception:
+            return False
+
+    def age(self):
+        """Секунды с последнего сообщения потока или загрузки через REST."""
+        return time.monotonic() - self.last_update if self.last_update is not None else float('inf')
+
+    def is_live(self):
+        """
+        True, если состояние можно читать из памяти: оно загружено и поток подключён.
+        После переподключения или при возрасте больше max_age состояние сначала перечитывается через REST.
+        """
+        if not self.seeded:
+            return False
+        if not self.connected():
+            if not self._disconnected:
+                self._disconnected = True
+                self.log("⚠️ Приватный WebSocket отключён: позиции, баланс и исполнения читаются через REST")
+            return False
+        if self._disconnected or self.age() > self.max_age:
+            if time.monotonic() < self._reseed_after:
+                return False  # Пауза после неудачного перечитывания: пока читаем через REST
+            return self._reseed()
+        return True
+
+    def is_current(self):
+        """
+        Как is_live(), но без обращения к REST: False, если состояние нужно перечитать.
+        Для потоков, которые не должны ждать сети (обработка тикеров); перечитывание
+        выполняют вызовы is_live() из рабочих потоков.
+        """
+        return self.seeded and not self._disconnected and self.connected() and self.age() <= self.max_age
+
+    def _reseed(self):
+        """Повторная загрузка состояния всех символов через REST (одна на все потоки)."""
+        with self._seed_lock:
+            if not self._disconnected and self.age() <= self.max_age:
+                return True
+            if time.monotonic() < self._reseed_after:
+                return False  # Другой поток только что получил ошибку
+            reason = "после переподключения" if self._disconnected else f"сообщений не было {self.age():.0f} сек"
+            ok = all(self.seed(client, symbol, coin) for symbol, (client, coin) in list(self._seed_targets.items()))
+            if ok:
+                self._disconnected = False
+                self._reseed_failures = 0
+                self._reseed_after = 0.0
+                self.reseeds += 1
+                self.log(f"🔄 Состояние аккаунта перечитано через REST ({reason})")
+            else:
+                pause = min(self.reseed_delay * (2 ** self._reseed_failures), self.max_age)
+                self._reseed_failures += 1
+                self._reseed_after = time.monotonic() + pause
+                self.log(f"⚠️ Состояние аккаунта не перечитано (попытка {self._reseed_failures}), повтор через {pause:.0f} сек")
+            return ok
+
+    # ------------------------------------------------------------ обработчики
+
+    def _on_position(self, message):
+        with self._cond:
+            for entry in message.get('data', []):
+                symbol = entry.get('symbol')
+                if symbol is None:
+                    continue
+                position = self._positions.setdefault(symbol, {})
+                position.update(entry)
+                # В потоке цена входа называется entryPrice, в REST — avgPrice
+                if 'entryPrice' in entry:
+                    position['avgPrice'] = entry['entryPrice']
+                self._position_version[symbol] = self._position_version.get(symbol, 0) + 1
+            self.last_update = time.monotonic()
+            self._cond.notify_all()
+
+    def _on_wallet(self, message):
+        with self._cond:
+            for account in message.get('data', []):
+                for coin_entry in account.get('coin', []):
+                    self._wallet.setdefault(coin_entry['coin'], {}).update(coin_entry)
+            self.last_update = time.monotonic()
+            self._cond.notify_all()
+
+    def _on_execution(self, message):
+        with self._cond:
+            for entry in message.get('data', []):
+                if entry.get('execType', 'Trade') != 'Trade':
+                    continue
+                order_id = entry.get('orderId')
+                fill = self._fills.setdefault(order_id, {'qty': 0.0, 'leaves': None, 'price': None,
+                                                         'created': time.monotonic()})
+                fill['qty'] += float(entry.get('execQty') or 0)
+                if entry.get('leavesQty') not in (None, ''):
+                    fill['leaves'] = float(entry['leavesQty'])
+                if entry.get('execPrice') not in (None, ''):
+                    fill['price'] = float(entry['execPrice'])
+            self.last_update = time.monotonic()
+            self._evict_fills(self.last_update)
+            self._cond.notify_all()
+
+    def _evict_fills(self, now):
+        """Удаляет исполнения, которые никто не забрал: старше FILL_TTL и сверх MAX_FILLS (по порядку появления)."""
+        for order_id in list(self._fills):
+            if len(self._fills) <= MAX_FILLS and now - self._fills[order_id]['created'] <= FILL_TTL:
+                break
+            del self._fills[order_id]
+
+    # ---------------------------------------------------------------- чтение
+
+    def get_position(self, symbol):
+        """Копия позиции в формате REST или None."""
+        with self._cond:
+            position = self._positions.get(symbol)
+            return dict(position) if position is not None else None
+
+    def get_wallet_balance(self, coin='USDT'):
+        """walletBalance монеты из памяти или None."""
+        with self._cond:
+            entry = self._wallet.get(coin)
+            if entry is None or entry.get('walletBalance') in (None, ''):
+                return None
+            return float(entry['walletBalance'])
+
+    def position_version(self, symbol):
+        with self._cond:
+            return self._position_version.get(symbol, 0)
+
+    # -------------------------------------------------------------- ожидание
+
+    def wait_for_fill(self, order_id, timeout=5.0):
+        """
+        Ждёт полного исполнения ордера (leavesQty == 0). Возвращает данные исполнения или None
+        по таймауту и при отключении потока (тогда исполнение проверяется через REST).
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                fill = self._fills.get(order_id)
+                if fill is not None and fill['leaves'] == 0:
+                    return dict(self._fills.pop(order_id))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.connected():
+                    return None
+                self._cond.wait(min(remaining, 1.0))
+
+    def wait_for_position_update(self, symbol, since_version, predicate=None, timeout=5.0):
+        """
+        Ждёт обновления позиции после версии since_version (и выполнения predicate, если задан).
+        Возвращает позицию в формате REST или None по таймауту.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._position_version.get(symbol, 0) > since_version:
+                    position = self._positions.get(symbol)
+                    if predicate is None or (position is not None and predicate(position)):
+                        return dict(position) if position is not None else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
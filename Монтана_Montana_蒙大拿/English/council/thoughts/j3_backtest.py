@@ -0,0 +1,458 @@
+# j3_backtest
+
+import ast
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from j3_indicators import compute_indicators
+from j3_regimes import RegimeTable, REGIME_NONE, REGIME_BULL, REGIME_BEAR
+from j3_rules import compile_rules
+from j3_journal import TRADE_COLUMNS  # Колонки файла trades_bybit_*.csv
+from j3_margin import solve_liquidation_close, target_leverage
+
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+MONDAY_ORIGIN_MS = 4 * DAY_MS  # 1970-01-05 00:00 UTC — понедельник, начало недельных свечей Bybit
+
+
+REGIME_NAMES = {REGIME_BULL: 'bull', REGIME_BEAR: 'bear'}
+
+# Параметры стратегии, которые читаются из j3_463.py
+STRATEGY_PREFIXES = ('BULL_', 'BEAR_', 'MIN_DELTA_LIQUIDATION_')
+STRATEGY_NAMES = ('TRADING_CONFIG',)
+
+
+def load_strategy_params(path=None):
+    """
+    Читает TRADING_CONFIG, MIN_DELTA_LIQUIDATION_* и параметры BULL_*/BEAR_* из исходника бота
+    без его выполнения (бот при импорте подключается к бирже). Возвращает словарь имя -> значение.
+    """
+    path = Path(path) if path is not None else Path(__file__).with_name('j3_463.py')
+    tree = ast.parse(path.read_text(encoding='utf-8'))
+    params = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+            continue
+        name = node.targets[0].id
+        if name in STRATEGY_NAMES or name.startswith(STRATEGY_PREFIXES):
+            try:
+                params[name] = ast.literal_eval(node.value)
+            except ValueError:
+                continue
+    return params
+
+
+def indicator_params(strategy, market_type):
+    """Периоды и источники индикаторов для типа рынка (как get_indicator_params в j3_463)."""
+    prefix = 'BULL_' if market_type == 'bull' else 'BEAR_'
+    return {
+        'rsi_period': strategy[prefix + 'RSI_PERIOD'],
+        'sma_rsi_period': strategy[prefix + 'SMA_RSI_PERIOD'],
+        'stochrsi_rsi_period': strategy[prefix + 'STOCHRSI_RSI_PERIOD'],
+        'stochrsi_stoch_period': strategy[prefix + 'STOCHRSI_STOCH_PERIOD'],
+        'stochrsi_k_period': strategy[prefix + 'STOCHRSI_K_PERIOD'],
+        'stochrsi_d_period': strategy[prefix + 'STOCHRSI_D_PERIOD'],
+        'williams_overbought_period': strategy[prefix + 'WILLIAMS_OVERBOUGHT_PERIOD'],
+        'williams_overbought_source': strategy[prefix + 'WILLIAMS_OVERBOUGHT_SOURCE'],
+        'williams_oversold_period': strategy[prefix + 'WILLIAMS_OVERSOLD_PERIOD'],
+        'williams_oversold_source': strategy[prefix + 'WILLIAMS_OVERSOLD_SOURCE'],
+    }
+
+
+def format_duration(seconds):
+    """Длительность сделки в том же формате, что и в журнале бота."""
+    if seconds < 60:
+        return f"{seconds:.2f} сек"
+    elif seconds < 3600:
+        return f"{seconds / 60:.2f} мин"
+    elif seconds < 86400:
+        return f"{seconds / 3600:.2f} ч"
+    return f"{seconds / 86400:.2f} дн"
+
+
+# ---------------------------------------------------------------- данные
+
+def aggregate_candles(times_ms, opens, highs, lows, closes, step_ms=WEEK_MS, origin_ms=MONDAY_ORIGIN_MS):
+    """
+    Агрегирует свечи младшего таймфрейма в старший (по умолчанию неделя с понедельника 00:00 UTC).
+    Возвращает (time, open, high, low, close, last_index), где last_index — индекс последней
+    исходной свечи в каждой агрегированной.
+    """
+    times_ms = np.asarray(times_ms, dtype=np.int64)
+    bucket = (times_ms - origin_ms) // step_ms
+    starts = np.flatnonzero(np.r_[True, np.diff(bucket) != 0])
+    last_index = np.r_[starts[1:] - 1, len(times_ms) - 1]
+    return (
+        origin_ms + bucket[starts] * step_ms,
+        np.asarray(opens, dtype=np.float64)[starts],
+        np.maximum.reduceat(np.asarray(highs, dtype=np.float64), starts),
+        np.minimum.reduceat(np.asarray(lows, dtype=np.float64), starts),
+        np.asarray(closes, dtype=np.float64)[last_index],
+        last_index,
+    )
+
+
+def regime_codes(times_ms, market_periods, trading_config):
+    """
+    Тип рынка для каждого момента времени (REGIME_*), как get_market_type: сравнение по дням,
+    start <= день < change, выключенный в TRADING_CONFIG рынок даёт REGIME_NONE.
+    market_periods — список периодов или готовая RegimeTable.
+    """
+    table = market_periods if isinstance(market_periods, RegimeTable) else RegimeTable(list(market_periods))
+    return table.codes(np.atleast_1d(np.asarray(times_ms, dtype=np.int64)),
+                       enable_bull=trading_config.get('ENABLE_BULL_MARKET', True),
+                       enable_bear=trading_config.get('ENABLE_BEAR_MARKET', True))
+
+
+def fear_greed_values(candle_times_ms, dates_ms, values):
+    """Индекс страха и жадности на дату открытия каждой свечи (NaN, если данных нет)."""
+    candle_days = np.asarray(candle_times_ms, dtype=np.int64) // DAY_MS
+    if dates_ms is None or len(dates_ms) == 0:
+        return np.full(len(candle_days), np.nan)
+    days = np.asarray(dates_ms, dtype=np.int64) // DAY_MS
+    order = np.argsort(days, kind='stable')
+    days = days[order]
+    values = np.asarray(values, dtype=np.float64)[order]
+    pos = np.clip(np.searchsorted(days, candle_days), 0, len(days) - 1)
+    return np.where(days[pos] == candle_days, values[pos], np.nan)
+
+
+# --------------------------------------------------------------- сигналы
+
+def strategy_signals(indicators, market_type, strategy, fear_greed, rules=None):
+    """
+    Правила check_signals для одного типа рынка по свечам — те же скомпилированные правила
+    j3_rules, что и в живом цикле. Возвращает CompiledRules.signals: индекс правила входа
+    и индексы правил выхода по типам сделок.
+    """
+    rules = rules or compile_rules(strategy)
+    return rules.signals(market_type, indicators, fear_greed)
+
+
+def combine_signals(signals_by_regime, regimes, rules):
+    """Сводит сигналы bull/bear в массивы по свечам согласно типу рынка каждой свечи (причины — индексы)."""
+    n = len(regimes)
+    open_long = np.zeros(n, dtype=bool)
+    open_short = np.zeros(n, dtype=bool)
+    close_long = np.full(n, -1, dtype=np.int16)
+    close_short = np.full(n, -1, dtype=np.int16)
+    reasons = []
+    for code, name in REGIME_NAMES.items():
+        signals = signals_by_regime.get(name)
+        if signals is None:
+            continue
+        mask = regimes == code
+        open_rules = rules.open_rules[name]
+        if open_rules:
+            is_long = np.array(['LONG' in rule[0] for rule in open_rules] + [False])
+            is_short = np.array(['SHORT' in rule[0] for rule in open_rules] + [False])
+            # Индекс -1 (нет сигнала) попадает на последний элемент False
+            open_long |= mask & is_long[signals['open']]
+            open_short |= mask & is_short[signals['open']]
+        for target, direction in ((close_long, 'LONG'), (close_short, 'SHORT')):
+            trade_type = f'{name.upper()}_{direction}'
+            codes = []
+            for reason, _, _ in rules.close_rules[trade_type]:
+                if reason not in reasons:
+                    reasons.append(reason)
+                codes.append(reasons.index(reason))
+            fired = signals['close'][trade_type]
+            selected = mask & (fired >= 0)
+            if codes:
+                target[selected] = np.asarray(codes, dtype=np.int16)[fired[selected]]
+    return open_long, open_short, close_long, close_short, reasons
+
+
+# ------------------------------------------------------------- симуляция
+
+class _Simulator:
+    """Исполнение сделок: изолированная маржа, комиссия, контроль дельты до ликвидации."""
+
+    def __init__(self, strategy, initial_balance, maintenance_margin_rate, qty_step, min_order_qty):
+        self.config = strategy['TRADING_CONFIG']
+        self.commission_rate = self.config['COMMISSION_RATE'] / 100
+        self.min_delta = {'LONG': strategy['MIN_DELTA_LIQUIDATION_LONG'], 'SHORT': strategy['MIN_DELTA_LIQUIDATION_SHORT']}
+        self.delta_buffer = strategy.get('MIN_DELTA_LIQUIDATION_BUFFER', 0.0)
+        self.balance = float(initial_balance)
+        self.mmr = maintenance_margin_rate
+        self.precision = int(round(-math.log(qty_step, 10), 0))
+        self.min_order_qty = min_order_qty
+        self.position = None
+        self.next_trade_id = 1
+        self.rows = []
+        self.events = []  # (индекс часовой свечи, баланс, объём со знаком, цена входа)
+
+    def _liquidation_price(self, position):
+        if position['side'] == 'LONG':
+            return position['entry_price'] * (1 - 1 / position['leverage'] + self.mmr)
+        return position['entry_price'] * (1 + 1 / position['leverage'] - self.mmr)
+
+    def _delta(self, price):
+        position = self.position
+        if position['side'] == 'LONG':
+            return (price - position['liq_price']) / price * 100
+        return (position['liq_price'] - price) / price * 100
+
+    def _event(self, index):
+        position = self.position
+        if position is None:
+            self.events.append((index, self.balance, 0.0, 0.0))
+        else:
+            sign = 1.0 if position['side'] == 'LONG' else -1.0
+            self.events.append((index, self.balance, sign * position['size'], position['entry_price']))
+
+    def open(self, trade_type, price, time_ms, index):
+        if not self.config[f'ENABLE_{trade_type}'] or self.position is not None:
+            return
+        position_value = self.balance * self.config[trade_type]['ENTRY_PERCENT'] / 100
+        leverage = self.config.get(trade_type, {}).get('LEVERAGE', 1)
+        size = ((position_value * leverage) / price) * 0.9
+        size = math.floor(size * (10 ** self.precision)) / (10 ** self.precision)
+        if size < self.min_order_qty:
+            return
+        commission_open = size * price * self.commission_rate
+        self.balance -= commission_open
+        self.position = {
+            'id': self.next_trade_id, 'direction': trade_type, 'side': 'LONG' if 'LONG' in trade_type else 'SHORT',
+            'entry_price': price, 'entry_time': time_ms, 'size': size, 'value': position_value,
+            'leverage': leverage, 'opening_leverage': leverage, 'commission_open': commission_open,
+        }
+        self.position['liq_price'] = self._liquidation_price(self.position)
+        self.next_trade_id += 1
+        self._event(index)
+
+    def close(self, reason, price, time_ms, index, amount=None):
+        """Полное (amount=None) или частичное закрытие, как close_all_trades."""
+        position = self.position
+        if position is None:
+            return
+        size = position['size']
+        if amount is not None:
+            amount = max(min(amount, size), self.min_order_qty)
+            amount = math.floor(amount * (10 ** self.precision)) / (10 ** self.precision)
+            amount = min(amount, size)
+        else:
+            amount = size
+        sign = 1.0 if position['side'] == 'LONG' else -1.0
+        pnl = sign * (price - position['entry_price']) * amount
+        commission_close = amount * price * self.commission_rate
+        commission_open = position['commission_open'] * (amount / size)
+        self.balance += pnl - commission_close
+        net_pnl = pnl - commission_close - commission_open
+        self._row(position, reason, price, time_ms, amount, net_pnl)
+        remaining = round(size - amount, self.precision)
+        if remaining > 0:
+            position['value'] *= remaining / size
+            position['commission_open'] -= commission_open
+            position['size'] = remaining
+        else:
+            self.position = None
+        self._event(index)
+
+    def liquidate(self, time_ms, index):
+        position = self.position
+        margin = position['size'] * position['entry_price'] / position['leverage']
+        self.balance -= margin
+        self._row(position, 'liquidation', position['liq_price'], time_ms, position['size'],
+                  -margin - position['commission_open'])
+        self.position = None
+        self._event(index)
+
+    def _row(self, position, status, price, time_ms, amount, net_pnl):
+        duration = (time_ms - position['entry_time']) / 1000
+        self.rows.append({
+            'Trade_ID': str(position['id']),
+            'Status': status,
+            'Direction': position['direction'],
+            'Entry_Time': position['entry_time'],
+            'Exit_Time': time_ms,
+            'Trade_Duration': format_duration(duration),
+            'Hours': duration / 3600,
+            'Entry_Price': position['entry_price'],
+            'Exit_Price': price,
+            'Position_Size': amount,
+            'Position_Value': position['value'],
+            'Leverage': position['opening_leverage'],
+            'Net_PnL_USDT': net_pnl,
+            'Net_PnL_Percent': net_pnl / position['value'] * 100 if position['value'] > 0 else 0,
+            'Balance': self.balance,
+            'Withdraw': np.nan,
+        })
+
+    def _reduce_leverage(self, price, side):
+        """adjust_leverage_after_partial_close: плечо сразу снижается до target_leverage (маржа доливается из баланса)."""
+        position = self.position
+        if self._delta(price) >= self.min_delta[side]:
+            return
+        new_leverage, _ = target_leverage(
+            side, price, position['entry_price'], position['leverage'], position['liq_price'],
+            self.min_delta[side] + self.delta_buffer, size=position['size'], budget=self.balance
+        )
+        if new_leverage < position['leverage']:
+            position['leverage'] = new_leverage
+            position['liq_price'] = self._liquidation_price(position)
+
+    def control_delta(self, price, time_ms, index):
+        """
+        manage_liquidation_price: при дельте ниже минимума закрывается объём из solve_liquidation_close
+        (дельта возвращается к минимуму с запасом одним ордером), затем снижается плечо.
+        Если снижения плеча не хватило, закрывается ещё минимальный объём.
+        """
+        fallback = False
+        while self.position is not None:
+            position = self.position
+            side = position['side']
+            if self._delta(price) >= self.min_delta[side]:
+                return
+            close_amount, _ = solve_liquidation_close(
+                side, price, position['entry_price'], position['size'], position['leverage'], position['liq_price'],
+                self.balance, self.min_delta[side] + self.delta_buffer, fee_rate=self.commission_rate,
+                qty_step=10 ** -self.precision, min_qty=self.min_order_qty
+            )
+            if fallback:
+                close_amount = max(close_amount, self.min_order_qty)
+            if close_amount > 0:
+                self.close(f"delta_control_{side.lower()}", price, time_ms, index, amount=close_amount)
+                if self.position is None:
+                    return
+            self._reduce_leverage(price, side)
+            fallback = True
+
+    def guard(self, times_ms, highs, lows, closes, start, stop, step_ms):
+        """Ежечасный контроль дельты и ликвидации на свечах [start, stop) — векторно по участкам."""
+        while self.position is not None and start < stop:
+            liq_price = self.position['liq_price']
+            min_delta = self.min_delta[self.position['side']]
+            segment_closes = closes[start:stop]
+            if self.position['side'] == 'LONG':
+                liquidated = lows[start:stop] <= liq_price
+                low_delta = (segment_closes - liq_price) / segment_closes * 100 < min_delta
+            else:
+                liquidated = highs[start:stop] >= liq_price
+                low_delta = (liq_price - segment_closes) / segment_closes * 100 < min_delta
+            first_liquidation = int(np.argmax(liquidated)) if liquidated.any() else None
+            first_low_delta = int(np.argmax(low_delta)) if low_delta.any() else None
+            if first_liquidation is None and first_low_delta is None:
+                return
+            if first_liquidation is not None and (first_low_delta is None or first_liquidation <= first_low_delta):
+                index = start + first_liquidation
+                self.liquidate(int(times_ms[index]) + step_ms, index)
+                return
+            index = start + first_low_delta
+            self.control_delta(float(closes[index]), int(times_ms[index]) + step_ms, index)
+            start = index + 1
+
+
+def run_backtest(times_ms, opens, highs, lows, closes, strategy, market_periods=None, regimes=None,
+                 fear_greed=None, initial_balance=1000.0, step_ms=HOUR_MS, maintenance_margin_rate=0.005,
+                 qty_step=0.001, min_order_qty=0.001, indicators=None, start_ms=None, end_ms=None):
+    """
+    Бэктест стратегии Юнона 3 на свечах ANALYSIS_TIMEFRAME (по умолчанию 1h).
+    Индикаторы и правила j3_rules (общие с check_signals) считаются векторно по недельным свечам, собранным
+    из входных; сигнал закрытой недели исполняется по открытию первой свечи следующей недели.
+    При смене типа рынка позиция закрывается и открывается сделка нового рынка, как в run().
+    Каждую свечу проверяется дельта до ликвидации (manage_liquidation_price).
+    PnL и комиссия считаются от номинала позиции, ликвидация списывает изолированную маржу.
+
+    strategy — словарь из load_strategy_params(); market_periods — периоды calculate_market_periods
+    (или готовый массив regimes по недельным свечам); fear_greed — (даты в мс, значения);
+    indicators — заранее посчитанные индикаторы {'bull': {...}, 'bear': {...}} по недельным свечам.
+    start_ms/end_ms ограничивают окно торговли (индикаторы по-прежнему считаются по всей истории,
+    без заглядывания вперёд); открытая на конце окна позиция закрывается со статусом window_end.
+    Возвращает словарь: trades (DataFrame в колонках trades_bybit_*.csv), times и equity
+    (по свечам окна), balance, weekly (недельные свечи).
+    """
+    times_ms = np.asarray(times_ms, dtype=np.int64)
+    opens = np.asarray(opens, dtype=np.float64)
+    highs = np.asarray(highs, dtype=np.float64)
+    lows = np.asarray(lows, dtype=np.float64)
+    closes = np.asarray(closes, dtype=np.float64)
+    week_time, week_open, week_high, week_low, week_close, week_last = aggregate_candles(times_ms, opens, highs, lows, closes)
+    config = strategy['TRADING_CONFIG']
+    if regimes is None:
+        # Тип рынка на момент проверки сигнала — начало следующей недели
+        regimes = regime_codes(week_time + WEEK_MS, market_periods or [], config)
+    if fear_greed is not None:
+        fear_greed = fear_greed_values(week_time, *fear_greed)
+    else:
+        fear_greed = np.full(len(week_time), np.nan)
+    if indicators is None:
+        indicators = {name: compute_indicators(indicator_params(strategy, name), week_open, week_high, week_low, week_close)
+                      for name in REGIME_NAMES.values()}
+    rules = compile_rules(strategy)
+    signals = {name: strategy_signals(indicators[name], name, strategy, fear_greed, rules) for name in REGIME_NAMES.values()}
+    open_long, open_short, close_long, close_short, reasons = combine_signals(signals, regimes, rules)
+
+    first = 0 if start_ms is None else int(np.searchsorted(times_ms, start_ms))
+    stop = len(times_ms) if end_ms is None else int(np.searchsorted(times_ms, end_ms))
+    signal_index = week_last + 1  # Первая свеча следующей недели — момент проверки сигнала
+    in_window = np.flatnonzero((signal_index >= first) & (signal_index < stop))
+    simulator = _Simulator(strategy, initial_balance, maintenance_margin_rate, qty_step, min_order_qty)
+    simulator._event(first)
+    last_regime = int(regimes[in_window[0]]) if len(in_window) else REGIME_NONE
+    checked = first  # Свечи до этого индекса уже прошли контроль дельты
+    for week in in_window:
+        index = int(signal_index[week])
+        simulator.guard(times_ms, highs, lows, closes, checked, index, step_ms)
+        checked = index
+        price = float(opens[index])
+        signal_time = int(times_ms[index])
+        regime = int(regimes[week])
+        # Смена типа рынка: закрытие всех сделок и вход по новому рынку
+        if regime != last_regime:
+            name = REGIME_NAMES.get(regime)
+            simulator.close(f"market_type_change_to_{name}", price, signal_time, index)
+            if name is not None:
+                simulator.open('BULL_LONG' if name == 'bull' else 'BEAR_SHORT', price, signal_time, index)
+            last_regime = regime
+        if regime == REGIME_NONE:
+            continue
+        name = REGIME_NAMES[regime].upper()
+        position = simulator.position
+        if position is None:
+            if open_long[week]:
+                simulator.open(f'{name}_LONG', price, signal_time, index)
+            elif open_short[week]:
+                simulator.open(f'{name}_SHORT', price, signal_time, index)
+        elif position['direction'] == f'{name}_LONG' and close_long[week] >= 0:
+            simulator.close(reasons[close_long[week]], price, signal_time, index)
+        elif position['direction'] == f'{name}_SHORT' and close_short[week] >= 0:
+            simulator.close(reasons[close_short[week]], price, signal_time, index)
+        if simulator.position is not None:
+            simulator.control_delta(price, signal_time, index)
+    simulator.guard(times_ms, highs, lows, closes, checked, stop, step_ms)
+    if end_ms is not None and simulator.position is not None and stop > first:
+        simulator.close('window_end', float(closes[stop - 1]), int(times_ms[stop - 1]) + step_ms, stop - 1)
+
+    # Открытая на конец истории позиция — строка со статусом open, как в журнале бота
+    rows = list(simulator.rows)
+    if simulator.position is not None:
+        position = simulator.position
+        rows.append({
+            'Trade_ID': str(position['id']), 'Status': 'open', 'Direction': position['direction'],
+            'Entry_Time': position['entry_time'], 'Exit_Time': None, 'Trade_Duration': '', 'Hours': np.nan,
+            'Entry_Price': position['entry_price'], 'Exit_Price': np.nan, 'Position_Size': position['size'],
+            'Position_Value': position['value'], 'Leverage': position['opening_leverage'],
+            'Net_PnL_USDT': np.nan, 'Net_PnL_Percent': np.nan, 'Balance': simulator.balance, 'Withdraw': np.nan,
+        })
+    trades = pd.DataFrame(rows, columns=TRADE_COLUMNS)
+    trades['Entry_Time'] = pd.to_datetime(trades['Entry_Time'], unit='ms', utc=True)
+    trades['Exit_Time'] = pd.to_datetime(trades['Exit_Time'], unit='ms', utc=True)
+
+    # Кривая капитала: баланс + нереализованный PnL, кусочно-постоянные параметры позиции по событиям
+    events = np.array(simulator.events, dtype=np.float64)
+    event_index = np.searchsorted(events[:, 0], np.arange(first, stop), side='right') - 1
+    balance, signed_size, entry_price = events[event_index, 1], events[event_index, 2], events[event_index, 3]
+    equity = balance + signed_size * (closes[first:stop] - entry_price)
+    return {
+        'trades': trades,
+        'times': times_ms[first:stop],
+        'equity': equity,
+        'balance': simulator.balance,
+        'weekly': {'time': week_time, 'open': week_open, 'high': week_high, 'low': week_low, 'close': week_close},
+    }
@@ -0,0 +1,506 @@
+# j3_bench
+
+import os
+import gc
+import csv
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import importlib
+import statistics
+import tracemalloc
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from j3_exchange_sim import ExchangeSimulator, LocalClient, WEEK_MS
+
+
+BASELINE_FILE = Path(__file__).with_name('j3_bench_baseline.json')
+SCALES = (1, 10, 100)
+
+# Объёмы данных на масштабе 1× — текущие размеры; масштабы 10× и 100× умножают их
+BASE_CANDLES = 350  # Недельные свечи BTCUSDT бессрочного контракта Bybit (с 2020 г.)
+BASE_LEDGER_ROWS = 2000  # Строк junona_stat.csv: сделки, закрытые позиции и ежедневный баланс с 2024-09
+BASE_GROUP_ENTRIES = 1000  # Записей на входе group_trades (исполнения частями и закрытые позиции)
+BASE_NEW_TRADES = 100  # Новых сделок на бирже с последнего save_stat
+NEW_TRADES_DAYS = 30  # За сколько дней save_stat догружает новые сделки
+# Время биржи в симуляторе бота: свечи симулятора, индикаторы и правила не зависят от дня запуска
+EXCHANGE_TIME = datetime(2026, 10, 14, 12, 0, tzinfo=timezone.utc)
+CANDLE_SEED = 8  # Зерно синтетической истории свечей: на ней срабатывает вход BULL_LONG по Williams %R
+
+TIME_THRESHOLD = 0.5  # Допустимый рост медианного времени (доля от базового)
+MEMORY_THRESHOLD = 0.25  # Допустимый рост пикового объёма памяти
+MIN_TIME_DELTA = 0.002  # Разница во времени меньше 2 мс — шум таймера, не регрессия
+MIN_MEMORY_DELTA = 256 * 1024
+MIN_REPEATS = 3
+# Рабочий каталог в памяти: на ext4 замена файла через os.replace сбрасывает данные на диск (auto_da_alloc),
+# и десятки миллисекунд ожидания диска в save_indicator_engine/save_market_data заслоняют время кода
+RAM_DIR = '/dev/shm'
+
+
+class _NoSleep:
+    """Модуль time без пауз: паузы save_stat между запросами к бирже не входят в замер."""
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    @staticmethod
+    def sleep(seconds):
+        pass
+
+
+class BenchEnv:
+    """
+    Окружение замеров: временный рабочий каталог, симулятор биржи и загруженные в нём боты.
+    Боты импортируются как при обычном запуске (USE_BITWARDEN=false, BYBIT_ENDPOINT на симулятор),
+    затем их client заменяется на LocalClient — REST идёт в симулятор в том же процессе, без сети.
+    """
+
+    def __init__(self, workdir):
+        self.workdir = Path(workdir)
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        self.pristine = self.workdir / 'pristine'
+        self.pristine.mkdir(exist_ok=True)
+        clock_offset_ms = int(EXCHANGE_TIME.timestamp() * 1000) - int(time.time() * 1000)
+        self.simulator = ExchangeSimulator(['BTCUSDT'], rate_scale=0, tick_interval=3600, history_days=NEW_TRADES_DAYS,
+                                           clock_offset_ms=clock_offset_ms, log=lambda message: None)
+        self._cwd = os.getcwd()
+        self._candles = {}
+        self._stats = {}
+        self.simulator.serve()
+        os.environ.update(BYBIT_ENDPOINT=self.simulator.endpoint, USE_BITWARDEN='false',
+                          BYBIT_API_KEY='bench', BYBIT_API_SECRET='bench')
+        os.chdir(self.workdir)
+        sys.path.insert(0, str(Path(__file__).parent))
+        self.bot = importlib.import_module('j3_463')
+        self.stat = importlib.import_module('j3_statbot_120')
+        for module in (self.bot, self.stat):
+            module.exchange_clock.stop()
+            module.client = LocalClient(self.simulator)
+        self.stat.time = _NoSleep()
+        self.bot.current_market_type = 'bull'
+        self.ctx = self.bot.create_contexts()['BTCUSDT']
+        self.ctx.market_type = 'bull'
+        self.bot.initialize_journal(self.ctx)
+        self.now = self.bot.get_server_time()
+
+    def close(self):
+        if self.ctx.candle_store is not None:
+            self.ctx.candle_store.close()
+        if self.ctx.journal is not None:
+            self.ctx.journal.close()
+        self.simulator.close()
+        for simulator in self._stats.values():
+            simulator.close()
+        os.chdir(self._cwd)
+
+    # ------------------------------------------------------------------ свечи
+
+    def _store_path(self):
+        return Path(f"candles_{self.ctx.symbol}_{self.bot.GLOBAL_TIMEFRAME}_{self.bot.script_name}.j3c")
+
+    def _release_store(self):
+        if self.ctx.candle_store is not None:
+            self.ctx.candle_store.close()
+        self.ctx.candle_store = None
+        self.ctx.kline_sync = None
+
+    def prepare_candles(self, count):
+        """
+        Хранилище из count - 1 закрытых недельных свечей: последние — свечи симулятора (биржа вернёт
+        их без изменений), более ранние — синтетическое броуновское движение, построенное от новых
+        свечей к старым. Недавняя история одинакова на всех масштабах, поэтому индикаторы и сработавшие
+        правила тоже совпадают. Последнюю закрытую свечу update_market_data_on_candle_close догружает
+        из симулятора. Сохраняются копии хранилища и контрольной точки индикаторов по нему.
+        """
+        if count in self._candles:
+            return self._candles[count]
+        bot = self.bot
+        current_start = bot.get_current_candle_start_time(self.now, bot.GLOBAL_TIMEFRAME)
+        current_start_ms = int(current_start.timestamp() * 1000)
+        rows = bot.client.get_kline(category='linear', symbol=self.ctx.symbol, interval='W',
+                                    end=current_start_ms - 1, limit=3)['result']['list']
+        tail = np.array([[float(value) for value in row[:5]] for row in reversed(rows)])
+        older = count - len(tail)
+        steps = np.random.default_rng(CANDLE_SEED).normal(0.0, 0.08, older)
+        wicks = np.abs(np.random.default_rng(2).normal(0.0, 0.03, (older, 2)))[::-1]
+        closes = (tail[0, 1] * np.exp(-np.r_[0.0, np.cumsum(steps[:-1])]))[::-1]
+        opens = np.r_[closes[0], closes[:-1]]
+        times = tail[0, 0] - (older - np.arange(older)) * WEEK_MS
+        candles = np.vstack([
+            np.column_stack([times, opens, np.maximum(opens, closes) * (1 + wicks[:, 0]),
+                             np.minimum(opens, closes) * (1 - wicks[:, 1]), closes]),
+            tail,
+        ])[:-1]
+        self._release_store()
+        store_path = self._store_path()
+        state_file = bot.get_indicator_state_file(self.ctx, self.ctx.market_type)
+        for path in (store_path, state_file):
+            path.unlink(missing_ok=True)
+        store = bot.get_candle_store(self.ctx)
+        store.upsert_ohlc(candles[:, 0].astype(np.int64), candles[:, 1], candles[:, 2], candles[:, 3], candles[:, 4])
+        engine = bot.IndicatorEngine(bot.get_indicator_params(self.ctx.market_type))
+        engine.run(candles[:, 0].astype(np.int64), candles[:, 1], candles[:, 2], candles[:, 3], candles[:, 4])
+        bot.save_indicator_engine(self.ctx, engine, self.ctx.market_type)
+        self._release_store()
+        saved = (self.pristine / f"candles_{count}.j3c", self.pristine / f"indicator_state_{count}.json")
+        shutil.copyfile(store_path, saved[0])
+        shutil.copyfile(state_file, saved[1])
+        self._candles[count] = saved
+        return saved
+
+    def restore_candles(self, count, checkpoint):
+        """Хранилище count - 1 свечей; checkpoint=False — без контрольной точки (полный пересчёт)."""
+        store_file, checkpoint_file = self.prepare_candles(count)
+        self._release_store()
+        shutil.copyfile(store_file, self._store_path())
+        state_file = self.bot.get_indicator_state_file(self.ctx, self.ctx.market_type)
+        if checkpoint:
+            shutil.copyfile(checkpoint_file, state_file)
+        else:
+            state_file.unlink(missing_ok=True)
+        self.bot.get_kline_sync(self.ctx, self.bot.GLOBAL_TIMEFRAME)
+
+    def update_candles(self):
+        self.bot.update_market_data_on_candle_close(self.ctx, self.bot.GLOBAL_TIMEFRAME, self.now)
+
+    # ------------------------------------------------------------------ статистика
+
+    def stats_simulator(self, trades):
+        """Симулятор с trades завершёнными сделками за NEW_TRADES_DAYS дней — новые записи для save_stat."""
+        if trades not in self._stats:
+            simulator = ExchangeSimulator(['BTCUSDT', 'ETHUSDT'], rate_scale=0, history_days=NEW_TRADES_DAYS,
+                                          seed=trades, log=lambda message: None)
+            simulator.seed_trades(trades)
+            self._stats[trades] = simulator
+        return self._stats[trades]
+
+    def ledger(self, rows):
+        """junona_stat.csv из rows строк; последняя — перед окном новых сделок симулятора статистики."""
+        path = self.pristine / f"ledger_{rows}.csv"
+        if not path.exists():
+            end = datetime.now(timezone.utc) - timedelta(days=NEW_TRADES_DAYS, hours=1)
+            write_ledger(path, rows, end, self.stat.FIELDNAMES)
+        return path
+
+
+def write_ledger(path, rows, end, fieldnames, seed=1):
+    """
+    Синтетическая статистика в формате save_stat: по кругу исполнение (Trade), закрытая позиция
+    и ежедневный баланс, по строке каждые 8 часов до end.
+    """
+    rng = np.random.default_rng(seed)
+    pnl = np.round(rng.normal(2.0, 40.0, rows), 2)
+    prices = 60000.0 * np.exp(np.cumsum(rng.normal(0.0, 0.01, rows)))
+    qty = np.round(rng.integers(1, 50, rows) * 0.001, 4)
+    cumulative = 0.0
+    balance = 10000.0
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(rows):
+            moment = end - timedelta(hours=8 * (rows - 1 - i))
+            stamp = moment.strftime('%Y-%m-%d %H:%M:%S')
+            kind = i % 3
+            row = dict.fromkeys(fieldnames, "")
+            row.update({"Time": stamp, "Symbol": "BTCUSDT"})
+            if kind == 0:
+                row.update({
+                    "Side": "Buy" if i % 2 else "Sell", "Price": round(prices[i], 2), "Quantity": qty[i],
+                    "Total": round(prices[i] * qty[i], 2), "Fee": round(prices[i] * qty[i] * 0.00055, 2),
+                    "Cumulative Net Realized Profit": round(cumulative, 2), "Stat Type": "Trade",
+                    "Trade ID": f"exec-{i}",
+                })
+            elif kind == 1:
+                cumulative += pnl[i]
+                balance += pnl[i]
+                row.update({
+                    "Side": "Close Long" if pnl[i] > 0 else "Close Short", "Price": round(prices[i], 2),
+                    "Quantity": qty[i], "Total": round(prices[i] * qty[i], 2), "Fee": 0.0,
+                    "Realized Profit": pnl[i], "Net Realized Profit": pnl[i],
+                    "Cumulative Net Realized Profit": round(cumulative, 2), "Stat Type": "Closed Position",
+                    "Trade ID": f"order-{i}",
+                })
+            else:
+                row.update({"Symbol": "", "Stat Type": "Balance", "Balance": round(balance, 2),
+                            "Trade ID": f"balance_{moment.strftime('%Y%m%d')}"})
+            writer.writerow(row)
+
+
+def group_entries(count, seed=1):
+    """Записи save_stat до группировки: ордера, исполненные тремя частями в одну минуту, и закрытые позиции."""
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 9, 1, tzinfo=timezone.utc)
+    entries = []
+    for i in range(count):
+        moment = start + timedelta(minutes=i // 4 * 37, seconds=int(rng.integers(0, 60)))
+        price = round(60000.0 + float(rng.normal(0.0, 500.0)), 2)
+        qty = round(float(rng.integers(1, 50)) * 0.001, 4)
+        entry = {
+            "Time": moment.strftime('%Y-%m-%d %H:%M:%S'), "Symbol": "BTCUSDT", "Price": price, "Quantity": qty,
+            "Total": round(price * qty, 2), "Cumulative Net Realized Profit": None, "Balance": "",
+        }
+        if i % 4 < 3:
+            entry.update({"Side": "Buy" if i // 4 % 2 else "Sell", "Fee": round(price * qty * 0.00055, 2),
+                          "Realized Profit": "", "Net Realized Profit": "", "Stat Type": "Trade",
+                          "Trade ID": f"exec-{i}"})
+        else:
+            pnl = round(float(rng.normal(2.0, 40.0)), 2)
+            entry.update({"Side": "Close Long", "Fee": 0.0, "Realized Profit": pnl, "Net Realized Profit": pnl,
+                          "Stat Type": "Closed Position", "Trade ID": f"order-{i}"})
+        entries.append(entry)
+    return entries
+
+
+# ------------------------------------------------------------------ сценарии: (env, масштаб) -> (setup, run)
+
+def case_update_full(env, scale):
+    """update_market_data_on_candle_close без контрольной точки: новая свеча и пересчёт индикаторов по всей истории."""
+    count = BASE_CANDLES * scale
+    return (lambda: env.restore_candles(count, checkpoint=False)), env.update_candles
+
+
+def case_update_incremental(env, scale):
+    """update_market_data_on_candle_close с контрольной точкой: индикаторы считаются только по новой свече."""
+    count = BASE_CANDLES * scale
+    return (lambda: env.restore_candles(count, checkpoint=True)), env.update_candles
+
+
+def case_load_market_data(env, scale):
+    """load_market_data: последние 242 свечи и индикаторы из хранилища count свечей."""
+    env.restore_candles(BASE_CANDLES * scale, checkpoint=False)
+    env.update_candles()
+    return (lambda: None), (lambda: env.bot.load_market_data(env.ctx, env.ctx.market_type))
+
+
+def _signals_case(env, scale, holding):
+    bot, ctx = env.bot, env.ctx
+    env.restore_candles(BASE_CANDLES * scale, checkpoint=False)
+    env.update_candles()
+    bot.load_market_data(ctx, ctx.market_type)
+    if not holding and bot.get_signal_rules().entry(ctx.market_type, ctx.rule_indicators(), [None, None]) is None:
+        raise RuntimeError(f"Правило входа не срабатывает на истории CANDLE_SEED={CANDLE_SEED}: замер не дойдёт до ордера")
+    state = {}
+
+    def setup():
+        if ctx.active_trades and not holding:
+            bot.close_all_trades(ctx, 'bench', force_close=True)
+        snapshot = bot.get_account_snapshot(ctx, refresh=True)
+        if holding and not ctx.active_trades:
+            position_value = ctx.capital(snapshot.balance) * bot.TRADING_CONFIG['BULL_LONG']['ENTRY_PERCENT'] / 100
+            bot.open_trade(ctx, 'BULL_LONG', snapshot.price, position_value, snapshot=snapshot)
+            snapshot = bot.get_account_snapshot(ctx, refresh=True)
+        state['snapshot'] = snapshot
+
+    def run():
+        bot.check_signals(ctx, state['snapshot'].price, snapshot=state['snapshot'])
+    return setup, run
+
+
+def case_check_signals_entry(env, scale):
+    """
+    check_signals без позиции по индикаторам из хранилища count свечей: на синтетической истории
+    срабатывает правило входа, ордер исполняется в симуляторе. Перед каждым замером позиция закрывается.
+    """
+    return _signals_case(env, scale, holding=False)
+
+
+def case_check_signals_hold(env, scale):
+    """check_signals с открытой позицией BULL_LONG: правила выхода и контроль дельты до ликвидации."""
+    return _signals_case(env, scale, holding=True)
+
+
+def case_group_trades(env, scale):
+    """group_trades: группировка исполнений по минуте, символу и направлению."""
+    entries = group_entries(BASE_GROUP_ENTRIES * scale)
+    return (lambda: None), (lambda: env.stat.group_trades(entries))
+
+
+def case_save_stat(env, scale):
+    """
+    save_stat: чтение junona_stat.csv, догрузка новых сделок из симулятора окнами по 7 дней
+    (без пауз между запросами), группировка и дозапись файла.
+    """
+    ledger = env.ledger(BASE_LEDGER_ROWS * scale)
+    simulator = env.stats_simulator(BASE_NEW_TRADES * scale)
+
+    def setup():
+        env.stat.client = LocalClient(simulator)
+        shutil.copyfile(ledger, env.stat.STAT_FILE)
+    return setup, env.stat.save_stat
+
+
+def case_balance_chart(env, scale):
+    """generate_balance_chart по файлу статистики."""
+    ledger = str(env.ledger(BASE_LEDGER_ROWS * scale))
+    return (lambda: None), (lambda: env.stat.generate_balance_chart(ledger, current_balance=10000.0))
+
+
+def case_profit_chart(env, scale):
+    """generate_cumulative_profit_chart по файлу статистики."""
+    ledger = str(env.ledger(BASE_LEDGER_ROWS * scale))
+    return (lambda: None), (lambda: env.stat.generate_cumulative_profit_chart(ledger))
+
+
+CASES = {
+    'update_market_data_full': case_update_full,
+    'update_market_data_incremental': case_update_incremental,
+    'load_market_data': case_load_market_data,
+    'check_signals_entry': case_check_signals_entry,
+    'check_signals_hold': case_check_signals_hold,
+    'group_trades': case_group_trades,
+    'save_stat': case_save_stat,
+    'generate_balance_chart': case_balance_chart,
+    'generate_cumulative_profit_chart': case_profit_chart,
+}
+
+
+def measure(setup, run, repeat=5, budget=5.0):
+    """
+    Медиана времени run() по repeat замерам (не меньше MIN_REPEATS, дальше — пока укладываемся в budget сек)
+    и пик памяти отдельного прогона под tracemalloc. setup() перед каждым прогоном в замер не входит.
+    """
+    times = []
+    spent = 0.0
+    while len(times) < max(repeat, 1) and (len(times) < MIN_REPEATS or spent < budget):
+        setup()
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+        spent += times[-1]
+    setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'peak_bytes': peak, 'runs': len(times)}
+
+
+def run_benchmarks(cases=None, scales=SCALES, repeat=5, budget=5.0, workdir=None, log=print):
+    """Прогон сценариев на каждом масштабе: {сценарий: {масштаб: результат measure}}."""
+    cases = cases or list(CASES)
+    temporary = workdir is None
+    if temporary:
+        workdir = tempfile.mkdtemp(prefix='j3_bench_', dir=RAM_DIR if os.path.isdir(RAM_DIR) else None)
+    workdir = Path(workdir)
+    env = BenchEnv(workdir)
+    results = {}
+    try:
+        for scale in scales:
+            for name in cases:
+                setup, run = CASES[name](env, scale)
+                result = measure(setup, run, repeat, budget)
+                results.setdefault(name, {})[str(scale)] = result
+                log(f"{name:34} {scale:>4}×  {result['seconds'] * 1000:10.2f} мс  {result['peak_bytes'] / 1024:10.0f} КБ")
+    finally:
+        env.close()
+        if temporary:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def load_baseline(path=BASELINE_FILE):
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_FILE, previous=None):
+    """Записывает базовые значения; сценарии и масштабы, которые не прогонялись, берутся из previous."""
+    merged = {name: dict(scales) for name, scales in ((previous or {}).get('results') or {}).items()}
+    for name, scales in results.items():
+        merged.setdefault(name, {}).update(scales)
+    baseline = {
+        'created': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': machine_info(),
+        'sizes': {'candles': BASE_CANDLES, 'ledger_rows': BASE_LEDGER_ROWS, 'group_entries': BASE_GROUP_ENTRIES,
+                  'new_trades': BASE_NEW_TRADES},
+        'results': merged,
+    }
+    tmp_file = Path(path).with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+    os.replace(tmp_file, path)
+
+
+def compare(results, baseline, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """
+    Регрессии относительно базовых значений: рост медианного времени больше time_threshold
+    (и больше MIN_TIME_DELTA) или пика памяти больше memory_threshold (и больше MIN_MEMORY_DELTA).
+    """
+    regressions = []
+    for name, scales in results.items():
+        for scale, result in scales.items():
+            base = ((baseline or {}).get('results') or {}).get(name, {}).get(scale)
+            if base is None:
+                continue
+            seconds, base_seconds = result['seconds'], base['seconds']
+            if seconds > base_seconds * (1 + time_threshold) and seconds - base_seconds > MIN_TIME_DELTA:
+                regressions.append(f"{name} {scale}×: время {seconds * 1000:.2f} мс, базовое {base_seconds * 1000:.2f} мс "
+                                   f"(+{(seconds / base_seconds - 1) * 100:.0f}%)")
+            peak, base_peak = result['peak_bytes'], base['peak_bytes']
+            if peak > base_peak * (1 + memory_threshold) and peak - base_peak > MIN_MEMORY_DELTA:
+                regressions.append(f"{name} {scale}×: память {peak / 1024:.0f} КБ, базовая {base_peak / 1024:.0f} КБ "
+                                   f"(+{(peak / base_peak - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей Юноны 3 и статистики с порогами регрессии")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), help="Сценарии (по умолчанию все)")
+    parser.add_argument('--scales', nargs='+', type=int, default=list(SCALES), help="Масштабы данных относительно текущих")
+    parser.add_argument('--repeat', type=int, default=5, help="Замеров на сценарий (медиана)")
+    parser.add_argument('--budget', type=float, default=5.0, help="Секунд на повторы сценария сверх минимальных 3")
+    parser.add_argument('--baseline', default=str(BASELINE_FILE))
+    parser.add_argument('--update-baseline', action='store_true', help="Записать результаты как базовые")
+    parser.add_argument('--time-threshold', type=float, default=TIME_THRESHOLD, help="Допустимый рост времени, доля")
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD, help="Допустимый рост памяти, доля")
+    parser.add_argument('--workdir', help="Рабочий каталог (по умолчанию временный в /dev/shm, удаляется)")
+    parser.add_argument('--verbose', action='store_true', help="Не отключать журнал ботов")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    baseline = load_baseline(args.baseline)
+    if baseline is not None and baseline.get('machine') != machine_info():
+        print(f"⚠️ Базовые значения сняты на другой машине: {baseline.get('machine')}")
+    results = run_benchmarks(args.cases, args.scales, args.repeat, args.budget, args.workdir)
+    if args.update_baseline:
+        save_baseline(results, args.baseline, previous=baseline)
+        print(f"💾 Базовые значения записаны в {args.baseline}")
+        return
+    if baseline is None:
+        print(f"⚠️ Нет базовых значений {args.baseline}: запустите с --update-baseline")
+        return
+    regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+    for regression in regressions:
+        print(f"❌ {regression}")
+    if regressions:
+        sys.exit(1)
+    print("✅ Регрессий нет")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+# j3_candle_store
+
+import os
+import json
+from pathlib import Path
+
+import numpy as np
+
+from j3_indicators import INDICATOR_COLUMNS
+
+
+MAGIC = b'J3CANDLE'
+VERSION = 1
+HEADER_SIZE = 4096  # Заголовок: фиксированная часть + JSON с описанием полей
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('record_size', '<u4'),
+    ('count', '<u8'),  # Количество подтверждённых записей
+    ('capacity', '<u8'),  # Количество записей, под которые выделен файл
+    ('descr_size', '<u4'),
+])
+MARKET_TYPES = ('bull', 'bear')
+
+
+def indicator_field(market_type, column):
+    """Имя поля индикатора для типа рынка: индикаторы bull и bear считаются с разными параметрами."""
+    return f"{market_type}_{column}"
+
+
+def candle_dtype(market_types=MARKET_TYPES):
+    """Структура записи: время открытия свечи (мс), OHLC и индикаторы для каждого типа рынка."""
+    fields = [('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8')]
+    for market_type in market_types:
+        for column in INDICATOR_COLUMNS:
+            fields.append((indicator_field(market_type, column), '<f8'))
+    return np.dtype(fields)
+
+
+class CandleStore:
+    """
+    Хранилище свечей одного символа и таймфрейма в файле, отображённом в память (np.memmap).
+    Записи отсортированы по времени и только дописываются в конец; последнюю свечу можно
+    перезаписать (ревизия биржей), а пропуски внутри истории заполняются редкой атомарной
+    перезаписью файла (insert_ohlc). Запись надёжна к сбою: сначала пишутся данные,
+    затем в заголовке увеличивается count, поэтому недописанная запись просто не видна.
+    last(n) и slice() возвращают представления без копирования.
+    """
+
+    def __init__(self, path, dtype=None, initial_capacity=1024):
+        self.path = Path(path)
+        self.dtype = dtype or candle_dtype()
+        self._header = None
+        self._data = None
+        if self.path.exists() and self.path.stat().st_size >= HEADER_SIZE:
+            self._open()
+        else:
+            self._create(initial_capacity)
+
+    # ------------------------------------------------------------ файл
+
+    def _descr(self):
+        return json.dumps([[name, self.dtype.fields[name][0].str] for name in self.dtype.names]).encode('utf-8')
+
+    def _create(self, capacity):
+        descr = self._descr()
+        if HEADER_DTYPE.itemsize + len(descr) > HEADER_SIZE:
+            raise ValueError("Описание полей не помещается в заголовок")
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header['magic'] = MAGIC
+            header['version'] = VERSION
+            header['record_size'] = self.dtype.itemsize
+            header['count'] = 0
+            header['capacity'] = capacity
+            header['descr_size'] = len(descr)
+            f.write(header.tobytes())
+            f.write(descr)
+            f.truncate(HEADER_SIZE + capacity * self.dtype.itemsize)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._open()
+
+    def _open(self):
+        header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r+', offset=0, shape=(1,))
+        if bytes(header['magic'][0]) != MAGIC:
+            raise ValueError(f"{self.path}: неизвестный формат файла свечей")
+        descr_size = int(header['descr_size'][0])
+        with open(self.path, 'rb') as f:
+            f.seek(HEADER_DTYPE.itemsize)
+            descr = f.read(descr_size)
+        if descr != self._descr() or int(header['record_size'][0]) != self.dtype.itemsize:
+            raise ValueError(f"{self.path}: структура записей не совпадает с ожидаемой")
+        self._header = header
+        capacity = int(header['capacity'][0])
+        self._data = np.memmap(self.path, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+
+    def _grow(self, min_capacity):
+        capacity = int(self._header['capacity'][0])
+        while capacity < min_capacity:
+            capacity *= 2
+        self._data.flush()
+        self._data = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + capacity * self.dtype.itemsize)
+        self._header['capacity'] = capacity
+        self._header.flush()
+        self._data = np.memmap(self.path, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+
+    def _commit(self, count):
+        # Сначала данные на диск, затем счётчик — частично записанная свеча не станет видимой
+        self._data.flush()
+        self._header['count'] = count
+        self._header.flush()
+
+    def close(self):
+        if self._data is not None:
+            self._data.flush()
+        self._data = None
+        self._header = None
+
+    # ---------------------------------------------------------- запись
+
+    def __len__(self):
+        return int(self._header['count'][0])
+
+    def append(self, records):
+        """Дописывает свечи (структурированный массив или список кортежей) новее последней."""
+        records = np.asarray(records, dtype=self.dtype)
+        if records.ndim == 0:
+            records = records.reshape(1)
+        if len(records) == 0:
+            return 0
+        count = len(self)
+        if np.any(np.diff(records['time']) <= 0):
+            raise ValueError("Свечи должны идти строго по возрастанию времени")
+        if count and records['time'][0] <= self._data['time'][count - 1]:
+            raise ValueError("Свеча не новее последней сохранённой")
+        if count + len(records) > int(self._header['capacity'][0]):
+            self._grow(count + len(records))
+        self._data[count:count + len(records)] = records
+        self._commit(count + len(records))
+        return len(records)
+
+    def upsert_ohlc(self, times_ms, opens, highs, lows, closes):
+        """
+        Записывает OHLC: существующие свечи с тем же временем обновляются на месте
+        (индикаторы не трогаются), новые — дописываются. Возвращает (обновлено, добавлено, индекс первой изменённой).
+        """
+        times_ms = np.asarray(times_ms, dtype=np.int64)
+        order = np.argsort(times_ms, kind='stable')
+        times_ms = times_ms[order]
+        ohlc = [np.asarray(values, dtype=np.float64)[order] for values in (opens, highs, lows, closes)]
+        count = len(self)
+        last_time = self._data['time'][count - 1] if count else None
+        existing = times_ms <= last_time if last_time is not None else np.zeros(len(times_ms), dtype=bool)
+        first_changed = None
+        updated = 0
+        if existing.any():
+            stored_times = self._data['time'][:count]
+            positions = np.searchsorted(stored_times, times_ms[existing])
+            for pos, t, o, h, l, c in zip(positions, times_ms[existing], *(values[existing] for values in ohlc)):
+                if pos >= count or stored_times[pos] != t:
+                    continue  # Пропуски внутри истории заполняются через insert_ohlc
+                row = self._data[pos]
+                if (row['open'], row['high'], row['low'], row['close']) != (o, h, l, c):
+                    self._data[pos]['open'] = o
+                    self._data[pos]['high'] = h
+                    self._data[pos]['low'] = l
+                    self._data[pos]['close'] = c
+                    updated += 1
+                    first_changed = pos if first_changed is None else min(first_changed, pos)
+        new_mask = ~existing
+        added = 0
+        if new_mask.any():
+            records = np.zeros(int(new_mask.sum()), dtype=self.dtype)
+            for name in self.dtype.names:
+                if name != 'time':
+                    records[name] = np.nan
+            records['time'] = times_ms[new_mask]
+            records['open'], records['high'], records['low'], records['close'] = (values[new_mask] for values in ohlc)
+            added = self.append(records)
+            first_changed = count if first_changed is None else min(first_changed, count)
+        elif updated:
+            self._commit(count)
+        return updated, added, first_changed
+
+    def insert_ohlc(self, times_ms, opens, highs, lows, closes):
+        """
+        Вставляет отсутствующие свечи внутрь истории (заполнение пропусков).
+        Редкая операция: файл переписывается целиком во временный и атомарно заменяется.
+        Возвращает (вставлено, индекс первой вставленной) или (0, None).
+        """
+        times_ms = np.asarray(times_ms, dtype=np.int64)
+        current = self.view()
+        keep = ~np.isin(times_ms, current['time'])
+        if not keep.any():
+            return 0, None
+        records = np.zeros(int(keep.sum()), dtype=self.dtype)
+        for name in self.dtype.names:
+            if name != 'time':
+                records[name] = np.nan
+        records['time'] = times_ms[keep]
+        records['open'] = np.asarray(opens, dtype=np.float64)[keep]
+        records['high'] = np.asarray(highs, dtype=np.float64)[keep]
+        records['low'] = np.asarray(lows, dtype=np.float64)[keep]
+        records['close'] = np.asarray(closes, dtype=np.float64)[keep]
+        merged = np.concatenate([np.array(current), records])
+        merged = merged[np.argsort(merged['time'], kind='stable')]
+        first_inserted = int(np.searchsorted(merged['time'], records['time'].min()))
+        tmp_path = self.path.with_suffix(self.path.suffix + '.rebuild')
+        if tmp_path.exists():
+            tmp_path.unlink()
+        rebuilt = CandleStore(tmp_path, dtype=self.dtype, initial_capacity=max(int(self._header['capacity'][0]), len(merged)))
+        rebuilt.append(merged)
+        rebuilt.close()
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._open()
+        return len(records), first_inserted
+
+    def set_values(self, start, columns):
+        """Записывает столбцы (dict имя -> массив) начиная с индекса start."""
+        count = len(self)
+        for name, values in columns.items():
+            values = np.asarray(values)
+            if start + len(values) > count:
+                raise IndexError("Запись за пределами сохранённых свечей")
+            self._data[name][start:start + len(values)] = values
+        self._commit(count)
+
+    # ----------------------------------------------------------- чтение
+
+    def view(self):
+        """Все сохранённые свечи (представление без копирования)."""
+        return self._data[:len(self)]
+
+    def last(self, n):
+        """Последние n свечей (представление без копирования)."""
+        count = len(self)
+        return self._data[max(count - n, 0):count]
+
+    def slice(self, start_ms=None, end_ms=None):
+        """Свечи с временем в [start_ms, end_ms] (представление без копирования)."""
+        times = self._data['time'][:len(self)]
+        lo = 0 if start_ms is None else int(np.searchsorted(times, start_ms, side='left'))
+        hi = len(times) if end_ms is None else int(np.searchsorted(times, end_ms, side='right'))
+        return self._data[lo:hi]
+
+    def index_of(self, time_ms):
+        """Индекс свечи с заданным временем или None."""
+        times = self._data['time'][:len(self)]
+        pos = int(np.searchsorted(times, time_ms))
+        if pos < len(times) and times[pos] == time_ms:
+            return pos
+        return None
+
+    def last_time(self):
+        count = len(self)
+        return int(self._data['time'][count - 1]) if count else None
+
+    def find_gaps(self, step_ms):
+        """Пропуски в истории: список (начало, конец) отсутствующих диапазонов при шаге step_ms."""
+        times = self._data['time'][:len(self)]
+        if len(times) < 2:
+            return []
+        holes = np.flatnonzero(np.diff(times) > step_ms)
+        return [(int(times[i]) + step_ms, int(times[i + 1]) - step_ms) for i in holes]
@@ -0,0 +1,118 @@
+# j3_clock
+
+import time
+import threading
+import logging
+from datetime import datetime, timezone
+
+
+class ExchangeClock:
+    """
+    Локальные часы биржи Bybit.
+    Один раз синхронизируются с client.get_server_time() по схеме NTP (RTT и смещение),
+    затем отдают время из time.monotonic() плюс смещение без сетевых запросов.
+    Фоновый поток периодически пересинхронизирует часы и сообщает о дрейфе.
+    """
+
+    def __init__(self, client, resync_interval=900, samples=5, drift_alarm_ms=500, max_rtt_ms=2000, log=logging.info):
+        self.client = client
+        self.resync_interval = resync_interval  # Период пересинхронизации, сек
+        self.samples = samples  # Количество замеров за одну синхронизацию
+        self.drift_alarm_ms = drift_alarm_ms  # Порог дрейфа для предупреждения, мс
+        self.max_rtt_ms = max_rtt_ms  # Замеры с большим RTT отбрасываются
+        self.log = log
+        self._lock = threading.Lock()
+        # Якорь: время биржи (нс) в момент монотонных часов _anchor_mono_ns
+        self._anchor_server_ns = time.time_ns()
+        self._anchor_mono_ns = time.monotonic_ns()
+        self.offset_ms = 0.0  # Смещение времени биржи относительно локальных часов, мс
+        self.rtt_ms = None  # RTT лучшего замера последней синхронизации, мс
+        self.last_drift_ms = 0.0  # Дрейф, обнаруженный последней пересинхронизацией, мс
+        self.last_sync = None  # Монотонное время последней успешной синхронизации
+        self.synced = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        """Один замер: возвращает (rtt_ns, server_ns, wall_mid_ns, mono_mid_ns) или None."""
+        wall_0 = time.time_ns()
+        mono_0 = time.monotonic_ns()
+        response = self.client.get_server_time()
+        mono_1 = time.monotonic_ns()
+        wall_1 = time.time_ns()
+        if response.get('retCode') != 0:
+            raise ValueError(f"Ошибка API: {response.get('retMsg')}")
+        result = response['result']
+        if result.get('timeNano'):
+            server_ns = int(result['timeNano'])
+        else:
+            server_ns = int(result['timeSecond']) * 1_000_000_000
+        rtt_ns = mono_1 - mono_0
+        # Как в NTP: считаем, что биржа ответила в середине интервала запроса
+        return rtt_ns, server_ns, (wall_0 + wall_1) // 2, (mono_0 + mono_1) // 2
+
+    def sync(self):
+        """Синхронизирует часы с биржей. Возвращает True при успехе."""
+        best = None
+        for attempt in range(self.samples):
+            try:
+                sample = self._sample()
+            except Exception as e:
+                self.log(f"⚠️ Ошибка синхронизации времени с биржей (замер {attempt + 1}/{self.samples}): {e}")
+                continue
+            if sample[0] > self.max_rtt_ms * 1_000_000:
+                continue
+            if best is None or sample[0] < best[0]:
+                best = sample
+        if best is None:
+            self.log("⚠️ Не удалось синхронизировать время с биржей, используются локальные часы")
+            return False
+        rtt_ns, server_ns, wall_mid_ns, mono_mid_ns = best
+        with self._lock:
+            if self.synced:
+                # Сравниваем предсказание локальных часов с фактическим временем биржи
+                predicted_ns = self._anchor_server_ns + (mono_mid_ns - self._anchor_mono_ns)
+                self.last_drift_ms = (server_ns - predicted_ns) / 1_000_000
+            self._anchor_server_ns = server_ns
+            self._anchor_mono_ns = mono_mid_ns
+            self.offset_ms = (server_ns - wall_mid_ns) / 1_000_000
+            self.rtt_ms = rtt_ns / 1_000_000
+            self.last_sync = time.monotonic()
+            was_synced = self.synced
+            self.synced = True
+        if was_synced and abs(self.last_drift_ms) > self.drift_alarm_ms:
+            self.log(f"⚠️ Дрейф часов {self.last_drift_ms:+.0f} мс за {self.resync_interval} сек (порог {self.drift_alarm_ms} мс)")
+        return True
+
+    def now(self):
+        """Текущее время биржи (UTC) без сетевого запроса."""
+        with self._lock:
+            server_ns = self._anchor_server_ns + (time.monotonic_ns() - self._anchor_mono_ns)
+        return datetime.fromtimestamp(server_ns / 1_000_000_000, tz=timezone.utc)
+
+    def timestamp_ms(self):
+        """Текущее время биржи в миллисекундах."""
+        with self._lock:
+            server_ns = self._anchor_server_ns + (time.monotonic_ns() - self._anchor_mono_ns)
+        return server_ns // 1_000_000
+
+    def _resync_loop(self):
+        while not self._stop_event.wait(self.resync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.log(f"⚠️ Ошибка фоновой синхронизации времени: {e}")
+
+    def start(self):
+        """Запускает фоновую пересинхронизацию."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._resync_loop, name="exchange-clock", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
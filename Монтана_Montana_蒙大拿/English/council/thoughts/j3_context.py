@@ -0,0 +1,80 @@
+# j3_context
+
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from j3_indicators import INDICATOR_COLUMNS
+from j3_candle_store import indicator_field
+
+
+class SymbolContext:
+    """
+    Состояние стратегии одного линейного контракта: индикаторы последних двух закрытых свечей,
+    открытые сделки, журнал сделок, блокировки и объекты данных (хранилище свечей, синхронизатор,
+    автомат ордеров, срезы аккаунта). Соединения (HTTP, WebSocket), лимит запросов,
+    периоды рынка и индекс страха и жадности общие для всех контекстов процесса.
+    file_suffix — окончание имён файлов контекста: у первого символа оно совпадает с именем
+    скрипта, поэтому файлы прежней односимвольной версии подхватываются без переименования.
+    """
+
+    def __init__(self, symbol, file_suffix, allocation=100.0):
+        self.symbol = symbol
+        self.file_suffix = file_suffix
+        self.allocation = allocation  # Доля баланса (%), от которой считается объём входа
+        self.previous = dict.fromkeys(INDICATOR_COLUMNS)  # Колонка индикатора -> значение предпоследней свечи
+        self.current = dict.fromkeys(INDICATOR_COLUMNS)  # ... и последней закрытой свечи
+        self.market_type = None  # Тип рынка, по которому работает контекст (меняется при смене рынка)
+        self.active_trades = {}
+        self.current_trade_type = None
+        self.next_trade_id = 1
+        self.bull_long_trades_count = 0
+        self.journal = None  # Журнал сделок (TradeJournal)
+        self.csv_file = Path(f"trades_bybit_{file_suffix}.csv")  # Выгрузка журнала в CSV и перенос прежней истории
+        self.trades_lock = threading.RLock()  # Быстрые проверки и запись сделок
+        self.order_lock = threading.RLock()  # Один ордер контекста в работе одновременно
+        self.previous_mid_price = 0
+        self.last_price_indicator = ""
+        self.instrument = None  # Лимиты инструмента (get_instrument_info)
+        self.warmup = {}  # Подготовка к закрытию свечи: её время и выставленное заранее плечо
+        self.candle_close = None  # Закрытие свечи текущего цикла сигналов (для задержки до подтверждения ордера)
+        self.candle_store = None
+        self.kline_sync = None
+        self.order_executor = None
+        self.snapshot_provider = None
+        self.liquidation_guard = None
+
+    def __repr__(self):
+        return f"SymbolContext({self.symbol}, {self.market_type}, trades={len(self.active_trades)})"
+
+    @property
+    def pair(self):
+        """Символ для отчёта: BTCUSDT -> BTC/USDT."""
+        if self.symbol.endswith('USDT'):
+            return f"{self.symbol[:-4]}/USDT"
+        return self.symbol
+
+    def capital(self, balance):
+        """Часть общего баланса, выделенная символу."""
+        return balance * self.allocation / 100
+
+    def path(self, prefix, extension):
+        """Файл контекста: {prefix}_{file_suffix}.{extension}."""
+        return Path(f"{prefix}_{self.file_suffix}.{extension}")
+
+    def set_indicators(self, records, market_type):
+        """Значения индикаторов двух последних свечей из записей хранилища (или NaN, если свечей меньше двух)."""
+        for col in INDICATOR_COLUMNS:
+            if len(records) >= 2:
+                self.previous[col], self.current[col] = records[indicator_field(market_type, col)][-2:]
+            else:
+                self.previous[col] = self.current[col] = np.nan
+
+    def indicators_ready(self):
+        """True, если все индикаторы последней свечи посчитаны."""
+        return all(self.current[col] is not None for col in INDICATOR_COLUMNS)
+
+    def rule_indicators(self):
+        """Индикаторы в виде массивов [предыдущее, текущее] для CompiledRules.entry / exit."""
+        return {col: [self.previous[col], self.current[col]] for col in INDICATOR_COLUMNS}
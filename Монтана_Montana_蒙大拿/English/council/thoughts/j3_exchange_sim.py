@@ -0,0 +1,1189 @@
+# j3_exchange_sim
+
+import os
+import json
+import hmac
+import time
+import uuid
+import queue
+import random
+import socket
+import struct
+import base64
+import bisect
+import hashlib
+import logging
+import argparse
+import itertools
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import numpy as np
+
+
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+WEEK_START_MS = 4 * DAY_MS  # 1970-01-05 — понедельник: недельные свечи Bybit начинаются в понедельник 00:00 UTC
+KLINE_HOURS = {'60': 1, '120': 2, '240': 4, '360': 6, '720': 12, 'D': 24, 'W': 24 * 7}  # 'M' — календарный месяц
+MAX_RANGE_MS = 7 * DAY_MS  # Максимальный диапазон startTime..endTime истории исполнений и закрытых позиций
+
+# Параметры инструментов: начальная цена, шаг цены, шаг и минимум объёма
+INSTRUMENTS = {
+    'BTCUSDT': {'price': 60000.0, 'tick_size': 0.1, 'qty_step': 0.001, 'min_qty': 0.001, 'max_qty': 100.0},
+    'ETHUSDT': {'price': 3000.0, 'tick_size': 0.01, 'qty_step': 0.01, 'min_qty': 0.01, 'max_qty': 1000.0},
+}
+DEFAULT_INSTRUMENT = {'price': 100.0, 'tick_size': 0.001, 'qty_step': 0.1, 'min_qty': 0.1, 'max_qty': 100000.0}
+
+# Лимиты Bybit v5 на UID, запросов в секунду (retCode 10006 при превышении)
+RATE_LIMITS = {
+    '/v5/order/create': 10,
+    '/v5/position/set-leverage': 10,
+    '/v5/position/list': 50,
+    '/v5/account/wallet-balance': 50,
+    '/v5/position/closed-pnl': 50,
+    '/v5/execution/list': 50,
+}
+PUBLIC_RATE_LIMIT = 120  # Публичные эндпоинты: 600 запросов за 5 сек с одного IP (HTTP 403 при превышении)
+
+# (метод, путь) -> (обработчик, приватный эндпоинт)
+ROUTES = {
+    ('GET', '/v5/market/time'): ('_get_server_time', False),
+    ('GET', '/v5/market/kline'): ('_get_kline', False),
+    ('GET', '/v5/market/tickers'): ('_get_tickers', False),
+    ('GET', '/v5/market/instruments-info'): ('_get_instruments_info', False),
+    ('GET', '/v5/position/list'): ('_get_positions', True),
+    ('GET', '/v5/account/wallet-balance'): ('_get_wallet_balance', True),
+    ('GET', '/v5/position/closed-pnl'): ('_get_closed_pnl', True),
+    ('GET', '/v5/execution/list'): ('_get_executions', True),
+    ('POST', '/v5/order/create'): ('_place_order', True),
+    ('POST', '/v5/position/set-leverage'): ('_set_leverage', True),
+}
+WS_PUBLIC_PATH = '/v5/public/linear'
+WS_PRIVATE_PATH = '/v5/private'
+PRIVATE_TOPICS = ('position', 'wallet', 'execution')
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+class SimError(Exception):
+    """Ошибка запроса в формате Bybit: retCode и retMsg."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def _fmt(value, digits=8):
+    """Число в строку, как в ответах Bybit: без лишних нулей."""
+    text = f"{value:.{digits}f}".rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+def _digits(step):
+    return max(int(round(-np.log10(step))), 0)
+
+
+def _int(params, key, default=None):
+    value = params.get(key)
+    return default if value in (None, '') else int(value)
+
+
+def _bucket_start(times, interval):
+    """Время открытия свечи интервала interval для каждого времени (мс)."""
+    if interval == 'M':
+        return times.astype('datetime64[ms]').astype('datetime64[M]').astype('datetime64[ms]').astype(np.int64)
+    if interval == 'W':
+        return (times - WEEK_START_MS) // WEEK_MS * WEEK_MS + WEEK_START_MS
+    span = KLINE_HOURS[interval] * HOUR_MS
+    return times // span * span
+
+
+# ------------------------------------------------------------------ WebSocket: кадры RFC 6455
+
+def _mask(payload, key):
+    n = len(payload)
+    if n == 0:
+        return payload
+    repeated = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(n, 'big')
+
+
+def encode_frame(opcode, payload, mask=False):
+    """Один кадр WebSocket (FIN); клиент маскирует кадры, сервер — нет."""
+    n = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, mask_bit | n)
+    elif n < 65536:
+        head = struct.pack('!BBH', 0x80 | opcode, mask_bit | 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, mask_bit | 127, n)
+    if mask:
+        key = os.urandom(4)
+        return head + key + _mask(payload, key)
+    return head + payload
+
+
+def read_frame(stream):
+    """Читает кадр из потока; (None, None) при закрытии соединения. Фрагментация не поддерживается."""
+    head = stream.read(2)
+    if len(head) < 2:
+        return None, None
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', stream.read(8))[0]
+    key = stream.read(4) if head[1] & 0x80 else None
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None, None
+    return opcode, _mask(payload, key) if key else payload
+
+
+class _TokenBucket:
+    """Лимит rate запросов в секунду с запасом на одну секунду."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def headers(self, now_ms):
+        """Заголовки лимита Bybit: X-Bapi-Limit-Reset-Timestamp читает pybit при retCode 10006."""
+        wait_ms = 0 if self.tokens >= 1 else int((1 - self.tokens) / self.rate * 1000) + 1
+        return {
+            'X-Bapi-Limit': str(int(self.rate)),
+            'X-Bapi-Limit-Status': str(int(self.tokens)),
+            'X-Bapi-Limit-Reset-Timestamp': str(now_ms + wait_ms),
+        }
+
+
+class _Market:
+    """Цена символа: часовые свечи истории (геометрическое броуновское движение) и текущий час, обновляемый тиками."""
+
+    def __init__(self, symbol, spec, now_ms, history_days, volatility, rng):
+        self.symbol = symbol
+        self.spec = spec
+        self.volatility = volatility  # Стандартное отклонение часовой доходности
+        self.digits = _digits(spec['tick_size'])
+        current_hour = now_ms // HOUR_MS * HOUR_MS
+        n = history_days * 24 + 1
+        # Путь строится так, чтобы текущая цена совпала с начальной ценой инструмента
+        path = np.cumsum(rng.normal(0.0, volatility, n))
+        closes = spec['price'] * np.exp(path - path[-1])
+        opens = np.r_[closes[0], closes[:-1]]
+        wicks = np.abs(rng.normal(0.0, volatility / 2, (2, n)))
+        self.times = current_hour - (n - 1 - np.arange(n, dtype=np.int64)) * HOUR_MS
+        self.ohlcv = np.column_stack([
+            opens, np.maximum(opens, closes) * (1 + wicks[0]), np.minimum(opens, closes) * (1 - wicks[1]),
+            closes, rng.lognormal(3.0, 1.0, n),
+        ])
+        self.n = n
+        self.price = round(float(opens[-1]), self.digits)
+        self.ohlcv[n - 1] = [self.price, self.price, self.price, self.price, 0.0]
+        self.prev_price_24h = float(self.ohlcv[max(n - 25, 0), 3])
+
+    def _append_hour(self, hour_ms):
+        if self.n == len(self.times):
+            self.times = np.concatenate([self.times, np.zeros(24 * 30, np.int64)])
+            self.ohlcv = np.concatenate([self.ohlcv, np.zeros((24 * 30, 5))])
+        self.times[self.n] = hour_ms
+        self.ohlcv[self.n] = [self.price, self.price, self.price, self.price, 0.0]
+        self.n += 1
+        self.prev_price_24h = float(self.ohlcv[max(self.n - 25, 0), 3])
+
+    def tick(self, now_ms, dt, rng):
+        """Новая цена через dt сек; часы без тиков заполняются последней ценой."""
+        current_hour = now_ms // HOUR_MS * HOUR_MS
+        while self.times[self.n - 1] < current_hour:
+            self._append_hour(int(self.times[self.n - 1]) + HOUR_MS)
+        step = rng.normal(0.0, self.volatility * np.sqrt(max(dt, 0.0) / 3600))
+        self.price = max(round(self.price * float(np.exp(step)), self.digits), self.spec['tick_size'])
+        row = self.ohlcv[self.n - 1]
+        row[1] = max(row[1], self.price)
+        row[2] = min(row[2], self.price)
+        row[3] = self.price
+        row[4] += float(rng.exponential(1.0))
+
+    def klines(self, interval, start_ms, end_ms, limit):
+        """Свечи с временем открытия в [start_ms, end_ms], не больше limit, новые первыми (как get_kline)."""
+        if interval not in KLINE_HOURS and interval != 'M':
+            raise SimError(10001, f"Invalid interval {interval}: симулятор поддерживает интервалы от 60 минут")
+        span = KLINE_HOURS[interval] * HOUR_MS if interval != 'M' else 31 * DAY_MS
+        times = self.times[:self.n]
+        end_ms = int(times[-1]) if end_ms is None else end_ms
+        if start_ms is None:
+            start_ms = end_ms - limit * span
+        first = int(_bucket_start(np.array([start_ms], dtype=np.int64), interval)[0])
+        lo = np.searchsorted(times, first)
+        hi = np.searchsorted(times, end_ms + span, side='right')
+        if lo >= hi:
+            return []
+        times = times[lo:hi]
+        rows = self.ohlcv[lo:hi]
+        keys = _bucket_start(times, interval)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)] - 1
+        candles = np.column_stack([
+            rows[starts, 0], np.maximum.reduceat(rows[:, 1], starts), np.minimum.reduceat(rows[:, 2], starts),
+            rows[ends, 3], np.add.reduceat(rows[:, 4], starts),
+        ])
+        keys = keys[starts]
+        selected = np.flatnonzero((keys >= start_ms) & (keys <= end_ms))[-limit:][::-1]
+        return [
+            [str(int(keys[i])), _fmt(candles[i, 0], self.digits), _fmt(candles[i, 1], self.digits),
+             _fmt(candles[i, 2], self.digits), _fmt(candles[i, 3], self.digits), _fmt(candles[i, 4], 3),
+             _fmt(candles[i, 4] * candles[i, 3], 4)]
+            for i in selected
+        ]
+
+    def ticker(self):
+        tick_size = self.spec['tick_size']
+        return {
+            'symbol': self.symbol,
+            'lastPrice': _fmt(self.price, self.digits),
+            'markPrice': _fmt(self.price, self.digits),
+            'indexPrice': _fmt(self.price, self.digits),
+            'bid1Price': _fmt(self.price - tick_size, self.digits),
+            'ask1Price': _fmt(self.price + tick_size, self.digits),
+        }
+
+
+class _WsConnection:
+    """Соединение WebSocket на стороне сервера: подписки и очередь отправки с задержкой delay сек."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, sock, private, delay=0.0):
+        self.sock = sock
+        self.private = private
+        self.delay = delay
+        self.id = f"sim-{next(self._ids)}"
+        self.topics = set()
+        self.authorized = False
+        self.closed = False
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._writer, name=f'ws-{self.id}', daemon=True)
+        self._thread.start()
+
+    def send(self, message, opcode=WS_TEXT):
+        payload = message if isinstance(message, bytes) else json.dumps(message, separators=(',', ':')).encode()
+        self._queue.put((time.monotonic() + self.delay, opcode, payload))
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            due, opcode, payload = item
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.sock.sendall(encode_frame(opcode, payload))
+            except OSError:
+                self.closed = True
+                return
+
+    def close(self):
+        self.closed = True
+        self._queue.put(None)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive: pybit держит одно соединение в requests.Session
+    disable_nagle_algorithm = True  # Заголовки и тело уходят отдельными записями; без TCP_NODELAY — паузы ~40 мс
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path in (WS_PUBLIC_PATH, WS_PRIVATE_PATH) and self.headers.get('Upgrade', '').lower() == 'websocket':
+            self.server.simulator.serve_websocket(self, private=path == WS_PRIVATE_PATH)
+            return
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        split = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, payload = self.server.simulator.handle(
+            method, split.path, split.query, body, self.headers, self.client_address[0])
+        data = json.dumps(payload, separators=(',', ':')).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Журнал запросов не нужен при тысячах запросов в секунду
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ExchangeSimulator:
+    """
+    Локальная биржа Bybit v5 (linear, USDT, изолированная маржа) для нагрузочных тестов без сети.
+    REST — эндпоинты pybit HTTP: get_server_time, get_kline, get_tickers, get_instruments_info,
+    get_positions, get_wallet_balance, get_closed_pnl, get_executions, place_order (рыночные ордера)
+    и set_leverage; ответы в формате Bybit (строковые числа, retCode/retMsg, курсоры страниц).
+    WebSocket на том же порту: /v5/public/linear (tickers.{symbol}) и /v5/private (position, wallet, execution).
+    Настройки нагрузки: задержка ответа latency + jitter сек (path_latency — по путям), доля ошибок error_rate
+    (поровну HTTP 503 и retCode 10016), лимиты RATE_LIMITS × rate_scale (0 — без лимитов), задержка
+    сообщений WebSocket ws_delay. Подпись HMAC проверяется, если задан api_secret.
+    """
+
+    def __init__(self, symbols=('BTCUSDT',), balance=10000.0, latency=0.0, jitter=0.0, path_latency=None,
+                 error_rate=0.0, rate_scale=1.0, ws_delay=0.0, tick_interval=0.5, volatility=0.006,
+                 history_days=1500, fee_rate=0.00055, mmr=0.005, max_leverage=100.0, api_key=None,
+                 api_secret=None, clock_offset_ms=0, seed=1, log=logging.info):
+        self.latency = latency
+        self.jitter = jitter
+        self.path_latency = dict(path_latency or {})
+        self.error_rate = error_rate
+        self.rate_scale = rate_scale
+        self.ws_delay = ws_delay
+        self.tick_interval = tick_interval
+        self.fee_rate = fee_rate  # Комиссия тейкера
+        self.mmr = mmr  # Ставка поддерживающей маржи
+        self.max_leverage = max_leverage
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.clock_offset_ms = clock_offset_ms  # Сдвиг часов биржи относительно локальных (проверка ExchangeClock)
+        self.log = log
+        self._rng = np.random.default_rng(seed)
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        now_ms = self.now_ms()
+        self.markets = {symbol: _Market(symbol, INSTRUMENTS.get(symbol, DEFAULT_INSTRUMENT), now_ms,
+                                        history_days, volatility, self._rng)
+                        for symbol in symbols}
+        self.wallet = float(balance)  # walletBalance USDT
+        self.cum_realised = 0.0
+        self.positions = {symbol: self._empty_position(now_ms) for symbol in symbols}
+        self.executions = []  # Исполнения по возрастанию execTime
+        self._execution_times = []
+        self._executions_by_order = {}
+        self.closed_pnl = []  # Закрытые позиции по возрастанию updatedTime
+        self._closed_times = []
+        self._buckets = {}
+        self._limit_lock = threading.Lock()
+        self._ws_lock = threading.Lock()
+        self._ws_connections = set()
+        self._seq = itertools.count(1)
+        self._stats_lock = threading.Lock()
+        self.requests = Counter()  # Запросы по путям
+        self.rate_limited = 0
+        self.injected_errors = 0
+        self.liquidations = 0
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+        self.endpoint = None
+
+    def now_ms(self):
+        return int(time.time() * 1000) + self.clock_offset_ms
+
+    # ------------------------------------------------------------------ запуск
+
+    def serve(self, host='127.0.0.1', port=0):
+        """Запускает HTTP/WebSocket сервер и поток тиков; endpoint — адрес для client.endpoint."""
+        self._server = _Server((host, port), _Handler)
+        self._server.simulator = self
+        self.endpoint = f"http://{host}:{self._server.server_address[1]}"
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name='exchange-sim-http', daemon=True),
+            threading.Thread(target=self._run_ticks, name='exchange-sim-ticks', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.log(f"🧪 Симулятор Bybit: {self.endpoint} ({', '.join(self.markets)})")
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        with self._ws_lock:
+            connections = list(self._ws_connections)
+        for conn in connections:
+            conn.close()
+
+    def _run_ticks(self):
+        last = time.monotonic()
+        while not self._stop.wait(self.tick_interval):
+            now = time.monotonic()
+            self.tick(now - last)
+            last = now
+
+    def tick(self, dt):
+        """Сдвигает цены на dt сек, проверяет ликвидации и рассылает тикеры."""
+        with self._lock:
+            now_ms = self.now_ms()
+            for symbol, market in self.markets.items():
+                market.tick(now_ms, dt, self._rng)
+                self._check_liquidation(symbol, now_ms)
+                self._publish(f'tickers.{symbol}', {
+                    'topic': f'tickers.{symbol}', 'type': 'delta', 'data': market.ticker(),
+                    'cs': next(self._seq), 'ts': now_ms,
+                })
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'requests': dict(self.requests), 'rate_limited': self.rate_limited,
+                'injected_errors': self.injected_errors, 'liquidations': self.liquidations,
+                'ws_connections': len(self._ws_connections),
+            }
+
+    # ------------------------------------------------------------------ REST
+
+    def _envelope(self, code, message, result=None):
+        return {'retCode': code, 'retMsg': message, 'result': result if result is not None else {},
+                'retExtInfo': {}, 'time': self.now_ms()}
+
+    def _bucket(self, key, rate):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _TokenBucket(rate)
+        return bucket
+
+    def handle(self, method, path, query, body, headers, client_ip='127.0.0.1'):
+        """Один запрос REST: (HTTP статус, заголовки, JSON-ответ или None)."""
+        route = ROUTES.get((method, path))
+        if route is None:
+            return 404, {}, None
+        name, private = route
+        with self._stats_lock:
+            self.requests[path] += 1
+        delay = self.path_latency.get(path, self.latency)
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        extra_headers = {}
+        if self.rate_scale > 0:
+            with self._limit_lock:
+                if private:
+                    bucket = self._bucket((headers.get('X-BAPI-API-KEY', ''), path), RATE_LIMITS[path] * self.rate_scale)
+                else:
+                    bucket = self._bucket((client_ip, 'public'), PUBLIC_RATE_LIMIT * self.rate_scale)
+                allowed = bucket.take(time.monotonic())
+                if private:
+                    extra_headers = bucket.headers(self.now_ms())
+            if not allowed:
+                with self._stats_lock:
+                    self.rate_limited += 1
+                if not private:
+                    return 403, {}, None
+                return 200, extra_headers, self._envelope(10006, 'Too many visits!')
+        if self.error_rate and self._random.random() < self.error_rate:
+            with self._stats_lock:
+                self.injected_errors += 1
+            if self._random.random() < 0.5:
+                return 503, {}, None
+            return 200, extra_headers, self._envelope(10016, 'Server error.')
+        try:
+            if method == 'GET':
+                params = dict(parse_qsl(query))
+                payload = query
+            else:
+                payload = body.decode()
+                params = json.loads(payload) if payload else {}
+            if private:
+                self._authenticate(headers, payload)
+            with self._lock:
+                result = getattr(self, name)(params)
+            return 200, extra_headers, self._envelope(0, 'OK', result)
+        except SimError as e:
+            return 200, extra_headers, self._envelope(e.code, str(e))
+        except (ValueError, TypeError, KeyError) as e:
+            return 200, extra_headers, self._envelope(10001, f"params error: {e}")
+
+    def _authenticate(self, headers, payload):
+        api_key = headers.get('X-BAPI-API-KEY')
+        if not api_key or (self.api_key is not None and api_key != self.api_key):
+            raise SimError(10003, 'API key is invalid.')
+        if self.api_secret is None:
+            return
+        timestamp = headers.get('X-BAPI-TIMESTAMP', '')
+        recv_window = headers.get('X-BAPI-RECV-WINDOW', '5000')
+        now_ms = self.now_ms()
+        if not timestamp.isdigit() or not now_ms - int(recv_window) <= int(timestamp) < now_ms + 1000:
+            raise SimError(10002, 'invalid request, please check your server timestamp or recv_window param')
+        expected = hmac.new(self.api_secret.encode(), f"{timestamp}{api_key}{recv_window}{payload}".encode(),
+                            hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, headers.get('X-BAPI-SIGN', '')):
+            raise SimError(10004, 'error sign! origin_string[...]')
+
+    def _market(self, params):
+        if params.get('category', 'linear') != 'linear':
+            raise SimError(10001, 'params error: category only support linear')
+        market = self.markets.get(params.get('symbol'))
+        if market is None:
+            raise SimError(10001, f"params error: symbol invalid {params.get('symbol')}")
+        return market
+
+    def _get_server_time(self, params):
+        now_ns = time.time_ns() + self.clock_offset_ms * 1_000_000
+        return {'timeSecond': str(now_ns // 1_000_000_000), 'timeNano': str(now_ns)}
+
+    def _get_kline(self, params):
+        market = self._market(params)
+        limit = min(max(_int(params, 'limit', 200), 1), 1000)
+        candles = market.klines(str(params['interval']), _int(params, 'start'), _int(params, 'end'), limit)
+        return {'category': 'linear', 'symbol': market.symbol, 'list': candles}
+
+    def _get_tickers(self, params):
+        markets = [self._market(params)] if params.get('symbol') else list(self.markets.values())
+        now_ms = self.now_ms()
+        rows = []
+        for market in markets:
+            row = market.ticker()
+            row.update({
+                'prevPrice24h': _fmt(market.prev_price_24h, market.digits),
+                'price24hPcnt': _fmt(market.price / market.prev_price_24h - 1, 6),
+                'fundingRate': '0.0001',
+                'nextFundingTime': str((now_ms // (8 * HOUR_MS) + 1) * 8 * HOUR_MS),
+            })
+            rows.append(row)
+        return {'category': 'linear', 'list': rows}
+
+    def _get_instruments_info(self, params):
+        markets = [self._market(params)] if params.get('symbol') else list(self.markets.values())
+        rows = []
+        for market in markets:
+            spec = market.spec
+            rows.append({
+                'symbol': market.symbol, 'contractType': 'LinearPerpetual', 'status': 'Trading',
+                'baseCoin': market.symbol[:-4], 'quoteCoin': 'USDT', 'settleCoin': 'USDT',
+                'priceScale': str(market.digits),
+                'leverageFilter': {'minLeverage': '1', 'maxLeverage': _fmt(self.max_leverage, 2), 'leverageStep': '0.01'},
+                'priceFilter': {'minPrice': _fmt(spec['tick_size']), 'maxPrice': '1999999.8', 'tickSize': _fmt(spec['tick_size'])},
+                'lotSizeFilter': {'maxOrderQty': _fmt(spec['max_qty']), 'maxMktOrderQty': _fmt(spec['max_qty']),
+                                  'minOrderQty': _fmt(spec['min_qty']), 'qtyStep': _fmt(spec['qty_step']),
+                                  'postOnlyMaxOrderQty': _fmt(spec['max_qty']), 'minNotionalValue': '5'},
+                'fundingInterval': 480,
+            })
+        return {'category': 'linear', 'list': rows, 'nextPageCursor': ''}
+
+    # ------------------------------------------------------------------ позиции и кошелёк
+
+    def _empty_position(self, now_ms):
+        return {'side': '', 'size': 0.0, 'entry': 0.0, 'leverage': 10.0, 'open_fee': 0.0,
+                'cur_realised': 0.0, 'cum_realised': 0.0, 'created': now_ms, 'updated': now_ms}
+
+    def _liq_price(self, position):
+        entry, leverage = position['entry'], position['leverage']
+        if position['side'] == 'Buy':
+            return entry * (1 - 1 / leverage + self.mmr)
+        return entry * (1 + 1 / leverage - self.mmr)
+
+    def _unrealised(self, symbol):
+        position = self.positions[symbol]
+        if position['size'] <= 0:
+            return 0.0
+        sign = 1.0 if position['side'] == 'Buy' else -1.0
+        return sign * (self.markets[symbol].price - position['entry']) * position['size']
+
+    def _initial_margin(self, symbol):
+        position = self.positions[symbol]
+        return position['size'] * position['entry'] / position['leverage'] if position['size'] > 0 else 0.0
+
+    def _available(self):
+        return self.wallet - sum(self._initial_margin(symbol) for symbol in self.positions)
+
+    def _position_row(self, symbol, stream=False):
+        position = self.positions[symbol]
+        market = self.markets[symbol]
+        size = position['size']
+        qty_digits = _digits(market.spec['qty_step'])
+        entry = _fmt(position['entry'], market.digits) if size > 0 else '0'
+        row = {
+            'positionIdx': 0, 'riskId': 1, 'riskLimitValue': '2000000', 'symbol': symbol,
+            'side': position['side'], 'size': _fmt(size, qty_digits),
+            'positionValue': _fmt(size * position['entry'], 4), 'tradeMode': 0, 'autoAddMargin': 0,
+            'positionStatus': 'Normal', 'leverage': _fmt(position['leverage'], 2),
+            'markPrice': _fmt(market.price, market.digits),
+            'liqPrice': _fmt(self._liq_price(position), market.digits) if size > 0 else '',
+            'positionIM': _fmt(self._initial_margin(symbol), 8),
+            'positionMM': _fmt(size * position['entry'] * self.mmr, 8),
+            'positionBalance': _fmt(self._initial_margin(symbol), 8),
+            'takeProfit': '0', 'stopLoss': '0', 'trailingStop': '0',
+            'unrealisedPnl': _fmt(self._unrealised(symbol), 8),
+            'curRealisedPnl': _fmt(position['cur_realised'], 8), 'cumRealisedPnl': _fmt(position['cum_realised'], 8),
+            'createdTime': str(position['created']), 'updatedTime': str(position['updated']),
+        }
+        if stream:
+            row['category'] = 'linear'
+            row['entryPrice'] = entry  # В потоке position цена входа называется entryPrice
+        else:
+            row['avgPrice'] = entry
+        return row
+
+    def _wallet_row(self):
+        upnl = sum(self._unrealised(symbol) for symbol in self.positions)
+        initial_margin = sum(self._initial_margin(symbol) for symbol in self.positions)
+        equity = self.wallet + upnl
+        coin = {
+            'coin': 'USDT', 'walletBalance': _fmt(self.wallet), 'equity': _fmt(equity), 'usdValue': _fmt(equity),
+            'unrealisedPnl': _fmt(upnl), 'cumRealisedPnl': _fmt(self.cum_realised),
+            'availableToWithdraw': _fmt(max(self.wallet - initial_margin, 0.0)),
+            'totalPositionIM': _fmt(initial_margin), 'totalOrderIM': '0', 'locked': '0', 'bonus': '0',
+            'borrowAmount': '0', 'accruedInterest': '0', 'marginCollateral': True, 'collateralSwitch': True,
+        }
+        return {
+            'accountType': 'UNIFIED', 'totalEquity': _fmt(equity), 'totalWalletBalance': _fmt(self.wallet),
+            'totalMarginBalance': _fmt(equity), 'totalAvailableBalance': _fmt(max(equity - initial_margin, 0.0)),
+            'totalPerpUPL': _fmt(upnl), 'totalInitialMargin': _fmt(initial_margin), 'accountLTV': '0',
+            'coin': [coin],
+        }
+
+    def _get_positions(self, params):
+        if params.get('symbol'):
+            symbols = [self._market(params).symbol]
+        elif params.get('settleCoin') == 'USDT':
+            symbols = [symbol for symbol, position in self.positions.items() if position['size'] > 0]
+        else:
+            raise SimError(10001, 'params error: symbol or settleCoin is required')
+        return {'category': 'linear', 'list': [self._position_row(symbol) for symbol in symbols], 'nextPageCursor': ''}
+
+    def _get_wallet_balance(self, params):
+        if params.get('accountType') != 'UNIFIED':
+            raise SimError(10001, 'accountType only support UNIFIED.')
+        return {'list': [self._wallet_row()]}
+
+    # ------------------------------------------------------------------ ордера
+
+    def _execution_row(self, symbol, order_id, link_id, side, price, qty, fee, closed, exec_type, exec_ms):
+        market = self.markets[symbol]
+        qty_digits = _digits(market.spec['qty_step'])
+        return {
+            'symbol': symbol, 'category': 'linear', 'orderId': order_id, 'orderLinkId': link_id or '',
+            'side': side, 'orderPrice': _fmt(price, market.digits), 'orderQty': _fmt(qty, qty_digits),
+            'orderType': 'Market', 'execId': str(uuid.uuid4()), 'execPrice': _fmt(price, market.digits),
+            'execQty': _fmt(qty, qty_digits), 'execValue': _fmt(price * qty, 8), 'execFee': _fmt(fee, 8),
+            'feeRate': _fmt(self.fee_rate, 6), 'execType': exec_type, 'execTime': str(exec_ms),
+            'leavesQty': '0', 'closedSize': _fmt(closed, qty_digits), 'isMaker': False,
+        }
+
+    def _closed_pnl_row(self, symbol, order_id, side, qty, entry, price, pnl, leverage, created_ms, exec_ms, exec_type):
+        market = self.markets[symbol]
+        qty_digits = _digits(market.spec['qty_step'])
+        return {
+            'symbol': symbol, 'orderId': order_id, 'side': side, 'qty': _fmt(qty, qty_digits),
+            'orderPrice': _fmt(price, market.digits), 'orderType': 'Market', 'execType': exec_type,
+            'closedSize': _fmt(qty, qty_digits), 'cumEntryValue': _fmt(entry * qty, 8),
+            'avgEntryPrice': _fmt(entry, market.digits), 'cumExitValue': _fmt(price * qty, 8),
+            'avgExitPrice': _fmt(price, market.digits), 'closedPnl': _fmt(pnl, 8), 'fillCount': '1',
+            'leverage': _fmt(leverage, 2), 'createdTime': str(created_ms), 'updatedTime': str(exec_ms),
+        }
+
+    def _record_execution(self, row):
+        index = bisect.bisect_right(self._execution_times, int(row['execTime']))
+        self._execution_times.insert(index, int(row['execTime']))
+        self.executions.insert(index, row)
+        self._executions_by_order.setdefault(row['orderId'], []).append(row)
+
+    def _record_closed_pnl(self, row):
+        index = bisect.bisect_right(self._closed_times, int(row['updatedTime']))
+        self._closed_times.insert(index, int(row['updatedTime']))
+        self.closed_pnl.insert(index, row)
+
+    def _fill(self, symbol, side, qty, price, order_id, link_id='', exec_type='Trade', fee_rate=None):
+        """Исполняет qty по price: закрывает противоположную позицию (реализуя PnL), остаток открывает или доливает."""
+        position = self.positions[symbol]
+        now_ms = self.now_ms()
+        fee = qty * price * (self.fee_rate if fee_rate is None else fee_rate)
+        self.wallet -= fee
+        closed = 0.0
+        if position['size'] > 0 and position['side'] != side:
+            closed = min(qty, position['size'])
+            sign = 1.0 if position['side'] == 'Buy' else -1.0
+            pnl = sign * (price - position['entry']) * closed
+            open_fee = position['open_fee'] * closed / position['size']
+            net_pnl = pnl - fee * closed / qty - open_fee
+            self.wallet += pnl
+            self.cum_realised += net_pnl
+            position['open_fee'] -= open_fee
+            position['cur_realised'] += pnl - fee * closed / qty
+            position['cum_realised'] += pnl - fee * closed / qty
+            self._record_closed_pnl(self._closed_pnl_row(
+                symbol, order_id, side, closed, position['entry'], price, net_pnl, position['leverage'],
+                position['created'], now_ms, exec_type))
+            position['size'] = round(position['size'] - closed, 10)
+            if position['size'] <= 0:
+                position.update(side='', size=0.0, entry=0.0, open_fee=0.0, cur_realised=0.0)
+        opened = round(qty - closed, 10)
+        if opened > 0:
+            if position['size'] <= 0:
+                position.update(side=side, size=opened, entry=price, created=now_ms, cur_realised=-fee * opened / qty)
+            else:
+                size = position['size'] + opened
+                position['entry'] = (position['entry'] * position['size'] + price * opened) / size
+                position['size'] = size
+                position['cur_realised'] -= fee * opened / qty
+            position['open_fee'] += fee * opened / qty
+            position['cum_realised'] -= fee * opened / qty
+        position['updated'] = now_ms
+        row = self._execution_row(symbol, order_id, link_id, side, price, qty, fee, closed, exec_type, now_ms)
+        self._record_execution(row)
+        self._publish_private('execution', [row])
+        self._publish_private('position', [self._position_row(symbol, stream=True)])
+        self._publish_private('wallet', [self._wallet_row()])
+
+    def _place_order(self, params):
+        market = self._market(params)
+        symbol = market.symbol
+        link_id = params.get('orderLinkId', '')
+        if link_id and any(row['orderLinkId'] == link_id for row in self.executions):
+            raise SimError(110072, 'OrderLinkedID is duplicate')
+        side = params.get('side')
+        if side not in ('Buy', 'Sell'):
+            raise SimError(10001, 'params error: side invalid')
+        if params.get('orderType', 'Market') != 'Market':
+            raise SimError(10001, 'params error: симулятор исполняет только рыночные ордера')
+        qty = float(params['qty'])
+        spec = market.spec
+        steps = qty / spec['qty_step']
+        if qty < spec['min_qty'] or abs(steps - round(steps)) > 1e-6 or qty > spec['max_qty']:
+            raise SimError(10001, f"Qty invalid: min {_fmt(spec['min_qty'])}, step {_fmt(spec['qty_step'])}")
+        position = self.positions[symbol]
+        reduce_only = params.get('reduceOnly') in (True, 'true', 'True')
+        if reduce_only:
+            if position['size'] <= 0 or position['side'] == side:
+                raise SimError(110017, 'Reduce-only rule not satisfied')
+            qty = min(qty, position['size'])
+        # Цена исполнения — лучшая цена стакана: ask для покупки, bid для продажи
+        price = market.price + spec['tick_size'] if side == 'Buy' else market.price - spec['tick_size']
+        opened = qty - min(qty, position['size']) if position['size'] > 0 and position['side'] != side else qty
+        if opened > 0 and opened * price / position['leverage'] + qty * price * self.fee_rate > self._available():
+            raise SimError(110007, 'ab not enough for new order')
+        order_id = str(uuid.uuid4())
+        self._fill(symbol, side, qty, price, order_id, link_id)
+        return {'orderId': order_id, 'orderLinkId': link_id}
+
+    def _set_leverage(self, params):
+        market = self._market(params)
+        symbol = market.symbol
+        buy, sell = float(params['buyLeverage']), float(params['sellLeverage'])
+        if buy != sell:
+            raise SimError(10001, 'params error: buy leverage must equal sell leverage in one-way mode')
+        if not 1.0 <= buy <= self.max_leverage:
+            raise SimError(10001, f"params error: leverage must be in [1, {_fmt(self.max_leverage)}]")
+        position = self.positions[symbol]
+        if abs(position['leverage'] - buy) < 1e-9:
+            raise SimError(110043, 'Set leverage not modified')
+        if position['size'] > 0:
+            extra = position['size'] * position['entry'] * (1 / buy - 1 / position['leverage'])
+            if extra > self._available():
+                raise SimError(110012, 'Insufficient available balance')
+        position['leverage'] = buy
+        position['updated'] = self.now_ms()
+        self._publish_private('position', [self._position_row(symbol, stream=True)])
+        self._publish_private('wallet', [self._wallet_row()])
+        return {}
+
+    def _check_liquidation(self, symbol, now_ms):
+        position = self.positions[symbol]
+        if position['size'] <= 0:
+            return
+        price = self.markets[symbol].price
+        liq_price = self._liq_price(position)
+        if (position['side'] == 'Buy' and price > liq_price) or (position['side'] == 'Sell' and price < liq_price):
+            return
+        # Ликвидация по цене ликвидации; поддерживающая маржа уходит в страховой фонд
+        maintenance = position['size'] * position['entry'] * self.mmr
+        side = 'Sell' if position['side'] == 'Buy' else 'Buy'
+        self._fill(symbol, side, position['size'], liq_price, str(uuid.uuid4()), exec_type='BustTrade', fee_rate=0.0)
+        self.wallet -= maintenance
+        self.cum_realised -= maintenance
+        with self._stats_lock:
+            self.liquidations += 1
+        self.log(f"💥 Симулятор: ликвидация {symbol} по {liq_price:.2f}")
+
+    # ------------------------------------------------------------------ история
+
+    def _time_range(self, params):
+        start, end = _int(params, 'startTime'), _int(params, 'endTime')
+        if start is None and end is None:
+            end = self.now_ms()
+        if start is None:
+            start = end - MAX_RANGE_MS
+        elif end is None:
+            end = start + MAX_RANGE_MS
+        if end - start > MAX_RANGE_MS:
+            raise SimError(10001, 'The time range between startTime and endTime cannot exceed 7 days.')
+        return start, end
+
+    @staticmethod
+    def _page(rows, params, limit_max):
+        """Страница списка (новые первыми) по cursor — смещению; лимит сверх максимума ограничивается."""
+        limit = min(max(_int(params, 'limit', 50), 1), limit_max)
+        offset = int(params.get('cursor') or 0)
+        page = rows[offset:offset + limit]
+        cursor = str(offset + limit) if offset + limit < len(rows) else ''
+        return page, cursor
+
+    def _get_executions(self, params):
+        symbol = params.get('symbol')
+        if params.get('orderId') or params.get('orderLinkId'):
+            if params.get('orderId'):
+                rows = list(self._executions_by_order.get(params['orderId'], []))
+            else:
+                rows = [row for row in self.executions if row['orderLinkId'] == params['orderLinkId']]
+            rows.reverse()
+        else:
+            start, end = self._time_range(params)
+            lo = bisect.bisect_left(self._execution_times, start)
+            hi = bisect.bisect_right(self._execution_times, end)
+            rows = self.executions[lo:hi][::-1]
+        if symbol:
+            rows = [row for row in rows if row['symbol'] == symbol]
+        page, cursor = self._page(rows, params, 100)
+        return {'category': 'linear', 'list': page, 'nextPageCursor': cursor}
+
+    def _get_closed_pnl(self, params):
+        start, end = self._time_range(params)
+        lo = bisect.bisect_left(self._closed_times, start)
+        hi = bisect.bisect_right(self._closed_times, end)
+        rows = self.closed_pnl[lo:hi][::-1]
+        if params.get('symbol'):
+            rows = [row for row in rows if row['symbol'] == params['symbol']]
+        page, cursor = self._page(rows, params, 100)
+        return {'category': 'linear', 'list': page, 'nextPageCursor': cursor}
+
+    def seed_trades(self, count, max_hold_hours=72):
+        """Случайные завершённые сделки по истории цен: исполнения и закрытые позиции для save_stat."""
+        with self._lock:
+            symbols = list(self.markets)
+            for _ in range(count):
+                market = self.markets[symbols[int(self._rng.integers(len(symbols)))]]
+                spec = market.spec
+                i = int(self._rng.integers(0, market.n - 2))
+                j = min(i + int(self._rng.integers(1, max_hold_hours + 1)), market.n - 2)
+                open_ms = int(market.times[i] + self._rng.integers(0, HOUR_MS))
+                close_ms = int(market.times[j] + self._rng.integers(0, HOUR_MS))
+                entry, price = float(market.ohlcv[i, 3]), float(market.ohlcv[j, 3])
+                qty = round(spec['min_qty'] * int(self._rng.integers(1, 50)), _digits(spec['qty_step']))
+                side = 'Buy' if self._rng.random() < 0.5 else 'Sell'
+                close_side = 'Sell' if side == 'Buy' else 'Buy'
+                leverage = float(self._rng.integers(1, 11))
+                open_fee, close_fee = qty * entry * self.fee_rate, qty * price * self.fee_rate
+                pnl = (1.0 if side == 'Buy' else -1.0) * (price - entry) * qty
+                self._record_execution(self._execution_row(
+                    market.symbol, str(uuid.uuid4()), '', side, entry, qty, open_fee, 0.0, 'Trade', open_ms))
+                close_order = str(uuid.uuid4())
+                self._record_execution(self._execution_row(
+                    market.symbol, close_order, '', close_side, price, qty, close_fee, qty, 'Trade', close_ms))
+                net_pnl = pnl - open_fee - close_fee
+                self._record_closed_pnl(self._closed_pnl_row(
+                    market.symbol, close_order, close_side, qty, entry, price, net_pnl, leverage,
+                    open_ms, close_ms, 'Trade'))
+                self.wallet += net_pnl
+                self.cum_realised += net_pnl
+
+    # ------------------------------------------------------------------ WebSocket
+
+    def _publish(self, topic, message):
+        with self._ws_lock:
+            connections = [conn for conn in self._ws_connections if topic in conn.topics]
+        for conn in connections:
+            conn.send(message)
+
+    def _publish_private(self, topic, data):
+        self._publish(topic, {'id': f"{topic}-{next(self._seq)}", 'topic': topic,
+                              'creationTime': self.now_ms(), 'data': data})
+
+    def serve_websocket(self, handler, private):
+        """Переключает соединение HTTP-обработчика на WebSocket и обслуживает его до закрытия."""
+        key = handler.headers.get('Sec-WebSocket-Key')
+        if not key:
+            handler.send_error(400)
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        handler.send_response(101, 'Switching Protocols')
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        handler.end_headers()
+        handler.wfile.flush()
+        handler.close_connection = True
+        conn = _WsConnection(handler.connection, private, self.ws_delay)
+        with self._ws_lock:
+            self._ws_connections.add(conn)
+        try:
+            while not conn.closed:
+                opcode, payload = read_frame(handler.rfile)
+                if opcode is None or opcode == WS_CLOSE:
+                    break
+                if opcode == WS_PING:
+                    conn.send(payload, opcode=WS_PONG)
+                elif opcode == WS_TEXT:
+                    self._on_ws_message(conn, json.loads(payload))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._ws_lock:
+                self._ws_connections.discard(conn)
+            conn.close()
+
+    def _on_ws_message(self, conn, message):
+        op = message.get('op')
+        reply = {'success': True, 'ret_msg': '', 'conn_id': conn.id, 'op': op}
+        if message.get('req_id'):
+            reply['req_id'] = message['req_id']
+        args = message.get('args') or []
+        snapshots = []
+        if op == 'ping':
+            reply['ret_msg'] = 'pong'
+        elif op == 'auth':
+            conn.authorized = self._ws_authorized(args)
+            if not conn.authorized:
+                reply.update(success=False, ret_msg='Request not authorized')
+        elif op == 'subscribe':
+            if conn.private:
+                valid = conn.authorized and all(topic in PRIVATE_TOPICS for topic in args)
+            else:
+                valid = all(topic.startswith('tickers.') and topic[8:] in self.markets for topic in args)
+            if valid:
+                conn.topics.update(args)
+                snapshots = [topic[8:] for topic in args if topic.startswith('tickers.')]
+            else:
+                reply.update(success=False, ret_msg=f"Invalid topic or not authorized: {args}")
+        elif op == 'unsubscribe':
+            conn.topics.difference_update(args)
+        else:
+            reply.update(success=False, ret_msg=f"Invalid op: {op}")
+        conn.send(reply)
+        with self._lock:
+            for symbol in snapshots:
+                conn.send({'topic': f'tickers.{symbol}', 'type': 'snapshot', 'data': self.markets[symbol].ticker(),
+                           'cs': next(self._seq), 'ts': self.now_ms()})
+
+    def _ws_authorized(self, args):
+        if len(args) < 3:
+            return False
+        api_key, expires, signature = args[0], int(args[1]), args[2]
+        if self.api_key is not None and api_key != self.api_key:
+            return False
+        if self.api_secret is None:
+            return True
+        expected = hmac.new(self.api_secret.encode(), f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+        return expires > self.now_ms() and hmac.compare_digest(expected, signature)
+
+
+class LocalClient:
+    """
+    Клиент с методами pybit HTTP (get_kline, place_order, ...), который вызывает ExchangeSimulator.handle
+    напрямую, без сокетов и подписи: для бенчмарков, где сетевой стек не должен попадать в замер.
+    Ответ с retCode ≠ 0 возвращается как есть, HTTP-ошибка (503, 403) — исключение ConnectionError.
+    """
+
+    def __init__(self, simulator, api_key='local'):
+        self.simulator = simulator
+        self.headers = {'X-BAPI-API-KEY': api_key}
+        self.endpoint = 'local'
+        self._routes = {name.lstrip('_'): (method, path) for (method, path), (name, _) in ROUTES.items()}
+
+    def __getattr__(self, name):
+        routes = self.__dict__.get('_routes', {})
+        if name not in routes:
+            raise AttributeError(name)
+        method, path = routes[name]
+
+        def call(**params):
+            params = {key: value for key, value in params.items() if value is not None}
+            if method == 'GET':
+                query, body = urlencode(params), b''
+            else:
+                query, body = '', json.dumps(params).encode()
+            status, _, payload = self.simulator.handle(method, path, query, body, self.headers)
+            if status != 200:
+                raise ConnectionError(f"HTTP {status} {path}")
+            return payload
+        return call
+
+
+class SimWebSocket:
+    """
+    Клиент WebSocket симулятора с интерфейсом pybit WebSocket, который используют MarketDataFeed
+    и AccountStateStore: ticker_stream, position_stream, wallet_stream, execution_stream, exit.
+    """
+
+    def __init__(self, endpoint, channel_type='linear', api_key=None, api_secret=None, ping_interval=20.0,
+                 timeout=5.0, log=logging.info):
+        url = urlsplit(endpoint)
+        self.path = WS_PRIVATE_PATH if channel_type == 'private' else f'/v5/public/{channel_type}'
+        self.log = log
+        self._callbacks = {}
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.sock = socket.create_connection((url.hostname, url.port or 80), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((
+            f"GET {self.path} HTTP/1.1\r\nHost: {url.netloc}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        self._rfile = self.sock.makefile('rb')
+        status = self._rfile.readline().decode()
+        headers = {}
+        for line in iter(self._rfile.readline, b'\r\n'):
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        expected = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        if ' 101 ' not in status or headers.get('sec-websocket-accept') != expected:
+            self.sock.close()
+            raise ConnectionError(f"WebSocket handshake failed: {status.strip()}")
+        self.sock.settimeout(None)
+        if channel_type == 'private':
+            expires = int((time.time() + 10) * 1000)
+            signature = hmac.new((api_secret or '').encode(), f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+            self._send({'op': 'auth', 'args': [api_key or '', expires, signature]})
+        self._threads = [
+            threading.Thread(target=self._reader, name=f'sim-ws-{channel_type}', daemon=True),
+            threading.Thread(target=self._pinger, args=(ping_interval,), name=f'sim-ws-ping-{channel_type}', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _send(self, message, opcode=WS_TEXT):
+        payload = message if isinstance(message, bytes) else json.dumps(message).encode()
+        with self._send_lock:
+            self.sock.sendall(encode_frame(opcode, payload, mask=True))
+
+    def _subscribe(self, topics, callback):
+        for topic in topics:
+            self._callbacks[topic] = callback
+        self._send({'op': 'subscribe', 'args': topics, 'req_id': str(uuid.uuid4())})
+
+    def ticker_stream(self, symbol, callback):
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        self._subscribe([f'tickers.{s}' for s in symbols], callback)
+
+    def position_stream(self, callback):
+        self._subscribe(['position'], callback)
+
+    def wallet_stream(self, callback):
+        self._subscribe(['wallet'], callback)
+
+    def execution_stream(self, callback):
+        self._subscribe(['execution'], callback)
+
+    def _reader(self):
+        while not self._stop.is_set():
+            try:
+                opcode, payload = read_frame(self._rfile)
+            except (OSError, ValueError):
+                break
+            if opcode is None or opcode == WS_CLOSE:
+                break
+            if opcode == WS_PING:
+                self._send(payload, opcode=WS_PONG)
+                continue
+            if opcode != WS_TEXT:
+                continue
+            message = json.loads(payload)
+            if message.get('success') is False:
+                self.log(f"⚠️ WebSocket симулятора: {message.get('ret_msg')}")
+            callback = self._callbacks.get(message.get('topic'))
+            if callback is None:
+                continue
+            try:
+                callback(message)
+            except Exception as e:
+                self.log(f"⚠️ Ошибка обработчика {message.get('topic')}: {e}")
+
+    def is_connected(self):
+        return not self._stop.is_set() and self._threads[0].is_alive()
+
+    def _pinger(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self._send({'op': 'ping'})
+            except OSError:
+                return
+
+    def exit(self):
+        self._stop.set()
+        try:
+            self._send(b'', opcode=WS_CLOSE)
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def sim_ws_factory(endpoint, channel_type='linear', api_key=None, api_secret=None):
+    """Фабрика WebSocket симулятора для MarketDataFeed/AccountStateStore (аналог private_ws_factory)."""
+    def factory():
+        return SimWebSocket(endpoint, channel_type, api_key=api_key, api_secret=api_secret)
+    return factory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный симулятор Bybit v5 (REST + WebSocket) для нагрузочных тестов без сети")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--symbols', nargs='+', default=['BTCUSDT'])
+    parser.add_argument('--balance', type=float, default=10000.0)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Задержка каждого ответа REST")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Случайная добавка к задержке, равномерно [0, jitter]")
+    parser.add_argument('--ws-delay-ms', type=float, default=0.0, help="Задержка сообщений WebSocket")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля запросов с ошибкой (HTTP 503 или retCode 10016)")
+    parser.add_argument('--rate-scale', type=float, default=1.0, help="Множитель лимитов запросов Bybit, 0 — без лимитов")
+    parser.add_argument('--tick', type=float, default=0.5, help="Период обновления цены, сек")
+    parser.add_argument('--volatility', type=float, default=0.006, help="Стандартное отклонение часовой доходности")
+    parser.add_argument('--history-days', type=int, default=1500)
+    parser.add_argument('--seed-trades', type=int, default=0, help="Сделок в истории исполнений и закрытых позиций")
+    parser.add_argument('--api-key', help="Принимать только этот ключ")
+    parser.add_argument('--api-secret', help="Проверять подпись HMAC этим секретом")
+    parser.add_argument('--clock-offset-ms', type=int, default=0, help="Сдвиг часов биржи")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    simulator = ExchangeSimulator(
+        args.symbols, balance=args.balance, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        ws_delay=args.ws_delay_ms / 1000, error_rate=args.error_rate, rate_scale=args.rate_scale,
+        tick_interval=args.tick, volatility=args.volatility, history_days=args.history_days,
+        api_key=args.api_key, api_secret=args.api_secret, clock_offset_ms=args.clock_offset_ms, seed=args.seed,
+    )
+    simulator.seed_trades(args.seed_trades)
+    simulator.serve(args.host, args.port)
+    logging.info(f"BYBIT_ENDPOINT={simulator.endpoint}")
+    try:
+        while True:
+            time.sleep(10)
+            logging.info(f"📊 {simulator.stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+# j3_fear_greed
+
+import os
+import csv
+import time
+import threading
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+from j3_candle_store import CandleStore
+
+
+DAY_MS = 24 * 3600 * 1000
+FEAR_GREED_URL = "https://api.alternative.me/fng/"
+FEAR_GREED_DTYPE = np.dtype([('time', '<i8'), ('value', '<i4')])  # Начало суток UTC (мс), значение индекса
+FEAR_GREED_START = datetime(2018, 2, 1, tzinfo=timezone.utc)  # Первые сутки истории индекса на alternative.me
+
+
+def day_ms(value):
+    """datetime / pd.Timestamp / мс -> начало суток UTC в мс."""
+    if isinstance(value, (int, np.integer)):
+        return int(value) // DAY_MS * DAY_MS
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000) // DAY_MS * DAY_MS
+
+
+def fetch_fear_greed_entries(limit, max_retries=5, delay=5, timeout=10, log=logging.info):
+    """
+    Последние limit значений индекса с alternative.me (limit=0 — вся история) в виде
+    [(начало суток, мс), значение] по возрастанию даты. None — запрос не удался.
+    """
+    for attempt in range(max_retries):
+        try:
+            response = requests.get(FEAR_GREED_URL, params={'limit': limit}, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()['data']
+            return sorted((day_ms(int(entry['timestamp']) * 1000), int(entry['value'])) for entry in data)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            log(f"⚠️ Ошибка при запросе индекса страха и жадности (попытка {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                time.sleep(delay * (2 ** attempt))
+    log("⚠️ Не удалось получить данные индекса после всех попыток")
+    return None
+
+
+class FearGreedStore:
+    """
+    Индекс страха и жадности по суткам UTC. История хранится в CandleStore (запись — начало
+    суток в мс и значение) и дописывается: update() запрашивает у API лишь дни новее
+    последнего сохранённого. Если история не начинается с FEAR_GREED_START (пустое хранилище
+    или перенесённый CSV за последние недели), первый update() загружает её целиком
+    и вставляет недостающие дни перед сохранёнными (merge). В памяти — словарь
+    сутки -> значение, поэтому value() отвечает без фильтрации таблицы; arrays() отдаёт
+    историю в виде (даты в мс, значения) для бэктеста.
+    """
+
+    def __init__(self, path, fetch=fetch_fear_greed_entries, log=logging.info):
+        self.store = CandleStore(path, dtype=FEAR_GREED_DTYPE)
+        self.fetch = fetch  # fetch(limit) -> [(сутки в мс, значение)] или None
+        self.log = log
+        self._lock = threading.Lock()
+        self._full_history = False  # Полная история уже загружалась в этом процессе
+        records = self.store.view()
+        self._values = dict(zip((records['time'] // DAY_MS).tolist(), records['value'].tolist()))
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"FearGreedStore({self.store.path}, days={len(self)})"
+
+    def last_day(self):
+        """Начало последних сохранённых суток (мс) или None."""
+        return self.store.last_time()
+
+    def history_complete(self):
+        """История начинается с первых суток индекса (FEAR_GREED_START)."""
+        records = self.store.view()
+        return bool(len(records)) and int(records['time'][0]) <= day_ms(FEAR_GREED_START)
+
+    def value(self, day):
+        """Значение индекса за сутки day (datetime или мс) или None."""
+        return self._values.get(day_ms(day) // DAY_MS)
+
+    def add(self, entries):
+        """Дописывает значения [(сутки в мс, значение)] новее последних сохранённых. Возвращает число добавленных дней."""
+        with self._lock:
+            last = self.store.last_time()
+            days = {}
+            for day, value in entries:
+                day = day_ms(day)
+                if last is None or day > last:
+                    days[day] = int(value)
+            if not days:
+                return 0
+            records = np.array(sorted(days.items()), dtype=FEAR_GREED_DTYPE)
+            self.store.append(records)
+            self._values.update(zip((records['time'] // DAY_MS).tolist(), records['value'].tolist()))
+            return len(records)
+
+    def merge(self, entries):
+        """
+        Добавляет дни [(сутки в мс, значение)], которых нет в хранилище, в любом месте истории;
+        сохранённые значения не меняются. Дни раньше последнего сохранённого требуют
+        атомарной перезаписи файла. Возвращает число добавленных дней.
+        """
+        with self._lock:
+            days = {}
+            for day, value in entries:
+                day = day_ms(day)
+                if day // DAY_MS not in self._values:
+                    days[day] = int(value)
+            if not days:
+                return 0
+            records = np.array(sorted(days.items()), dtype=FEAR_GREED_DTYPE)
+            last = self.store.last_time()
+            if last is None or records['time'][0] > last:
+                self.store.append(records)
+            else:
+                merged = np.concatenate([np.array(self.store.view()), records])
+                self._rewrite(merged[np.argsort(merged['time'], kind='stable')])
+            self._values.update(zip((records['time'] // DAY_MS).tolist(), records['value'].tolist()))
+            return len(records)
+
+    def _rewrite(self, records):
+        path = self.store.path
+        tmp_path = path.with_suffix(path.suffix + '.rebuild')
+        if tmp_path.exists():
+            tmp_path.unlink()
+        rebuilt = CandleStore(tmp_path, dtype=FEAR_GREED_DTYPE, initial_capacity=max(len(records), 1024))
+        rebuilt.append(records)
+        rebuilt.close()
+        self.store.close()
+        os.replace(tmp_path, path)
+        self.store = CandleStore(path, dtype=FEAR_GREED_DTYPE)
+
+    def update(self, now, **fetch_options):
+        """
+        Загрузка дней после последнего сохранённого до now. Возвращает число новых дней или None при ошибке.
+        fetch_options передаются в fetch (например, max_retries и timeout для короткого запроса).
+        Неполная история один раз за процесс загружается целиком (limit=0) и сливается с сохранённой.
+        """
+        if not self._full_history and not self.history_complete():
+            entries = self.fetch(0, **fetch_options)
+            if entries is None:
+                return None
+            self._full_history = True
+            return self.merge(entries)
+        last = self.last_day()
+        today = day_ms(now)
+        if last is not None and last >= today:
+            return 0
+        limit = 0 if last is None else (today - last) // DAY_MS + 1
+        entries = self.fetch(limit, **fetch_options)
+        if entries is None:
+            return None
+        return self.add(entries)
+
+    def import_csv(self, path):
+        """Перенос прежнего fear_greed_index_*.csv (Date в формате ДД/ММ/ГГГГ, Value)."""
+        entries = []
+        with open(path, newline='', encoding='utf-8') as f:
+            for record in csv.DictReader(f):
+                try:
+                    date = datetime.strptime(record['Date'], '%d/%m/%Y').replace(tzinfo=timezone.utc)
+                    entries.append((day_ms(date), int(float(record['Value']))))
+                except (KeyError, TypeError, ValueError):
+                    continue
+        return self.add(sorted(entries))
+
+    def arrays(self, start_ms=None, end_ms=None):
+        """(даты в мс, значения) за диапазон — аргумент fear_greed для run_backtest."""
+        with self._lock:
+            records = self.store.slice(start_ms, end_ms)
+            return np.array(records['time']), np.array(records['value'], dtype=np.float64)
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,137 @@
+# j3_history
+
+import os
+import json
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from j3_candle_store import CandleStore
+from j3_kline_sync import KlineSync
+
+
+OHLC_DTYPE = np.dtype([('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8')])
+
+
+class HistoryDownloader:
+    """
+    Загрузчик исторических свечей с локальным кешем на диске (ключ — символ и интервал).
+    Запрошенный диапазон делится на независимые страницы по page_limit свечей, которые
+    скачиваются параллельно в пуле потоков под общим RateLimiter. С биржи запрашиваются
+    только участки за пределами уже закешированного диапазона; закрытые свечи
+    сохраняются в CandleStore, а покрытый диапазон — в соседнем JSON.
+    """
+
+    def __init__(self, client, symbol, interval, step_ms, cache_dir='history_cache', page_limit=1000,
+                 workers=4, rate_limiter=None, max_retries=5, delay=5, log=logging.info):
+        self.symbol = symbol
+        self.interval = interval
+        self.step_ms = step_ms  # Длительность свечи, мс (для месяца — верхняя оценка)
+        self.page_limit = page_limit
+        self.workers = workers
+        self.log = log
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.store = CandleStore(self.cache_dir / f"history_{symbol}_{interval}.j3c", dtype=OHLC_DTYPE)
+        self.meta_path = self.cache_dir / f"history_{symbol}_{interval}.json"
+        # Запросы и повторы — через KlineSync без хранилища: только fetch() по страницам
+        self.fetcher = KlineSync(client, None, symbol, interval, step_ms, page_limit=page_limit,
+                                 max_retries=max_retries, delay=delay, log=log, rate_limiter=rate_limiter)
+
+    # ------------------------------------------------------------ кеш
+
+    def _covered(self):
+        """Диапазон [начало, конец] (мс), в котором кеш полон, или None."""
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            return int(meta['covered_start']), int(meta['covered_end'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_covered(self, covered_start, covered_end):
+        tmp_path = self.meta_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'covered_start': covered_start, 'covered_end': covered_end}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    # ------------------------------------------------------- загрузка
+
+    def pages(self, start_ms, end_ms):
+        """Независимые страницы [начало, конец] по page_limit свечей."""
+        span = self.page_limit * self.step_ms
+        return [(page_start, min(page_start + span - 1, end_ms)) for page_start in range(start_ms, end_ms + 1, span)]
+
+    def fetch_range(self, start_ms, end_ms):
+        """Свечи диапазона с биржи: страницы параллельно, результат (n, 5) отсортирован по времени."""
+        pages = self.pages(start_ms, end_ms)
+        if len(pages) == 1:
+            parts = [self.fetcher.fetch(*pages[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pages))) as pool:
+                parts = list(pool.map(lambda page: self.fetcher.fetch(*page), pages))
+        rows = np.concatenate(parts) if parts else np.empty((0, 5), dtype=np.float64)
+        _, unique = np.unique(rows[:, 0], return_index=True)
+        return rows[unique]
+
+    def _store_rows(self, rows):
+        if len(rows) == 0:
+            return
+        times = rows[:, 0].astype(np.int64)
+        last_time = self.store.last_time()
+        if last_time is not None:
+            older = times < last_time
+            if older.any():
+                self.store.insert_ohlc(times[older], *rows[older, 1:5].T)
+        self.store.upsert_ohlc(times, *rows[:, 1:5].T)
+
+    def load(self, start_ms, end_ms, now_ms):
+        """
+        Свечи с временем открытия в [start_ms, end_ms] (структурированный массив OHLC_DTYPE).
+        Кешируются только закрытые к now_ms свечи; текущая незакрытая запрашивается каждый раз.
+        """
+        final_ms = min(end_ms, now_ms - self.step_ms)  # Свечи не новее — гарантированно закрыты
+        covered = self._covered()
+        if covered is None or len(self.store) == 0:
+            missing = [(start_ms, end_ms)]
+        else:
+            # Покрытие хранится одним диапазоном: догружается всё от его края, включая разрыв
+            # между покрытием и запросом, иначе непрочитанный разрыв считался бы закешированным
+            missing = []
+            if start_ms < covered[0]:
+                missing.append((start_ms, covered[0] - 1))
+            if end_ms > covered[1]:
+                missing.append((covered[1] + 1, end_ms))
+        fresh = []
+        requests_before = self.fetcher.requests
+        for range_start, range_end in missing:
+            if range_start > range_end:
+                continue
+            rows = self.fetch_range(range_start, range_end)
+            closed = rows[:, 0] <= final_ms
+            self._store_rows(rows[closed])
+            fresh.append(rows[~closed])
+        if missing:
+            if covered is None or len(self.store) == 0:
+                covered = (start_ms, final_ms)
+            else:
+                covered = (min(covered[0], start_ms), max(covered[1], final_ms))
+            if covered[0] <= covered[1]:
+                self._save_covered(*covered)
+            self.log(f"📥 История {self.symbol} {self.interval}: {self.fetcher.requests - requests_before} запросов, "
+                     f"в кеше {len(self.store)} свечей")
+        cached = np.array(self.store.slice(start_ms, end_ms))
+        fresh = np.concatenate(fresh) if fresh else np.empty((0, 5), dtype=np.float64)
+        if len(fresh) == 0:
+            return cached
+        extra = np.zeros(len(fresh), dtype=OHLC_DTYPE)
+        extra['time'] = fresh[:, 0].astype(np.int64)
+        extra['open'], extra['high'], extra['low'], extra['close'] = fresh[:, 1], fresh[:, 2], fresh[:, 3], fresh[:, 4]
+        extra = extra[~np.isin(extra['time'], cached['time'])]
+        merged = np.concatenate([cached, extra])
+        return merged[np.argsort(merged['time'], kind='stable')]
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,362 @@
+# j3_indicators
+
+import math
+from collections import deque
+
+import numpy as np
+
+
+# Колонки индикаторов в файлах market_data (совпадают с j3_463)
+INDICATOR_COLUMNS = ['RSI', 'RSI-based MA', 'StochRSI_K', 'StochRSI_D', 'Williams_R_Overbought', 'Williams_R_Oversold']
+
+
+def _is_zero(value):
+    """Аналог TA_IS_ZERO из TA-Lib."""
+    return -0.00000001 < value < 0.00000001
+
+
+class WilderRSI:
+    """
+    RSI со сглаживанием Уайлдера, O(1) на свечу.
+    Повторяет арифметику TA_RSI: первое значение — средние прирост/падение за period,
+    далее prev = (prev * (period - 1) + x) * (1 / period). Совпадает с talib.RSI бит в бит
+    на той же последовательности цен, начиная с той же первой свечи.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.inv_period = 1.0 / period  # TA-Lib умножает на обратную величину, а не делит
+        self.prev_value = None
+        self.count = 0  # Количество обработанных приращений
+        self.prev_gain = 0.0
+        self.prev_loss = 0.0
+
+    def update(self, value):
+        if self.prev_value is None:
+            self.prev_value = value
+            return math.nan
+        diff = value - self.prev_value
+        self.prev_value = value
+        self.count += 1
+        if self.count <= self.period:
+            # Накопление начальных сумм
+            if diff < 0:
+                self.prev_loss -= diff
+            else:
+                self.prev_gain += diff
+            if self.count < self.period:
+                return math.nan
+            self.prev_loss *= self.inv_period
+            self.prev_gain *= self.inv_period
+        else:
+            self.prev_loss *= (self.period - 1)
+            self.prev_gain *= (self.period - 1)
+            if diff < 0:
+                self.prev_loss -= diff
+            else:
+                self.prev_gain += diff
+            self.prev_loss *= self.inv_period
+            self.prev_gain *= self.inv_period
+        total = self.prev_gain + self.prev_loss
+        if not _is_zero(total):
+            return 100.0 * (self.prev_gain / total)
+        return 0.0
+
+    def get_state(self):
+        return {'period': self.period, 'prev_value': self.prev_value, 'count': self.count,
+                'prev_gain': self.prev_gain, 'prev_loss': self.prev_loss}
+
+    def set_state(self, state):
+        self.prev_value = state['prev_value']
+        self.count = state['count']
+        self.prev_gain = state['prev_gain']
+        self.prev_loss = state['prev_loss']
+
+
+class RollingSMA:
+    """
+    Простая скользящая средняя с накопителем, как TA_SMA: сумма ведётся
+    с начала ряда (add, затем subtract), поэтому ошибки округления совпадают с TA-Lib.
+    Ведущие NaN пропускаются (так же делает обёртка talib).
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.total = 0.0
+        self.window = deque()
+
+    def update(self, value):
+        if math.isnan(value) and not self.window:
+            return math.nan
+        self.total += value
+        self.window.append(value)
+        if len(self.window) < self.period:
+            return math.nan
+        result = self.total / self.period
+        self.total -= self.window.popleft()
+        return result
+
+    def get_state(self):
+        return {'period': self.period, 'total': self.total, 'window': list(self.window)}
+
+    def set_state(self, state):
+        self.total = state['total']
+        self.window = deque(state['window'])
+
+
+class RollingExtremum:
+    """Скользящий максимум или минимум за period значений (монотонная очередь, O(1) амортизированно)."""
+
+    def __init__(self, period, mode='max'):
+        self.period = period
+        self.mode = mode
+        self.index = 0
+        self.queue = deque()  # Пары (индекс, значение), монотонные по значению
+
+    def update(self, value):
+        if self.mode == 'max':
+            while self.queue and self.queue[-1][1] <= value:
+                self.queue.pop()
+        else:
+            while self.queue and self.queue[-1][1] >= value:
+                self.queue.pop()
+        self.queue.append((self.index, value))
+        # Удаляем значения, вышедшие из окна
+        while self.queue[0][0] <= self.index - self.period:
+            self.queue.popleft()
+        self.index += 1
+        if self.index < self.period:
+            return math.nan
+        return self.queue[0][1]
+
+    def get_state(self):
+        return {'period': self.period, 'mode': self.mode, 'index': self.index, 'queue': [list(item) for item in self.queue]}
+
+    def set_state(self, state):
+        self.index = state['index']
+        self.queue = deque((item[0], item[1]) for item in state['queue'])
+
+
+class StochRSI:
+    """
+    Stochastic RSI как talib.STOCHRSI(timeperiod, fastk_period, fastd_period, fastd_matype=0).
+    update() возвращает (fastk, fastd).
+    """
+
+    def __init__(self, rsi_period, fastk_period, fastd_period):
+        self.rsi = WilderRSI(rsi_period)
+        self.highest = RollingExtremum(fastk_period, 'max')
+        self.lowest = RollingExtremum(fastk_period, 'min')
+        self.fastd = RollingSMA(fastd_period)
+
+    def update(self, value):
+        rsi = self.rsi.update(value)
+        if math.isnan(rsi):
+            return math.nan, math.nan
+        highest = self.highest.update(rsi)
+        lowest = self.lowest.update(rsi)
+        if math.isnan(highest):
+            return math.nan, math.nan
+        # Та же арифметика, что в TA_STOCHF
+        diff = highest - lowest
+        fastk = (rsi - lowest) / diff * 100.0 if not _is_zero(diff) else 0.0
+        return fastk, self.fastd.update(fastk)
+
+    def get_state(self):
+        return {'rsi': self.rsi.get_state(), 'highest': self.highest.get_state(),
+                'lowest': self.lowest.get_state(), 'fastd': self.fastd.get_state()}
+
+    def set_state(self, state):
+        self.rsi.set_state(state['rsi'])
+        self.highest.set_state(state['highest'])
+        self.lowest.set_state(state['lowest'])
+        self.fastd.set_state(state['fastd'])
+
+
+class WilliamsR:
+    """Williams %R как talib.WILLR(high, low, source, timeperiod)."""
+
+    def __init__(self, period):
+        self.highest = RollingExtremum(period, 'max')
+        self.lowest = RollingExtremum(period, 'min')
+
+    def update(self, high, low, source):
+        highest = self.highest.update(high)
+        lowest = self.lowest.update(low)
+        if math.isnan(highest):
+            return math.nan
+        # Та же арифметика, что в TA_WILLR
+        diff = highest - lowest
+        if not _is_zero(diff):
+            return (highest - source) / diff * -100.0
+        return 0.0
+
+    def get_state(self):
+        return {'highest': self.highest.get_state(), 'lowest': self.lowest.get_state()}
+
+    def set_state(self, state):
+        self.highest.set_state(state['highest'])
+        self.lowest.set_state(state['lowest'])
+
+
+class IndicatorEngine:
+    """
+    Потоковый расчёт индикаторов стратегии Юнона 3 по закрытым свечам.
+    params — словарь периодов и источников (см. get_indicator_params в j3_463):
+    rsi_period, sma_rsi_period, stochrsi_rsi_period, stochrsi_stoch_period,
+    stochrsi_k_period, stochrsi_d_period, williams_overbought_period,
+    williams_overbought_source, williams_oversold_period, williams_oversold_source.
+    Состояние сохраняется в JSON-совместимый словарь (get_state/from_state).
+    """
+
+    def __init__(self, params):
+        self.params = dict(params)
+        self.rsi = WilderRSI(params['rsi_period'])
+        self.sma_rsi = RollingSMA(params['sma_rsi_period'])
+        self.stoch = StochRSI(params['stochrsi_rsi_period'], params['stochrsi_stoch_period'], params['stochrsi_k_period'])
+        self.stoch_d = RollingSMA(params['stochrsi_d_period'])
+        self.williams_overbought = WilliamsR(params['williams_overbought_period'])
+        self.williams_oversold = WilliamsR(params['williams_oversold_period'])
+        self.last_time = None  # Время открытия последней обработанной свечи (мс)
+        self.candles = 0
+
+    def update(self, candle_time_ms, open_, high, low, close):
+        """Обрабатывает закрытую свечу, возвращает словарь значений индикаторов."""
+        rsi = self.rsi.update(close)
+        sma_rsi = self.sma_rsi.update(rsi)
+        _, stoch_k = self.stoch.update(close)  # В стратегии K — это fastd из STOCHRSI
+        stoch_d = self.stoch_d.update(stoch_k)
+        source_overbought = open_ if self.params['williams_overbought_source'] == 'Open' else close
+        source_oversold = open_ if self.params['williams_oversold_source'] == 'Open' else close
+        williams_overbought = self.williams_overbought.update(high, low, source_overbought)
+        williams_oversold = self.williams_oversold.update(high, low, source_oversold)
+        self.last_time = int(candle_time_ms)
+        self.candles += 1
+        return {
+            'RSI': rsi,
+            'RSI-based MA': sma_rsi,
+            'StochRSI_K': stoch_k,
+            'StochRSI_D': stoch_d,
+            'Williams_R_Overbought': williams_overbought,
+            'Williams_R_Oversold': williams_oversold,
+        }
+
+    def run(self, times_ms, opens, highs, lows, closes):
+        """Прогоняет массивы свечей через движок, возвращает словарь массивов индикаторов."""
+        n = len(closes)
+        out = {col: np.full(n, np.nan, dtype=np.float64) for col in INDICATOR_COLUMNS}
+        for i in range(n):
+            values = self.update(times_ms[i], float(opens[i]), float(highs[i]), float(lows[i]), float(closes[i]))
+            for col in INDICATOR_COLUMNS:
+                out[col][i] = values[col]
+        return out
+
+    def get_state(self):
+        """Контрольная точка движка (JSON-совместимый словарь)."""
+        return {
+            'params': self.params,
+            'last_time': self.last_time,
+            'candles': self.candles,
+            'rsi': self.rsi.get_state(),
+            'sma_rsi': self.sma_rsi.get_state(),
+            'stoch': self.stoch.get_state(),
+            'stoch_d': self.stoch_d.get_state(),
+            'williams_overbought': self.williams_overbought.get_state(),
+            'williams_oversold': self.williams_oversold.get_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Восстанавливает движок из контрольной точки."""
+        engine = cls(state['params'])
+        engine.last_time = state['last_time']
+        engine.candles = state['candles']
+        engine.rsi.set_state(state['rsi'])
+        engine.sma_rsi.set_state(state['sma_rsi'])
+        engine.stoch.set_state(state['stoch'])
+        engine.stoch_d.set_state(state['stoch_d'])
+        engine.williams_overbought.set_state(state['williams_overbought'])
+        engine.williams_oversold.set_state(state['williams_oversold'])
+        return engine
+
+
+# ---------------------------------------------------------------------------
+# Расчёт по массивам (бэктест, перебор параметров). Значения совпадают с IndicatorEngine.run:
+# скользящие экстремумы, StochF и Williams %R считаются векторно, а рекурсивные RSI и SMA —
+# последовательно, с той же арифметикой, что и в TA-Lib.
+
+def rolling_extremum(values, period, mode='max'):
+    """Скользящий максимум/минимум за period значений; первые period - 1 значений — NaN."""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        windows = np.lib.stride_tricks.sliding_window_view(values, period)
+        out[period - 1:] = windows.max(axis=1) if mode == 'max' else windows.min(axis=1)
+    return out
+
+
+def wilder_rsi(closes, period):
+    """RSI Уайлдера по массиву цен закрытия (как WilderRSI)."""
+    rsi = WilderRSI(period)
+    return np.array([rsi.update(value) for value in np.asarray(closes, dtype=np.float64).tolist()], dtype=np.float64)
+
+
+def running_sma(values, period):
+    """SMA с накопителем по массиву (как RollingSMA, ведущие NaN пропускаются)."""
+    sma = RollingSMA(period)
+    return np.array([sma.update(value) for value in np.asarray(values, dtype=np.float64).tolist()], dtype=np.float64)
+
+
+def _stoch_ratio(source, highest, lowest, scale):
+    diff = highest - lowest
+    zero = (diff > -0.00000001) & (diff < 0.00000001)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if scale > 0:
+            ratio = (source - lowest) / diff * scale
+        else:
+            ratio = (highest - source) / diff * scale
+    ratio = np.where(zero, 0.0, ratio)
+    ratio[np.isnan(highest)] = np.nan
+    return ratio
+
+
+def stoch_rsi(closes, rsi_period, fastk_period, fastd_period):
+    """Массивы (fastk, fastd) как talib.STOCHRSI."""
+    rsi = wilder_rsi(closes, rsi_period)
+    fastk = np.full(len(rsi), np.nan)
+    fastd = np.full(len(rsi), np.nan)
+    valid = np.flatnonzero(~np.isnan(rsi))
+    if len(valid):
+        series = rsi[valid[0]:]
+        highest = rolling_extremum(series, fastk_period, 'max')
+        lowest = rolling_extremum(series, fastk_period, 'min')
+        fastk[valid[0]:] = _stoch_ratio(series, highest, lowest, 100.0)
+        fastd[valid[0]:] = running_sma(fastk[valid[0]:], fastd_period)
+    return fastk, fastd
+
+
+def williams_r(highs, lows, source, period):
+    """Массив Williams %R как talib.WILLR(high, low, source, period)."""
+    highest = rolling_extremum(highs, period, 'max')
+    lowest = rolling_extremum(lows, period, 'min')
+    return _stoch_ratio(np.asarray(source, dtype=np.float64), highest, lowest, -100.0)
+
+
+def compute_indicators(params, opens, highs, lows, closes):
+    """Все индикаторы стратегии по массивам свечей; результат совпадает с IndicatorEngine(params).run(...)."""
+    opens = np.asarray(opens, dtype=np.float64)
+    highs = np.asarray(highs, dtype=np.float64)
+    lows = np.asarray(lows, dtype=np.float64)
+    closes = np.asarray(closes, dtype=np.float64)
+    rsi = wilder_rsi(closes, params['rsi_period'])
+    _, stoch_k = stoch_rsi(closes, params['stochrsi_rsi_period'], params['stochrsi_stoch_period'], params['stochrsi_k_period'])
+    source_overbought = opens if params['williams_overbought_source'] == 'Open' else closes
+    source_oversold = opens if params['williams_oversold_source'] == 'Open' else closes
+    return {
+        'RSI': rsi,
+        'RSI-based MA': running_sma(rsi, params['sma_rsi_period']),
+        'StochRSI_K': stoch_k,
+        'StochRSI_D': running_sma(stoch_k, params['stochrsi_d_period']),
+        'Williams_R_Overbought': williams_r(highs, lows, source_overbought, params['williams_overbought_period']),
+        'Williams_R_Oversold': williams_r(highs, lows, source_oversold, params['williams_oversold_period']),
+    }
@@ -0,0 +1,298 @@
+# j3_journal
+
+import os
+import csv
+import sqlite3
+import argparse
+import threading
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+
+
+# Колонки журнала сделок (и файла trades_bybit_*.csv, который выгружается из него)
+TRADE_COLUMNS = [
+    'Trade_ID', 'Status', 'Direction', 'Entry_Time', 'Exit_Time', 'Trade_Duration', 'Hours',
+    'Entry_Price', 'Exit_Price', 'Position_Size', 'Position_Value',
+    'Leverage', 'Net_PnL_USDT', 'Net_PnL_Percent', 'Balance', 'Withdraw'
+]
+# Колонки, которые заполняются при закрытии сделки
+EXIT_COLUMNS = ['Status', 'Exit_Time', 'Trade_Duration', 'Hours', 'Exit_Price',
+                'Net_PnL_USDT', 'Net_PnL_Percent', 'Withdraw', 'Balance']
+TIME_COLUMNS = ('Entry_Time', 'Exit_Time')
+TEXT_COLUMNS = ('Status', 'Direction', 'Trade_Duration')
+# Колонка журнала -> поле таблицы trades
+FIELDS = {
+    'Trade_ID': 'trade_id', 'Status': 'status', 'Direction': 'direction',
+    'Entry_Time': 'entry_ms', 'Exit_Time': 'exit_ms', 'Trade_Duration': 'trade_duration', 'Hours': 'hours',
+    'Entry_Price': 'entry_price', 'Exit_Price': 'exit_price', 'Position_Size': 'position_size',
+    'Position_Value': 'position_value', 'Leverage': 'leverage', 'Net_PnL_USDT': 'net_pnl_usdt',
+    'Net_PnL_Percent': 'net_pnl_percent', 'Balance': 'balance', 'Withdraw': 'withdraw',
+}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trades (
+    row_id INTEGER PRIMARY KEY,
+    trade_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    direction TEXT,
+    entry_ms INTEGER,
+    exit_ms INTEGER,
+    trade_duration TEXT,
+    hours REAL,
+    entry_price REAL,
+    exit_price REAL,
+    position_size REAL,
+    position_value REAL,
+    leverage REAL,
+    net_pnl_usdt REAL,
+    net_pnl_percent REAL,
+    balance REAL,
+    withdraw REAL
+);
+CREATE INDEX IF NOT EXISTS trades_trade_id ON trades (trade_id, status);
+CREATE INDEX IF NOT EXISTS trades_entry ON trades (entry_ms);
+CREATE INDEX IF NOT EXISTS trades_exit ON trades (exit_ms);
+CREATE TABLE IF NOT EXISTS balances (
+    time_ms INTEGER NOT NULL,
+    balance REAL NOT NULL,
+    event TEXT
+);
+CREATE INDEX IF NOT EXISTS balances_time ON balances (time_ms);
+"""
+
+
+def _missing(value):
+    """None, NaN и NaT — пустое значение."""
+    return value is None or value != value or value == ''
+
+
+def to_ms(value):
+    """datetime / pd.Timestamp / строка ISO -> мс UTC или None."""
+    if _missing(value):
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(round(value.timestamp() * 1000))
+
+
+def from_ms(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+def _to_field(column, value):
+    if column in TIME_COLUMNS:
+        return to_ms(value)
+    if _missing(value):
+        return None
+    if column == 'Trade_ID':
+        return int(float(value))
+    if column in TEXT_COLUMNS:
+        return str(value)
+    return float(value)
+
+
+class TradeJournal:
+    """
+    Журнал сделок в SQLite (режим WAL): строки только добавляются, закрытие сделки
+    (close_trade) — обновление открытой строки по индексу (trade_id, status), частичное
+    закрытие добавляет строку с остатком позиции. История не обрезается; выборка по времени входа или выхода идёт
+    по индексам, а CSV выгружается по запросу (export_csv). Отдельно хранятся отметки баланса.
+    Одно соединение на журнал, вызовы из потоков обязанностей сериализуются блокировкой.
+    """
+
+    def __init__(self, path, log=logging.info):
+        self.path = Path(path)
+        self.log = log
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # В WAL запись на диск при контрольной точке
+        self._conn.executescript(SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM trades").fetchone()[0]
+
+    def __repr__(self):
+        return f"TradeJournal({self.path})"
+
+    def _insert(self, row):
+        columns = [column for column in TRADE_COLUMNS if column in row]
+        self._conn.execute(
+            f"INSERT INTO trades ({', '.join(FIELDS[c] for c in columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [_to_field(c, row[c]) for c in columns]
+        )
+
+    # ------------------------------------------------------------ запись
+
+    def append(self, row):
+        """Новая строка (словарь в колонках TRADE_COLUMNS; отсутствующие колонки пустые)."""
+        with self._lock:
+            self._insert(row)
+
+    def close_trade(self, row, remaining_size=None):
+        """
+        Закрытие сделки row['Trade_ID']: колонки EXIT_COLUMNS из row записываются в её открытые
+        строки. remaining_size — частичное закрытие: к журналу добавляется открытая строка
+        с остатком позиции. Если открытых строк нет, row добавляется целиком.
+        Возвращает число закрытых строк.
+        """
+        trade_id = _to_field('Trade_ID', row['Trade_ID'])
+        exit_columns = [column for column in EXIT_COLUMNS if column in row]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                row_ids = [r[0] for r in self._conn.execute(
+                    "SELECT row_id FROM trades WHERE trade_id = ? AND status = 'open'", (trade_id,))]
+                if not row_ids:
+                    self._insert(row)
+                for row_id in row_ids:
+                    self._conn.execute(
+                        f"UPDATE trades SET {', '.join(f'{FIELDS[c]} = ?' for c in exit_columns)} WHERE row_id = ?",
+                        [_to_field(c, row[c]) for c in exit_columns] + [row_id]
+                    )
+                    if remaining_size is not None:
+                        # Остаток позиции: та же сделка (вход, объём в USDT, плечо) без данных выхода
+                        self._conn.execute(
+                            "INSERT INTO trades (trade_id, status, direction, entry_ms, trade_duration, entry_price, "
+                            "position_size, position_value, leverage, balance) "
+                            "SELECT trade_id, 'open', direction, entry_ms, '', entry_price, ?, position_value, leverage, balance "
+                            "FROM trades WHERE row_id = ?", (float(remaining_size), row_id)
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(row_ids)
+
+    def mark_balance(self, time, balance, event=None):
+        """Отметка баланса USDT на момент time (открытие, закрытие сделки)."""
+        if _missing(balance):
+            return
+        with self._lock:
+            self._conn.execute("INSERT INTO balances (time_ms, balance, event) VALUES (?, ?, ?)",
+                               (to_ms(time), float(balance), event))
+
+    # ------------------------------------------------------------ чтение
+
+    def max_trade_id(self):
+        """Наибольший Trade_ID в журнале (0 — журнал пуст)."""
+        with self._lock:
+            value = self._conn.execute("SELECT MAX(trade_id) FROM trades").fetchone()[0]
+        return int(value) if value is not None else 0
+
+    def open_rows(self):
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(FIELDS.values())} FROM trades WHERE status = 'open' ORDER BY row_id")
+            return [self._row(values) for values in cursor]
+
+    def rows(self, start=None, end=None, limit=None):
+        """
+        Строки, у которых вход или выход попадает в [start, end] (datetime; None — без границы),
+        в порядке записи. limit — только последние limit строк.
+        """
+        conditions, params = [], []
+        if start is not None or end is not None:
+            low = to_ms(start) if start is not None else -2 ** 62
+            high = to_ms(end) if end is not None else 2 ** 62
+            conditions.append("(entry_ms BETWEEN ? AND ? OR exit_ms BETWEEN ? AND ?)")
+            params += [low, high, low, high]
+        query = f"SELECT row_id, {', '.join(FIELDS.values())} FROM trades"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if limit is not None:
+            query = f"SELECT * FROM ({query} ORDER BY row_id DESC LIMIT ?)"
+            params.append(int(limit))
+        query += " ORDER BY row_id"
+        with self._lock:
+            return [self._row(values[1:]) for values in self._conn.execute(query, params)]
+
+    def balances(self, start=None, end=None):
+        """Отметки баланса [(datetime, баланс, событие)] в диапазоне [start, end]."""
+        low = to_ms(start) if start is not None else -2 ** 62
+        high = to_ms(end) if end is not None else 2 ** 62
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT time_ms, balance, event FROM balances WHERE time_ms BETWEEN ? AND ? ORDER BY time_ms", (low, high))
+            return [(from_ms(time_ms), balance, event) for time_ms, balance, event in cursor]
+
+    @staticmethod
+    def _row(values):
+        row = dict(zip(TRADE_COLUMNS, values))
+        for column in TIME_COLUMNS:
+            row[column] = from_ms(row[column])
+        row['Trade_ID'] = str(row['Trade_ID'])
+        return row
+
+    # ------------------------------------------------------------ CSV
+
+    def export_csv(self, path, start=None, end=None):
+        """Выгрузка журнала (или диапазона) в CSV в колонках TRADE_COLUMNS. Возвращает число строк."""
+        path = Path(path)
+        rows = self.rows(start, end)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(TRADE_COLUMNS)
+            for row in rows:
+                writer.writerow([_format(column, row[column]) for column in TRADE_COLUMNS])
+        os.replace(tmp_path, path)
+        return len(rows)
+
+    def import_csv(self, path):
+        """Перенос истории из прежнего trades_bybit_*.csv (строки без Trade_ID пропускаются)."""
+        count = 0
+        with open(path, newline='', encoding='utf-8') as f, self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for record in csv.DictReader(f):
+                    if _missing(record.get('Trade_ID')) or _missing(record.get('Status')):
+                        continue
+                    self._insert({column: record[column] for column in TRADE_COLUMNS if column in record})
+                    count += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _format(column, value):
+    if value is None:
+        return ''
+    if column in TIME_COLUMNS:
+        return value.isoformat(sep=' ', timespec='milliseconds')
+    if column == 'Position_Size':
+        return f"{value:.3f}"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка журнала сделок Юнона 3 в CSV")
+    parser.add_argument('journal', help="Файл журнала trades_bybit_*.sqlite")
+    parser.add_argument('--out', help="CSV (по умолчанию — имя журнала с расширением .csv)")
+    parser.add_argument('--start', help="Начало диапазона, ISO (например 2025-01-01)")
+    parser.add_argument('--end', help="Конец диапазона, ISO")
+    args = parser.parse_args()
+    journal = TradeJournal(args.journal)
+    out = args.out or Path(args.journal).with_suffix('.csv')
+    start = datetime.fromisoformat(args.start) if args.start else None
+    end = datetime.fromisoformat(args.end) if args.end else None
+    count = journal.export_csv(out, start, end)
+    journal.close()
+    print(f"{count} строк -> {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# j3_kline_sync
+
+import time
+import logging
+import threading
+
+import numpy as np
+
+
+def parse_klines(candles):
+    """Ответ get_kline (список строк Bybit) -> массив (n, 5): time, open, high, low, close без цикла по свечам."""
+    if not candles:
+        return np.empty((0, 5), dtype=np.float64)
+    return np.asarray(candles)[:, :5].astype(np.float64)
+
+
+class RateLimiter:
+    """
+    Общий для потоков лимит запросов к API (token bucket): в среднем не более rate запросов
+    в секунду, всплеск до burst. acquire() ждёт свободный токен.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0  # Суммарное время ожидания токенов, сек
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+
+class KlineSync:
+    """
+    Инкрементальная синхронизация закрытых свечей биржи с CandleStore.
+    Знает последнюю сохранённую свечу и запрашивает только недостающий диапазон,
+    начиная с неё самой (последняя свеча перепроверяется — биржа может её пересмотреть).
+    Пропуски во вновь полученных данных и в истории хранилища запрашиваются отдельно.
+    В установившемся режиме это один запрос на 2 свечи при каждом закрытии.
+    Счётчики requests и fetched_candles — телеметрия трафика get_kline.
+    rate_limiter (RateLimiter) — общий бюджет запросов с другими загрузчиками.
+    """
+
+    def __init__(self, client, store, symbol, interval, step_ms, history=242, page_limit=1000,
+                 regular=True, max_retries=5, delay=5, log=logging.info, rate_limiter=None):
+        self.client = client
+        self.store = store
+        self.symbol = symbol
+        self.interval = interval
+        self.step_ms = step_ms  # Длительность свечи, мс
+        self.history = history  # Сколько свечей загрузить в пустое хранилище
+        self.page_limit = page_limit  # Максимум свечей в одном ответе Bybit
+        self.regular = regular  # Свечи идут с постоянным шагом (для месяца поиск пропусков отключён)
+        self.max_retries = max_retries
+        self.delay = delay
+        self.log = log
+        self.rate_limiter = rate_limiter
+        self.requests = 0  # Количество запросов get_kline
+        self.fetched_candles = 0  # Количество полученных свечей
+        self._unfillable = set()  # Пропуски, которые биржа не смогла заполнить
+
+    def _request(self, start_ms, end_ms):
+        """Один запрос get_kline с повторами. Возвращает список свечей Bybit (новые первыми)."""
+        for attempt in range(self.max_retries):
+            try:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                response = self.client.get_kline(
+                    category="linear",
+                    symbol=self.symbol,
+                    interval=self.interval,
+                    start=start_ms,
+                    end=end_ms,
+                    limit=self.page_limit
+                )
+                if response['retCode'] != 0:
+                    raise ValueError(f"Ошибка API: {response['retMsg']}")
+                candles = response['result']['list']
+                self.requests += 1
+                self.fetched_candles += len(candles)
+                return candles
+            except Exception as e:
+                self.log(f"⚠️ Ошибка при получении свечей (попытка {attempt + 1}/{self.max_retries}): {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.delay * (2 ** attempt))
+        raise RuntimeError("Не удалось получить свечи после всех попыток")
+
+    def fetch(self, start_ms, end_ms):
+        """
+        Свечи с временем открытия в [start_ms, end_ms] как массив (n, 5): time, open, high, low, close,
+        отсортированный по времени. Длинные диапазоны запрашиваются страницами от конца к началу.
+        """
+        pages = []
+        page_end_ms = end_ms
+        while start_ms <= page_end_ms:
+            candles = self._request(start_ms, page_end_ms)
+            if not candles:
+                break
+            page = parse_klines(candles)
+            pages.append(page)
+            if len(candles) < self.page_limit:
+                break
+            page_end_ms = int(page[:, 0].min()) - 1
+        if not pages:
+            return np.empty((0, 5), dtype=np.float64)
+        rows = np.concatenate(pages)
+        rows = rows[(rows[:, 0] >= start_ms) & (rows[:, 0] <= end_ms)]
+        _, unique = np.unique(rows[:, 0], return_index=True)
+        return rows[unique]
+
+    def _gaps(self, times, after_ms=None):
+        """Пропуски в отсортированном массиве времён (и между after_ms и первым временем)."""
+        if not self.regular or len(times) == 0:
+            return []
+        times = np.asarray(times, dtype=np.int64)
+        if after_ms is not None:
+            times = np.concatenate([[after_ms], times])
+        holes = np.flatnonzero(np.diff(times) > self.step_ms)
+        return [(int(times[i]) + self.step_ms, int(times[i + 1]) - self.step_ms) for i in holes]
+
+    def sync(self, current_candle_start_ms):
+        """
+        Догружает закрытые свечи до текущей (не включая её).
+        Возвращает (обновлено, добавлено, индекс первой изменённой свечи или None).
+        """
+        end_ms = current_candle_start_ms - 1
+        last_time = self.store.last_time()
+        if last_time is None:
+            start_ms = current_candle_start_ms - self.history * self.step_ms
+        else:
+            start_ms = min(last_time, end_ms)  # Последняя сохранённая свеча перепроверяется
+        rows = self.fetch(start_ms, end_ms)
+        # Пропуски в полученных данных и в истории хранилища
+        gaps = self._gaps(rows[:, 0], after_ms=last_time if last_time is not None and len(rows) and rows[0, 0] > last_time else None)
+        if self.regular:
+            gaps += self.store.find_gaps(self.step_ms)
+        gaps = [gap for gap in gaps if gap not in self._unfillable]
+        for gap in gaps:
+            filled = self.fetch(*gap)
+            if len(filled) == 0:
+                self._unfillable.add(gap)
+                self.log(f"⚠️ Биржа не вернула свечи для пропуска {gap[0]}–{gap[1]}")
+                continue
+            self.log(f"🩹 Заполнен пропуск свечей: {len(filled)} шт.")
+            rows = np.concatenate([rows, filled])
+        if len(rows) == 0:
+            return 0, 0, None
+        _, unique = np.unique(rows[:, 0], return_index=True)
+        rows = rows[unique]
+        times = rows[:, 0].astype(np.int64)
+        first_changed = None
+        # Свечи старше последней сохранённой, которых нет в хранилище, — вставка внутрь истории
+        inserted = 0
+        if last_time is not None:
+            older = times < last_time
+            if older.any():
+                inserted, first_changed = self.store.insert_ohlc(times[older], *rows[older, 1:5].T)
+        updated, added, first_upserted = self.store.upsert_ohlc(times, *rows[:, 1:5].T)
+        if first_upserted is not None:
+            first_changed = first_upserted if first_changed is None else min(first_changed, first_upserted)
+        return updated + inserted, added, first_changed
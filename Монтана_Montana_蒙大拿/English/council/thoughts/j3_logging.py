@@ -0,0 +1,181 @@
+# j3_logging
+
+import re
+import sys
+import queue
+import atexit
+import threading
+import logging
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from logging.handlers import QueueHandler
+
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+SEGMENT_DATE = re.compile(r'_(\d{4}-\d{2}-\d{2})\.txt$')
+
+
+class UTCFormatter(logging.Formatter):
+    def formatTime(self, record, datefmt=None):
+        utc_time = datetime.fromtimestamp(record.created, tz=timezone.utc)
+        if datefmt:
+            return utc_time.strftime(datefmt)
+        return utc_time.strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+
+
+class SegmentHandler(logging.Handler):
+    """
+    Запись в суточные сегменты {prefix}_YYYY-MM-DD.txt (сутки UTC по времени записи).
+    При переходе на новый сегмент удаляются сегменты старше retention_days — файлы целиком,
+    без чтения и перезаписи содержимого. flush() сбрасывает буфер файла на диск; между
+    вызовами строки копятся в буфере, поэтому пакет записей стоит одной записи на диск.
+    """
+
+    def __init__(self, prefix, retention_days=14, directory='.'):
+        super().__init__()
+        self.prefix = prefix
+        self.retention_days = retention_days
+        self.directory = Path(directory)
+        self.day = None
+        self.stream = None
+
+    def segment_path(self, day):
+        return self.directory / f"{self.prefix}_{day.isoformat()}.txt"
+
+    def segments(self):
+        """Сегменты журнала: [(дата, путь)] по возрастанию даты."""
+        result = []
+        for path in self.directory.glob(f"{self.prefix}_*.txt"):
+            match = SEGMENT_DATE.search(path.name)
+            if match is None or path.name != f"{self.prefix}_{match.group(1)}.txt":
+                continue
+            try:
+                result.append((datetime.strptime(match.group(1), '%Y-%m-%d').date(), path))
+            except ValueError:
+                continue
+        return sorted(result)
+
+    def remove_expired(self, today):
+        """Удаляет сегменты старше retention_days относительно today. Возвращает число файлов."""
+        cutoff = today - timedelta(days=self.retention_days)
+        removed = 0
+        for day, path in self.segments():
+            if day >= cutoff:
+                break
+            try:
+                path.unlink()
+                removed += 1
+            except OSError as e:
+                print(f"Ошибка при удалении сегмента логов {path}: {e}", file=sys.stderr)
+        return removed
+
+    def _open(self, day):
+        if self.stream is not None:
+            self.stream.close()
+        self.day = day
+        self.stream = open(self.segment_path(day), 'a', encoding='utf-8')
+        self.remove_expired(day)
+
+    def emit(self, record):
+        try:
+            day = datetime.fromtimestamp(record.created, tz=timezone.utc).date()
+            if day != self.day:
+                self._open(day)
+            self.stream.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+        super().close()
+
+
+class LogWriter:
+    """
+    Фоновая запись логов. Вызовы logging в рабочих потоках только кладут запись в очередь
+    (QueueHandler); поток writer забирает записи пакетами до batch_size, передаёт их
+    обработчикам (файл, консоль) и сбрасывает буферы один раз на пакет.
+    Ротация и удаление старых сегментов тоже выполняются в этом потоке.
+    """
+
+    _STOP = object()
+
+    def __init__(self, handlers, batch_size=512):
+        self.handlers = list(handlers)
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.handler = QueueHandler(self.queue)
+        self._thread = None
+        self.records = 0  # Сколько записей передано обработчикам
+        self.batches = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(record is self._STOP for record in batch)
+            records = [record for record in batch if record is not self._STOP]
+            for handler in self.handlers:
+                for record in records:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                handler.flush()
+            self.records += len(records)
+            self.batches += 1
+            if stop:
+                return
+
+    def stop(self, timeout=5.0):
+        """Дописывает очередь и останавливает поток."""
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_queue_logging(prefix, retention_days=14, level=logging.INFO, console=True):
+    """
+    Корневой логгер пишет через очередь: файл — суточные сегменты {prefix}_YYYY-MM-DD.txt
+    с хранением retention_days суток, консоль — по желанию. Возвращает запущенный LogWriter.
+    """
+    formatter = UTCFormatter(LOG_FORMAT)
+    handlers = [SegmentHandler(prefix, retention_days)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    writer = LogWriter(handlers).start()
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    # Удаляем все существующие обработчики, чтобы избежать дублирования
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if isinstance(handler, QueueHandler) and hasattr(handler, 'writer'):
+            handler.writer.stop()
+    writer.handler.writer = writer
+    logger.addHandler(writer.handler)
+    atexit.register(writer.stop)
+    return writer
@@ -0,0 +1,138 @@
+# j3_margin
+
+import math
+import time
+import threading
+import logging
+
+
+def position_delta(direction, price, liq_price):
+    """Расстояние от цены до ликвидации, % от цены (как в manage_liquidation_price)."""
+    if direction == 'LONG':
+        return (price - liq_price) / price * 100
+    return (liq_price - price) / price * 100
+
+
+def maintenance_term(direction, entry_price, leverage, liq_price):
+    """
+    E·mmr — часть цены входа на поддерживающую маржу. Выводится из цены ликвидации биржи
+    (изолированная маржа: LONG liq = E·(1 - 1/L + mmr), SHORT liq = E·(1 + 1/L - mmr)),
+    поэтому учитывает риск-лимит и резерв на комиссию без отдельного запроса.
+    """
+    if direction == 'LONG':
+        term = liq_price - entry_price + entry_price / leverage
+    else:
+        term = entry_price + entry_price / leverage - liq_price
+    return max(term, 0.0)
+
+
+def liquidation_price(direction, entry_price, leverage, mmr_term):
+    """Цена ликвидации изолированной позиции при плече leverage (mmr_term = E·mmr, см. maintenance_term)."""
+    if direction == 'LONG':
+        return entry_price - entry_price / leverage + mmr_term
+    return entry_price + entry_price / leverage - mmr_term
+
+
+def target_leverage(direction, price, entry_price, leverage, liq_price, min_delta, size=None, budget=None, step=0.01):
+    """
+    Плечо, при котором ликвидация отстоит от price на min_delta (%), из модели изолированной маржи:
+    E/L* = P·min_delta/100 + E·mmr - s·(P - E). Округляется вниз до шага step (дельта не меньше целевой),
+    не выше текущего плеча и не ниже 1x. Если заданы size и budget, плечо не опускается ниже
+    size·E/budget — на меньшее не хватит маржи. Возвращает (плечо, ожидаемая дельта %).
+    """
+    sign = 1.0 if direction == 'LONG' else -1.0
+    mmr_term = maintenance_term(direction, entry_price, leverage, liq_price)
+    margin_per_unit = price * min_delta / 100 + mmr_term - sign * (price - entry_price)
+    target = entry_price / margin_per_unit if margin_per_unit > 0 else math.inf
+    target = math.floor(round(target / step, 9)) * step if math.isfinite(target) else leverage
+    if size is not None and budget is not None and budget > 0:
+        affordable = math.ceil(round(size * entry_price / budget / step, 9)) * step
+        target = max(target, affordable)
+    target = round(min(max(target, 1.0), leverage), 2)
+    return target, position_delta(direction, price, liquidation_price(direction, entry_price, target, mmr_term))
+
+
+def solve_liquidation_close(direction, price, entry_price, size, leverage, liq_price, budget, min_delta,
+                            fee_rate=0.0, qty_step=0.001, min_qty=0.001):
+    """
+    Объём частичного закрытия, после которого снижение плеча возвращает дельту до ликвидации
+    к min_delta (%) одним ордером. budget — средства символа в кошельке (включая маржу позиции).
+    Остаток Q' с плечом L* должен уместиться в капитал после закрытия:
+        Q'·E/L* ≤ budget + s·(P - E)·(Q - Q') - fee·P·(Q - Q'),
+    где E/L* + s·(P - E) = P·min_delta/100 + E·mmr, поэтому
+        Q' = (budget + s·(P - E)·Q - fee·P·Q) / (P·min_delta/100 + E·mmr - fee·P).
+    Возвращает (объём закрытия, округлённый вверх до шага qty_step, целевое плечо L* ≥ 1).
+    Объём 0 — позицию можно сохранить целиком, достаточно снизить плечо.
+    """
+    sign = 1.0 if direction == 'LONG' else -1.0
+    target, _ = target_leverage(direction, price, entry_price, leverage, liq_price, min_delta)
+    margin_per_unit = entry_price / target
+    equity = budget + sign * (price - entry_price) * size - fee_rate * price * size
+    keep = equity / (margin_per_unit + sign * (price - entry_price) - fee_rate * price)
+    if keep >= size:
+        return 0.0, target
+    close_amount = size - max(keep, 0.0)
+    precision = max(int(round(-math.log10(qty_step))), 0)
+    close_amount = math.ceil(round(close_amount / qty_step, 9)) * qty_step
+    close_amount = round(min(max(close_amount, min_qty), size), precision)
+    return close_amount, target
+
+
+class LiquidationGuard:
+    """
+    Контроль дельты до ликвидации по каждому обновлению тикера (MarketDataFeed.add_listener).
+    Дельта считается по mark-цене и позиции из памяти: get_position вызывается в потоке
+    WebSocket и не должен обращаться к REST (в том числе для перечитывания состояния);
+    при дельте ниже порога действие action() запускается в отдельном потоке, не задерживая
+    поток WebSocket. Одновременно выполняется не больше одного действия, после каждого —
+    пауза cooldown сек; срабатывания в это время только считаются (suppressed).
+    """
+
+    def __init__(self, symbol, get_position, min_delta, action, cooldown=60.0, log=logging.info, clock=time.monotonic):
+        self.symbol = symbol
+        self.get_position = get_position  # () -> позиция в формате REST или None
+        self.min_delta = min_delta  # {'LONG': %, 'SHORT': %}
+        self.action = action
+        self.cooldown = cooldown
+        self.log = log
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._running = False
+        self._next_allowed = 0.0
+        self.checks = 0  # Проверок дельты по тикерам
+        self.triggers = 0  # Запущенных действий
+        self.suppressed = 0  # Срабатываний во время действия или паузы
+
+    def on_ticker(self, symbol, ticker):
+        if symbol != self.symbol:
+            return
+        price = ticker.get('mark') or ticker.get('last')
+        if not price:
+            return
+        position = self.get_position()
+        if position is None or float(position.get('size') or 0) <= 0 or position.get('liqPrice') in (None, ''):
+            return
+        self.checks += 1
+        direction = 'LONG' if position['side'] == 'Buy' else 'SHORT'
+        delta = position_delta(direction, price, float(position['liqPrice']))
+        if delta >= self.min_delta[direction]:
+            return
+        with self._lock:
+            now = self.clock()
+            if self._running or now < self._next_allowed:
+                self.suppressed += 1
+                return
+            self._running = True
+            self.triggers += 1
+        self.log(f"🛡️ {self.symbol}: дельта {delta:.2f}% < {self.min_delta[direction]}% по mark {price}")
+        threading.Thread(target=self._run, name=f'liquidation-guard-{self.symbol}', daemon=True).start()
+
+    def _run(self):
+        try:
+            self.action()
+        except Exception as e:
+            self.log(f"⚠️ {self.symbol}: ошибка контроля ликвидации: {e}")
+        finally:
+            with self._lock:
+                self._running = False
+                self._next_allowed = self.clock() + self.cooldown
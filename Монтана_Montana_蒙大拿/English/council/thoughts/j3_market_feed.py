@@ -0,0 +1,116 @@
+# j3_market_feed
+
+import time
+import threading
+import logging
+
+
+# Поля тикера Bybit v5 (linear), которые храним в локальном кеше
+TICKER_FIELDS = {
+    'lastPrice': 'last',
+    'markPrice': 'mark',
+    'indexPrice': 'index',
+    'bid1Price': 'bid',
+    'ask1Price': 'ask',
+}
+
+
+def default_ws_factory():
+    """Публичный WebSocket Bybit для линейных контрактов (pybit)."""
+    from pybit.unified_trading import WebSocket
+    return WebSocket(testnet=False, channel_type="linear")
+
+
+class MarketDataFeed:
+    """
+    Подписка на публичный поток tickers.{symbol} и локальный кеш цен.
+    Для каждого символа хранит last/mark/index/bid/ask и время последнего обновления,
+    чтобы торговый цикл читал цену из памяти, а REST оставался только запасным путём.
+    ws_factory позволяет подставить локальную заглушку WebSocket: объект
+    с методами ticker_stream(symbol=..., callback=...) и exit().
+    """
+
+    def __init__(self, symbols, ws_factory=None, max_age=5.0, log=logging.info):
+        self.symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        self.ws_factory = ws_factory or default_ws_factory
+        self.max_age = max_age  # Максимальный возраст цены в кеше, сек
+        self.log = log
+        self.ws = None
+        self._lock = threading.Lock()
+        self._tickers = {}  # symbol -> {'last': float, 'mark': float, ..., 'updated': monotonic, 'ts': ms}
+        self._listeners = []
+        self.messages = 0  # Счётчик обработанных сообщений
+
+    def start(self):
+        """Подключается к WebSocket и подписывается на тикеры."""
+        if self.ws is not None:
+            return
+        try:
+            self.ws = self.ws_factory()
+            self.ws.ticker_stream(symbol=self.symbols, callback=self._on_ticker)
+            self.log(f"📡 Подписка на тикеры WebSocket: {', '.join(self.symbols)}")
+        except Exception as e:
+            self.ws = None
+            self.log(f"⚠️ Не удалось подключить WebSocket тикеров, используется REST: {e}")
+
+    def stop(self):
+        if self.ws is not None:
+            try:
+                self.ws.exit()
+            except Exception as e:
+                self.log(f"⚠️ Ошибка при закрытии WebSocket тикеров: {e}")
+            self.ws = None
+
+    def add_listener(self, callback):
+        """Регистрирует callback(symbol, ticker) на каждое обновление тикера."""
+        self._listeners.append(callback)
+
+    def _on_ticker(self, message):
+        data = message.get('data')
+        if not data:
+            return
+        # Snapshot и delta приходят одним объектом; delta содержит только изменённые поля
+        entries = data if isinstance(data, list) else [data]
+        for entry in entries:
+            symbol = entry.get('symbol')
+            if symbol is None:
+                continue
+            with self._lock:
+                ticker = self._tickers.setdefault(symbol, {})
+                for field, key in TICKER_FIELDS.items():
+                    value = entry.get(field)
+                    if value not in (None, ''):
+                        ticker[key] = float(value)
+                ticker['updated'] = time.monotonic()
+                ticker['ts'] = message.get('ts')
+                snapshot = dict(ticker)
+                self.messages += 1
+            for callback in self._listeners:
+                try:
+                    callback(symbol, snapshot)
+                except Exception as e:
+                    self.log(f"⚠️ Ошибка обработчика тикера {symbol}: {e}")
+
+    def get_ticker(self, symbol, max_age=None):
+        """Копия тикера из кеша или None, если данных нет или они устарели."""
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            ticker = self._tickers.get(symbol)
+            if ticker is None or time.monotonic() - ticker['updated'] > max_age:
+                return None
+            return dict(ticker)
+
+    def get_price(self, symbol, field='last', max_age=None):
+        """Цена из кеша (last, mark, index, bid, ask) или None, если она устарела."""
+        ticker = self.get_ticker(symbol, max_age)
+        if ticker is None:
+            return None
+        return ticker.get(field)
+
+    def age(self, symbol):
+        """Возраст данных тикера в секундах (None, если данных нет)."""
+        with self._lock:
+            ticker = self._tickers.get(symbol)
+            if ticker is None:
+                return None
+            return time.monotonic() - ticker['updated']
@@ -0,0 +1,198 @@
+# j3_metrics
+
+import os
+import time
+import threading
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в стиле HDR: значения в микросекундах, до 2**sub_bucket_bits мкс
+    хранятся точно, выше каждая октава делится на 2**(sub_bucket_bits - 1) равных корзин,
+    поэтому относительная ошибка квантиля не больше 2**(1 - sub_bucket_bits) (1,6% при 7 битах)
+    при фиксированной памяти. Значения больше 2**max_bits мкс (≈ 12 суток) попадают в последнюю корзину.
+    """
+
+    def __init__(self, sub_bucket_bits=7, max_bits=40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_bits = max_bits
+        self._exact = 1 << sub_bucket_bits
+        self._half = self._exact >> 1
+        self.counts = [0] * (self._exact + (max_bits - sub_bucket_bits + 1) * self._half)
+        self.count = 0
+        self.sum = 0.0  # Сек
+        self.max = 0.0  # Сек
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value < self._exact:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return min(self._exact + (shift - 1) * self._half + (value >> shift) - self._half, len(self.counts) - 1)
+
+    def _upper(self, index):
+        """Верхняя граница корзины, мкс."""
+        if index < self._exact:
+            return index
+        shift = (index - self._exact) // self._half + 1
+        top = (index - self._exact) % self._half + self._half
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        seconds = max(float(seconds), 0.0)
+        index = self._index(int(seconds * 1e6))
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """Квантиль q (0..1) в секундах; None — значений нет."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(int(q * self.count + 0.5), 1)
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(self._upper(index) / 1e6, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Реестр метрик процесса: гистограммы задержек этапов (LatencyHistogram) и счётчики
+    с метками. Счётчики объектов, которые ведут их сами (KlineSync, MarketDataFeed, Duty,
+    SnapshotProvider), читаются при выгрузке через сборщики add_collector(). render() — текстовый
+    формат Prometheus; write() записывает его в файл, serve() отдаёт по HTTP на /metrics.
+    """
+
+    def __init__(self, namespace='j3', log=logging.info):
+        self.namespace = namespace
+        self.log = log
+        self._lock = threading.Lock()
+        self._histograms = {}  # (имя, метки) -> LatencyHistogram
+        self._counters = {}  # (имя, метки) -> значение
+        self._help = {}  # имя -> (тип, описание)
+        self._collectors = []
+        self._server = None
+
+    def describe(self, name, kind, help_text):
+        self._help[f"{self.namespace}_{name}"] = (kind, help_text)
+
+    def histogram(self, name, **labels):
+        key = (f"{self.namespace}_{name}", tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).record(seconds)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Время выполнения блока with в гистограмму name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def inc(self, name, value=1, **labels):
+        key = (f"{self.namespace}_{name}", tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_collector(self, collector):
+        """collector() -> [(имя, тип, {метки}, значение)], вызывается при каждой выгрузке."""
+        self._collectors.append(collector)
+
+    # ---------------------------------------------------------- выгрузка
+
+    def _samples(self):
+        samples = {}  # имя -> (тип, [(метки, значение)])
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+        for (name, labels), histogram in histograms:
+            lines = samples.setdefault(name, ('summary', []))[1]
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                if value is not None:
+                    lines.append((name, labels + (('quantile', str(q)),), value))
+            lines.append((f"{name}_sum", labels, histogram.sum))
+            lines.append((f"{name}_count", labels, histogram.count))
+            # Максимум не входит в summary: отдельное семейство со своим TYPE
+            samples.setdefault(f"{name}_max", ('gauge', []))[1].append((f"{name}_max", labels, histogram.max))
+        for (name, labels), value in counters:
+            samples.setdefault(name, ('counter', []))[1].append((name, labels, value))
+        for collector in self._collectors:
+            try:
+                for name, kind, labels, value in collector():
+                    name = f"{self.namespace}_{name}"
+                    samples.setdefault(name, (kind, []))[1].append((name, tuple(sorted(labels.items())), value))
+            except Exception as e:
+                self.log(f"⚠️ Ошибка сборщика метрик: {e}")
+        return samples
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        out = []
+        for name, (kind, lines) in sorted(self._samples().items()):
+            help_kind, help_text = self._help.get(name, (kind, None))
+            if help_text:
+                out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {help_kind}")
+            for sample, labels, value in lines:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                out.append(f"{sample}{{{label_text}}} {float(value):.9g}" if label_text else f"{sample} {float(value):.9g}")
+        return '\n'.join(out) + '\n'
+
+    def write(self, path):
+        """Атомарная запись метрик в файл (для node_exporter textfile или ручного просмотра)."""
+        path = Path(path)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """HTTP /metrics в фоновом потоке (только локальный адрес по умолчанию)."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        self.log(f"📊 Метрики: http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
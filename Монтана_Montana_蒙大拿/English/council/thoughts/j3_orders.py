@@ -0,0 +1,269 @@
+# j3_orders
+
+import time
+import uuid
+import threading
+import logging
+
+
+ORDER_PENDING = 'pending'  # Создан, ещё не отправлен (или ждёт повтора после отказа)
+ORDER_SUBMITTED = 'submitted'  # Запрос place_order отправлен, ответ не получен
+ORDER_ACKED = 'acked'  # Биржа приняла ордер (есть orderId)
+ORDER_FILLED = 'filled'
+ORDER_FAILED = 'failed'
+ORDER_TRANSITIONS = {
+    ORDER_PENDING: {ORDER_SUBMITTED, ORDER_FAILED},
+    ORDER_SUBMITTED: {ORDER_ACKED, ORDER_PENDING, ORDER_FAILED},  # PENDING — повтор после отказа биржи
+    ORDER_ACKED: {ORDER_FILLED, ORDER_FAILED},
+    ORDER_FILLED: set(),
+    ORDER_FAILED: set(),
+}
+ORDER_LINK_ID_DUPLICATE = 110072  # retCode Bybit: ордер с таким orderLinkId уже есть — прежняя отправка дошла
+
+
+def call_with_retries(action, description, max_retries=5, delay=5, deadline=None, log=logging.info):
+    """
+    Вызов запроса к бирже с повторами (delay * 2**попытка) и общим сроком deadline (time.monotonic()).
+    Возвращает результат или None. Вызывать без удержания trades_lock.
+    """
+    for attempt in range(max_retries):
+        try:
+            return action()
+        except Exception as e:
+            log(f"⚠️ Ошибка: {description} (попытка {attempt + 1}/{max_retries}): {e}")
+            pause = delay * (2 ** attempt)
+            if deadline is not None:
+                pause = min(pause, deadline - time.monotonic())
+            if attempt >= max_retries - 1 or pause <= 0:
+                break
+            time.sleep(pause)
+    log(f"⚠️ Не удалось: {description}")
+    return None
+
+
+class Order:
+    """Рыночный ордер и его состояние: pending → submitted → acked → filled/failed."""
+
+    def __init__(self, side, qty, reduce_only=False, params=None, link_id=None):
+        self.side = side
+        self.qty = qty
+        self.reduce_only = reduce_only
+        self.params = params or {}  # Дополнительные поля place_order (например, marginMode)
+        self.link_id = link_id or f"j3-{uuid.uuid4().hex[:24]}"  # orderLinkId: повтор не создаст дубль
+        self.order_id = None
+        self.state = ORDER_PENDING
+        self.attempts = 0
+        self.next_attempt = 0.0  # time.monotonic(), раньше которого повтор не отправляется
+        self.deadline = None  # Срок текущего шага, time.monotonic()
+        self.submit_deadline = None  # Срок отправки: общий для всех повторов
+        self.filled_qty = 0.0
+        self.avg_price = None
+        self.error = None
+        self.history = []  # [(состояние, time.monotonic())]
+
+    @property
+    def done(self):
+        return self.state in (ORDER_FILLED, ORDER_FAILED)
+
+    def __repr__(self):
+        return f"Order({self.side} {self.qty}, {self.state}, id={self.order_id}, link={self.link_id})"
+
+
+class OrderExecutor:
+    """
+    Исполнение ордеров как конечного автомата. step() продвигает ордер не более чем на один
+    запрос к бирже и никогда не спит; execute() между шагами ждёт событие исполнения из
+    приватного потока execution (AccountStateStore) или короткий интервал опроса REST.
+    У каждого шага свой срок: отправка (submit_timeout), подтверждение (ack_timeout),
+    исполнение (fill_timeout) — по его истечении ордер переходит в failed.
+    Вызывающий код не должен держать trades_lock во время execute().
+    """
+
+    def __init__(self, client, symbol, account_state=None, category="linear", submit_timeout=60.0,
+                 ack_timeout=10.0, fill_timeout=30.0, poll_interval=0.5, max_retries=5, delay=5,
+                 log=logging.info, clock=time.monotonic):
+        self.client = client
+        self.symbol = symbol
+        self.account_state = account_state
+        self.category = category
+        self.timeouts = {ORDER_PENDING: submit_timeout, ORDER_SUBMITTED: ack_timeout, ORDER_ACKED: fill_timeout}
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.delay = delay
+        self.log = log
+        self.clock = clock
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self.in_flight = {}  # link_id -> Order
+
+    def _stream_live(self):
+        return self.account_state is not None and self.account_state.is_live()
+
+    def _transition(self, order, state, error=None):
+        if state not in ORDER_TRANSITIONS[order.state]:
+            raise ValueError(f"Недопустимый переход ордера {order.state} → {state}")
+        now = self.clock()
+        order.state = state
+        order.history.append((state, now))
+        if error is not None:
+            order.error = error
+        if state == ORDER_PENDING:
+            order.deadline = order.submit_deadline  # Повтор после отказа не продлевает срок отправки
+        elif state in self.timeouts:
+            order.deadline = now + self.timeouts[state]
+        with self._lock:
+            if order.done:
+                self.in_flight.pop(order.link_id, None)
+            else:
+                self.in_flight[order.link_id] = order
+        if state == ORDER_FAILED:
+            self.log(f"❌ Ордер {order.side} {order.qty} не исполнен: {order.error}")
+
+    def submit(self, order):
+        """Регистрирует ордер в состоянии pending."""
+        order.history.append((ORDER_PENDING, self.clock()))
+        order.deadline = order.submit_deadline = self.clock() + self.timeouts[ORDER_PENDING]
+        with self._lock:
+            self.in_flight[order.link_id] = order
+        return order
+
+    # ------------------------------------------------------------- шаги
+
+    def _place(self, order):
+        from pybit.exceptions import InvalidRequestError
+        order.attempts += 1
+        self._transition(order, ORDER_SUBMITTED)
+        try:
+            response = self.client.place_order(
+                category=self.category,
+                symbol=self.symbol,
+                side=order.side,
+                orderType="Market",
+                qty=str(order.qty),
+                reduceOnly=order.reduce_only,
+                orderLinkId=order.link_id,
+                **order.params
+            )
+        except InvalidRequestError as e:
+            # pybit сообщает об отказе биржи (retCode != 0) исключением, а не ответом
+            response = {'retCode': e.status_code, 'retMsg': e.message}
+        except Exception as e:
+            # Ответ не получен: ордер мог дойти до биржи, его судьба выясняется по orderLinkId
+            order.error = str(e)
+            self.log(f"⚠️ Ответ на размещение ордера не получен (попытка {order.attempts}/{self.max_retries}): {e}")
+            return self.poll_interval
+        if response['retCode'] == ORDER_LINK_ID_DUPLICATE:
+            # Предыдущая отправка дошла до биржи: ордер существует, ждём его исполнений по orderLinkId
+            self._transition(order, ORDER_ACKED)
+            self.log(f"✅ Ордер {order.link_id} уже принят биржей, проверяем исполнение ({order.side} {order.qty})")
+            return 0
+        if response['retCode'] != 0:
+            error = f"Ошибка API: {response['retMsg']}"
+            self.log(f"⚠️ Ошибка размещения ордера (попытка {order.attempts}/{self.max_retries}): {error}")
+            if order.attempts >= self.max_retries:
+                self._transition(order, ORDER_FAILED, error)
+                return 0
+            self._transition(order, ORDER_PENDING, error)
+            order.next_attempt = self.clock() + self.delay * (2 ** (order.attempts - 1))
+            return order.next_attempt - self.clock()
+        order.order_id = (response.get('result') or {}).get('orderId')
+        self._transition(order, ORDER_ACKED)
+        self.log(f"✅ Ордер принят биржей: {order.order_id} ({order.side} {order.qty})")
+        return 0
+
+    def _executions(self, order):
+        """Исполнения ордера через REST get_executions (по orderId или orderLinkId)."""
+        key = {'orderId': order.order_id} if order.order_id else {'orderLinkId': order.link_id}
+        response = self.client.get_executions(category=self.category, symbol=self.symbol, **key)
+        if response['retCode'] != 0:
+            raise ValueError(f"Ошибка API: {response['retMsg']}")
+        return [entry for entry in response['result']['list'] if entry.get('execType', 'Trade') == 'Trade']
+
+    def _apply_executions(self, order, executions):
+        """Обновляет исполненный объём; True, если ордер исполнен полностью."""
+        qty = sum(float(entry.get('execQty') or 0) for entry in executions)
+        if qty <= 0:
+            return False
+        value = sum(float(entry.get('execQty') or 0) * float(entry.get('execPrice') or 0) for entry in executions)
+        order.filled_qty = qty
+        order.avg_price = value / qty if value > 0 else None
+        if order.order_id is None:
+            order.order_id = executions[0].get('orderId')
+        leaves = [float(entry['leavesQty']) for entry in executions if entry.get('leavesQty') not in (None, '')]
+        return (min(leaves) == 0) if leaves else qty >= order.qty
+
+    def _fill(self, order, qty, price):
+        order.filled_qty = qty
+        order.avg_price = price
+        self._transition(order, ORDER_FILLED)
+        self.log(f"✅ Ордер {order.order_id} исполнен: {qty} по {price}")
+
+    def step(self, order):
+        """
+        Одно продвижение ордера без ожидания. Возвращает рекомендуемую паузу (сек)
+        до следующего шага; 0 — можно продолжать сразу.
+        """
+        now = self.clock()
+        if order.done:
+            return 0
+        if order.deadline is not None and now >= order.deadline:
+            reasons = {
+                ORDER_PENDING: "истёк срок отправки",
+                ORDER_SUBMITTED: "биржа не подтвердила ордер",
+                ORDER_ACKED: "исполнение не подтверждено",
+            }
+            if order.state == ORDER_SUBMITTED and order.attempts < self.max_retries:
+                # Ордер не найден на бирже — повторная отправка с тем же orderLinkId безопасна
+                self._transition(order, ORDER_PENDING, reasons[ORDER_SUBMITTED])
+                return 0
+            self._transition(order, ORDER_FAILED, reasons[order.state])
+            return 0
+        if order.state == ORDER_PENDING:
+            if now < order.next_attempt:
+                return order.next_attempt - now
+            return self._place(order)
+        if order.state == ORDER_SUBMITTED:
+            try:
+                executions = self._executions(order)
+            except Exception as e:
+                self.log(f"⚠️ Ошибка проверки ордера {order.link_id}: {e}")
+                return self.poll_interval
+            if executions:
+                self._transition(order, ORDER_ACKED)
+                if self._apply_executions(order, executions):
+                    self._fill(order, order.filled_qty, order.avg_price)
+            return self.poll_interval
+        # ORDER_ACKED: события потока execution; REST — без потока, без orderId или если событие запаздывает
+        if order.order_id and self._stream_live() and now < order.deadline - self.timeouts[ORDER_ACKED] / 2:
+            return self.poll_interval
+        try:
+            executions = self._executions(order)
+        except Exception as e:
+            self.log(f"⚠️ Ошибка проверки исполнения ордера {order.order_id}: {e}")
+            return self.poll_interval
+        if self._apply_executions(order, executions):
+            self._fill(order, order.filled_qty, order.avg_price)
+            return 0
+        return self.poll_interval
+
+    def _wait(self, order, timeout):
+        if timeout <= 0:
+            return
+        if order.deadline is not None:
+            timeout = max(min(timeout, order.deadline - self.clock()), 0)
+        if order.state == ORDER_ACKED and order.order_id and self._stream_live():
+            fill = self.account_state.wait_for_fill(order.order_id, timeout=timeout)
+            if fill is not None:
+                self._fill(order, fill['qty'], fill['price'])
+            return
+        self._wakeup.wait(timeout)
+
+    def execute(self, order):
+        """Проводит ордер до filled/failed. Блокирует только вызывающий поток."""
+        if not order.history:
+            self.submit(order)
+        while not order.done:
+            pause = self.step(order)
+            if not order.done:
+                self._wait(order, pause)
+        return order
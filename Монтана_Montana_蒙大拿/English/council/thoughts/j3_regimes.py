@@ -0,0 +1,177 @@
+# j3_regimes
+
+import os
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+
+DAY_MS = 24 * 3600 * 1000
+WEEK_MS = 7 * DAY_MS
+REGIME_NONE = 0
+REGIME_BULL = 1
+REGIME_BEAR = 2
+REGIME_CODES = {'bull': REGIME_BULL, 'bear': REGIME_BEAR}
+# Халвинги биткоина: (номер цикла, время блока)
+HALVINGS = [
+    (1, datetime(2012, 11, 28, 15, 24, 38, tzinfo=timezone.utc)),
+    (2, datetime(2016, 7, 9, 16, 46, 13, tzinfo=timezone.utc)),
+    (3, datetime(2020, 5, 11, 19, 23, 43, tzinfo=timezone.utc)),
+    (4, datetime(2024, 4, 20, 0, 9, 27, tzinfo=timezone.utc)),
+]
+WEEKS_BEFORE_HALVING = 100  # Сколько недельных свечей до халвинга нужно для поиска дна
+WEEKS_AFTER_HALVING = 10
+
+
+def to_ms(value):
+    """datetime/Timestamp -> мс UTC."""
+    return int(pd.Timestamp(value).value // 10**6)
+
+
+def monday_after(halving):
+    """Понедельник 00:00 UTC недели после халвинга (или день халвинга, если это понедельник)."""
+    if halving.weekday() == 0:
+        return halving.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (halving + timedelta(days=7 - halving.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def history_range(halvings=HALVINGS):
+    """Диапазон недельных свечей (start, end), покрывающий все циклы."""
+    return (halvings[0][1] - timedelta(weeks=WEEKS_BEFORE_HALVING),
+            halvings[-1][1] + timedelta(weeks=WEEKS_AFTER_HALVING))
+
+
+def candles_hash(times_ms, lows, halvings=HALVINGS):
+    """Хеш исходных данных таблицы: недельные свечи (время и минимум) и даты халвингов."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(times_ms, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(lows, dtype=np.float64).tobytes())
+    digest.update(json.dumps([[cycle, halving.isoformat()] for cycle, halving in halvings]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cycle_periods(cycle, halving, times_ms, lows):
+    """
+    Периоды bull и bear одного цикла: дно — меньший минимум из недель за 74 и 78 до халвинга,
+    пик — через 152 недели после дна, смена на bear через неделю после пика, bear длится 52 недели.
+    Возвращает список периодов или строку с причиной пропуска.
+    """
+    i_halving = int(np.searchsorted(times_ms, to_ms(monday_after(halving))))
+    if i_halving >= len(times_ms) or times_ms[i_halving] != to_ms(monday_after(halving)):
+        return "нет недельной свечи халвинга"
+    i_74 = i_halving - 74
+    i_78 = i_halving - 78
+    if i_74 < 0 or i_78 < 0:
+        return "индексы за пределами данных"
+    bottom_i = i_74 if lows[i_74] < lows[i_78] else i_78
+    bottom_date = pd.Timestamp(int(times_ms[bottom_i]), unit='ms', tz='UTC')
+    peak_date = bottom_date + timedelta(weeks=152)
+    change_to_bear = peak_date + timedelta(weeks=1)
+    bear_change = change_to_bear + timedelta(weeks=52)
+    return [
+        {'cycle': cycle, 'type': 'bull', 'start': bottom_date, 'change': change_to_bear},
+        {'cycle': cycle, 'type': 'bear', 'start': change_to_bear, 'change': bear_change},
+    ]
+
+
+class RegimeTable:
+    """
+    Таблица периодов рынка в виде отсортированных массивов дней (эпоха, UTC).
+    Тип рынка и дата следующей смены ищутся двоичным поиском; codes() размечает
+    сразу массив моментов времени. Как и прежний линейный поиск, сравнение идёт
+    по дням (start <= день < change), а при пересечении периодов побеждает более ранний в списке.
+    """
+
+    def __init__(self, periods, source_hash=None):
+        self.periods = periods
+        self.source_hash = source_hash
+        starts, changes, rows = [], [], []
+        covered_until = None
+        for row, period in enumerate(periods):
+            start_day = to_ms(pd.Timestamp(period['start']).normalize()) // DAY_MS
+            change_day = to_ms(pd.Timestamp(period['change']).normalize()) // DAY_MS
+            if covered_until is not None:
+                start_day = max(start_day, covered_until)  # Пересечение достаётся раннему периоду
+            if start_day >= change_day:
+                continue
+            starts.append(start_day)
+            changes.append(change_day)
+            rows.append(row)
+            covered_until = change_day if covered_until is None else max(covered_until, change_day)
+        order = np.argsort(starts, kind='stable')
+        self.start_days = np.asarray(starts, dtype=np.int64)[order]
+        self.change_days = np.asarray(changes, dtype=np.int64)[order]
+        self.rows = np.asarray(rows, dtype=np.int64)[order]
+        self.row_codes = np.asarray([REGIME_CODES[period['type']] for period in periods] + [REGIME_NONE], dtype=np.int8)
+
+    def __len__(self):
+        return len(self.periods)
+
+    def period_index(self, times_ms):
+        """Номер периода (в self.periods) для каждого момента времени или -1."""
+        days = np.asarray(times_ms, dtype=np.int64) // DAY_MS
+        if not len(self.start_days):
+            return np.full(days.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.start_days, days, side='right') - 1
+        safe = np.clip(pos, 0, len(self.start_days) - 1)
+        inside = (pos >= 0) & (days < self.change_days[safe])
+        return np.where(inside, self.rows[safe], -1)
+
+    def codes(self, times_ms, enable_bull=True, enable_bear=True):
+        """REGIME_* для каждого момента времени; выключенный рынок даёт REGIME_NONE."""
+        codes = self.row_codes[self.period_index(times_ms)]  # Индекс -1 попадает на REGIME_NONE в конце
+        if not enable_bull:
+            codes[codes == REGIME_BULL] = REGIME_NONE
+        if not enable_bear:
+            codes[codes == REGIME_BEAR] = REGIME_NONE
+        return codes
+
+    def lookup(self, date):
+        """Период, содержащий дату, или None."""
+        index = int(self.period_index(to_ms(date)))
+        return self.periods[index] if index >= 0 else None
+
+    # ------------------------------------------------------------ файл
+
+    def save(self, path):
+        """Атомарно сохраняет периоды и хеш исходных свечей в JSON."""
+        path = Path(path)
+        data = {
+            'source_hash': self.source_hash,
+            'periods': [dict(period, start=pd.Timestamp(period['start']).isoformat(),
+                             change=pd.Timestamp(period['change']).isoformat()) for period in self.periods],
+        }
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Таблица из файла или None, если файла нет или он повреждён."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            periods = [dict(period, start=pd.Timestamp(period['start']), change=pd.Timestamp(period['change']))
+                       for period in data['periods']]
+            return cls(periods, source_hash=data.get('source_hash'))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+def build_regime_table(times_ms, lows, halvings=HALVINGS, log=print):
+    """Периоды рынка всех циклов по недельным свечам (отсортированным по времени)."""
+    times_ms = np.asarray(times_ms, dtype=np.int64)
+    lows = np.asarray(lows, dtype=np.float64)
+    periods = []
+    for cycle, halving in halvings:
+        result = cycle_periods(cycle, halving, times_ms, lows)
+        if isinstance(result, str):
+            log(f"⚠️ Цикл {cycle} (халвинг {halving.strftime('%Y-%m-%d')}): {result}, пропуск")
+            continue
+        periods.extend(result)
+    return RegimeTable(periods, source_hash=candles_hash(times_ms, lows, halvings))
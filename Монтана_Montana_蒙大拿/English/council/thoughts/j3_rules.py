@@ -0,0 +1,150 @@
+# j3_rules
+
+import numpy as np
+
+
+# Правила входа и выхода: (рынок, направление, действие, условие, флаг индикатора, описание).
+# Порядок строк — порядок проверки: из нескольких сработавших правил исполняется первое.
+# Правило включено, если TRADING_CONFIG[f'ENABLE_{РЫНОК}_{флаг}'] и (для входа) ENABLE_{РЫНОК}_{НАПРАВЛЕНИЕ].
+# Причина закрытия в журнале сделок совпадает с именем условия.
+SIGNAL_RULES = [
+    ('bull', 'LONG', 'open', 'rsi_up', 'RSI', "Пересечение RSI вверх"),
+    ('bull', 'LONG', 'open', 'williams_oversold', 'WILLIAMS_OVERSOLD', "Перепроданность Williams %R"),
+    ('bull', 'LONG', 'open', 'fear_greed_low', 'FEAR_GREED', "Низкий индекс страха"),
+    ('bull', 'LONG', 'open', 'stoch_up', 'STOCHRSI', "Пересечение StochRSI вверх"),
+    ('bull', 'SHORT', 'open', 'rsi_down', 'RSI', "Пересечение RSI вниз"),
+    ('bull', 'SHORT', 'open', 'williams_overbought', 'WILLIAMS_OVERBOUGHT', "Перекупленность Williams %R"),
+    ('bull', 'SHORT', 'open', 'always', 'FEAR_GREED', "Высокий индекс жадности"),  # Без порога, как в прежнем check_signals
+    ('bull', 'SHORT', 'open', 'stoch_down', 'STOCHRSI', "Пересечение StochRSI вниз"),
+    ('bull', 'LONG', 'close', 'rsi_down', 'RSI', "Пересечение RSI вниз"),
+    ('bull', 'LONG', 'close', 'stoch_down', 'STOCHRSI', "Пересечение StochRSI вниз"),
+    ('bull', 'LONG', 'close', 'williams_overbought', 'WILLIAMS_OVERBOUGHT', "Перекупленность Williams %R"),
+    ('bull', 'SHORT', 'close', 'rsi_up', 'RSI', "Пересечение RSI вверх"),
+    ('bull', 'SHORT', 'close', 'stoch_up', 'STOCHRSI', "Пересечение StochRSI вверх"),
+    ('bull', 'SHORT', 'close', 'williams_oversold', 'WILLIAMS_OVERSOLD', "Перепроданность Williams %R"),
+    ('bear', 'SHORT', 'open', 'rsi_down', 'RSI', "Пересечение RSI вниз"),
+    ('bear', 'SHORT', 'open', 'williams_overbought', 'WILLIAMS_OVERBOUGHT', "Перекупленность Williams %R"),
+    ('bear', 'SHORT', 'open', 'fear_greed_high', 'FEAR_GREED', "Высокий индекс страха"),
+    ('bear', 'SHORT', 'open', 'stoch_down', 'STOCHRSI', "Пересечение StochRSI вниз"),
+    ('bear', 'LONG', 'open', 'rsi_up', 'RSI', "Пересечение RSI вверх"),
+    ('bear', 'LONG', 'open', 'williams_oversold', 'WILLIAMS_OVERSOLD', "Перепроданность Williams %R"),
+    ('bear', 'LONG', 'open', 'always', 'FEAR_GREED', "Низкий индекс страха"),  # Без порога, как в прежнем check_signals
+    ('bear', 'LONG', 'open', 'stoch_up', 'STOCHRSI', "Пересечение StochRSI вверх"),
+    ('bear', 'SHORT', 'close', 'rsi_up', 'RSI', "Пересечение RSI вверх"),
+    ('bear', 'SHORT', 'close', 'stoch_up', 'STOCHRSI', "Пересечение StochRSI вверх"),
+    ('bear', 'SHORT', 'close', 'williams_oversold', 'WILLIAMS_OVERSOLD', "Перепроданность Williams %R"),
+    ('bear', 'LONG', 'close', 'rsi_down', 'RSI', "Пересечение RSI вниз"),
+    ('bear', 'LONG', 'close', 'stoch_down', 'STOCHRSI', "Пересечение StochRSI вниз"),
+    ('bear', 'LONG', 'close', 'williams_overbought', 'WILLIAMS_OVERBOUGHT', "Перекупленность Williams %R"),
+]
+DIRECTIONS = ('LONG', 'SHORT')
+
+
+def crossings(current, reference):
+    """Пересечения вверх/вниз между соседними свечами (RSI и SMA RSI, StochRSI K и D)."""
+    previous = np.r_[np.nan, current[:-1]]
+    previous_reference = np.r_[np.nan, reference[:-1]]
+    up = (previous < previous_reference) & (current > reference)
+    down = (previous > previous_reference) & (current < reference)
+    return up, down
+
+
+class CompiledRules:
+    """
+    Таблица SIGNAL_RULES, скомпилированная под конкретную стратегию: выключенные правила
+    отброшены, пороги прочитаны один раз. Условия считаются векторно по массивам свечей,
+    поэтому одни и те же правила работают и на всей истории в бэктесте, и на последних
+    двух свечах в живом цикле (entry / exit) — без запросов к бирже и с одинаковым результатом.
+    """
+
+    def __init__(self, strategy, rules=SIGNAL_RULES):
+        config = strategy['TRADING_CONFIG']
+        self.thresholds = {}
+        self.open_rules = {}  # рынок -> [(тип сделки, условие, флаг, описание)]
+        self.close_rules = {}  # тип сделки -> [(условие, флаг, описание)]
+        for market_type in ('bull', 'bear'):
+            prefix = market_type.upper()
+            self.thresholds[market_type] = {
+                'williams_overbought': strategy[f'{prefix}_WILLIAMS_OVERBOUGHT_LEVEL'],
+                'williams_oversold': strategy[f'{prefix}_WILLIAMS_OVERSOLD_LEVEL'],
+                'fear_greed_low': strategy.get(f'{prefix}_FEAR_GREED_LOW'),
+                'fear_greed_high': strategy.get(f'{prefix}_FEAR_GREED_HIGH'),
+            }
+            self.open_rules[market_type] = []
+            for direction in DIRECTIONS:
+                self.close_rules[f'{prefix}_{direction}'] = []
+        for market_type, direction, action, condition, flag, description in rules:
+            prefix = market_type.upper()
+            trade_type = f'{prefix}_{direction}'
+            if not config.get(f'ENABLE_{prefix}_MARKET', True) or not config[f'ENABLE_{prefix}_{flag}']:
+                continue
+            if action == 'open':
+                if config[f'ENABLE_{trade_type}']:
+                    self.open_rules[market_type].append((trade_type, condition, flag, description))
+            else:
+                self.close_rules[trade_type].append((condition, flag, description))
+
+    def conditions(self, market_type, indicators, fear_greed):
+        """Булевы массивы условий по свечам для индикаторов типа рынка market_type."""
+        thresholds = self.thresholds[market_type]
+        rsi = np.asarray(indicators['RSI'], dtype=np.float64)
+        rsi_up, rsi_down = crossings(rsi, np.asarray(indicators['RSI-based MA'], dtype=np.float64))
+        stoch_up, stoch_down = crossings(np.asarray(indicators['StochRSI_K'], dtype=np.float64),
+                                         np.asarray(indicators['StochRSI_D'], dtype=np.float64))
+        fear_greed = np.asarray(fear_greed, dtype=np.float64)
+        result = {
+            'rsi_up': rsi_up,
+            'rsi_down': rsi_down,
+            'stoch_up': stoch_up,
+            'stoch_down': stoch_down,
+            'williams_overbought': np.asarray(indicators['Williams_R_Overbought'], dtype=np.float64) >= thresholds['williams_overbought'],
+            'williams_oversold': np.asarray(indicators['Williams_R_Oversold'], dtype=np.float64) <= thresholds['williams_oversold'],
+            'always': np.ones(len(rsi), dtype=bool),
+        }
+        if thresholds['fear_greed_low'] is not None:
+            result['fear_greed_low'] = fear_greed <= thresholds['fear_greed_low']
+        if thresholds['fear_greed_high'] is not None:
+            result['fear_greed_high'] = fear_greed >= thresholds['fear_greed_high']
+        return result
+
+    def signals(self, market_type, indicators, fear_greed):
+        """
+        Сигналы одного типа рынка по свечам: open — индекс сработавшего правила входа
+        в open_rules[market_type] (-1 — нет), close — {тип сделки: индекс правила выхода или -1}.
+        """
+        conditions = self.conditions(market_type, indicators, fear_greed)
+        n = len(conditions['always'])
+        open_rule = np.full(n, -1, dtype=np.int16)
+        # Обратный порядок: первое сработавшее правило перезаписывает последующие
+        for number in range(len(self.open_rules[market_type]) - 1, -1, -1):
+            open_rule[conditions[self.open_rules[market_type][number][1]]] = number
+        close_rule = {}
+        prefix = market_type.upper()
+        for direction in DIRECTIONS:
+            trade_type = f'{prefix}_{direction}'
+            fired = np.full(n, -1, dtype=np.int16)
+            for number in range(len(self.close_rules[trade_type]) - 1, -1, -1):
+                fired[conditions[self.close_rules[trade_type][number][0]]] = number
+            close_rule[trade_type] = fired
+        return {'open': open_rule, 'close': close_rule}
+
+    def entry(self, market_type, indicators, fear_greed):
+        """
+        Правило входа живого цикла по последней свече (indicators — массивы [предыдущее, текущее]):
+        (тип сделки, условие, флаг, описание) или None.
+        """
+        number = int(self.signals(market_type, indicators, fear_greed)['open'][-1])
+        return self.open_rules[market_type][number] if number >= 0 else None
+
+    def exit(self, market_type, indicators, fear_greed, trade_type):
+        """Правило выхода из открытой сделки trade_type по последней свече: (условие, флаг, описание) или None."""
+        close_rule = self.signals(market_type, indicators, fear_greed)['close']
+        if trade_type not in close_rule:
+            return None
+        number = int(close_rule[trade_type][-1])
+        return self.close_rules[trade_type][number] if number >= 0 else None
+
+
+def compile_rules(strategy, rules=SIGNAL_RULES):
+    """Компиляция таблицы правил под параметры стратегии (словарь как load_strategy_params)."""
+    return CompiledRules(strategy, rules)
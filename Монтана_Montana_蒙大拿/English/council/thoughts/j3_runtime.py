@@ -0,0 +1,222 @@
+# j3_runtime
+
+import heapq
+import asyncio
+import logging
+from datetime import timedelta
+
+
+class TimerWheel:
+    """
+    Таймеры по часам биржи: куча (время срабатывания, порядковый номер, имя).
+    Один цикл ждёт ближайший срок и вызывает обратный вызов в потоке event loop;
+    таймеры с одинаковым сроком срабатывают в порядке постановки.
+    """
+
+    def __init__(self, clock, log=logging.info):
+        self.clock = clock  # Функция без аргументов -> datetime с часовым поясом
+        self.log = log
+        self._heap = []
+        self._seq = 0
+        self._active = {}  # имя -> порядковый номер актуальной постановки
+        self._wakeup = None
+
+    def schedule(self, name, when, callback):
+        """Ставит (или переставляет) таймер name на время when."""
+        self._seq += 1
+        self._active[name] = self._seq
+        heapq.heappush(self._heap, (when, self._seq, name, callback))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, name):
+        self._active.pop(name, None)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            while self._heap and self._active.get(self._heap[0][2]) != self._heap[0][1]:
+                heapq.heappop(self._heap)  # Отменённые и переставленные таймеры
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            when, seq, name, callback = self._heap[0]
+            delay = (when - self.clock()).total_seconds()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            del self._active[name]
+            try:
+                callback(when)
+            except Exception as e:
+                self.log(f"⚠️ Ошибка таймера {name}: {e}")
+
+
+class Duty:
+    """
+    Независимая обязанность бота (обновление данных, сигналы, контроль ликвидации, отчёт).
+    Своя задача asyncio ждёт срабатывания и выполняет блокирующее действие (REST pybit)
+    в пуле потоков с ограничением по времени. Зависший запрос не задерживает другие задачи:
+    по тайм-ауту задача продолжает работу, а новые срабатывания пропускаются, пока
+    предыдущий вызов не завершится. Срабатывания, пришедшие во время выполнения, сливаются в одно.
+    group — общий asyncio.Lock для обязанностей, которые нельзя выполнять одновременно;
+    он освобождается только после завершения потока, даже если тайм-аут уже истёк.
+    retries — сколько раз повторить неудачный или зависший запуск с тем же when
+    (через retry_delay сек после завершения потока), пока новое срабатывание его не заменит.
+    """
+
+    def __init__(self, name, action, timeout, group=None, log=logging.info, retries=0, retry_delay=30):
+        self.name = name
+        self.action = action  # Функция (when) -> результат, выполняется в потоке
+        self.timeout = timeout  # Сек
+        self.group = group
+        self.log = log
+        self.retries = retries
+        self.retry_delay = retry_delay  # Сек
+        self.followers = []  # Обязанности, которые запускаются после успешного выполнения
+        self.on_finished = []  # Обратные вызовы (when) в потоке event loop после каждого запуска
+        self.runs = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._event = None
+        self._pending = None
+        self._running = None
+        self._failed_when = None
+        self._failures = 0  # Неудачных запуска подряд для _failed_when
+
+    def trigger(self, when=None):
+        self._pending = when
+        if self._event is not None:
+            self._event.set()
+
+    def _retry(self, when):
+        if self._pending == when:  # Новое срабатывание уже заменило неудачное
+            self.trigger(when)
+
+    def _schedule_retry(self, when):
+        if when != self._failed_when:
+            self._failed_when, self._failures = when, 0
+        if self._failures >= self.retries:
+            if self.retries:
+                self.log(f"⚠️ {self.name}: повторы исчерпаны ({self.retries}), ждём следующего срабатывания")
+            return
+        self._failures += 1
+        self.log(f"🔁 {self.name}: повтор {self._failures}/{self.retries} через {self.retry_delay} сек")
+        loop = asyncio.get_running_loop()
+        # Зависший поток ещё работает: отсчёт паузы начинается после его завершения
+        self._running.add_done_callback(lambda _: loop.call_later(self.retry_delay, self._retry, when))
+
+    async def _execute(self, when):
+        self._running = asyncio.ensure_future(asyncio.to_thread(self.action, when))
+        done, _ = await asyncio.wait({self._running}, timeout=self.timeout)
+        if not done:
+            self.timeouts += 1
+            self.log(f"⏱️ {self.name}: превышено время выполнения {self.timeout} сек")
+            return False
+        try:
+            self._running.result()
+        except Exception as e:
+            self.errors += 1
+            self.log(f"⚠️ Ошибка в задаче {self.name}: {e}")
+            return False
+        return True
+
+    async def run(self):
+        self._event = asyncio.Event()
+        if self._pending is not None:
+            self._event.set()
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            when = self._pending
+            if self._running is not None and not self._running.done():
+                self.log(f"⏱️ {self.name}: предыдущий запуск ещё выполняется, срабатывание пропущено")
+                ok = None
+            elif self.group is None:
+                ok = await self._execute(when)
+            else:
+                await self.group.acquire()
+                try:
+                    ok = await self._execute(when)
+                finally:
+                    if self._running.done():
+                        self.group.release()
+                    else:
+                        # Поток продолжает работу с общими данными: группа занята до его завершения
+                        self._running.add_done_callback(lambda _: self.group.release())
+            self.runs += 1
+            if ok:
+                self._failed_when, self._failures = None, 0
+                for follower in self.followers:
+                    follower.trigger(when)
+            elif ok is False:
+                self._schedule_retry(when)
+            for callback in self.on_finished:
+                callback(when)
+
+
+class Runtime:
+    """
+    Событийное ядро: колесо таймеров по закрытию свечей и смене рынка
+    и отдельная задача asyncio на каждую обязанность. stop() отменяет все задачи.
+    """
+
+    def __init__(self, clock, log=logging.info, retry_delay=2):
+        self.clock = clock
+        self.log = log
+        self.retry_delay = retry_delay  # Сек: минимальная пауза перед повтором таймера
+        self.wheel = TimerWheel(clock, log=log)
+        self.duties = {}
+        self._tasks = []
+        self._stop = None
+
+    def add_duty(self, name, action, timeout, group=None, after=(), retries=0, retry_delay=30):
+        """
+        Регистрирует обязанность; after — обязанности, после успешного выполнения которых она запускается.
+        retries/retry_delay — повторы неудачного запуска (см. Duty).
+        """
+        duty = Duty(name, action, timeout, group=group, log=self.log, retries=retries, retry_delay=retry_delay)
+        self.duties[name] = duty
+        for previous in after:
+            self.duties[previous].followers.append(duty)
+        return duty
+
+    def every(self, name, next_time, duty_name):
+        """
+        Периодический таймер: срабатывает в next_time(сейчас) и запускает обязанность.
+        Следующий срок считается после её завершения; None — таймер больше не ставится.
+        """
+        duty = self.duties[duty_name]
+
+        def reschedule(_=None):
+            now = self.clock()
+            when = next_time(now)
+            if when is None:
+                return
+            if when <= now:
+                when = now + timedelta(seconds=self.retry_delay)  # Срок уже прошёл, а действие не помогло
+            self.wheel.schedule(name, when, duty.trigger)
+
+        duty.on_finished.append(reschedule)
+        reschedule()
+
+    async def run(self):
+        self._stop = asyncio.Event()
+        self._tasks = [asyncio.create_task(self.wheel.run(), name='timer_wheel')]
+        self._tasks += [asyncio.create_task(duty.run(), name=name) for name, duty in self.duties.items()]
+        try:
+            await self._stop.wait()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
@@ -0,0 +1,88 @@
+# j3_snapshot
+
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AccountSnapshot:
+    """
+    Согласованный срез аккаунта и рынка на один цикл решения: баланс USDT, ответ
+    get_positions (в формате REST) и последняя цена. Срез неизменяем и передаётся явно
+    через проверку сигналов, расчёт объёма и отчёт, поэтому все они видят одни и те же данные.
+    Поле равно None, если его не удалось получить; ошибка сохраняется в errors.
+    """
+
+    def __init__(self, balance, positions_response, price, taken_at, errors=None):
+        self.balance = balance
+        self.positions_response = positions_response
+        self.price = price
+        self.taken_at = taken_at  # time.monotonic() момента получения
+        self.errors = errors or {}  # поле -> текст ошибки
+
+    @property
+    def position(self):
+        """Первая позиция символа в формате REST или None."""
+        response = self.positions_response
+        if response is None or response.get('retCode') != 0 or not response['result']['list']:
+            return None
+        return response['result']['list'][0]
+
+    def age(self, clock=time.monotonic):
+        return clock() - self.taken_at
+
+    def __repr__(self):
+        return f"AccountSnapshot(balance={self.balance}, price={self.price}, age={self.age():.1f}s)"
+
+
+class SnapshotProvider:
+    """
+    Источник срезов с коротким TTL. Баланс, позиции и цена запрашиваются одновременно
+    в небольшом пуле потоков (при живых потоках WebSocket каждый запрос читает память).
+    Одновременные вызовы get() ждут одного общего запроса, а не дублируют его.
+    После ордеров срез сбрасывается через invalidate().
+    """
+
+    def __init__(self, fetch_balance, fetch_positions, fetch_price, ttl=2.0, log=logging.info, clock=time.monotonic):
+        self.fetchers = {'balance': fetch_balance, 'positions_response': fetch_positions, 'price': fetch_price}
+        self.ttl = ttl  # Сек
+        self.log = log
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=len(self.fetchers), thread_name_prefix='snapshot')
+        self._snapshot = None
+        self.fetches = 0  # Сколько раз срез запрашивался у источников
+        self.hits = 0  # Сколько раз отдан готовый срез
+
+    def _fetch(self):
+        futures = {name: self._pool.submit(fetch) for name, fetch in self.fetchers.items()}
+        values, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                values[name] = future.result()
+            except Exception as e:
+                values[name] = None
+                errors[name] = str(e)
+                self.log(f"⚠️ Срез аккаунта: не удалось получить {name}: {e}")
+        self.fetches += 1
+        return AccountSnapshot(values['balance'], values['positions_response'], values['price'],
+                               taken_at=self.clock(), errors=errors)
+
+    def get(self, max_age=None, refresh=False):
+        """Срез не старше max_age (по умолчанию ttl); refresh=True — всегда новый."""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            snapshot = self._snapshot
+            if not refresh and snapshot is not None and self.clock() - snapshot.taken_at <= max_age:
+                self.hits += 1
+                return snapshot
+            self._snapshot = self._fetch()
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def close(self):
+        self._pool.shutdown(wait=False)
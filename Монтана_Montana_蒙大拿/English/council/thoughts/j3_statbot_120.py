@@ -39,6 +39,7 @@ import datetime as dt
 from pybit.unified_trading import HTTP
 import getpass
 import subprocess
+from j3_clock import ExchangeClock
 
 
 
@@ -71,23 +72,18 @@ def log_event(event):
     
     logging.info(f"{event}")
 
+exchange_clock = None # Локальные часы биржи (ExchangeClock)
+
 def get_server_time():
-    try:
-        response = client.get_server_time()
-        if response['retCode'] == 0:
-            server_time_ms = int(response['result']['timeSecond']) * 1000
-            return datetime.fromtimestamp(server_time_ms / 1000, tz=timezone.utc)
-        else:
-            log_event(f"⚠️ Ошибка получения времени сервера: {response['retMsg']}")
-            return datetime.now(timezone.utc)
-    except Exception as e:
-        # log_event(f"⚠️ Ошибка при получении времени сервера: {e}")  # Комментируем, чтобы избежать рекурсии если log_event вызывает это
-        return datetime.now(timezone.utc)
+    """Время биржи из локальных часов ExchangeClock (без запроса к API)."""
+    if exchange_clock is not None:
+        return exchange_clock.now()
+    return datetime.now(timezone.utc)
 
 
 
-# Переключатель авторизации: True - Bitwarden, False - .env файл
-USE_BITWARDEN = True  # Измените на False для использования .env
+# Переключатель авторизации: True - Bitwarden, False - .env файл (или переменная окружения USE_BITWARDEN=false)
+USE_BITWARDEN = os.getenv('USE_BITWARDEN', 'true').lower() != 'false'  # Измените на False для использования .env
 
 if USE_BITWARDEN:
     # Оригинальный код для Bitwarden с улучшениями
@@ -163,12 +159,6 @@ if USE_BITWARDEN:
         testnet=False                 # Установите True для тестовой сети
     )
 
-    # Проверка расхождения времени (после создания client)
-    server_time = get_server_time()
-    local_time = datetime.now(timezone.utc)
-    time_diff = abs((server_time - local_time).total_seconds())
-    if time_diff > 60:
-        log_event(f"⚠️ Расхождение времени: локальное {local_time}, сервер Bybit {server_time} (разница {time_diff:.0f} сек). Это может вызвать ошибки с токенами Bitwarden. Синхронизируйте время сервера (NTP).")
 else:
     load_dotenv()
     BYBIT_API_KEY = os.getenv('BYBIT_API_KEY')
@@ -182,6 +172,25 @@ else:
         testnet=False
     )
 
+# Локальный симулятор биржи (python j3_exchange_sim.py): REST и WebSocket без сети
+BYBIT_ENDPOINT = os.getenv('BYBIT_ENDPOINT')
+if BYBIT_ENDPOINT:
+    client.endpoint = BYBIT_ENDPOINT.rstrip('/')
+    log_event(f"🧪 Биржа: локальный симулятор {client.endpoint}")
+
+# Синхронизация часов с биржей один раз, далее время берётся локально с фоновой пересинхронизацией
+exchange_clock = ExchangeClock(client, log=log_event)
+exchange_clock.sync()
+exchange_clock.start()
+
+# Проверка расхождения времени (после синхронизации часов)
+if USE_BITWARDEN:
+    server_time = get_server_time()
+    local_time = datetime.now(timezone.utc)
+    time_diff = abs((server_time - local_time).total_seconds())
+    if time_diff > 60:
+        log_event(f"⚠️ Расхождение времени: локальное {local_time}, сервер Bybit {server_time} (разница {time_diff:.0f} сек). Это может вызвать ошибки с токенами Bitwarden. Синхронизируйте время сервера (NTP).")
+
 
 
 
@@ -0,0 +1,373 @@
+# j3_sweep
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+from pathlib import Path
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from j3_backtest import (
+    run_backtest, load_strategy_params, indicator_params, aggregate_candles, REGIME_NAMES
+)
+from j3_indicators import wilder_rsi, running_sma, stoch_rsi, williams_r
+from j3_fear_greed import FearGreedStore
+
+
+# Параметры, от которых зависят индикаторы: их перебор идёт во внешних циклах,
+# чтобы соседние комбинации попадали в кеш индикаторов одного процесса
+INDICATOR_SUFFIXES = (
+    'RSI_PERIOD', 'SMA_RSI_PERIOD', 'STOCHRSI_RSI_PERIOD', 'STOCHRSI_STOCH_PERIOD', 'STOCHRSI_K_PERIOD',
+    'STOCHRSI_D_PERIOD', 'WILLIAMS_OVERBOUGHT_PERIOD', 'WILLIAMS_OVERBOUGHT_SOURCE',
+    'WILLIAMS_OVERSOLD_PERIOD', 'WILLIAMS_OVERSOLD_SOURCE',
+)
+SWEEP_FILE = 'sweep.json'  # Отпечаток перебора в каталоге результатов
+METRIC_COLUMNS = ['final_balance', 'return_percent', 'max_drawdown_percent', 'trades', 'win_rate', 'liquidations']
+
+
+class SharedCandles:
+    """
+    Свечи в одном блоке multiprocessing.shared_memory: время (int64) и open/high/low/close (float64).
+    Процессы подключаются по имени блока и читают массивы без копирования.
+    """
+
+    def __init__(self, name, length, shm=None, owner=False):
+        self.name = name
+        self.length = length
+        self.shm = shm or shared_memory.SharedMemory(name=name)
+        self.owner = owner
+        self.times = np.ndarray((length,), dtype=np.int64, buffer=self.shm.buf)
+        self.values = np.ndarray((4, length), dtype=np.float64, buffer=self.shm.buf, offset=length * 8)
+
+    @classmethod
+    def create(cls, times_ms, opens, highs, lows, closes):
+        length = len(times_ms)
+        shm = shared_memory.SharedMemory(create=True, size=max(5 * length * 8, 1))
+        candles = cls(shm.name, length, shm=shm, owner=True)
+        candles.times[:] = times_ms
+        for row, values in enumerate((opens, highs, lows, closes)):
+            candles.values[row] = values
+        return candles
+
+    def columns(self):
+        """Представления (time, open, high, low, close) без копирования."""
+        return (self.times, self.values[0], self.values[1], self.values[2], self.values[3])
+
+    def close(self):
+        self.times = None
+        self.values = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class IndicatorCache:
+    """
+    Кеш индикаторов процесса: каждый компонент (RSI, SMA от RSI, StochRSI, Williams %R)
+    считается один раз для своего набора периодов и переиспользуется всеми комбинациями.
+    """
+
+    def __init__(self, opens, highs, lows, closes):
+        self.opens = opens
+        self.highs = highs
+        self.lows = lows
+        self.closes = closes
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, compute):
+        value = self._cache.get(key)
+        if value is None:
+            self.misses += 1
+            value = compute()
+            self._cache[key] = value
+        else:
+            self.hits += 1
+        return value
+
+    def indicators(self, params):
+        rsi = self._get(('rsi', params['rsi_period']), lambda: wilder_rsi(self.closes, params['rsi_period']))
+        stoch_key = ('stoch', params['stochrsi_rsi_period'], params['stochrsi_stoch_period'], params['stochrsi_k_period'])
+        stoch_k = self._get(stoch_key, lambda: stoch_rsi(self.closes, *stoch_key[1:])[1])
+        overbought_source = self.opens if params['williams_overbought_source'] == 'Open' else self.closes
+        oversold_source = self.opens if params['williams_oversold_source'] == 'Open' else self.closes
+        overbought_key = ('williams', params['williams_overbought_period'], params['williams_overbought_source'])
+        oversold_key = ('williams', params['williams_oversold_period'], params['williams_oversold_source'])
+        return {
+            'RSI': rsi,
+            'RSI-based MA': self._get(('sma_rsi', params['rsi_period'], params['sma_rsi_period']),
+                                      lambda: running_sma(rsi, params['sma_rsi_period'])),
+            'StochRSI_K': stoch_k,
+            'StochRSI_D': self._get(stoch_key + (params['stochrsi_d_period'],),
+                                    lambda: running_sma(stoch_k, params['stochrsi_d_period'])),
+            'Williams_R_Overbought': self._get(overbought_key, lambda: williams_r(self.highs, self.lows, overbought_source, overbought_key[1])),
+            'Williams_R_Oversold': self._get(oversold_key, lambda: williams_r(self.highs, self.lows, oversold_source, oversold_key[1])),
+        }
+
+
+def order_grid(grid):
+    """Порядок параметров перебора: сначала индикаторные (меняются реже всего), затем уровни и пороги."""
+    names = list(grid)
+    return sorted(names, key=lambda name: (not name.endswith(INDICATOR_SUFFIXES), names.index(name)))
+
+
+def iter_combinations(grid):
+    """Пары (номер, словарь параметров) во внутреннем порядке перебора."""
+    names = order_grid(grid)
+    for number, values in enumerate(itertools.product(*(grid[name] for name in names))):
+        yield number, dict(zip(names, values))
+
+
+def summarize(result, initial_balance):
+    """Метрики одного прогона бэктеста."""
+    equity = result['equity']
+    peak = np.maximum.accumulate(equity)
+    drawdown = np.where(peak > 0, (peak - equity) / peak * 100, 0.0)
+    trades = result['trades']
+    closed = trades[trades['Status'] != 'open']
+    return {
+        'final_balance': result['balance'],
+        'return_percent': (result['balance'] / initial_balance - 1) * 100,
+        'max_drawdown_percent': float(drawdown.max()) if len(drawdown) else 0.0,
+        'trades': int(trades['Trade_ID'].nunique()),
+        'win_rate': float((closed['Net_PnL_USDT'] > 0).mean() * 100) if len(closed) else 0.0,
+        'liquidations': int((closed['Status'] == 'liquidation').sum()),
+    }
+
+
+# ------------------------------------------------------------- процессы
+
+_worker = {}
+
+
+def _init_worker(shm_name, length, base_strategy, market_periods, fear_greed, initial_balance):
+    candles = SharedCandles(shm_name, length)
+    times_ms, opens, highs, lows, closes = candles.columns()
+    week_time, week_open, week_high, week_low, week_close, _ = aggregate_candles(times_ms, opens, highs, lows, closes)
+    _worker.update({
+        'candles': candles,
+        'columns': (times_ms, opens, highs, lows, closes),
+        'cache': IndicatorCache(week_open, week_high, week_low, week_close),
+        'strategy': base_strategy,
+        'market_periods': market_periods,
+        'fear_greed': fear_greed,
+        'initial_balance': initial_balance,
+    })
+
+
+def apply_params(base_strategy, params):
+    """Стратегия с подставленными параметрами (ключи TRADING_CONFIG задаются как 'TRADING_CONFIG.КЛЮЧ')."""
+    strategy = dict(base_strategy)
+    strategy['TRADING_CONFIG'] = dict(base_strategy['TRADING_CONFIG'])
+    for name, value in params.items():
+        if name.startswith('TRADING_CONFIG.'):
+            strategy['TRADING_CONFIG'][name.split('.', 1)[1]] = value
+        else:
+            strategy[name] = value
+    return strategy
+
+
+def _run_chunk(chunk):
+    times_ms, opens, highs, lows, closes = _worker['columns']
+    cache = _worker['cache']
+    rows = []
+    for number, params in chunk:
+        strategy = apply_params(_worker['strategy'], params)
+        indicators = {name: cache.indicators(indicator_params(strategy, name)) for name in REGIME_NAMES.values()}
+        result = run_backtest(
+            times_ms, opens, highs, lows, closes, strategy,
+            market_periods=_worker['market_periods'],
+            fear_greed=_worker['fear_greed'],
+            initial_balance=_worker['initial_balance'],
+            indicators=indicators
+        )
+        rows.append((number, params, summarize(result, _worker['initial_balance'])))
+    return rows
+
+
+# -------------------------------------------------------------- результаты
+
+def result_parts(out_dir):
+    """Файлы с записанными порциями результатов (без недописанных временных)."""
+    return [part for part in sorted(Path(out_dir).glob('part-*.npz')) if not part.name.endswith('.tmp.npz')]
+
+
+def array_digest(*arrays):
+    """sha256 содержимого массивов (свечи, индекс страха и жадности) в фиксированном представлении."""
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.asarray(array)
+        dtype = np.int64 if array.dtype.kind in 'iu' else np.float64
+        digest.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        digest.update(len(array).to_bytes(8, 'little'))  # Граница между массивами
+    return digest.hexdigest()
+
+
+def sweep_fingerprint(grid, base_strategy, initial_balance, candles=(), market_periods=None, fear_greed=None):
+    """
+    Хеш упорядоченной сетки, базовой стратегии, начального баланса и входных данных
+    (свечи time/OHLC, периоды рынка, индекс страха и жадности): номера комбинаций
+    сравнимы только при совпадении всего перечисленного.
+    """
+    names = order_grid(grid)
+    payload = json.dumps({
+        'grid': [[name, grid[name]] for name in names],
+        'strategy': base_strategy,
+        'initial_balance': initial_balance,
+        'candles': array_digest(*candles),
+        'market_periods': market_periods or [],
+        'fear_greed': array_digest(*fear_greed) if fear_greed is not None else None,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def check_sweep_dir(out_dir, fingerprint, restart=False, log=print):
+    """
+    Сверяет отпечаток перебора с записанным в out_dir. При расхождении продолжение невозможно:
+    с restart=True прежние результаты удаляются, иначе ValueError. Возвращает True, если каталог очищен.
+    """
+    sweep_file = Path(out_dir) / SWEEP_FILE
+    saved = None
+    if sweep_file.exists():
+        with open(sweep_file, encoding='utf-8') as f:
+            saved = json.load(f).get('fingerprint')
+    parts = list(Path(out_dir).glob('part-*.npz'))
+    cleared = False
+    if saved != fingerprint and (parts or saved is not None):
+        if not restart:
+            raise ValueError(f"Каталог {out_dir} содержит результаты другого перебора (сетка, стратегия или данные изменились): "
+                             f"укажите другой каталог или перезапустите перебор (restart)")
+        for part in parts:
+            part.unlink()
+        log(f"🗑️ Сетка или данные перебора изменились: удалено порций результатов {len(parts)}")
+        cleared = True
+    tmp_file = sweep_file.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': fingerprint}, f)
+    os.replace(tmp_file, sweep_file)
+    return cleared
+
+
+def completed_numbers(out_dir):
+    """Номера уже посчитанных комбинаций (для продолжения прерванного перебора)."""
+    done = set()
+    for part in result_parts(out_dir):
+        try:
+            with np.load(part) as data:
+                done.update(data['number'].tolist())
+        except Exception:
+            continue  # Недописанная часть игнорируется и будет пересчитана
+    return done
+
+
+def write_part(out_dir, part_number, rows, param_names):
+    """Атомарно записывает порцию результатов в колоночном виде (npz: один массив на колонку)."""
+    columns = {'number': np.array([row[0] for row in rows], dtype=np.int64)}
+    for name in param_names:
+        columns[f'param:{name}'] = np.array([row[1][name] for row in rows])
+    for name in METRIC_COLUMNS:
+        columns[name] = np.array([row[2][name] for row in rows], dtype=np.float64)
+    tmp_path = Path(out_dir) / f"part-{part_number:06d}.tmp.npz"
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, Path(out_dir) / f"part-{part_number:06d}.npz")
+
+
+def load_results(out_dir):
+    """Все результаты перебора одним DataFrame (колонки param:* и метрики)."""
+    frames = []
+    for part in result_parts(out_dir):
+        with np.load(part) as data:
+            frames.append(pd.DataFrame({key: data[key] for key in data.files}))
+    if not frames:
+        return pd.DataFrame(columns=['number'] + METRIC_COLUMNS)
+    return pd.concat(frames, ignore_index=True).sort_values('number').reset_index(drop=True)
+
+
+def run_sweep(times_ms, opens, highs, lows, closes, grid, out_dir, base_strategy=None, market_periods=None,
+              fear_greed=None, initial_balance=1000.0, workers=None, chunk_size=32, restart=False, log=print):
+    """
+    Перебор параметров grid ({имя: [значения]}) на пуле процессов.
+    Свечи загружаются в shared_memory один раз, индикаторы кешируются в каждом процессе,
+    результаты пишутся порциями в out_dir; повторный запуск пропускает посчитанные комбинации,
+    если сетка, стратегия и данные не менялись (иначе ValueError или, с restart=True, перебор заново).
+    """
+    base_strategy = base_strategy or load_strategy_params()
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fingerprint = sweep_fingerprint(grid, base_strategy, initial_balance, candles=(times_ms, opens, highs, lows, closes),
+                                    market_periods=market_periods, fear_greed=fear_greed)
+    check_sweep_dir(out_dir, fingerprint, restart=restart, log=log)
+    param_names = order_grid(grid)
+    total = int(np.prod([len(grid[name]) for name in param_names])) if param_names else 0
+    done = completed_numbers(out_dir)
+    pending = [item for item in iter_combinations(grid) if item[0] not in done]
+    log(f"🔁 Перебор: {total} комбинаций, посчитано {len(done)}, осталось {len(pending)}")
+    if not pending:
+        return load_results(out_dir)
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    part_number = max((int(part.name[5:11]) for part in result_parts(out_dir)), default=-1) + 1
+    candles = SharedCandles.create(times_ms, opens, highs, lows, closes)
+    started = time.perf_counter()
+    finished = 0
+    try:
+        with multiprocessing.Pool(
+            processes=workers or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(candles.name, candles.length, base_strategy, market_periods, fear_greed, initial_balance)
+        ) as pool:
+            for rows in pool.imap_unordered(_run_chunk, chunks):
+                write_part(out_dir, part_number, rows, param_names)
+                part_number += 1
+                finished += len(rows)
+                elapsed = time.perf_counter() - started
+                log(f"📊 {len(done) + finished}/{total} ({finished / elapsed:.1f} комб/сек)")
+    finally:
+        candles.close()
+    return load_results(out_dir)
+
+
+def load_candles_csv(path):
+    """Свечи из CSV с колонками time, open, high, low, close (time — мс или дата)."""
+    df = pd.read_csv(path)
+    if np.issubdtype(df['time'].dtype, np.number):
+        times_ms = df['time'].to_numpy(dtype=np.int64)
+    else:
+        times = pd.to_datetime(df['time'], utc=True)
+        times_ms = ((times - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64)
+    return (times_ms, df['open'].to_numpy(np.float64), df['high'].to_numpy(np.float64),
+            df['low'].to_numpy(np.float64), df['close'].to_numpy(np.float64))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перебор параметров стратегии Юнона 3")
+    parser.add_argument('--candles', required=True, help="CSV со свечами 1h: time, open, high, low, close")
+    parser.add_argument('--grid', required=True, help="JSON {параметр: [значения]}")
+    parser.add_argument('--periods', help="JSON со списком периодов рынка {type, start, change}")
+    parser.add_argument('--out', default='sweep_results')
+    parser.add_argument('--fear-greed', help="Хранилище индекса страха и жадности fear_greed_*.j3c")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=32)
+    parser.add_argument('--restart', action='store_true', help="Удалить результаты прежнего перебора с другой сеткой, стратегией или данными")
+    args = parser.parse_args()
+    fear_greed = FearGreedStore(args.fear_greed).arrays() if args.fear_greed else None
+    with open(args.grid, encoding='utf-8') as f:
+        grid = json.load(f)
+    market_periods = []
+    if args.periods:
+        with open(args.periods, encoding='utf-8') as f:
+            market_periods = [dict(period, start=pd.Timestamp(period['start']), change=pd.Timestamp(period['change']))
+                              for period in json.load(f)]
+    results = run_sweep(*load_candles_csv(args.candles), grid, args.out, market_periods=market_periods,
+                        fear_greed=fear_greed, workers=args.workers, chunk_size=args.chunk, restart=args.restart)
+    print(results.sort_values('final_balance', ascending=False).head(20).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+# j3_wfo
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from j3_backtest import run_backtest, load_strategy_params, indicator_params, WEEK_MS, REGIME_NAMES
+from j3_fear_greed import FearGreedStore
+from j3_sweep import (
+    SharedCandles, _worker, _init_worker, apply_params, iter_combinations, summarize, load_candles_csv
+)
+
+
+def to_ms(value):
+    """datetime/Timestamp -> мс UTC."""
+    return int(pd.Timestamp(value).value // 10**6)
+
+
+def make_folds(market_periods, data_start_ms, data_end_ms, is_weeks=104, oos_weeks=26):
+    """
+    Фолды walk-forward, выровненные по периодам рынка из calculate_market_periods:
+    OOS-окна по oos_weeks недель идут внутри каждого периода и обрезаются на его границе
+    (одно OOS-окно никогда не захватывает два режима), IS — предшествующие is_weeks недель.
+    Фолды без полной IS-истории в данных пропускаются.
+    """
+    folds = []
+    for period in market_periods:
+        period_start = max(to_ms(period['start']), data_start_ms)
+        period_end = min(to_ms(period['change']), data_end_ms)
+        oos_start = period_start
+        while oos_start < period_end:
+            oos_end = min(oos_start + oos_weeks * WEEK_MS, period_end)
+            is_start = oos_start - is_weeks * WEEK_MS
+            if is_start >= data_start_ms:
+                folds.append({
+                    'fold': len(folds),
+                    'regime': period['type'],
+                    'is_start': is_start,
+                    'is_end': oos_start,
+                    'oos_start': oos_start,
+                    'oos_end': oos_end,
+                })
+            oos_start = oos_end
+    return folds
+
+
+# ------------------------------------------------------------- процессы
+
+def _init_fold_worker(shm_name, length, base_strategy, market_periods, fear_greed, initial_balance, grid, objective):
+    _init_worker(shm_name, length, base_strategy, market_periods, fear_greed, initial_balance)
+    _worker['combinations'] = list(iter_combinations(grid))
+    _worker['objective'] = objective
+
+
+def _backtest(strategy, start_ms, end_ms):
+    times_ms, opens, highs, lows, closes = _worker['columns']
+    cache = _worker['cache']
+    indicators = {name: cache.indicators(indicator_params(strategy, name)) for name in REGIME_NAMES.values()}
+    return run_backtest(
+        times_ms, opens, highs, lows, closes, strategy,
+        market_periods=_worker['market_periods'],
+        fear_greed=_worker['fear_greed'],
+        initial_balance=_worker['initial_balance'],
+        indicators=indicators,
+        start_ms=start_ms,
+        end_ms=end_ms
+    )
+
+
+def _run_fold(fold):
+    """Оптимизация на IS-окне фолда и прогон лучших параметров на OOS-окне."""
+    initial_balance = _worker['initial_balance']
+    objective = _worker['objective']
+    best = None
+    for number, params in _worker['combinations']:
+        strategy = apply_params(_worker['strategy'], params)
+        metrics = summarize(_backtest(strategy, fold['is_start'], fold['is_end']), initial_balance)
+        if best is None or metrics[objective] > best[2][objective]:
+            best = (number, params, metrics)
+    number, params, is_metrics = best
+    oos = _backtest(apply_params(_worker['strategy'], params), fold['oos_start'], fold['oos_end'])
+    oos_metrics = summarize(oos, initial_balance)
+    return fold, number, params, is_metrics, oos_metrics, oos['times'], oos['equity']
+
+
+# ----------------------------------------------------------------- отчёт
+
+def stitch_equity(fold_results, initial_balance):
+    """
+    Сквозная OOS-кривая капитала: кривые фолдов нормируются на начальный баланс
+    и сцепляются по порядку, каждая начинается с итогового капитала предыдущей.
+    """
+    times, equity = [], []
+    capital = initial_balance
+    for result in sorted(fold_results, key=lambda result: result[0]['oos_start']):
+        fold_times, fold_equity = result[5], result[6]
+        if len(fold_equity) == 0:
+            continue
+        scaled = capital * fold_equity / initial_balance
+        times.append(fold_times)
+        equity.append(scaled)
+        capital = float(scaled[-1])
+    if not times:
+        return pd.Series(dtype=np.float64)
+    index = pd.to_datetime(np.concatenate(times), unit='ms', utc=True)
+    return pd.Series(np.concatenate(equity), index=index, name='equity')
+
+
+def fold_report(fold_results, objective):
+    """Таблица фолдов: окна, режим, выбранные параметры, IS-метрика и OOS-метрики."""
+    rows = []
+    for fold, number, params, is_metrics, oos_metrics, _, _ in sorted(fold_results, key=lambda result: result[0]['fold']):
+        row = {
+            'fold': fold['fold'],
+            'regime': fold['regime'],
+            'is_start': pd.Timestamp(fold['is_start'], unit='ms', tz='UTC'),
+            'oos_start': pd.Timestamp(fold['oos_start'], unit='ms', tz='UTC'),
+            'oos_end': pd.Timestamp(fold['oos_end'], unit='ms', tz='UTC'),
+            'combination': number,
+            f'is_{objective}': is_metrics[objective],
+        }
+        row.update({f'oos_{name}': value for name, value in oos_metrics.items()})
+        row.update({f'param:{name}': value for name, value in params.items()})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def run_walk_forward(times_ms, opens, highs, lows, closes, grid, market_periods, base_strategy=None,
+                     fear_greed=None, initial_balance=1000.0, is_weeks=104, oos_weeks=26,
+                     objective='return_percent', workers=None, log=print):
+    """
+    Walk-forward оптимизация: фолды считаются параллельно (один фолд — одна задача пула),
+    свечи общие через shared_memory, индикаторы кешируются в каждом процессе и
+    переиспользуются всеми окнами и комбинациями. Возвращает (таблица фолдов, сквозная OOS-кривая).
+    """
+    base_strategy = base_strategy or load_strategy_params()
+    folds = make_folds(market_periods, int(times_ms[0]), int(times_ms[-1]) + 1, is_weeks, oos_weeks)
+    log(f"🔁 Walk-forward: {len(folds)} фолдов, IS {is_weeks} нед., OOS {oos_weeks} нед.")
+    if not folds:
+        return fold_report([], objective), stitch_equity([], initial_balance)
+    candles = SharedCandles.create(times_ms, opens, highs, lows, closes)
+    started = time.perf_counter()
+    results = []
+    try:
+        with multiprocessing.Pool(
+            processes=min(workers or os.cpu_count(), len(folds)),
+            initializer=_init_fold_worker,
+            initargs=(candles.name, candles.length, base_strategy, market_periods, fear_greed,
+                      initial_balance, grid, objective)
+        ) as pool:
+            for result in pool.imap_unordered(_run_fold, folds):
+                results.append(result)
+                fold, oos_metrics = result[0], result[4]
+                log(f"📊 Фолд {fold['fold']} ({fold['regime']}): OOS {oos_metrics['return_percent']:.2f}% "
+                    f"— {len(results)}/{len(folds)} за {time.perf_counter() - started:.1f} сек")
+    finally:
+        candles.close()
+    return fold_report(results, objective), stitch_equity(results, initial_balance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward оптимизация стратегии Юнона 3")
+    parser.add_argument('--candles', required=True, help="CSV со свечами 1h: time, open, high, low, close")
+    parser.add_argument('--grid', required=True, help="JSON {параметр: [значения]}")
+    parser.add_argument('--periods', required=True, help="JSON со списком периодов рынка {type, start, change}")
+    parser.add_argument('--is-weeks', type=int, default=104)
+    parser.add_argument('--oos-weeks', type=int, default=26)
+    parser.add_argument('--objective', default='return_percent')
+    parser.add_argument('--fear-greed', help="Хранилище индекса страха и жадности fear_greed_*.j3c")
+    parser.add_argument('--out', default='wfo_results')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    fear_greed = FearGreedStore(args.fear_greed).arrays() if args.fear_greed else None
+    with open(args.grid, encoding='utf-8') as f:
+        grid = json.load(f)
+    with open(args.periods, encoding='utf-8') as f:
+        market_periods = [dict(period, start=pd.Timestamp(period['start']), change=pd.Timestamp(period['change']))
+                          for period in json.load(f)]
+    folds, equity = run_walk_forward(*load_candles_csv(args.candles), grid, market_periods,
+                                     is_weeks=args.is_weeks, oos_weeks=args.oos_weeks,
+                                     objective=args.objective, fear_greed=fear_greed, workers=args.workers)
+    os.makedirs(args.out, exist_ok=True)
+    folds.to_csv(os.path.join(args.out, 'folds.csv'), index=False)
+    equity.to_csv(os.path.join(args.out, 'oos_equity.csv'), header=True)
+    print(folds.to_string())
+
+
+if __name__ == '__main__':
+    main()